@@ -0,0 +1,255 @@
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import argparse
+import resource
+import tempfile
+import subprocess
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCHMARKS_DIR), 'src')
+sys.path.insert(0, SRC_DIR)
+
+from synthetic_sql_repository import SyntheticSqlRepository, SYNTHETIC_ENCODINGS
+
+logger = logging.getLogger(__name__)
+
+MEGABYTE = 1024 * 1024
+
+# Benchmark scenarios: files per category and database, average file size, large insert scripts
+PRESETS = {
+    'small': {'files_per_category': 50, 'file_size': 16 * 1024, 'large_insert_files': 0, 'large_insert_size': 0},
+    'medium': {'files_per_category': 400, 'file_size': 32 * 1024, 'large_insert_files': 1, 'large_insert_size': 20 * MEGABYTE},
+    'large': {'files_per_category': 3000, 'file_size': 32 * 1024, 'large_insert_files': 1, 'large_insert_size': 200 * MEGABYTE},
+}
+
+def peak_rss_kb() -> int:
+    """
+    Peak resident set size of this process in KB.
+    """
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux reports KB
+    return peak_rss // 1024 if sys.platform == 'darwin' else peak_rss
+
+def prepare_release_config(template_path):
+    """
+    Point the builder at the repository templates and keep caches out of the measurement.
+    """
+    import config
+    config.BASE_TEMPLATE_PATH = template_path
+    config.TEMPLATE_PACK_PATH = os.path.join(template_path, 'templates.pack.json')
+    config.INCREMENTAL_BUILD = False
+    config.ARTIFACT_CACHE = False
+    return config
+
+def clean_release_output(tree_dir, config):
+    """
+    Remove the output of a previous run from the synthetic tree.
+    """
+    shutil.rmtree(os.path.join(tree_dir, config.BASE_RELEASE_DIR), ignore_errors=True)
+    deploy_guide_path = os.path.join(tree_dir, config.RELEASE_DOCX)
+    if os.path.exists(deploy_guide_path):
+        os.remove(deploy_guide_path)
+
+def release_stages(release_handler, config):
+    """
+    The release stages main.main schedules, in declaration order so they can run one by one.
+    """
+    import main
+    from bgt_db_release_utils import StageScheduler
+    stage_scheduler = StageScheduler(max_workers=1)
+    main.add_release_stages(stage_scheduler=stage_scheduler, release_handler=release_handler)
+    return stage_scheduler.ordered_stages()
+
+def measure(target, tree_dir, template_path):
+    """
+    Run one measurement inside this process and return its timings. Called in a fresh
+    interpreter per measurement so peak RSS and import costs are not shared between runs.
+    """
+    os.chdir(tree_dir)
+    config = prepare_release_config(template_path=template_path)
+    clean_release_output(tree_dir=tree_dir, config=config)
+    with open('files.json', 'r', encoding='utf-8') as rf:
+        changed_files = json.load(rf)
+
+    results = {}
+    if target == 'main':
+        start_time = time.perf_counter()
+        import main
+        main.main(files_changed_with_tags=changed_files, release_number='1')
+        results['main'] = {'wall_s': time.perf_counter() - start_time, 'peak_rss_kb': peak_rss_kb()}
+    else:
+        from bgt_release_handler import BGTReleaseHandler
+        release_handler = BGTReleaseHandler(files_changed_with_tags=changed_files, release_number='1')
+        for stage_name, stage in release_stages(release_handler=release_handler, config=config):
+            start_time = time.perf_counter()
+            stage()
+            results[stage_name] = {'wall_s': time.perf_counter() - start_time, 'peak_rss_kb': peak_rss_kb()}
+            # Stages run per database, e.g. copy_sql_files:agt, are also reported together
+            if ':' in stage_name:
+                stage_total = results.setdefault(stage_name.split(':', 1)[0], {'wall_s': 0.0, 'peak_rss_kb': 0})
+                stage_total['wall_s'] += results[stage_name]['wall_s']
+                stage_total['peak_rss_kb'] = results[stage_name]['peak_rss_kb']
+    return results
+
+def run_measurement(target, tree_dir, template_path, cache_dir):
+    """
+    Run a measurement in a child interpreter and return its parsed results.
+    """
+    measure_env = dict(os.environ, BGT_RELEASE_CACHE_DIR=cache_dir, BGT_INCREMENTAL_BUILD='0',
+                       BGT_ARTIFACT_CACHE='0')
+    completed = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--measure', target, '--tree', tree_dir, '--templates', template_path],
+        env=measure_env, check=True, stdout=subprocess.PIPE, text=True
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+def run_benchmarks(args):
+    """
+    Generate the synthetic tree, run every measurement and collect the best of the repeats.
+    """
+    preset = dict(PRESETS[args.preset])
+    for option in ('files_per_category', 'file_size', 'large_insert_files', 'large_insert_size'):
+        if getattr(args, option) is not None:
+            preset[option] = getattr(args, option)
+
+    import config
+    category_counts = {category: preset['files_per_category'] for category in config.RELEASE_FILE_MAPPING}
+    for category_count in args.category_count:
+        category, file_count = category_count.split('=', 1)
+        category_counts[category] = int(file_count)
+    encoding_weights = {}
+    for encoding_weight in args.encodings.split(','):
+        encoding_name, weight = encoding_weight.split('=', 1)
+        if encoding_name not in SYNTHETIC_ENCODINGS:
+            raise ValueError(f"Unknown encoding {encoding_name}, expected one of {list(SYNTHETIC_ENCODINGS)}")
+        encoding_weights[encoding_name] = float(weight)
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='bgt_release_bench_')
+    tree_dir = os.path.join(work_dir, 'tree')
+    cache_dir = os.path.join(work_dir, 'cache')
+    try:
+        synthetic_repository = SyntheticSqlRepository(
+            root_dir=tree_dir,
+            database_names=config.BASE_RELEASE_DB,
+            category_counts=category_counts,
+            file_size=preset['file_size'],
+            encoding_weights=encoding_weights,
+            large_insert_files=preset['large_insert_files'],
+            large_insert_size=preset['large_insert_size'],
+            seed=args.seed
+        )
+        changed_files = synthetic_repository.generate()
+        with open(os.path.join(tree_dir, 'files.json'), 'w', encoding='utf-8') as wf:
+            json.dump(changed_files, wf)
+
+        best_results = {}
+        for _ in range(args.repeat):
+            for target in ('main', 'stages'):
+                shutil.rmtree(cache_dir, ignore_errors=True)
+                for name, result in run_measurement(target=target, tree_dir=tree_dir, template_path=args.templates, cache_dir=cache_dir).items():
+                    if name not in best_results or result['wall_s'] < best_results[name]['wall_s']:
+                        best_results[name] = result
+
+        # Throughput is reported for the measurements that process every changed file
+        for name in ('main', 'copy_sql_files'):
+            wall_s = best_results[name]['wall_s']
+            best_results[name]['files'] = len(changed_files)
+            best_results[name]['bytes'] = synthetic_repository.generated_bytes
+            best_results[name]['files_per_s'] = len(changed_files) / wall_s if wall_s else None
+            best_results[name]['mb_per_s'] = synthetic_repository.generated_bytes / MEGABYTE / wall_s if wall_s else None
+
+        return {
+            'scenario': {
+                'preset': args.preset,
+                'category_counts': category_counts,
+                'databases': config.BASE_RELEASE_DB,
+                'file_size': preset['file_size'],
+                'large_insert_files': preset['large_insert_files'],
+                'large_insert_size': preset['large_insert_size'],
+                'encodings': encoding_weights,
+                'repeat': args.repeat,
+            },
+            'results': best_results
+        }
+    finally:
+        if not args.keep and not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+def compare_with_baseline(report, baseline, tolerance) -> list:
+    """
+    Return the measurements whose wall time regressed by more than the tolerance.
+    """
+    regressions = []
+    for name, baseline_result in baseline.get('results', {}).items():
+        result = report['results'].get(name)
+        if not result or not baseline_result.get('wall_s'):
+            continue
+        ratio = result['wall_s'] / baseline_result['wall_s']
+        result['baseline_ratio'] = ratio
+        if ratio > 1 + tolerance:
+            regressions.append(f"{name}: {result['wall_s']:.3f}s vs baseline {baseline_result['wall_s']:.3f}s ({ratio:.2f}x)")
+    return regressions
+
+def print_report(report) -> None:
+    """
+    Print a human readable summary of the results.
+    """
+    print(f"{'measurement':<20}{'wall s':>10}{'files/s':>12}{'MB/s':>10}{'peak RSS MB':>14}{'vs base':>10}")
+    for name, result in report['results'].items():
+        files_per_s = f"{result['files_per_s']:.1f}" if result.get('files_per_s') else '-'
+        mb_per_s = f"{result['mb_per_s']:.1f}" if result.get('mb_per_s') else '-'
+        baseline_ratio = f"{result['baseline_ratio']:.2f}x" if result.get('baseline_ratio') else '-'
+        print(f"{name:<20}{result['wall_s']:>10.3f}{files_per_s:>12}{mb_per_s:>10}{result['peak_rss_kb'] / 1024:>14.1f}{baseline_ratio:>10}")
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the release builder against a synthetic SQL repository.')
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='small')
+    parser.add_argument('--files-per-category', type=int, help='Files per source folder and database')
+    parser.add_argument('--category-count', action='append', default=[], metavar='CATEGORY=COUNT',
+                        help='Override the file count of one source folder, e.g. stored_procedures=3000')
+    parser.add_argument('--file-size', type=int, help='Approximate size of each script in bytes')
+    parser.add_argument('--large-insert-files', type=int, help='Large insert_statements scripts per database')
+    parser.add_argument('--large-insert-size', type=int, help='Size of each large insert script in bytes')
+    parser.add_argument('--encodings', default='utf-8=60,utf-8-bom=15,utf-16le=15,cp1252=10',
+                        help='Encoding mix as NAME=WEIGHT pairs')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement, the fastest is reported')
+    parser.add_argument('--templates', default=os.path.join(SRC_DIR, 'file_templates'))
+    parser.add_argument('--work-dir', help='Generate the tree here instead of a temporary directory')
+    parser.add_argument('--keep', action='store_true', help='Keep the temporary directory')
+    parser.add_argument('--output', help='Write the JSON report to this file')
+    parser.add_argument('--baseline', help='Compare against a stored JSON report')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Allowed wall time regression against the baseline')
+    parser.add_argument('--measure', choices=['main', 'stages'], help=argparse.SUPPRESS)
+    parser.add_argument('--tree', help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.measure:
+        results = measure(target=args.measure, tree_dir=args.tree, template_path=args.templates)
+        print(json.dumps(results))
+        sys.exit(0)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    report = run_benchmarks(args=args)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as rf:
+            regressions = compare_with_baseline(report=report, baseline=json.load(rf), tolerance=args.tolerance)
+    print_report(report=report)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as wf:
+            json.dump(report, wf, indent=2)
+
+    if regressions:
+        print("Regressions against the baseline:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
@@ -0,0 +1,142 @@
+import os
+import codecs
+import random
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Encodings produced by the generator, written the way SSMS and editors save them
+SYNTHETIC_ENCODINGS = {
+    'utf-8': ('utf-8', b''),
+    'utf-8-bom': ('utf-8', codecs.BOM_UTF8),
+    'utf-16le': ('utf-16-le', codecs.BOM_UTF16_LE),
+    'cp1252': ('cp1252', b''),
+}
+
+# Object type created by the scripts of each source folder
+CATEGORY_OBJECT_TYPES = {
+    'tables': 'TABLE',
+    'alter_table': 'TABLE',
+    'index': 'INDEX',
+    'functions': 'FUNCTION',
+    'triggers': 'TRIGGER',
+    'views': 'VIEW',
+    'stored_procedures': 'PROCEDURE',
+    'insert_statements': 'INSERT',
+}
+
+class SyntheticSqlRepository():
+    """
+    Generates a datatrak_bgt_agt / datatrak_bgt_awb style source tree for benchmarking the release builder.
+    """
+    def __init__(self, root_dir, database_names, category_counts, file_size, encoding_weights,
+                 large_insert_files=0, large_insert_size=0, seed=0):
+        """
+        Initialize the SyntheticSqlRepository class.
+        category_counts maps each source folder to the number of files per database,
+        encoding_weights maps a SYNTHETIC_ENCODINGS name to its relative share of the files.
+        """
+        self.root_dir = root_dir
+        self.database_names = database_names
+        self.category_counts = category_counts
+        self.file_size = file_size
+        self.encoding_weights = encoding_weights
+        self.large_insert_files = large_insert_files
+        self.large_insert_size = large_insert_size
+        self.random = random.Random(seed)
+        self.generated_files = []
+        self.generated_bytes = 0
+
+    def generate(self) -> list:
+        """
+        Write the source tree and version files. Returns the changed file paths relative to root_dir.
+        """
+        os.makedirs(self.root_dir, exist_ok=True)
+        encoding_names = list(self.encoding_weights)
+        encoding_shares = [self.encoding_weights[encoding_name] for encoding_name in encoding_names]
+
+        for database_name in self.database_names:
+            self.write_version_file(database_name=database_name)
+            for category, file_count in self.category_counts.items():
+                for file_index in range(file_count):
+                    encoding_name = self.random.choices(encoding_names, weights=encoding_shares)[0]
+                    self.write_script(database_name=database_name, category=category, file_index=file_index,
+                                      encoding_name=encoding_name, target_size=self.file_size)
+
+            for file_index in range(self.large_insert_files):
+                self.write_script(database_name=database_name, category='insert_statements',
+                                  file_index=f"large_{file_index}", encoding_name='cp1252',
+                                  target_size=self.large_insert_size)
+
+        logger.info(f"Generated {len(self.generated_files)} files ({self.generated_bytes} bytes) in {self.root_dir}")
+        return self.generated_files
+
+    def write_version_file(self, database_name:str) -> None:
+        """
+        Write the version.txt read when no version tags are passed.
+        """
+        version_file_path = self.make_parent(os.path.join(self.root_dir, database_name, 'version.txt'))
+        with open(version_file_path, 'w', encoding='utf-8') as wf:
+            wf.write("old_version=1.0.0-b1\nnew_version=1.0.1-b1\n")
+
+    def make_parent(self, file_path:str) -> str:
+        """
+        Create the parent directory of a file path and return the path.
+        """
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        return file_path
+
+    def script_lines(self, category:str, object_name:str):
+        """
+        Yield the lines of a script of the given category, forever. The caller stops at the target size.
+        """
+        object_type = CATEGORY_OBJECT_TYPES.get(category, 'PROCEDURE')
+        if object_type == 'INSERT':
+            yield f"-- Reference data for {object_name}\r\n"
+            row_id = 0
+            while True:
+                row_id += 1
+                yield f"INSERT INTO dbo.{object_name} (id, code, description) VALUES ({row_id}, 'C{row_id:08d}', 'Café résumé {self.random.random():.6f}');\r\n"
+                if row_id % 1000 == 0:
+                    yield "GO\r\n"
+        elif object_type in ('TABLE', 'INDEX'):
+            yield f"CREATE TABLE dbo.{object_name} (\r\n    id int NOT NULL,\r\n"
+            column_id = 0
+            while True:
+                column_id += 1
+                yield f"    col_{column_id} varchar(50) NULL, -- naïve column {column_id}\r\n"
+        else:
+            yield f"CREATE OR ALTER {object_type} dbo.{object_name}\r\nAS\r\nBEGIN\r\n"
+            statement_id = 0
+            while True:
+                statement_id += 1
+                yield f"    SELECT {statement_id} AS step, 'déjà vu' AS note FROM dbo.{object_name}_source WHERE id > {statement_id};\r\n"
+
+    def write_script(self, database_name:str, category:str, file_index, encoding_name:str, target_size:int) -> None:
+        """
+        Write one script of roughly target_size encoded bytes.
+        """
+        codec_name, bom = SYNTHETIC_ENCODINGS[encoding_name]
+        object_name = f"{category}_{file_index}"
+        relative_path = os.path.join(database_name, category, f"{object_name}.sql")
+        file_path = self.make_parent(os.path.join(self.root_dir, relative_path))
+
+        written_bytes = 0
+        with open(file_path, 'wb') as wf:
+            wf.write(bom)
+            written_bytes += len(bom)
+            pending_lines = []
+            for line in self.script_lines(category=category, object_name=object_name):
+                pending_lines.append(line)
+                if len(pending_lines) >= 512 or written_bytes + len(line) * len(pending_lines) >= target_size:
+                    encoded_lines = ''.join(pending_lines).encode(codec_name)
+                    wf.write(encoded_lines)
+                    written_bytes += len(encoded_lines)
+                    pending_lines = []
+                    if written_bytes >= target_size:
+                        break
+            wf.write("\r\nGO\r\n".encode(codec_name))
+            written_bytes += len("\r\nGO\r\n".encode(codec_name))
+
+        self.generated_files.append(relative_path)
+        self.generated_bytes += written_bytes
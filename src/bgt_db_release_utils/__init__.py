@@ -1,9 +1,54 @@
 from .version_manager import VersionManager
 from .files_manager import FilesManager
 from .release_resource_manager import ReleaseResourceManager
+from .encoding_cache import EncodingCache
+from .build_manifest import BuildManifest
+from .build_journal import BuildJournal
+from .template_engine import TemplateEngine
+from .template_registry import TemplateRegistry
+from .build_metrics import BuildMetrics
+from .git_source_reader import GitSourceReader
+from .docx_template_renderer import DocxTemplateRenderer
+from .stage_scheduler import StageScheduler
+from .encoding_prepass import EncodingPrepass
+from .output_backend import OutputBackend, FileSystemOutputBackend, ArchiveOutputBackend, MemoryOutputBackend
+from .release_archive import ReleaseArchiveWriter
+from .sql_dependency_analyzer import SqlDependencyAnalyzer
+from .sql_definition_deduplicator import SqlDefinitionDeduplicator
+from .release_ledger import ReleaseLedger
+from .artifact_cache import ArtifactCache
+from .release_file_router import ReleaseFileRouter
+from .sql_batch_indexer import SqlBatchIndexer
+from .checksum_manifest import ChecksumManifest
+from .exceptions import ReleaseBuildError, ReleaseInputError, ReleaseStageError
 
 __all__ = [
     VersionManager,
     FilesManager,
-    ReleaseResourceManager
+    ReleaseResourceManager,
+    EncodingCache,
+    BuildManifest,
+    BuildJournal,
+    TemplateEngine,
+    TemplateRegistry,
+    BuildMetrics,
+    GitSourceReader,
+    DocxTemplateRenderer,
+    StageScheduler,
+    EncodingPrepass,
+    OutputBackend,
+    FileSystemOutputBackend,
+    ArchiveOutputBackend,
+    MemoryOutputBackend,
+    ReleaseArchiveWriter,
+    SqlDependencyAnalyzer,
+    SqlDefinitionDeduplicator,
+    ReleaseLedger,
+    ArtifactCache,
+    ReleaseFileRouter,
+    SqlBatchIndexer,
+    ChecksumManifest,
+    ReleaseBuildError,
+    ReleaseInputError,
+    ReleaseStageError
 ]
\ No newline at end of file
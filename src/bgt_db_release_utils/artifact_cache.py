@@ -0,0 +1,184 @@
+import os
+import json
+import fcntl
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Linux ioctl cloning a file into another on copy on write filesystems (btrfs, XFS)
+FICLONE = 0x40049409
+
+class ArtifactCache():
+    """
+    Content addressable cache of rendered release artifacts shared by the builds on a runner, like ccache.
+    An artifact is stored under the hash of its fingerprint (inputs, templates, versions) and of the builder
+    version, and is reflinked or copied into the release bundle on a hit instead of being regenerated.
+    Entries are directories renamed into place once complete, so concurrent builds never see a partial entry, and
+    the least recently used entries are evicted once the cache grows past max_bytes.
+    A restored file never shares its bytes with the entry, so writing to the bundle cannot alter the cache.
+    """
+    def __init__(self, cache_dir:str, max_bytes:int, builder_version:str):
+        """
+        Initialize the ArtifactCache class.
+        """
+        self.cache_dir = cache_dir
+        self.entries_dir = os.path.join(cache_dir, 'entries')
+        self.temp_dir = os.path.join(cache_dir, 'tmp')
+        self.max_bytes = max_bytes
+        self.builder_version = builder_version
+        # Input path -> (size, mtime_ns, SHA-256), inputs are hashed once per process while unchanged
+        self.file_hashes = {}
+        self.lock = threading.Lock()
+
+    def artifact_key(self, fingerprint:str) -> str:
+        """
+        Return the cache key of an artifact.
+        """
+        return hashlib.sha256(f"{self.builder_version}\n{fingerprint}".encode('utf-8')).hexdigest()
+
+    def entry_path(self, artifact_key:str) -> str:
+        """
+        Return the directory of a cache entry, spread over 256 subdirectories.
+        """
+        return os.path.join(self.entries_dir, artifact_key[:2], artifact_key)
+
+    def hash_file(self, file_path:str) -> str:
+        """
+        Return the SHA-256 of an input file, reusing the hash while its size and modification time are unchanged.
+        """
+        file_stat = os.stat(file_path)
+        with self.lock:
+            file_hash = self.file_hashes.get(file_path)
+        if file_hash and file_hash[:2] == (file_stat.st_size, file_stat.st_mtime_ns):
+            return file_hash[2]
+
+        sha256 = hashlib.sha256()
+        with open(file_path, 'rb') as rf:
+            for chunk in iter(lambda: rf.read(1024 * 1024), b''):
+                sha256.update(chunk)
+        with self.lock:
+            self.file_hashes[file_path] = (file_stat.st_size, file_stat.st_mtime_ns, sha256.hexdigest())
+        return sha256.hexdigest()
+
+    def restore(self, fingerprint:str, target_path:str):
+        """
+        Link the artifact cached for fingerprint to target_path, replacing the file there.
+        Returns the metadata stored with the artifact, or None on a miss.
+        """
+        entry_path = self.entry_path(artifact_key=self.artifact_key(fingerprint=fingerprint))
+        try:
+            with open(os.path.join(entry_path, 'metadata.json'), 'r', encoding='utf-8') as rf:
+                artifact_metadata = json.load(rf)
+            if os.path.lexists(target_path):
+                os.unlink(target_path)
+            link_mode = self.link_file(source_path=os.path.join(entry_path, 'artifact'), target_path=target_path)
+            # The entry modification time orders the entries for eviction
+            os.utime(entry_path)
+        except (OSError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError) or os.path.exists(entry_path):
+                logger.warning(f"Unable to restore {target_path} from the artifact cache: {e}")
+            return None
+
+        logger.info(f"Restored {target_path} from the artifact cache ({link_mode})")
+        return artifact_metadata
+
+    def link_file(self, source_path:str, target_path:str) -> str:
+        """
+        Make target_path a copy of source_path, as a reflink when the filesystem supports it, else a plain copy.
+        Not a hardlink, a file written in place in the bundle would write through it into the cache entry.
+        Returns how the file was linked.
+        """
+        try:
+            with open(source_path, 'rb') as source_file, open(target_path, 'xb') as target_file:
+                fcntl.ioctl(target_file.fileno(), FICLONE, source_file.fileno())
+            return 'reflink'
+        except OSError:
+            if os.path.lexists(target_path):
+                os.unlink(target_path)
+        shutil.copyfile(source_path, target_path)
+        return 'copy'
+
+    def store(self, fingerprint:str, artifact_path:str, artifact_metadata=None) -> bool:
+        """
+        Cache the finished artifact at artifact_path under fingerprint, with JSON serialisable metadata.
+        Returns False when the artifact could not be cached, the build goes on without it.
+        """
+        entry_path = self.entry_path(artifact_key=self.artifact_key(fingerprint=fingerprint))
+        if os.path.isdir(entry_path):
+            return True
+        temp_entry_path = None
+        try:
+            os.makedirs(self.temp_dir, exist_ok=True)
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+            temp_entry_path = tempfile.mkdtemp(dir=self.temp_dir, prefix='entry.')
+            # A copy, the bundle file may be a link to another entry or be replaced later
+            shutil.copyfile(artifact_path, os.path.join(temp_entry_path, 'artifact'))
+            with open(os.path.join(temp_entry_path, 'metadata.json'), 'w', encoding='utf-8') as wf:
+                json.dump(artifact_metadata or {}, wf)
+            os.rename(temp_entry_path, entry_path)
+            temp_entry_path = None
+            return True
+
+        except OSError as e:
+            # Another build stored the same artifact first
+            if os.path.isdir(entry_path):
+                return True
+            logger.warning(f"Unable to store {artifact_path} in the artifact cache: {e}")
+            return False
+        finally:
+            if temp_entry_path:
+                shutil.rmtree(temp_entry_path, ignore_errors=True)
+
+    def evict(self) -> int:
+        """
+        Remove the least recently used entries until the cache fits in max_bytes. One build evicts at a time,
+        the others skip it. Returns the number of entries removed.
+        """
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            lock_file = open(os.path.join(self.cache_dir, 'evict.lock'), 'w')
+        except OSError as e:
+            logger.warning(f"Unable to evict from the artifact cache {self.cache_dir}: {e}")
+            return 0
+        with lock_file:
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return 0
+
+            entries = []
+            cache_size = 0
+            for entry_path, entry_mtime, entry_size in self.iter_entries():
+                entries.append((entry_mtime, entry_size, entry_path))
+                cache_size += entry_size
+            evicted_count = 0
+            for _, entry_size, entry_path in sorted(entries):
+                if cache_size <= self.max_bytes:
+                    break
+                shutil.rmtree(entry_path, ignore_errors=True)
+                cache_size -= entry_size
+                evicted_count += 1
+        if evicted_count:
+            logger.info(f"Evicted {evicted_count} entries from the artifact cache {self.cache_dir}")
+        return evicted_count
+
+    def iter_entries(self):
+        """
+        Yield the path, modification time and size of every complete entry.
+        """
+        if not os.path.isdir(self.entries_dir):
+            return
+        for prefix_entry in os.scandir(self.entries_dir):
+            if not prefix_entry.is_dir():
+                continue
+            for cache_entry in os.scandir(prefix_entry.path):
+                try:
+                    entry_size = sum(entry_file.stat().st_size for entry_file in os.scandir(cache_entry.path))
+                    yield cache_entry.path, cache_entry.stat().st_mtime_ns, entry_size
+                except OSError:
+                    # Evicted by another build meanwhile
+                    continue
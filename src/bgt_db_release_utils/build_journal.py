@@ -0,0 +1,160 @@
+import os
+import json
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+class BuildJournal():
+    """
+    Records the progress of a build as it goes, one JSON line per completed unit of work, so a build killed half way
+    resumes where it stopped instead of starting from scratch. A release file built from scripts is journaled when it
+    is started, after each script appended to it and when it is complete; any other release file once it is written.
+    Entries carry the fingerprint of the release file, a restarted build only reuses the work done from the same
+    inputs. The journal is removed once the build completes, the build manifest then records the bundle.
+    """
+    JOURNAL_FORMAT_VERSION = 1
+
+    def __init__(self, journal_path:str):
+        """
+        Initialize the BuildJournal class.
+        """
+        self.journal_path = journal_path
+        # Release file path -> entry of the release files completed by an interrupted build
+        self.completed_files = {}
+        # Release file path -> fingerprint, header size and completed scripts of the release files it left staged
+        self.started_files = {}
+        self.journal_file = None
+        self.lock = threading.Lock()
+
+    def load(self) -> None:
+        """
+        Load the journal an interrupted build left behind. The last line may have been cut short when the build was
+        killed, lines that do not parse are ignored.
+        """
+        try:
+            with open(self.journal_path, 'r', encoding='utf-8') as rf:
+                journal_lines = rf.readlines()
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.warning(f"Failed to load build journal {self.journal_path}: {e}")
+            return
+
+        for journal_line in journal_lines:
+            try:
+                journal_entry = json.loads(journal_line)
+            except ValueError:
+                continue
+            if journal_entry.get('version') != self.JOURNAL_FORMAT_VERSION:
+                continue
+            self.apply_entry(journal_entry=journal_entry)
+        logger.info(f"Loaded build journal {self.journal_path} with {len(self.completed_files)} completed "
+                    f"and {len(self.started_files)} started release files")
+
+    def apply_entry(self, journal_entry:dict) -> None:
+        """
+        Replay one journal entry. Starting a release file again discards what was journaled for it before.
+        """
+        release_file_path = journal_entry.get('release_file')
+        entry_type = journal_entry.get('type')
+        if entry_type == 'started':
+            self.completed_files.pop(release_file_path, None)
+            self.started_files[release_file_path] = {
+                'fingerprint': journal_entry['fingerprint'],
+                'header_size': journal_entry['header_size'],
+                'scripts': []
+            }
+        elif entry_type == 'script':
+            started_file = self.started_files.get(release_file_path)
+            if started_file:
+                started_file['scripts'].append({key: journal_entry[key] for key in ('source', 'offset', 'length', 'end')})
+        elif entry_type == 'completed':
+            self.started_files.pop(release_file_path, None)
+            self.completed_files[release_file_path] = journal_entry
+
+    def record(self, journal_entry:dict, sync:bool=False) -> None:
+        """
+        Append an entry to the journal. Each line is written out at once, so it survives the build being killed;
+        sync also flushes it to disk. Keys keep their order, a resumed build writes the deployment plan entries and
+        batch indexes it replays byte for byte as they were built.
+        """
+        journal_line = json.dumps(dict(journal_entry, version=self.JOURNAL_FORMAT_VERSION)) + '\n'
+        with self.lock:
+            if self.journal_file is None:
+                self.journal_file = open(self.journal_path, 'a', encoding='utf-8')
+            self.journal_file.write(journal_line)
+            self.journal_file.flush()
+            if sync:
+                os.fsync(self.journal_file.fileno())
+
+    def record_file_started(self, release_file_path:str, fingerprint:str, header_size:int) -> None:
+        """
+        Journal a release file whose header was written, before the scripts are appended to it.
+        """
+        self.record(journal_entry={
+            'type': 'started',
+            'release_file': release_file_path,
+            'fingerprint': fingerprint,
+            'header_size': header_size
+        })
+
+    def record_script(self, release_file_path:str, source_path:str, offset:int, length:int, end:int) -> None:
+        """
+        Journal a script appended to a release file, at offset for length bytes, its separator ending at end.
+        """
+        self.record(journal_entry={
+            'type': 'script',
+            'release_file': release_file_path,
+            'source': source_path,
+            'offset': offset,
+            'length': length,
+            'end': end
+        })
+
+    def record_file_completed(self, release_file_path:str, fingerprint:str, plan_entry=None, batch_index=None,
+                              checksums=None) -> None:
+        """
+        Journal a release file that is complete and in place, with its deployment plan entry, batch index and
+        checksum manifest entry for a restarted build to reuse.
+        """
+        self.record(journal_entry={
+            'type': 'completed',
+            'release_file': release_file_path,
+            'fingerprint': fingerprint,
+            'plan_entry': plan_entry,
+            'batch_index': batch_index,
+            'checksums': checksums
+        }, sync=True)
+
+    def completed_file(self, release_file_path:str, fingerprint:str) -> dict:
+        """
+        Return the entry of a release file an interrupted build completed from the same inputs, None otherwise.
+        """
+        completed_file = self.completed_files.get(release_file_path)
+        if completed_file and completed_file.get('fingerprint') == fingerprint:
+            return completed_file
+        return None
+
+    def started_file(self, release_file_path:str, fingerprint:str) -> dict:
+        """
+        Return the header size and completed scripts of a release file an interrupted build left staged from the
+        same inputs, None otherwise.
+        """
+        started_file = self.started_files.get(release_file_path)
+        if started_file and started_file['fingerprint'] == fingerprint:
+            return started_file
+        return None
+
+    def remove(self) -> None:
+        """
+        Close and remove the journal once the build has completed.
+        """
+        with self.lock:
+            if self.journal_file is not None:
+                self.journal_file.close()
+                self.journal_file = None
+        try:
+            os.remove(self.journal_path)
+        except FileNotFoundError:
+            pass
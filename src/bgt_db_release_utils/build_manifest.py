@@ -0,0 +1,180 @@
+import os
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+class BuildManifest():
+    """
+    Records what every release file in a bundle was built from, so a later build with the same
+    inputs can leave unchanged release files in place.
+    """
+    MANIFEST_FORMAT_VERSION = 1
+
+    def __init__(self, manifest_path):
+        """
+        Initialize the BuildManifest class.
+        """
+        self.manifest_path = manifest_path
+        self.previous_inputs = {}
+        self.previous_release_files = {}
+        self.previous_bundle_files = {}
+        self.inputs = {}
+        self.release_files = {}
+        # Path relative to the bundle -> size, modification time and checksum manifest entry of every bundle file
+        self.bundle_files = {}
+        self.build_info = {}
+        self.dropped_duplicates = []
+        self.lock = threading.Lock()
+
+    def load(self) -> None:
+        """
+        Load the manifest of the previous build, then remove it from disk.
+        The manifest is only written back once the new build completes, so a build that dies
+        half way leaves no manifest behind and the next build only resumes what the build journal recorded.
+        """
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as rf:
+                manifest_data = json.load(rf)
+            os.remove(self.manifest_path)
+
+            if manifest_data.get('version') != self.MANIFEST_FORMAT_VERSION:
+                logger.info(f"Ignoring build manifest {self.manifest_path} with an old format.")
+                return
+            self.previous_inputs = manifest_data.get('inputs', {})
+            self.previous_release_files = manifest_data.get('release_files', {})
+            self.previous_bundle_files = manifest_data.get('bundle_files', {})
+            logger.info(f"Loaded build manifest {self.manifest_path} with {len(self.previous_release_files)} release files")
+
+        except FileNotFoundError:
+            logger.info(f"No previous build manifest at {self.manifest_path}, building everything.")
+        except Exception as e:
+            logger.warning(f"Failed to load build manifest {self.manifest_path}: {e}")
+
+    def set_build_info(self, **build_info) -> None:
+        """
+        Record build wide values such as the release number and database versions.
+        """
+        self.build_info.update(build_info)
+
+    def hash_file(self, file_path:str) -> str:
+        """
+        Return the SHA-256 of a file. The hash of the previous build is reused while
+        the size and modification time are unchanged.
+        """
+        with self.lock:
+            input_entry = self.inputs.get(file_path)
+        if input_entry:
+            return input_entry['sha256']
+
+        file_stat = os.stat(file_path)
+        previous_entry = self.previous_inputs.get(file_path)
+        if previous_entry and previous_entry.get('size') == file_stat.st_size \
+            and previous_entry.get('mtime_ns') == file_stat.st_mtime_ns:
+                file_hash = previous_entry['sha256']
+        else:
+            sha256 = hashlib.sha256()
+            with open(file_path, 'rb') as rf:
+                for chunk in iter(lambda: rf.read(1024 * 1024), b''):
+                    sha256.update(chunk)
+            file_hash = sha256.hexdigest()
+
+        with self.lock:
+            self.inputs[file_path] = {
+                'sha256': file_hash,
+                'size': file_stat.st_size,
+                'mtime_ns': file_stat.st_mtime_ns
+            }
+        return file_hash
+
+    @staticmethod
+    def fingerprint(parts) -> str:
+        """
+        Hash a JSON serialisable description of everything a release file depends on.
+        """
+        return hashlib.sha256(json.dumps(parts, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def is_up_to_date(self, release_file_path:str, fingerprint:str) -> bool:
+        """
+        Check if a release file was built by the previous build from the same inputs and still exists.
+        """
+        previous_entry = self.previous_release_files.get(release_file_path)
+        return bool(previous_entry) and previous_entry.get('fingerprint') == fingerprint \
+            and os.path.isfile(release_file_path)
+
+    def record_release_file(self, release_file_path:str, fingerprint:str, inputs=None) -> None:
+        """
+        Record the fingerprint of a release file and the inputs that contributed to it.
+        """
+        with self.lock:
+            self.release_files[release_file_path] = {
+                'fingerprint': fingerprint,
+                'inputs': list(inputs or [])
+            }
+
+    def bundle_file_entry(self, relative_path:str, file_path:str) -> dict:
+        """
+        Return the checksum manifest entry the previous build recorded for a bundle file, None when the file
+        changed since, going by its size and modification time.
+        """
+        previous_entry = self.previous_bundle_files.get(relative_path)
+        if not previous_entry:
+            return None
+        try:
+            file_stat = os.stat(file_path)
+        except OSError:
+            return None
+        if previous_entry.get('size') != file_stat.st_size or previous_entry.get('mtime_ns') != file_stat.st_mtime_ns:
+            return None
+        return previous_entry.get('checksums')
+
+    def record_bundle_file(self, relative_path:str, file_path:str, file_entry:dict) -> None:
+        """
+        Record the checksum manifest entry of a bundle file with its current size and modification time.
+        """
+        try:
+            file_stat = os.stat(file_path)
+        except OSError:
+            return
+        with self.lock:
+            self.bundle_files[relative_path] = {
+                'size': file_stat.st_size,
+                'mtime_ns': file_stat.st_mtime_ns,
+                'checksums': file_entry
+            }
+
+    def record_dropped_duplicates(self, dropped_duplicates) -> None:
+        """
+        Record the changed files left out of the bundle because a later file defines the same object.
+        """
+        with self.lock:
+            self.dropped_duplicates = list(dropped_duplicates)
+
+    def save(self) -> None:
+        """
+        Write the manifest next to the release bundle.
+        """
+        with self.lock:
+            manifest_data = {
+                'version': self.MANIFEST_FORMAT_VERSION,
+                'build': self.build_info,
+                'inputs': self.inputs,
+                'release_files': self.release_files,
+                'bundle_files': self.bundle_files,
+                'dropped_duplicates': self.dropped_duplicates
+            }
+
+        try:
+            manifest_dir = os.path.dirname(self.manifest_path) or '.'
+            os.makedirs(manifest_dir, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=manifest_dir, prefix='.build_manifest.')
+            with os.fdopen(fd, 'w', encoding='utf-8') as wf:
+                json.dump(manifest_data, wf, indent=2, sort_keys=True)
+            os.replace(temp_path, self.manifest_path)
+            logger.info(f"Saved build manifest {self.manifest_path}")
+
+        except Exception as e:
+            logger.error(f"Failed to save build manifest {self.manifest_path}: {e}")
@@ -0,0 +1,157 @@
+import os
+import json
+import time
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Counters reported for every build, even when they stay at zero
+BUILD_COUNTERS = [
+    'bytes_read',
+    'bytes_written',
+    'files_processed',
+    'files_written',
+    'encoding_detections',
+    'encoding_fast_path_hits',
+    'encoding_cache_hits',
+    'artifact_cache_hits',
+    'artifact_cache_misses',
+    'checksum_manifest_files_hashed',
+    'journal_resumed_files',
+    'journal_resumed_scripts',
+]
+
+class BuildMetrics():
+    """
+    Collects per stage wall and CPU time plus build wide counters for a release build.
+    CPU time is process wide, so stages running concurrently see each other's CPU usage.
+    """
+    def __init__(self, release_number=None):
+        """
+        Initialize the BuildMetrics class.
+        """
+        self.release_number = release_number
+        self.stages = OrderedDict()
+        self.counters = OrderedDict((counter_name, 0) for counter_name in BUILD_COUNTERS)
+        self.build_start_wall = time.perf_counter()
+        self.build_start_cpu = time.process_time()
+        self.build_status = 'running'
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, stage_name:str):
+        """
+        Time a build stage. A stage that raises is recorded as failed.
+        """
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        stage_status = 'failed'
+        try:
+            yield
+            stage_status = 'succeeded'
+        finally:
+            with self.lock:
+                self.stages[stage_name] = {
+                    'wall_seconds': time.perf_counter() - start_wall,
+                    'cpu_seconds': time.process_time() - start_cpu,
+                    'status': stage_status
+                }
+            logger.info(f"Stage {stage_name} {stage_status} in {self.stages[stage_name]['wall_seconds']:.3f}s")
+
+    def increment(self, counter_name:str, amount:int=1) -> None:
+        """
+        Add to a build counter.
+        """
+        with self.lock:
+            self.counters[counter_name] = self.counters.get(counter_name, 0) + amount
+
+    def finish(self, succeeded:bool) -> None:
+        """
+        Record the total build time and outcome.
+        """
+        with self.lock:
+            self.build_wall_seconds = time.perf_counter() - self.build_start_wall
+            self.build_cpu_seconds = time.process_time() - self.build_start_cpu
+            self.build_status = 'succeeded' if succeeded else 'failed'
+
+    def report(self) -> dict:
+        """
+        Return the metrics as a JSON serialisable dict.
+        """
+        with self.lock:
+            return {
+                'release_number': self.release_number,
+                'status': self.build_status,
+                'wall_seconds': getattr(self, 'build_wall_seconds', time.perf_counter() - self.build_start_wall),
+                'cpu_seconds': getattr(self, 'build_cpu_seconds', time.process_time() - self.build_start_cpu),
+                'stages': OrderedDict((stage_name, dict(stage)) for stage_name, stage in self.stages.items()),
+                'counters': dict(self.counters)
+            }
+
+    def prometheus_text(self) -> str:
+        """
+        Render the metrics in the Prometheus text exposition format used by the node exporter textfile collector.
+        """
+        build_report = self.report()
+        release_label = f'release="{build_report["release_number"] or ""}"'
+        lines = [
+            '# HELP bgt_release_build_wall_seconds Wall time of the release build.',
+            '# TYPE bgt_release_build_wall_seconds gauge',
+            f'bgt_release_build_wall_seconds{{{release_label}}} {build_report["wall_seconds"]:.6f}',
+            '# HELP bgt_release_build_cpu_seconds CPU time of the release build.',
+            '# TYPE bgt_release_build_cpu_seconds gauge',
+            f'bgt_release_build_cpu_seconds{{{release_label}}} {build_report["cpu_seconds"]:.6f}',
+            '# HELP bgt_release_build_success Whether the release build succeeded.',
+            '# TYPE bgt_release_build_success gauge',
+            f'bgt_release_build_success{{{release_label}}} {1 if build_report["status"] == "succeeded" else 0}',
+            '# HELP bgt_release_stage_wall_seconds Wall time of a release build stage.',
+            '# TYPE bgt_release_stage_wall_seconds gauge',
+        ]
+        for stage_name, stage in build_report['stages'].items():
+            lines.append(f'bgt_release_stage_wall_seconds{{{release_label},stage="{stage_name}"}} {stage["wall_seconds"]:.6f}')
+        lines.extend([
+            '# HELP bgt_release_stage_cpu_seconds Process CPU time spent while a release build stage ran.',
+            '# TYPE bgt_release_stage_cpu_seconds gauge',
+        ])
+        for stage_name, stage in build_report['stages'].items():
+            lines.append(f'bgt_release_stage_cpu_seconds{{{release_label},stage="{stage_name}"}} {stage["cpu_seconds"]:.6f}')
+        for counter_name, counter_value in build_report['counters'].items():
+            lines.extend([
+                f'# HELP bgt_release_build_{counter_name} Release build counter {counter_name}.',
+                f'# TYPE bgt_release_build_{counter_name} gauge',
+                f'bgt_release_build_{counter_name}{{{release_label}}} {counter_value}',
+            ])
+        return '\n'.join(lines) + '\n'
+
+    def write_atomically(self, file_path:str, file_content:str) -> None:
+        """
+        Write a report through a temporary file so collectors never read a partial file.
+        """
+        try:
+            report_dir = os.path.dirname(os.path.abspath(file_path))
+            os.makedirs(report_dir, exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=report_dir, prefix='.build_metrics.')
+            with os.fdopen(fd, 'w', encoding='utf-8') as wf:
+                wf.write(file_content)
+            os.chmod(temp_path, 0o644)
+            os.replace(temp_path, file_path)
+            logger.info(f"Written build metrics to {file_path}")
+
+        except Exception as e:
+            logger.error(f"Failed to write build metrics {file_path}: {e}")
+
+    def write_json_report(self, file_path:str) -> None:
+        """
+        Write the metrics as a JSON report.
+        """
+        self.write_atomically(file_path=file_path, file_content=json.dumps(self.report(), indent=2))
+
+    def write_prometheus_textfile(self, file_path:str) -> None:
+        """
+        Write the metrics as a Prometheus textfile.
+        """
+        self.write_atomically(file_path=file_path, file_content=self.prometheus_text())
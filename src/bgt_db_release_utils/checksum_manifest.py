@@ -0,0 +1,215 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+from .exceptions import ReleaseInputError
+
+logger = logging.getLogger(__name__)
+
+CHECKSUM_MANIFEST_FORMAT_VERSION = 1
+
+# Bytes read at a time when hashing a bundle file that was not written by the build
+HASH_CHUNK_SIZE = 1024 * 1024
+
+class FileChecksum():
+    """
+    Running digests of one bundle file, updated as its bytes are written, with the changed files its bytes came from.
+    """
+    def __init__(self, algorithms):
+        """
+        Initialize the FileChecksum class.
+        """
+        self.hashers = {algorithm: hashlib.new(algorithm) for algorithm in algorithms}
+        self.size = 0
+        # {'path', 'offset', 'length'} of each run of bytes appended from a changed file, {'path'} for a template
+        self.sources = []
+
+    def update(self, data:bytes, source_path:str=None) -> None:
+        """
+        Add the next bytes of the file, read from source_path, None for the headers and separators.
+        """
+        if source_path:
+            last_source = self.sources[-1] if self.sources else None
+            if last_source and last_source['path'] == source_path and last_source.get('offset', -1) + last_source.get('length', 0) == self.size:
+                last_source['length'] += len(data)
+            else:
+                self.sources.append({'path': source_path, 'offset': self.size, 'length': len(data)})
+        for hasher in self.hashers.values():
+            hasher.update(data)
+        self.size += len(data)
+
+    def entry(self) -> dict:
+        """
+        Describe the file for the manifest: its size, its digests by algorithm and its sources.
+        """
+        file_entry = {'size': self.size, 'sources': [dict(source) for source in self.sources]}
+        for algorithm, hasher in self.hashers.items():
+            file_entry[algorithm] = hasher.hexdigest()
+        return file_entry
+
+class ChecksumManifest():
+    """
+    Digests of every file of a release bundle, computed while the bytes are written instead of reading the bundle
+    again, and written as MANIFEST.json at the root of the bundle so the deployment can verify the bundle against it.
+    The manifest holds no timestamp and is serialised canonically, the same bundle always gives the same bytes and
+    a detached signature of the manifest covers the whole bundle.
+    Files kept from the previous build or restored from the artifact cache reuse the digests recorded with them.
+    """
+    def __init__(self, bundle_path:str, manifest_file_name:str='MANIFEST.json', algorithms=('sha256',)):
+        """
+        Initialize the ChecksumManifest class. algorithms are hashlib names, e.g. sha256 and blake2b.
+        Raises ReleaseInputError for an algorithm hashlib does not provide.
+        """
+        self.bundle_path = bundle_path
+        self.bundle_root = os.path.abspath(bundle_path)
+        self.manifest_file_name = manifest_file_name
+        self.algorithms = list(algorithms)
+        for algorithm in self.algorithms:
+            try:
+                hashlib.new(algorithm)
+            except (ValueError, TypeError) as e:
+                raise ReleaseInputError(f"Unknown checksum manifest algorithm {algorithm}: {e}") from e
+        # Path relative to the bundle -> FileChecksum of the files written by this build, or the entry of a kept file
+        self.file_checksums = {}
+        self.kept_entries = {}
+        # Files appended to without being written first, their digests are left to add_existing_files
+        self.untracked_paths = set()
+        # Files read back by add_existing_files because no digest was recorded for them
+        self.hashed_count = 0
+        self.lock = threading.Lock()
+
+    def relative_path(self, file_path:str) -> str:
+        """
+        Return the path of a file relative to the bundle, None for a file outside it or for the manifest itself.
+        """
+        relative_path = os.path.relpath(os.path.abspath(file_path), self.bundle_root)
+        if relative_path == os.curdir or relative_path.startswith(os.pardir) or relative_path == self.manifest_file_name:
+            return None
+        return relative_path.replace(os.sep, '/')
+
+    def record_write(self, file_path:str, file_content:bytes, source_paths=()) -> None:
+        """
+        Digest a bundle file created or overwritten with file_content, made from source_paths.
+        """
+        relative_path = self.relative_path(file_path=file_path)
+        if relative_path is None:
+            return
+        file_checksum = FileChecksum(algorithms=self.algorithms)
+        file_checksum.update(data=file_content)
+        file_checksum.sources = [{'path': source_path} for source_path in source_paths]
+        with self.lock:
+            self.file_checksums[relative_path] = file_checksum
+            self.kept_entries.pop(relative_path, None)
+            self.untracked_paths.discard(relative_path)
+
+    def record_append(self, file_path:str, data:bytes, source_path:str=None) -> None:
+        """
+        Digest bytes appended to a bundle file, read from source_path. Each file is appended to by one thread at a time.
+        """
+        relative_path = self.relative_path(file_path=file_path)
+        if relative_path is None:
+            return
+        with self.lock:
+            file_checksum = self.file_checksums.get(relative_path)
+            if file_checksum is None:
+                self.untracked_paths.add(relative_path)
+                return
+        file_checksum.update(data=data, source_path=source_path)
+
+    def record_kept_file(self, file_path:str, file_entry) -> bool:
+        """
+        Reuse the manifest entry recorded with a file the build did not write. Returns False when the entry misses
+        one of the algorithms, the file is then hashed by add_existing_files.
+        """
+        relative_path = self.relative_path(file_path=file_path)
+        if relative_path is None or not file_entry or any(algorithm not in file_entry for algorithm in self.algorithms):
+            return False
+        with self.lock:
+            self.kept_entries[relative_path] = self.kept_entry(file_entry=file_entry)
+            self.file_checksums.pop(relative_path, None)
+            self.untracked_paths.discard(relative_path)
+        return True
+
+    def kept_entry(self, file_entry:dict) -> dict:
+        """
+        Keep the size, the sources and the digests of the configured algorithms of a recorded entry.
+        """
+        kept_entry = {'size': file_entry['size'], 'sources': list(file_entry.get('sources', []))}
+        for algorithm in self.algorithms:
+            kept_entry[algorithm] = file_entry[algorithm]
+        return kept_entry
+
+    def file_entry(self, file_path:str) -> dict:
+        """
+        Return the manifest entry of a bundle file once it is complete, None when it is not known.
+        """
+        relative_path = self.relative_path(file_path=file_path)
+        with self.lock:
+            if relative_path in self.untracked_paths:
+                return None
+            file_checksum = self.file_checksums.get(relative_path)
+            kept_entry = self.kept_entries.get(relative_path)
+        return file_checksum.entry() if file_checksum else kept_entry
+
+    def add_existing_files(self, build_manifest=None) -> None:
+        """
+        Add the files of the bundle directory the build left in place, such as the release files of an incremental
+        build that were up to date, with the entries the build manifest recorded while they are unchanged.
+        Files without a usable entry are read and hashed.
+        """
+        for directory_path, _, file_names in os.walk(self.bundle_path):
+            for file_name in sorted(file_names):
+                file_path = os.path.join(directory_path, file_name)
+                relative_path = self.relative_path(file_path=file_path)
+                with self.lock:
+                    if relative_path is None or relative_path in self.kept_entries or relative_path in self.file_checksums:
+                        continue
+                previous_entry = build_manifest.bundle_file_entry(relative_path=relative_path, file_path=file_path) \
+                    if build_manifest else None
+                if self.record_kept_file(file_path=file_path, file_entry=previous_entry):
+                    continue
+                logger.info(f"Hashing {file_path} for the checksum manifest")
+                file_checksum = FileChecksum(algorithms=self.algorithms)
+                with open(file_path, 'rb') as rf:
+                    for chunk in iter(lambda: rf.read(HASH_CHUNK_SIZE), b''):
+                        file_checksum.update(data=chunk)
+                with self.lock:
+                    self.file_checksums[relative_path] = file_checksum
+                    self.untracked_paths.discard(relative_path)
+                self.hashed_count += 1
+
+    def record_bundle_files(self, build_manifest) -> None:
+        """
+        Record the entry of every file in the build manifest, for the next build of the bundle to reuse.
+        """
+        for relative_path, file_entry in self.manifest()['files'].items():
+            build_manifest.record_bundle_file(relative_path=relative_path,
+                                              file_path=os.path.join(self.bundle_path, relative_path),
+                                              file_entry=file_entry)
+
+    def manifest(self) -> dict:
+        """
+        Describe the bundle: every file by its path relative to the bundle, with its size, digests and sources.
+        """
+        with self.lock:
+            file_checksums = [
+                (relative_path, file_checksum) for relative_path, file_checksum in self.file_checksums.items()
+                if relative_path not in self.untracked_paths
+            ]
+            manifest_files = dict(self.kept_entries)
+        for relative_path, file_checksum in file_checksums:
+            manifest_files[relative_path] = file_checksum.entry()
+        return {
+            'version': CHECKSUM_MANIFEST_FORMAT_VERSION,
+            'bundle': os.path.basename(self.bundle_root),
+            'algorithms': self.algorithms,
+            'files': dict(sorted(manifest_files.items())),
+            'total_size': sum(file_entry['size'] for file_entry in manifest_files.values())
+        }
+
+    def to_json(self) -> str:
+        """
+        Serialise the manifest canonically: sorted keys, fixed indentation and a trailing newline.
+        """
+        return json.dumps(self.manifest(), indent=2, sort_keys=True, ensure_ascii=True) + '\n'
@@ -0,0 +1,161 @@
+import os
+import re
+import zipfile
+import logging
+import tempfile
+from xml.sax.saxutils import escape
+
+logger = logging.getLogger(__name__)
+
+# Parts of a docx package that hold document text
+TEXT_PART_PATTERN = re.compile(r'^word/(document|header\d*|footer\d*|footnotes|endnotes)\.xml$')
+
+# Paragraph boundaries and the text nodes of their runs. Text nodes never contain '<', it is escaped.
+PARAGRAPH_TOKEN_PATTERN = re.compile(
+    r'(?P<paragraph_start><w:p(?:\s[^>]*)?(?<!/)>)'
+    r'|(?P<paragraph_end></w:p>)'
+    r'|(?P<text_tag><w:t(?:\s[^>]*)?(?<!/)>)(?P<text>[^<]*)</w:t>'
+)
+
+XML_ENTITY_PATTERN = re.compile(r'&(#x[0-9a-fA-F]+|#[0-9]+|amp|lt|gt|quot|apos);')
+XML_ENTITIES = {'amp': '&', 'lt': '<', 'gt': '>', 'quot': '"', 'apos': "'"}
+
+class DocxTemplateRenderer():
+    """
+    Renders a Word template by replacing placeholders in the XML of its text parts. The package is streamed
+    member by member, parts without placeholders are copied through unchanged.
+    Placeholders are matched on the text of a whole paragraph, so a placeholder Word split across runs is
+    still replaced. The replacement takes the formatting of the run the placeholder starts in.
+    """
+    def __init__(self, replacements:dict):
+        """
+        Initialize the DocxTemplateRenderer class. Placeholders are replaced in the order of the dict.
+        """
+        self.replacements = {
+            placeholder: str(replacement)
+            for placeholder, replacement in replacements.items()
+            if placeholder
+        }
+
+    def render(self, template_path:str, output_path:str) -> int:
+        """
+        Write the rendered document to output_path. Returns the number of parts rewritten.
+        """
+        output_dir = os.path.dirname(os.path.abspath(output_path))
+        fd, temp_path = tempfile.mkstemp(dir=output_dir, prefix='.docx_render.')
+        try:
+            with os.fdopen(fd, 'wb') as wf:
+                rewritten_parts = self.render_to_stream(template_path=template_path, output_stream=wf)
+            os.replace(temp_path, output_path)
+
+        except Exception:
+            os.unlink(temp_path)
+            raise
+
+        logger.info(f"Rendered {template_path} to {output_path}, {rewritten_parts} parts rewritten")
+        return rewritten_parts
+
+    def render_to_stream(self, template_path:str, output_stream) -> int:
+        """
+        Write the rendered document to a writable binary stream. Returns the number of parts rewritten.
+        """
+        rewritten_parts = 0
+        with zipfile.ZipFile(template_path, 'r') as template_zip, \
+            zipfile.ZipFile(output_stream, 'w') as output_zip:
+                for member_info in template_zip.infolist():
+                    member_data = template_zip.read(member_info)
+                    if TEXT_PART_PATTERN.match(member_info.filename):
+                        rendered_xml = self.render_part(part_xml=member_data.decode('utf-8'))
+                        if rendered_xml is not None:
+                            member_data = rendered_xml.encode('utf-8')
+                            rewritten_parts += 1
+                    # The template's member info keeps timestamps, permissions and compression
+                    output_zip.writestr(member_info, member_data)
+        return rewritten_parts
+
+    def render_part(self, part_xml:str) -> str:
+        """
+        Replace placeholders in the paragraphs of one XML part. Returns None when nothing was replaced.
+        """
+        # Paragraphs can nest inside text boxes, text nodes belong to the innermost open paragraph
+        open_paragraphs = []
+        text_node_edits = []
+        for token in PARAGRAPH_TOKEN_PATTERN.finditer(part_xml):
+            if token.group('paragraph_start'):
+                open_paragraphs.append([])
+            elif token.group('paragraph_end'):
+                if open_paragraphs:
+                    text_node_edits.extend(self.render_paragraph(text_nodes=open_paragraphs.pop()))
+            elif open_paragraphs:
+                open_paragraphs[-1].append(token)
+
+        if not text_node_edits:
+            return None
+
+        rendered_parts = []
+        part_position = 0
+        for text_node, node_text in sorted(text_node_edits, key=lambda edit: edit[0].start()):
+            rendered_parts.append(part_xml[part_position:text_node.start()])
+            rendered_parts.append(f'<w:t xml:space="preserve">{escape(node_text)}</w:t>')
+            part_position = text_node.end()
+        rendered_parts.append(part_xml[part_position:])
+        return ''.join(rendered_parts)
+
+    def render_paragraph(self, text_nodes) -> list:
+        """
+        Replace placeholders across the text nodes of a paragraph. Returns (text node, new text) for each changed node.
+        """
+        node_texts = [self.unescape(text_node.group('text')) for text_node in text_nodes]
+        original_texts = list(node_texts)
+        for placeholder, replacement in self.replacements.items():
+            self.replace_placeholder(node_texts=node_texts, placeholder=placeholder, replacement=replacement)
+
+        return [
+            (text_node, node_text)
+            for text_node, node_text, original_text in zip(text_nodes, node_texts, original_texts)
+            if node_text != original_text
+        ]
+
+    def replace_placeholder(self, node_texts:list, placeholder:str, replacement:str) -> None:
+        """
+        Replace every occurrence of a placeholder in the joined node texts, left to right like str.replace.
+        The replacement goes into the node where the occurrence starts, the rest of the occurrence is removed
+        from the following nodes.
+        """
+        search_start = 0
+        while True:
+            paragraph_text = ''.join(node_texts)
+            match_start = paragraph_text.find(placeholder, search_start)
+            if match_start < 0:
+                return
+            match_end = match_start + len(placeholder)
+
+            node_start = 0
+            replacement_written = False
+            for node_index, node_text in enumerate(node_texts):
+                node_end = node_start + len(node_text)
+                overlap_start = max(match_start, node_start)
+                overlap_end = min(match_end, node_end)
+                if overlap_start < overlap_end:
+                    node_texts[node_index] = (
+                        node_text[:overlap_start - node_start]
+                        + ('' if replacement_written else replacement)
+                        + node_text[overlap_end - node_start:]
+                    )
+                    replacement_written = True
+                node_start = node_end
+
+            search_start = match_start + len(replacement)
+
+    def unescape(self, xml_text:str) -> str:
+        """
+        Resolve the XML entities and character references of a text node.
+        """
+        def resolve_entity(match):
+            entity = match.group(1)
+            if entity.startswith('#x'):
+                return chr(int(entity[2:], 16))
+            if entity.startswith('#'):
+                return chr(int(entity[1:]))
+            return XML_ENTITIES[entity]
+        return XML_ENTITY_PATTERN.sub(resolve_entity, xml_text)
@@ -0,0 +1,158 @@
+import os
+import json
+import fcntl
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+class EncodingCache():
+    """
+    Persistent cache of detected encodings keyed by a hash of the sampled file content.
+    Detection only looks at the sample, so a content hash hit is always a valid answer.
+    """
+    CACHE_FORMAT_VERSION = 1
+
+    def __init__(self, cache_path, max_entries):
+        """
+        Initialize the EncodingCache class.
+        """
+        self.cache_path = cache_path
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        # Modification time of the cache file when it was last loaded or saved
+        self.cache_mtime_ns = None
+        self.lock = threading.Lock()
+
+    def sample_key(self, sample:bytes) -> str:
+        """
+        Build the cache key for a sample of file content.
+        """
+        return hashlib.blake2b(sample, digest_size=16).hexdigest()
+
+    def get(self, sample:bytes) -> str:
+        """
+        Return the cached encoding for a sample, or None if it has not been seen before.
+        """
+        key = self.sample_key(sample)
+        with self.lock:
+            encoding = self.entries.get(key)
+            if encoding is None:
+                self.misses += 1
+                return None
+            # Mark the entry as most recently used
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return encoding
+
+    def put(self, sample:bytes, encoding:str) -> None:
+        """
+        Store the detected encoding for a sample, evicting the least recently used entries.
+        """
+        key = self.sample_key(sample)
+        with self.lock:
+            self.entries[key] = encoding
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            self.dirty = True
+
+    def load(self) -> None:
+        """
+        Load cache entries from disk, merged into the entries already held.
+        A missing or unreadable cache file starts an empty cache.
+        """
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as rf:
+                self.cache_mtime_ns = os.fstat(rf.fileno()).st_mtime_ns
+                cache_data = json.load(rf)
+            if cache_data.get('version') != self.CACHE_FORMAT_VERSION:
+                logger.info(f"Ignoring encoding cache {self.cache_path} with an old format.")
+                return
+
+            with self.lock:
+                # Entries are stored from least to most recently used
+                for key, encoding in cache_data.get('entries', [])[-self.max_entries:]:
+                    self.entries[key] = encoding
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+            logger.info(f"Loaded {len(self.entries)} encoding cache entries from {self.cache_path}")
+
+        except FileNotFoundError:
+            logger.info(f"No encoding cache found at {self.cache_path}")
+        except Exception as e:
+            logger.warning(f"Failed to load encoding cache {self.cache_path}: {e}")
+
+    def reload_if_changed(self) -> None:
+        """
+        Merge in the entries other runs saved since the cache was loaded, for processes kept between builds.
+        """
+        try:
+            cache_mtime_ns = os.stat(self.cache_path).st_mtime_ns
+        except OSError:
+            return
+        if cache_mtime_ns != self.cache_mtime_ns:
+            self.load()
+
+    def read_entries(self) -> list:
+        """
+        Read the entries saved on disk, from least to most recently used. A missing, unreadable or old cache file
+        has none.
+        """
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as rf:
+                cache_data = json.load(rf)
+        except FileNotFoundError:
+            return []
+        except Exception as e:
+            logger.warning(f"Failed to read encoding cache {self.cache_path}: {e}")
+            return []
+        if cache_data.get('version') != self.CACHE_FORMAT_VERSION:
+            return []
+        return cache_data.get('entries', [])
+
+    def save(self) -> None:
+        """
+        Write the cache to disk atomically so concurrent runs never see a partial file. The entries other runs saved
+        since this one loaded the cache are merged in under an exclusive lock, so concurrent runs keep each other's.
+        """
+        with self.lock:
+            if not self.dirty:
+                return
+            self.dirty = False
+
+        try:
+            cache_dir = os.path.dirname(self.cache_path) or '.'
+            os.makedirs(cache_dir, exist_ok=True)
+            with open(self.cache_path + '.lock', 'w') as lock_file:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+                saved_entries = self.read_entries()
+                with self.lock:
+                    # The entries of this run are the most recently used
+                    merged_entries = OrderedDict(saved_entries[-self.max_entries:])
+                    for key, encoding in self.entries.items():
+                        merged_entries[key] = encoding
+                        merged_entries.move_to_end(key)
+                    while len(merged_entries) > self.max_entries:
+                        merged_entries.popitem(last=False)
+                    self.entries = merged_entries
+                    cache_data = {
+                        'version': self.CACHE_FORMAT_VERSION,
+                        'entries': [[key, encoding] for key, encoding in merged_entries.items()]
+                    }
+
+                fd, temp_path = tempfile.mkstemp(dir=cache_dir, prefix='.encoding_cache.')
+                with os.fdopen(fd, 'w', encoding='utf-8') as wf:
+                    json.dump(cache_data, wf)
+                os.replace(temp_path, self.cache_path)
+                self.cache_mtime_ns = os.stat(self.cache_path).st_mtime_ns
+            logger.info(f"Saved {len(cache_data['entries'])} encoding cache entries to {self.cache_path}")
+
+        except Exception as e:
+            logger.warning(f"Failed to save encoding cache {self.cache_path}: {e}")
@@ -0,0 +1,142 @@
+import logging
+import multiprocessing
+from itertools import chain
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import chardet
+from .files_manager import FilesManager, ENCODING_SAMPLE_SIZE
+
+logger = logging.getLogger(__name__)
+
+def detect_sample_batch(samples:list) -> list:
+    """
+    Run chardet over a batch of samples in a worker process. Returns the detected encodings in sample order.
+    """
+    return [chardet.detect(sample)['encoding'] for sample in samples]
+
+def decode_source_batch(decode_jobs:list) -> list:
+    """
+    Read and transcode a batch of (file path, encoding) jobs to UTF-8 bytes in a worker process.
+    A file that fails gives None, the copy reads it again and reports the error.
+    """
+    file_manager = FilesManager()
+    decoded_sources = []
+    for file_path, encoding in decode_jobs:
+        file_manager.detected_encodings[file_path] = encoding
+        try:
+            decoded_sources.append(b''.join(file_manager.iter_source_utf8_chunks(file_path=file_path)))
+        except Exception:
+            decoded_sources.append(None)
+    return decoded_sources
+
+class EncodingPrepass():
+    """
+    Detects the encodings of the changed SQL files before the copy. Samples that need chardet are sent to a
+    process pool in batches, so detection uses every core instead of one interpreter. Optionally the files are
+    also decoded in the pool and the copy appends the UTF-8 bytes it is handed.
+    Small change sets are detected in process, starting the pool would cost more than it saves.
+    """
+    def __init__(self, file_manager, max_workers:int, min_pool_files:int, batch_size:int, start_method:str=None,
+                 decode:bool=False, decode_max_file_bytes:int=0, decode_max_bytes:int=0):
+        """
+        Initialize the EncodingPrepass class.
+        """
+        self.file_manager = file_manager
+        self.max_workers = max(1, max_workers)
+        self.min_pool_files = min_pool_files
+        self.batch_size = max(1, batch_size)
+        self.start_method = start_method
+        self.decode = decode
+        self.decode_max_file_bytes = decode_max_file_bytes
+        self.decode_max_bytes = decode_max_bytes
+
+    def run(self, file_paths) -> None:
+        """
+        Detect the encoding of each file and record it in the files manager, ahead of the copy.
+        """
+        file_paths = list(dict.fromkeys(file_paths))
+        pending_samples = OrderedDict()
+        for file_path in file_paths:
+            try:
+                with self.file_manager.open_source(file_path=file_path) as source_stream:
+                    sample = source_stream.read(ENCODING_SAMPLE_SIZE)
+            except (OSError, ValueError) as e:
+                # Left to the copy, which reports the error
+                logger.warning(f"Encoding prepass skipped {file_path}: {e}")
+                continue
+
+            encoding = self.file_manager.lookup_sample_encoding(sample=sample, file_path=file_path)
+            if encoding:
+                self.file_manager.detected_encodings[file_path] = encoding
+            else:
+                pending_samples[file_path] = sample
+
+        # Worker processes cannot share the git cat-file processes of the source reader, only disk files are decoded
+        decode_sources = self.decode and not self.file_manager.source_reader
+        use_pool = self.max_workers > 1 and (
+            len(pending_samples) >= self.min_pool_files or (decode_sources and len(file_paths) >= self.min_pool_files)
+        )
+        if not use_pool:
+            for file_path, sample in pending_samples.items():
+                encoding = self.file_manager.detect_sample_encoding(sample=sample, file_path=file_path)
+                if encoding:
+                    self.file_manager.detected_encodings[file_path] = encoding
+            logger.info(f"Encoding prepass detected {len(pending_samples)} encodings in process")
+            return
+
+        mp_context = multiprocessing.get_context(self.start_method) if self.start_method else None
+        with ProcessPoolExecutor(max_workers=self.max_workers, mp_context=mp_context) as executor:
+            self.detect_in_pool(executor=executor, pending_samples=pending_samples)
+            if decode_sources:
+                self.decode_in_pool(executor=executor, decode_jobs=self.plan_decode_jobs(file_paths=file_paths))
+
+    def batches(self, items:list) -> list:
+        """
+        Split work items into batches, one inter-process round trip each.
+        """
+        return [items[start:start + self.batch_size] for start in range(0, len(items), self.batch_size)]
+
+    def detect_in_pool(self, executor, pending_samples) -> None:
+        """
+        Run chardet over the pending samples in the pool, then cache and record the results.
+        """
+        samples = list(pending_samples.values())
+        encodings = chain.from_iterable(executor.map(detect_sample_batch, self.batches(items=samples)))
+        for (file_path, sample), encoding in zip(pending_samples.items(), encodings):
+            self.file_manager.remember_detected_encoding(sample=sample, encoding=encoding, file_path=file_path)
+            if encoding:
+                self.file_manager.detected_encodings[file_path] = encoding
+        logger.info(f"Encoding prepass detected {len(samples)} encodings in {self.max_workers} processes")
+
+    def plan_decode_jobs(self, file_paths) -> list:
+        """
+        Pick the files decoded ahead of the copy: on disk, with a known encoding, no larger than decode_max_file_bytes,
+        until decode_max_bytes of source is taken. Decoded files are held in memory until they are copied.
+        """
+        decode_jobs = []
+        decode_bytes = 0
+        for file_path in file_paths:
+            encoding = self.file_manager.detected_encodings.get(file_path)
+            if not encoding:
+                continue
+            try:
+                source_size = self.file_manager.source_size(file_path=file_path)
+            except OSError:
+                continue
+            if source_size > self.decode_max_file_bytes or decode_bytes + source_size > self.decode_max_bytes:
+                continue
+            decode_bytes += source_size
+            decode_jobs.append((file_path, encoding))
+        return decode_jobs
+
+    def decode_in_pool(self, executor, decode_jobs:list) -> None:
+        """
+        Transcode the planned files in the pool and hand the UTF-8 bytes to the files manager.
+        """
+        decoded_sources = chain.from_iterable(executor.map(decode_source_batch, self.batches(items=decode_jobs)))
+        decoded_count = 0
+        for (file_path, _), decoded_source in zip(decode_jobs, decoded_sources):
+            if decoded_source is not None:
+                self.file_manager.decoded_sources[file_path] = decoded_source
+                decoded_count += 1
+        logger.info(f"Encoding prepass decoded {decoded_count} of {len(decode_jobs)} files")
@@ -0,0 +1,22 @@
+class ReleaseBuildError(Exception):
+    """
+    Base class of the errors a release build raises. Callers embedding the build catch this instead of
+    the process exiting.
+    """
+
+class ReleaseInputError(ReleaseBuildError, ValueError):
+    """
+    The build inputs are unusable: changed files, version tags, version files or git refs.
+    """
+
+class ReleaseStageError(ReleaseBuildError):
+    """
+    A release stage failed. The error raised by the stage is kept as stage_error and as the cause.
+    """
+    def __init__(self, stage_name:str, stage_error:Exception):
+        """
+        Initialize the ReleaseStageError class.
+        """
+        super().__init__(f"Stage {stage_name} failed: {stage_error}")
+        self.stage_name = stage_name
+        self.stage_error = stage_error
@@ -1,38 +1,255 @@
 import logging
-import sys
 import os
+import io
+import codecs
+import hashlib
 import chardet
-import docx
-from datetime import datetime
+from .template_engine import TemplateEngine
+from .docx_template_renderer import DocxTemplateRenderer
+from .output_backend import FileSystemOutputBackend
+from .exceptions import ReleaseBuildError
 
 logger = logging.getLogger(__name__)
 
+# Number of bytes sampled from the start of a file for encoding detection
+ENCODING_SAMPLE_SIZE = 4096
+
+# Number of bytes read per chunk when copying a source file into a release file. Non UTF-8 sources
+# are transcoded one chunk at a time, so memory use stays bounded whatever the file size.
+COPY_CHUNK_SIZE = 1024 * 1024
+
+# Codecs whose bytes are copied as is, only translating newlines
+UTF8_CODECS = ('utf-8', 'utf-8-sig')
+
+# Byte order marks recognised without chardet. UTF-32 must be checked before UTF-16
+# because the UTF-32 LE BOM starts with the UTF-16 LE BOM.
+KNOWN_BOMS = [
+    (codecs.BOM_UTF32_LE, 'UTF-32'),
+    (codecs.BOM_UTF32_BE, 'UTF-32'),
+    (codecs.BOM_UTF8, 'UTF-8-SIG'),
+    (codecs.BOM_UTF16_LE, 'UTF-16'),
+    (codecs.BOM_UTF16_BE, 'UTF-16'),
+]
+
+class SampledSourceStream(io.RawIOBase):
+    """
+    Replays the encoding detection sample before the rest of a source stream, so a source is only opened once.
+    """
+    def __init__(self, sample:bytes, source_stream):
+        """
+        Initialize the SampledSourceStream class.
+        """
+        self.sample = memoryview(sample)
+        self.source_stream = source_stream
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self.sample:
+            sample_part = self.sample[:len(buffer)]
+            buffer[:len(sample_part)] = sample_part
+            self.sample = self.sample[len(sample_part):]
+            return len(sample_part)
+        data = self.source_stream.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self) -> None:
+        if not self.closed:
+            self.source_stream.close()
+        super().close()
+
 class FilesManager():
-    def __init__(self):
+    def __init__(self, encoding_cache=None, template_engine=None, build_metrics=None, source_reader=None, output_backend=None):
         """
         Initialize the FilesManager class.
+        Changed SQL files are read from disk, or from git objects when a source_reader is given.
+        Release files are written through the output backend, the release directory by default.
+        """
+        self.encoding_cache = encoding_cache
+        self.template_engine = template_engine or TemplateEngine()
+        self.build_metrics = build_metrics
+        self.source_reader = source_reader
+        self.output_backend = output_backend or FileSystemOutputBackend()
+        # Filled by the encoding prepass: file path -> encoding, and file path -> content already decoded to UTF-8
+        self.detected_encodings = {}
+        self.decoded_sources = {}
+        # Release directory name -> key of its database versions
+        self.release_db_keys = {}
+        # Digests of the bundle files, computed as they are written
+        self.checksum_manifest = None
+
+    def set_release_db_keys(self, release_db_keys:dict) -> None:
+        """
+        Set the database key of every release directory, used to pick its versions.
+        """
+        self.release_db_keys = release_db_keys
+
+    def set_checksum_manifest(self, checksum_manifest) -> None:
+        """
+        Digest the bundle files as they are written, for the checksum manifest of the bundle.
+        """
+        self.checksum_manifest = checksum_manifest
+
+    def count(self, counter_name:str, amount:int=1) -> None:
+        """
+        Add to a build metrics counter when metrics are collected.
+        """
+        if self.build_metrics:
+            self.build_metrics.increment(counter_name=counter_name, amount=amount)
+
+    def count_source_read(self, file_path:str) -> None:
+        """
+        Count a source file read in full.
+        """
+        if self.build_metrics:
+            self.build_metrics.increment(counter_name='bytes_read', amount=self.source_size(file_path=file_path))
+            self.build_metrics.increment(counter_name='files_processed')
+
+    def open_source(self, file_path:str):
+        """
+        Open a changed SQL file as a binary stream, from disk or from the git source.
+        """
+        if self.source_reader:
+            return self.source_reader.open_blob(file_path=file_path)
+        return open(file_path, 'rb')
+
+    def open_source_text(self, file_path:str):
+        """
+        Open a changed SQL file as text in its detected encoding, with the same newline handling as open().
+        """
+        source_stream = self.open_source(file_path=file_path)
+        try:
+            sample = source_stream.read(ENCODING_SAMPLE_SIZE)
+            curr_encoding = self.source_encoding(sample=sample, file_path=file_path)
+            if not curr_encoding:
+                raise ValueError(f"Failed to detect the encoding of {file_path}")
+        except Exception:
+            source_stream.close()
+            raise
+
+        sampled_stream = io.BufferedReader(SampledSourceStream(sample=sample, source_stream=source_stream), buffer_size=COPY_CHUNK_SIZE)
+        return io.TextIOWrapper(sampled_stream, encoding=curr_encoding.lower())
+
+    def source_exists(self, file_path:str) -> bool:
         """
-        pass
+        Check that a changed SQL file exists in the source.
+        """
+        if self.source_reader:
+            return self.source_reader.exists(file_path=file_path)
+        return os.path.isfile(file_path)
+
+    def source_size(self, file_path:str) -> int:
+        """
+        Return the size in bytes of a changed SQL file.
+        """
+        if self.source_reader:
+            return self.source_reader.blob_size(file_path=file_path)
+        return os.path.getsize(file_path)
+
+    def source_id(self, file_path:str) -> str:
+        """
+        Return the git blob id of a changed SQL file, None when it is read from disk.
+        """
+        if self.source_reader:
+            return self.source_reader.blob_id(file_path=file_path)
+        return None
     
+    def source_sha256(self, file_path:str) -> str:
+        """
+        Return the SHA-256 of a changed SQL file as stored, from disk or from the git source.
+        """
+        sha256 = hashlib.sha256()
+        with self.open_source(file_path=file_path) as source_stream:
+            for chunk in iter(lambda: source_stream.read(COPY_CHUNK_SIZE), b''):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+
     def detect_encoding(self, file_path:str) -> str:
         """
         Detect the encoding of a file.
         """
         try:
             with open(file_path, 'rb') as rf:
-                data = rf.read(4096) # Read only first 4 KB 
+                data = rf.read(ENCODING_SAMPLE_SIZE) # Read only first 4 KB 
         
-            # Use chardet to detect the encoding
-            result = chardet.detect(data)
-            logger.info(f"Detected encoding for {file_path}: {result}")
-            return result['encoding']
+            return self.detect_sample_encoding(sample=data, file_path=file_path)
         
         except UnicodeDecodeError:
             logger.error(f"Unable to decode file {file_path}")
-            sys.exit(1)
+            raise
         except Exception as e:
             logger.error(f"Error reading file {file_path}: {e}")
-            sys.exit(1)
+            raise
+
+    def detect_sample_encoding(self, sample:bytes, file_path:str) -> str:
+        """
+        Detect the encoding of a sample read from the start of a file.
+        BOMs and valid UTF-8 are recognised directly, other samples go through the cache and chardet.
+        """
+        encoding = self.lookup_sample_encoding(sample=sample, file_path=file_path)
+        if encoding:
+            return encoding
+
+        # Use chardet to detect the encoding
+        return self.remember_detected_encoding(sample=sample, encoding=chardet.detect(sample)['encoding'], file_path=file_path)
+
+    def lookup_sample_encoding(self, sample:bytes, file_path:str) -> str:
+        """
+        Recognise the encoding of a sample without chardet, from a BOM, valid UTF-8 or the cache.
+        Returns None when chardet is needed.
+        """
+        encoding = self.detect_known_encoding(sample=sample)
+        if encoding:
+            logger.info(f"Detected encoding for {file_path} without chardet: {encoding}")
+            self.count(counter_name='encoding_fast_path_hits')
+            return encoding
+
+        if self.encoding_cache:
+            encoding = self.encoding_cache.get(sample)
+            if encoding:
+                logger.info(f"Cached encoding for {file_path}: {encoding}")
+                self.count(counter_name='encoding_cache_hits')
+                return encoding
+        return None
+
+    def remember_detected_encoding(self, sample:bytes, encoding:str, file_path:str) -> str:
+        """
+        Count a chardet detection and cache its result for the sample.
+        """
+        self.count(counter_name='encoding_detections')
+        logger.info(f"Detected encoding for {file_path}: {encoding}")
+        if self.encoding_cache and encoding:
+            self.encoding_cache.put(sample, encoding)
+        return encoding
+
+    def source_encoding(self, sample:bytes, file_path:str) -> str:
+        """
+        Return the encoding of a changed SQL file, as found by the encoding prepass or detected from its sample.
+        """
+        return self.detected_encodings.get(file_path) or self.detect_sample_encoding(sample=sample, file_path=file_path)
+
+    def detect_known_encoding(self, sample:bytes) -> str:
+        """
+        Recognise a BOM or UTF-8 (including plain ASCII) sample. Returns None when chardet is needed.
+        """
+        if not sample:
+            return None
+
+        for bom, encoding in KNOWN_BOMS:
+            if sample.startswith(bom):
+                return encoding
+
+        if sample.isascii():
+            return 'utf-8'
+
+        try:
+            # A full sample may end in the middle of a multi-byte character
+            codecs.getincrementaldecoder('utf-8')().decode(sample, final=len(sample) < ENCODING_SAMPLE_SIZE)
+            return 'utf-8'
+        except UnicodeDecodeError:
+            return None
        
     def read_file_content(self, file_path:str) -> str:
         """
@@ -47,73 +264,69 @@ class FilesManager():
             # Open and read the file using the detected encoding
             with open(file_path, 'r', encoding=current_encoding.lower()) as rf:
                 data = rf.read() 
+            self.count(counter_name='bytes_read', amount=os.path.getsize(file_path))
             
             logger.info(f"File {file_path} read successfully.")
             return data
         
         except FileNotFoundError:
             logger.error(f"File {file_path} not found.")
-            sys.exit(1)
+            raise
         except ValueError as ve:
             logger.error(f"Encoding detection error: {ve}")
-            sys.exit(1)
+            raise
         except Exception as e:
             logger.error(f"Error reading {file_path}: {e}")
-            sys.exit(1)
+            raise
           
-    def write_file_content(self, file_path:str, file_content:str) -> None:
+    def write_file_content(self, file_path:str, file_content:str, source_paths=()) -> None:
         """
-        Write content to a file, creating or overwriting it.
+        Write content to a file, creating or overwriting it. source_paths are the inputs it was made from.
+        Raises ReleaseBuildError when the file cannot be written.
         """
         try:
-            with open(file_path, 'w', encoding='utf-8') as wf:
-                wf.write(file_content)
+            encoded_content = file_content.encode('utf-8')
+            bytes_written = self.output_backend.write_bytes(file_path=file_path, file_content=encoded_content)
+            self.output_backend.record_sources(file_path=file_path, source_paths=source_paths)
+            if self.checksum_manifest:
+                self.checksum_manifest.record_write(file_path=file_path, file_content=encoded_content, source_paths=source_paths)
+            self.count(counter_name='bytes_written', amount=bytes_written)
+            self.count(counter_name='files_written')
             
             logger.info(f"Written to file: {file_path}")
         
         except Exception as e:
-            logger.error(f"Failed to write to file {file_path}: {e}")
+            raise ReleaseBuildError(f"Failed to write to file {file_path}: {e}") from e
     
     def apply_file_replacements(self, file_content, db_versions_dict, release_dir_with_db_name, sql_release_file_name):
         """
-        Apply placeholder replacements to the data.
+        Apply placeholder replacements to the data in a single pass.
+        """
+        render_context = self.build_render_context(
+                db_versions_dict=db_versions_dict,
+                release_dir_with_db_name=release_dir_with_db_name,
+                sql_release_file_name=sql_release_file_name
+            )
+        return self.template_engine.render(file_content=file_content, render_context=render_context)
+
+    def build_render_context(self, db_versions_dict, release_dir_with_db_name, sql_release_file_name) -> dict:
+        """
+        Build the placeholder replacements for a release file of a database.
         """
-        if sql_release_file_name:
-            file_content = self.apply_sql_file_replacments(
-                    file_content=file_content, 
-                    sql_release_file_name=sql_release_file_name
-                )
-        
         # os.path.basename extracts everything after the last / in the path: release/AWB_<version>_and_AGT_<version>/<db_name>
         release_db_file_name = os.path.basename(release_dir_with_db_name)
-        file_content = self.replace_text_in_file(
-                file_content=file_content, 
-                target_text='deployment_db_name', 
-                replacement_text=release_db_file_name
-            )
-        
         db_version_tuple = self.get_versions_tuple(
             db_versions_dict=db_versions_dict, release_db_file_name=release_db_file_name
         )
         
         if not db_version_tuple:
-            logger.error("No DB versions in dict")
-            sys.exit(1)
-            
-        old_version, new_version = db_version_tuple
+            raise ValueError(f"No DB versions for {release_db_file_name}")
 
-        file_content = self.replace_text_in_file(
-                file_content=file_content, 
-                target_text='old_version', 
-                replacement_text=f"'{old_version}'"
+        return self.template_engine.build_context(
+                release_db_name=release_db_file_name,
+                db_version_tuple=db_version_tuple,
+                sql_release_file_name=sql_release_file_name
             )
-        file_content = self.replace_text_in_file(
-                file_content=file_content, 
-                target_text='new_version', 
-                replacement_text=f"'{new_version}'"
-            )
-        
-        return file_content
             
     def replace_text_in_file(self, file_content, target_text, replacement_text):
         """
@@ -125,62 +338,230 @@ class FilesManager():
         """
         Replace placeholders specific to SQL files.
         """
-        file_content = self.replace_text_in_file(
-                file_content=file_content, 
-                target_text='title_based_on_script', 
-                replacement_text=sql_release_file_name
-            )
-        file_content = self.replace_text_in_file(
-                file_content=file_content, 
-                target_text='strdatetime', 
-                replacement_text=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            )
-
-        return file_content
+        render_context = self.template_engine.build_context(sql_release_file_name=sql_release_file_name)
+        return self.template_engine.render(file_content=file_content, render_context=render_context)
     
     def get_versions_tuple(self, db_versions_dict, release_db_file_name):
         """
         Get old and new version tuples based on DB file name.
         """
-        db_version_tuple = None
         # Select the correct version replacement tuple
-        if 'agt' in release_db_file_name:
-            db_version_tuple = db_versions_dict['agt']
-        elif 'awb' in release_db_file_name:
-            db_version_tuple = db_versions_dict['awb']
-        else:
+        db_name = self.release_db_keys.get(release_db_file_name)
+        if db_name not in db_versions_dict:
             logger.error(f"Unknown path basename: {release_db_file_name}")
             return None
         
-        return db_version_tuple
+        return db_versions_dict[db_name]
     
-    def copy_file(self, target_file_path, final_release_path):
+    def iter_source_utf8_chunks(self, file_path:str, chunk_size:int=COPY_CHUNK_SIZE):
+        """
+        Yield the content of a changed SQL file as UTF-8 bytes, with newlines translated as open() does in text mode.
+        UTF-8 sources with LF newlines are copied byte for byte. Other sources, including UTF-8 with CRLF
+        newlines where translating str is faster than rewriting bytes, are transcoded chunk by chunk.
+        """
+        with self.open_source(file_path=file_path) as source_stream:
+            sample = source_stream.read(ENCODING_SAMPLE_SIZE)
+            if not sample:
+                # An empty file has no encoding to detect, it is copied as an empty script
+                logger.warning(f"Changed file {file_path} is empty")
+                return
+            curr_encoding = self.source_encoding(sample=sample, file_path=file_path)
+            if not curr_encoding:
+                raise ValueError(f"Failed to detect the encoding of {file_path}")
+
+            codec_name = codecs.lookup(curr_encoding).name
+            if codec_name in UTF8_CODECS and b'\r' not in sample:
+                if codec_name == 'utf-8-sig' and sample.startswith(codecs.BOM_UTF8):
+                    sample = sample[len(codecs.BOM_UTF8):]
+                yield from self.iter_utf8_chunks(first_chunk=sample, source_stream=source_stream, chunk_size=chunk_size)
+            else:
+                yield from self.iter_transcoded_chunks(first_chunk=sample, source_stream=source_stream,
+                                                       encoding=codec_name, chunk_size=chunk_size)
+
+    def iter_utf8_chunks(self, first_chunk:bytes, source_stream, chunk_size:int):
+        """
+        Copy UTF-8 bytes, replacing the occasional CRLF or lone CR with LF. The bytes are still validated so
+        a file that is not UTF-8 after the sample fails as it does when decoded. ASCII chunks need no validation.
+        """
+        utf8_validator = codecs.getincrementaldecoder('utf-8')()
+        pending_cr = b''
+        chunk = first_chunk
+        while chunk:
+            if not chunk.isascii() or utf8_validator.getstate()[0]:
+                utf8_validator.decode(chunk)
+
+            chunk = pending_cr + chunk
+            # A CR ending the chunk may be the first half of a CRLF
+            pending_cr = b'\r' if chunk.endswith(b'\r') else b''
+            if pending_cr:
+                chunk = chunk[:-1]
+            if b'\r' in chunk:
+                chunk = chunk.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+            if chunk:
+                yield chunk
+            chunk = source_stream.read(chunk_size)
+
+        utf8_validator.decode(b'', final=True)
+        if pending_cr:
+            yield b'\n'
+
+    def iter_transcoded_chunks(self, first_chunk:bytes, source_stream, encoding:str, chunk_size:int):
+        """
+        Decode chunks with an incremental decoder and universal newline translation, the same pipeline
+        TextIOWrapper uses, and re-encode them as UTF-8.
+        """
+        text_decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder(encoding)(), translate=True)
+        chunk = first_chunk
+        while chunk:
+            decoded_chunk = text_decoder.decode(chunk)
+            if decoded_chunk:
+                yield decoded_chunk.encode('utf-8')
+            chunk = source_stream.read(chunk_size)
+
+        decoded_chunk = text_decoder.decode(b'', final=True)
+        if decoded_chunk:
+            yield decoded_chunk.encode('utf-8')
+
+    def iter_copy_chunks(self, file_path:str, chunk_size:int=COPY_CHUNK_SIZE):
+        """
+        Yield the UTF-8 content of a changed SQL file for the copy, handed over whole when the encoding prepass
+        already decoded it.
+        """
+        decoded_source = self.decoded_sources.pop(file_path, None)
+        if decoded_source is not None:
+            yield decoded_source
+            return
+        yield from self.iter_source_utf8_chunks(file_path=file_path, chunk_size=chunk_size)
+
+    def peek_source_bytes(self, file_path:str) -> bytes:
+        """
+        Read a changed SQL file as UTF-8 bytes for analysis. Content decoded by the encoding prepass is
+        left in place for the copy, and the read is not counted in the build metrics.
+        """
+        decoded_source = self.decoded_sources.get(file_path)
+        if decoded_source is not None:
+            return decoded_source
+        return b''.join(self.iter_source_utf8_chunks(file_path=file_path))
+
+    def discard_decoded_sources(self, file_paths) -> None:
+        """
+        Release the content decoded ahead of the copy for files that are not copied after all.
+        """
+        for file_path in file_paths:
+            self.decoded_sources.pop(file_path, None)
+
+    def read_source_bytes(self, source_file_path:str) -> bytes:
+        """
+        Read a changed SQL file as UTF-8 bytes, ready to be appended to a release file.
+        Raises ReleaseBuildError when the file cannot be read, a release file must not miss a script.
+        """
+        try:
+            file_content = self.decoded_sources.pop(source_file_path, None)
+            if file_content is None:
+                file_content = b''.join(self.iter_source_utf8_chunks(file_path=source_file_path))
+            self.count_source_read(file_path=source_file_path)
+            return file_content
+
+        except ReleaseBuildError:
+            raise
+        except UnicodeError as e:
+            raise ReleaseBuildError(f"Encoding error with file {source_file_path}. Ensure it is UTF-16 encoded.") from e
+        except FileNotFoundError as e:
+            raise ReleaseBuildError(f"Source file {source_file_path} not found.") from e
+        except Exception as e:
+            raise ReleaseBuildError(f"Error reading {source_file_path}: {e}") from e
+
+    def read_source_content(self, source_file_path:str) -> str:
+        """
+        Read a changed SQL file with its detected encoding, ready to be appended to a release file.
+        Raises ReleaseBuildError when the file cannot be read, a release file must not miss a script.
+        """
+        try:
+            with self.open_source_text(file_path=source_file_path) as rf:
+                file_content = rf.read()
+            self.count_source_read(file_path=source_file_path)
+            return file_content
+
+        except ReleaseBuildError:
+            raise
+        except UnicodeError as e:
+            raise ReleaseBuildError(f"Encoding error with file {source_file_path}. Ensure it is UTF-16 encoded.") from e
+        except FileNotFoundError as e:
+            raise ReleaseBuildError(f"Source file {source_file_path} not found.") from e
+        except Exception as e:
+            raise ReleaseBuildError(f"Error reading {source_file_path}: {e}") from e
+
+    def copy_file(self, target_file_path, final_release_path, release_file_writer=None, chunk_size=COPY_CHUNK_SIZE):
         """
         Copies content from a source file to a destination file, converting to UTF-8 encoding.
+        The content is streamed in chunks of at most chunk_size bytes. When a release_file_writer is given,
+        it goes through its open handle instead of reopening the destination.
+        Raises ReleaseBuildError when the file cannot be copied.
         """
         try:
-            curr_encoding = self.detect_encoding(file_path=target_file_path)
-            with open(target_file_path,'r',encoding=curr_encoding.lower()) as rf, \
-                open(final_release_path,'a',encoding='utf-8') as wf:
-                    for line in rf:
-                        wf.write(line)  
-                    wf.write('\n\n')
-                    logger.info(f"Copied {target_file_path} to {final_release_path}")
+            if release_file_writer:
+                wf = release_file_writer.get_handle(release_file_path=final_release_path)
+                script_offset = wf.tell()
+                # Written through the writer, which indexes the batches as they stream past
+                for chunk in self.iter_copy_chunks(file_path=target_file_path, chunk_size=chunk_size):
+                    release_file_writer.write(release_file_path=final_release_path, data=chunk, source_path=target_file_path)
+                release_file_writer.finish_script(release_file_path=final_release_path, source_path=target_file_path,
+                                                  offset=script_offset)
+            else:
+                with self.output_backend.open_append(file_path=final_release_path) as wf:
+                    for chunk in self.iter_copy_chunks(file_path=target_file_path, chunk_size=chunk_size):
+                        wf.write(chunk)
+                        if self.checksum_manifest:
+                            self.checksum_manifest.record_append(file_path=final_release_path, data=chunk, source_path=target_file_path)
+                    wf.write(b'\n\n')
+                    if self.checksum_manifest:
+                        self.checksum_manifest.record_append(file_path=final_release_path, data=b'\n\n')
 
+            self.output_backend.record_sources(file_path=final_release_path, source_paths=[target_file_path])
+            self.count_source_read(file_path=target_file_path)
             logger.info(f"Copied {target_file_path} to {final_release_path}")
                  
-        except UnicodeError:
-            logger.error(f"Encoding error with file {target_file_path}. Ensure it is UTF-16 encoded.")
-        except FileNotFoundError:
-            logger.error(f"Source file {target_file_path} not found.")
+        except ReleaseBuildError:
+            raise
+        except UnicodeError as e:
+            raise ReleaseBuildError(f"Encoding error with file {target_file_path}. Ensure it is UTF-16 encoded.") from e
+        except FileNotFoundError as e:
+            raise ReleaseBuildError(f"Source file {target_file_path} not found.") from e
         except Exception as e:
-            logger.error(f"Error copying {target_file_path} to {final_release_path}: {e}")
+            raise ReleaseBuildError(f"Error copying {target_file_path} to {final_release_path}: {e}") from e
            
             
     def write_to_deploy_guide_word(self, deploy_guide_word_path, replace_dict, word_doc_name):
         """
         Modify and save a Word document based on placeholders.
+        The document XML is patched directly, python-docx is only used when that fails.
         """
+        try:
+            rendered_document = io.BytesIO()
+            DocxTemplateRenderer(replacements=replace_dict).render_to_stream(template_path=deploy_guide_word_path,
+                                                                             output_stream=rendered_document)
+            self.write_deploy_guide(deploy_guide_word_path=deploy_guide_word_path, word_doc_name=word_doc_name,
+                                    document_content=rendered_document.getvalue())
+
+        except Exception as e:
+            logger.warning(f"Failed to render the word document XML, falling back to python-docx: {e}")
+            self.write_to_deploy_guide_word_with_python_docx(
+                deploy_guide_word_path=deploy_guide_word_path,
+                replace_dict=replace_dict,
+                word_doc_name=word_doc_name
+            )
+
+    def write_to_deploy_guide_word_with_python_docx(self, deploy_guide_word_path, replace_dict, word_doc_name):
+        """
+        Modify and save a Word document with python-docx, replacing placeholders run by run.
+        """
+        try:
+            # Imported on demand, python-docx is optional and slow to import
+            import docx
+        except ImportError:
+            logger.error("Failed to create word document: python-docx is not installed.")
+            return
+
         try:
             # Load the Word document template
             doc = docx.Document(deploy_guide_word_path)
@@ -197,10 +578,23 @@ class FilesManager():
                             run.text = run.text.replace(placeholder, new_text)
             
             # Save the modified document to the new file path
-            doc.save(word_doc_name)
-            logger.info(f"Created the word document: {word_doc_name}")
+            rendered_document = io.BytesIO()
+            doc.save(rendered_document)
+            self.write_deploy_guide(deploy_guide_word_path=deploy_guide_word_path, word_doc_name=word_doc_name,
+                                    document_content=rendered_document.getvalue())
         
         except Exception as e:
             logger.error(f"Failed to create word document: {e}")
-    
-   
\ No newline at end of file
+
+    def write_deploy_guide(self, deploy_guide_word_path, word_doc_name, document_content:bytes) -> None:
+        """
+        Write a rendered deployment guide through the output backend.
+        """
+        bytes_written = self.output_backend.write_bytes(file_path=word_doc_name, file_content=document_content)
+        self.output_backend.record_sources(file_path=word_doc_name, source_paths=[deploy_guide_word_path])
+        if self.checksum_manifest:
+            self.checksum_manifest.record_write(file_path=word_doc_name, file_content=document_content,
+                                                source_paths=[deploy_guide_word_path])
+        self.count(counter_name='bytes_written', amount=bytes_written)
+        self.count(counter_name='files_written')
+        logger.info(f"Created the word document: {word_doc_name}")
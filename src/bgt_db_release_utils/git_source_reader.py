@@ -0,0 +1,252 @@
+import io
+import os
+import re
+import logging
+import posixpath
+import threading
+import subprocess
+from collections import OrderedDict
+from .exceptions import ReleaseInputError
+
+logger = logging.getLogger(__name__)
+
+# Prefixes of the database versions in the release tags, e.g. AGT_1.2.0-b3_and_AWB_4.5.6-b1
+VERSION_TAG_PREFIXES = ('AGT', 'AWB')
+
+# Read buffer of each blob streamed out of git cat-file
+BLOB_BUFFER_SIZE = 1024 * 1024
+
+class GitBlobStream(io.RawIOBase):
+    """
+    Raw stream over one blob in the output of a git cat-file --batch process.
+    """
+    def __init__(self, batch_stdout, blob_size:int):
+        """
+        Initialize the GitBlobStream class.
+        """
+        self.batch_stdout = batch_stdout
+        self.remaining = blob_size
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if self.remaining <= 0:
+            return 0
+        data = self.batch_stdout.read(min(len(buffer), self.remaining))
+        if not data:
+            raise OSError("git cat-file output ended in the middle of a blob")
+        buffer[:len(data)] = data
+        self.remaining -= len(data)
+        return len(data)
+
+    def close(self) -> None:
+        """
+        Skip what the reader left unread, plus the LF ending every batch entry, so the process is ready for the next blob.
+        """
+        if not self.closed:
+            while self.remaining > 0:
+                data = self.batch_stdout.read(min(self.remaining, BLOB_BUFFER_SIZE))
+                if not data:
+                    break
+                self.remaining -= len(data)
+            self.batch_stdout.read(1)
+        super().close()
+
+class GitSourceReader():
+    """
+    Reads the changed SQL files between two refs straight from the object store of a local git repository,
+    without a working tree checkout.
+    """
+    def __init__(self, repo_path, from_ref, to_ref, git_executable='git', version_tag_prefixes=VERSION_TAG_PREFIXES):
+        """
+        Initialize the GitSourceReader class. Refs named like release tags, the version of every database
+        prefixed with its version_tag_prefixes and joined with _and_, give the versions of the release.
+        """
+        self.repo_path = repo_path
+        self.from_ref = from_ref
+        self.to_ref = to_ref
+        self.git_executable = git_executable
+        self.version_tag_pattern = re.compile(
+            '^' + '_and_'.join(f"{re.escape(version_tag_prefix)}_.+" for version_tag_prefix in version_tag_prefixes) + '$'
+        )
+        self.to_commit = None
+        # Changed path -> blob id at to_ref
+        self.changed_blobs = OrderedDict()
+        self.blob_sizes = {}
+        # Each thread streams blobs through its own cat-file process
+        self.thread_local = threading.local()
+        self.batch_processes = []
+        self.lock = threading.Lock()
+
+    def run_git(self, *git_args, git_input:bytes=None) -> bytes:
+        """
+        Run a git plumbing command in the repository and return its output.
+        """
+        result = subprocess.run(
+            [self.git_executable, '-C', self.repo_path, *git_args],
+            input=git_input,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+        if result.returncode != 0:
+            raise ReleaseInputError(f"git {' '.join(git_args)} failed: {result.stderr.decode(errors='replace').strip()}")
+        return result.stdout
+
+    def resolve_commit(self, ref:str) -> str:
+        """
+        Resolve a branch, tag or commit id to a commit id.
+        """
+        return self.run_git('rev-parse', '--verify', f"{ref}^{{commit}}").decode().strip()
+
+    def normalize_path(self, file_path:str) -> str:
+        """
+        Turn a command line or config path such as ./datatrak_bgt_agt/version.txt into a repository path.
+        """
+        return posixpath.normpath(file_path.replace(os.sep, '/')).lstrip('/')
+
+    def list_changed_files(self, file_suffixes=('.sql',)) -> list:
+        """
+        List the files added, copied, modified or renamed between the two refs, in repository path order.
+        Deleted files are left out, there is nothing to copy for them.
+        """
+        from_commit = self.resolve_commit(self.from_ref)
+        self.to_commit = self.resolve_commit(self.to_ref)
+
+        # Raw -z records: ":<old mode> <new mode> <old blob> <new blob> <status>\0<path>\0", renames carry a second path
+        diff_fields = self.run_git('diff-tree', '-r', '-z', '--no-commit-id', '--diff-filter=ACMR',
+                                   from_commit, self.to_commit).split(b'\0')
+        field_index = 0
+        while field_index < len(diff_fields) - 1:
+            diff_record = diff_fields[field_index].decode()
+            field_index += 1
+            if not diff_record.startswith(':'):
+                continue
+            _, new_mode, _, blob_id, status = diff_record[1:].split(' ')
+            if status[0] in ('R', 'C'):
+                field_index += 1
+            file_path = os.fsdecode(diff_fields[field_index])
+            field_index += 1
+
+            # Only regular files hold SQL, submodules and symlinks are skipped
+            if not new_mode.startswith('100') or not file_path.lower().endswith(tuple(file_suffixes)):
+                continue
+            self.changed_blobs[file_path] = blob_id
+
+        if self.changed_blobs:
+            self.load_blob_sizes()
+        logger.info(f"Found {len(self.changed_blobs)} changed files between {self.from_ref} and {self.to_ref}")
+        return list(self.changed_blobs)
+
+    def load_blob_sizes(self) -> None:
+        """
+        Look up the sizes of all changed blobs with a single cat-file --batch-check.
+        """
+        batch_input = ''.join(f"{blob_id}\n" for blob_id in self.changed_blobs.values()).encode()
+        size_lines = self.run_git('cat-file', '--batch-check', git_input=batch_input).decode().splitlines()
+        for file_path, size_line in zip(self.changed_blobs, size_lines):
+            self.blob_sizes[file_path] = int(size_line.split()[2])
+
+    def version_tags(self) -> list:
+        """
+        Return the refs as the <prev_tag> <tag> pair when they are release tags, so versions come from the tags
+        as on the command line. Otherwise the version files are read from to_ref.
+        """
+        if self.version_tag_pattern.match(self.from_ref) and self.version_tag_pattern.match(self.to_ref):
+            return [self.from_ref, self.to_ref]
+        return []
+
+    def blob_id(self, file_path:str) -> str:
+        """
+        Return the blob id of a changed file, None for files outside the diff.
+        """
+        return self.changed_blobs.get(self.normalize_path(file_path))
+
+    def object_name(self, file_path:str) -> str:
+        """
+        Name the object of a path at to_ref, by blob id when the path is part of the diff.
+        """
+        repository_path = self.normalize_path(file_path)
+        return self.changed_blobs.get(repository_path) or f"{self.to_commit or self.to_ref}:{repository_path}"
+
+    def exists(self, file_path:str) -> bool:
+        """
+        Check that a path is a file at to_ref.
+        """
+        if self.blob_id(file_path):
+            return True
+        try:
+            return self.run_git('cat-file', '-t', self.object_name(file_path)).strip() == b'blob'
+        except ValueError:
+            return False
+
+    def get_batch_process(self):
+        """
+        Return the cat-file --batch process of the current thread, starting it on first use.
+        """
+        batch_process = getattr(self.thread_local, 'batch_process', None)
+        if batch_process is None:
+            batch_process = subprocess.Popen(
+                [self.git_executable, '-C', self.repo_path, 'cat-file', '--batch'],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                bufsize=BLOB_BUFFER_SIZE
+            )
+            self.thread_local.batch_process = batch_process
+            with self.lock:
+                self.batch_processes.append(batch_process)
+        return batch_process
+
+    def request_blob(self, file_path:str) -> tuple:
+        """
+        Ask the cat-file process of this thread for a blob. Returns the process and the blob size.
+        """
+        # A stream left open would still be holding unread output of this process
+        open_stream = getattr(self.thread_local, 'open_stream', None)
+        if open_stream is not None:
+            open_stream.close()
+
+        batch_process = self.get_batch_process()
+        batch_process.stdin.write(self.object_name(file_path).encode() + b'\n')
+        batch_process.stdin.flush()
+
+        header = batch_process.stdout.readline().decode().split()
+        if len(header) != 3:
+            raise FileNotFoundError(f"{file_path} does not exist at {self.to_ref}")
+        if header[1] != 'blob':
+            GitBlobStream(batch_stdout=batch_process.stdout, blob_size=int(header[2])).close()
+            raise FileNotFoundError(f"{file_path} is not a file at {self.to_ref}")
+        return batch_process, int(header[2])
+
+    def open_blob(self, file_path:str):
+        """
+        Open a binary stream over a file at to_ref. Close it before opening the next blob on the same thread.
+        """
+        batch_process, blob_size = self.request_blob(file_path=file_path)
+        self.blob_sizes[self.normalize_path(file_path)] = blob_size
+        blob_stream = GitBlobStream(batch_stdout=batch_process.stdout, blob_size=blob_size)
+        self.thread_local.open_stream = blob_stream
+        return io.BufferedReader(blob_stream, buffer_size=BLOB_BUFFER_SIZE)
+
+    def blob_size(self, file_path:str) -> int:
+        """
+        Return the size of a file at to_ref.
+        """
+        repository_path = self.normalize_path(file_path)
+        if repository_path in self.blob_sizes:
+            return self.blob_sizes[repository_path]
+        return int(self.run_git('cat-file', '-s', self.object_name(file_path)).strip())
+
+    def close(self) -> None:
+        """
+        Stop every cat-file process.
+        """
+        with self.lock:
+            batch_processes, self.batch_processes = self.batch_processes, []
+        for batch_process in batch_processes:
+            try:
+                batch_process.stdin.close()
+                batch_process.wait(timeout=10)
+            except Exception as e:
+                logger.warning(f"Failed to stop git cat-file: {e}")
+                batch_process.kill()
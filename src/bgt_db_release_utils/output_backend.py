@@ -0,0 +1,463 @@
+import os
+import io
+import json
+import hashlib
+import logging
+import uuid
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from .release_archive import ReleaseArchiveWriter
+
+logger = logging.getLogger(__name__)
+
+# A file written in stages is built under its name with this suffix and renamed into place once complete
+STAGING_SUFFIX = '.partial'
+# Suffix of the temporary files written files are renamed from
+TEMP_SUFFIX = '.tmp'
+
+class OutputBackend(ABC):
+    """
+    Where the release bundle is written. Paths are the bundle paths the stages build, under the release directory.
+    Every backend writes, appends to and reads back its files; the other hooks are optional.
+    """
+    @abstractmethod
+    def make_directory(self, directory_path:str) -> None:
+        """
+        Create a bundle directory, and its parents, if it does not exist.
+        """
+
+    @abstractmethod
+    def write_bytes(self, file_path:str, file_content:bytes) -> int:
+        """
+        Create or overwrite a bundle file. Returns the number of bytes written.
+        """
+
+    @abstractmethod
+    def open_append(self, file_path:str, buffer_size:int=-1):
+        """
+        Open a binary append handle on a bundle file.
+        """
+
+    @abstractmethod
+    def open_read(self, file_path:str):
+        """
+        Open a binary read handle on a bundle file, staged or not. Raises FileNotFoundError when it was not written.
+        """
+
+    def begin_file(self, file_path:str) -> None:
+        """
+        Write a bundle file in stages, e.g. a header then appended scripts: until commit_file, the writes and appends
+        go to a staging file and the bundle file keeps its previous content. For backends that do not write in place,
+        this does nothing.
+        """
+
+    def commit_file(self, file_path:str) -> None:
+        """
+        Move a bundle file written in stages into place.
+        """
+
+    def discard_staged_files(self, directory_path:str) -> None:
+        """
+        Remove the staging and temporary files an interrupted build left in a bundle directory.
+        """
+
+    def record_sources(self, file_path:str, source_paths) -> None:
+        """
+        Note the inputs that went into a bundle file, for backends that report them.
+        """
+
+    def record_dropped_duplicates(self, dropped_duplicates) -> None:
+        """
+        Note the inputs left out of the bundle as duplicates, for backends that report them.
+        """
+
+    def close(self, succeeded:bool=True) -> None:
+        """
+        Finish the bundle once every stage has run.
+        """
+
+class FileSystemOutputBackend(OutputBackend):
+    """
+    Writes the release bundle into the release directory. Files are never left half written: a file is written to a
+    temporary file renamed over it, and a file begun with begin_file is built in <file>.partial, renamed over it by
+    commit_file.
+    """
+    def __init__(self):
+        """
+        Initialize the FileSystemOutputBackend class.
+        """
+        self.staged_paths = set()
+        # Temporary files being written, kept by discard_staged_files
+        self.temp_paths = set()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def staging_path(file_path:str) -> str:
+        """
+        Return the file a bundle file is built in until it is committed.
+        """
+        return file_path + STAGING_SUFFIX
+
+    def is_staged(self, file_path:str) -> bool:
+        """
+        Check if a bundle file is being written in stages.
+        """
+        with self.lock:
+            return file_path in self.staged_paths
+
+    def make_directory(self, directory_path:str) -> None:
+        os.makedirs(directory_path, exist_ok=True)
+
+    def write_bytes(self, file_path:str, file_content:bytes) -> int:
+        if self.is_staged(file_path=file_path):
+            with open(self.staging_path(file_path=file_path), 'wb') as wf:
+                wf.write(file_content)
+            return len(file_content)
+
+        directory_path, file_name = os.path.split(file_path)
+        temp_path = os.path.join(directory_path, f".{file_name}.{uuid.uuid4().hex}{TEMP_SUFFIX}")
+        with self.lock:
+            self.temp_paths.add(temp_path)
+        try:
+            with open(temp_path, 'xb') as wf:
+                wf.write(file_content)
+            os.replace(temp_path, file_path)
+        finally:
+            with self.lock:
+                self.temp_paths.discard(temp_path)
+            if os.path.lexists(temp_path):
+                os.unlink(temp_path)
+        return len(file_content)
+
+    def open_append(self, file_path:str, buffer_size:int=-1):
+        if self.is_staged(file_path=file_path):
+            file_path = self.staging_path(file_path=file_path)
+        return open(file_path, 'ab', buffering=buffer_size)
+
+    def open_read(self, file_path:str):
+        if self.is_staged(file_path=file_path):
+            file_path = self.staging_path(file_path=file_path)
+        return open(file_path, 'rb')
+
+    def begin_file(self, file_path:str) -> None:
+        with self.lock:
+            self.staged_paths.add(file_path)
+
+    def commit_file(self, file_path:str) -> None:
+        """
+        Flush a file written in stages to disk and rename it into place.
+        """
+        with self.lock:
+            if file_path not in self.staged_paths:
+                return
+            self.staged_paths.discard(file_path)
+        staging_path = self.staging_path(file_path=file_path)
+        with open(staging_path, 'rb') as rf:
+            os.fsync(rf.fileno())
+        os.replace(staging_path, file_path)
+
+    def discard_staged_files(self, directory_path:str) -> None:
+        with self.lock:
+            active_paths = {self.staging_path(file_path=file_path) for file_path in self.staged_paths} | self.temp_paths
+        try:
+            directory_entries = list(os.scandir(directory_path))
+        except FileNotFoundError:
+            return
+        for directory_entry in directory_entries:
+            is_leftover = directory_entry.name.endswith(STAGING_SUFFIX) \
+                or (directory_entry.name.startswith('.') and directory_entry.name.endswith(TEMP_SUFFIX))
+            if is_leftover and directory_entry.is_file() and directory_entry.path not in active_paths:
+                logger.info(f"Removing {directory_entry.path} left by an interrupted build")
+                os.unlink(directory_entry.path)
+
+class MemberAppendHandle():
+    """
+    Append handle on a member held by the backend. Closing it leaves the member open for later appends.
+    Writes always go to the end of the member, whatever a read handle on it did in between.
+    """
+    def __init__(self, member_stream, lock):
+        """
+        Initialize the MemberAppendHandle class. lock guards the member against its read handles.
+        """
+        self.member_stream = member_stream
+        self.lock = lock
+
+    def write(self, data) -> int:
+        with self.lock:
+            self.member_stream.seek(0, os.SEEK_END)
+            return self.member_stream.write(data)
+
+    def tell(self) -> int:
+        with self.lock:
+            return self.member_stream.seek(0, os.SEEK_END)
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+class MemberReadHandle():
+    """
+    Read handle on a member held by the backend, with its own position so it does not disturb the appends.
+    """
+    def __init__(self, member_stream, lock):
+        """
+        Initialize the MemberReadHandle class. lock guards the member against its append handles.
+        """
+        self.member_stream = member_stream
+        self.lock = lock
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size:int=-1) -> bytes:
+        with self.lock:
+            self.member_stream.seek(self.position)
+            data = self.member_stream.read(size)
+        self.position += len(data)
+        return data
+
+    def seek(self, offset:int, whence:int=io.SEEK_SET) -> int:
+        if whence == io.SEEK_END:
+            with self.lock:
+                offset += self.member_stream.seek(0, io.SEEK_END)
+        elif whence == io.SEEK_CUR:
+            offset += self.position
+        self.position = max(0, offset)
+        return self.position
+
+    def tell(self) -> int:
+        return self.position
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+class ArchiveOutputBackend(OutputBackend):
+    """
+    Writes the release bundle as a deterministic .zip or .tar.gz archive instead of a directory tree.
+    Stages write release files concurrently and append to them over time, while archive members must be
+    contiguous and in a fixed order. Files written whole are kept as they were handed over, the files appended to
+    are spooled (in memory, spilling to a temporary file past spool_max_bytes), and when the build succeeds every
+    member is streamed once into the archive.
+    Files outside the release directory, such as the deployment guide, are still written to disk.
+    """
+    def __init__(self, archive_path:str, release_root:str, max_workers:int, compression_level:int=6,
+                 spool_max_bytes:int=8 * 1024 * 1024):
+        """
+        Initialize the ArchiveOutputBackend class. Member paths are relative to release_root.
+        """
+        self.archive_writer = ReleaseArchiveWriter(
+            archive_path=archive_path,
+            max_workers=max_workers,
+            compression_level=compression_level
+        )
+        self.release_root = os.path.abspath(release_root)
+        self.spool_max_bytes = spool_max_bytes
+        self.file_system = FileSystemOutputBackend()
+        # Archive path -> spooled member content, None for directories
+        self.members = OrderedDict()
+        self.lock = threading.Lock()
+
+    def member_path(self, file_path:str) -> str:
+        """
+        Turn a bundle path into an archive member path, None for a path outside the release directory.
+        """
+        relative_path = os.path.relpath(os.path.abspath(file_path), self.release_root)
+        if relative_path == os.curdir or relative_path.startswith(os.pardir):
+            return None
+        return relative_path.replace(os.sep, '/')
+
+    def make_directory(self, directory_path:str) -> None:
+        """
+        Add a directory member, and members for its parents below the release directory.
+        """
+        member_path = self.member_path(file_path=directory_path)
+        if member_path is None:
+            return self.file_system.make_directory(directory_path=directory_path)
+        with self.lock:
+            parts = member_path.split('/')
+            for part_count in range(1, len(parts) + 1):
+                self.members.setdefault('/'.join(parts[:part_count]), None)
+
+    def write_bytes(self, file_path:str, file_content:bytes) -> int:
+        """
+        Create or replace a file member. Returns the number of bytes written.
+        """
+        member_path = self.member_path(file_path=file_path)
+        if member_path is None:
+            return self.file_system.write_bytes(file_path=file_path, file_content=file_content)
+        member_stream = io.BytesIO(file_content)
+        with self.lock:
+            previous_stream = self.members.get(member_path)
+            self.members[member_path] = member_stream
+        if previous_stream is not None:
+            previous_stream.close()
+        return len(file_content)
+
+    def open_append(self, file_path:str, buffer_size:int=-1):
+        """
+        Open an append handle on a file member, creating it empty if needed.
+        """
+        member_path = self.member_path(file_path=file_path)
+        if member_path is None:
+            return self.file_system.open_append(file_path=file_path, buffer_size=buffer_size)
+        with self.lock:
+            member_stream = self.members.get(member_path)
+            if not isinstance(member_stream, tempfile.SpooledTemporaryFile):
+                spooled_stream = tempfile.SpooledTemporaryFile(max_size=self.spool_max_bytes)
+                if member_stream is not None:
+                    spooled_stream.write(member_stream.getbuffer())
+                member_stream = self.members[member_path] = spooled_stream
+        return MemberAppendHandle(member_stream=member_stream, lock=self.lock)
+
+    def open_read(self, file_path:str):
+        """
+        Open a read handle on a file member. Raises FileNotFoundError when the build did not write it.
+        """
+        member_path = self.member_path(file_path=file_path)
+        if member_path is None:
+            return self.file_system.open_read(file_path=file_path)
+        with self.lock:
+            member_stream = self.members.get(member_path)
+        if member_stream is None:
+            raise FileNotFoundError(f"{file_path} is not part of the archive")
+        return MemberReadHandle(member_stream=member_stream, lock=self.lock)
+
+    def close(self, succeeded:bool=True) -> None:
+        """
+        Write the archive when the build succeeded, then release the spooled members.
+        A failed build leaves no archive behind.
+        """
+        try:
+            if succeeded:
+                self.archive_writer.write(members=self.members)
+            else:
+                logger.info(f"Build failed, not writing {self.archive_writer.archive_path}")
+        finally:
+            for member_stream in self.members.values():
+                if member_stream is not None:
+                    member_stream.close()
+            self.members.clear()
+
+class MemoryOutputBackend(OutputBackend):
+    """
+    Keeps the release bundle in memory and reports what it holds, for validation runs that must not touch disk.
+    Each file records the inputs that went into it, in the order they were written.
+    """
+    def __init__(self):
+        """
+        Initialize the MemoryOutputBackend class.
+        """
+        self.directories = set()
+        # Bundle path -> file content
+        self.files = OrderedDict()
+        # Bundle path -> input paths that went into the file
+        self.file_sources = {}
+        self.dropped_duplicates = []
+        self.lock = threading.Lock()
+
+    def bundle_path(self, file_path:str) -> str:
+        """
+        Normalise a path so a file is found whichever way its path was joined.
+        """
+        return os.path.normpath(file_path).replace(os.sep, '/')
+
+    def make_directory(self, directory_path:str) -> None:
+        with self.lock:
+            self.directories.add(self.bundle_path(file_path=directory_path))
+
+    def write_bytes(self, file_path:str, file_content:bytes) -> int:
+        bundle_path = self.bundle_path(file_path=file_path)
+        with self.lock:
+            self.files[bundle_path] = io.BytesIO(file_content)
+            self.file_sources[bundle_path] = []
+        return len(file_content)
+
+    def open_append(self, file_path:str, buffer_size:int=-1):
+        bundle_path = self.bundle_path(file_path=file_path)
+        with self.lock:
+            file_stream = self.files.get(bundle_path)
+            if file_stream is None:
+                file_stream = self.files[bundle_path] = io.BytesIO()
+                self.file_sources[bundle_path] = []
+        return MemberAppendHandle(member_stream=file_stream, lock=self.lock)
+
+    def open_read(self, file_path:str):
+        bundle_path = self.bundle_path(file_path=file_path)
+        with self.lock:
+            file_stream = self.files.get(bundle_path)
+        if file_stream is None:
+            raise FileNotFoundError(f"{file_path} is not part of the bundle")
+        return MemberReadHandle(member_stream=file_stream, lock=self.lock)
+
+    def record_sources(self, file_path:str, source_paths) -> None:
+        bundle_path = self.bundle_path(file_path=file_path)
+        with self.lock:
+            self.file_sources.setdefault(bundle_path, []).extend(source_paths)
+
+    def record_dropped_duplicates(self, dropped_duplicates) -> None:
+        with self.lock:
+            self.dropped_duplicates = [
+                dict(dropped_duplicate, release_file=self.bundle_path(file_path=dropped_duplicate['release_file']))
+                for dropped_duplicate in dropped_duplicates
+            ]
+
+    def read_bytes(self, file_path:str) -> bytes:
+        """
+        Return the content of a bundle file. Raises FileNotFoundError when the build did not write it.
+        """
+        bundle_path = self.bundle_path(file_path=file_path)
+        with self.lock:
+            file_stream = self.files.get(bundle_path)
+        if file_stream is None:
+            raise FileNotFoundError(f"{file_path} is not part of the bundle")
+        return file_stream.getvalue()
+
+    def manifest(self) -> dict:
+        """
+        Describe the bundle: every directory, every file with its size, SHA-256 and contributing inputs,
+        and the inputs left out as duplicates.
+        """
+        with self.lock:
+            dropped_duplicates = list(self.dropped_duplicates)
+            files = list(self.files.items())
+            file_sources = {bundle_path: list(source_paths) for bundle_path, source_paths in self.file_sources.items()}
+            directories = sorted(self.directories)
+
+        manifest_files = {}
+        for bundle_path, file_stream in sorted(files):
+            file_content = file_stream.getbuffer()
+            manifest_files[bundle_path] = {
+                'size': len(file_content),
+                'sha256': hashlib.sha256(file_content).hexdigest(),
+                'sources': file_sources.get(bundle_path, [])
+            }
+            file_content.release()
+        return {
+            'directories': directories,
+            'files': manifest_files,
+            'total_size': sum(file_entry['size'] for file_entry in manifest_files.values()),
+            'dropped_duplicates': dropped_duplicates
+        }
+
+    def write_manifest(self, output_file) -> None:
+        """
+        Write the manifest as JSON to an open text stream.
+        """
+        json.dump(self.manifest(), output_file, indent=2)
+        output_file.write('\n')
@@ -0,0 +1,192 @@
+import io
+import os
+import gzip
+import shutil
+import logging
+import tarfile
+import zipfile
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Archive suffixes and the format written for them
+ARCHIVE_FORMATS = {
+    '.zip': 'zip',
+    '.tar.gz': 'tar.gz',
+    '.tgz': 'tar.gz',
+}
+
+# Fixed metadata of every member, so the same bundle always gives the same archive bytes
+ARCHIVE_FILE_MODE = 0o644
+ARCHIVE_DIRECTORY_MODE = 0o755
+# The earliest MS-DOS timestamp a zip entry can hold
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+# Made on Unix, so extractors apply the permission bits of external_attr
+ZIP_CREATE_SYSTEM = 3
+# MS-DOS directory attribute of a zip directory entry
+ZIP_DIRECTORY_FLAG = 0x10
+
+# Bytes read from a member per compression call, and the uncompressed size of each gzip member of a .tar.gz
+ARCHIVE_CHUNK_SIZE = 1024 * 1024
+GZIP_BLOCK_SIZE = 4 * 1024 * 1024
+
+def archive_format_for(archive_path:str) -> str:
+    """
+    Return the archive format written for a path, from its suffix.
+    """
+    for archive_suffix, archive_format in ARCHIVE_FORMATS.items():
+        if archive_path.lower().endswith(archive_suffix):
+            return archive_format
+    raise ValueError(f"Unsupported archive {archive_path}, expected one of {list(ARCHIVE_FORMATS)}")
+
+class ParallelGzipWriter(io.RawIOBase):
+    """
+    Writes a gzip stream as a series of gzip members of GZIP_BLOCK_SIZE uncompressed bytes each, compressed on a
+    thread pool and written in order. Concatenated members are a valid gzip file, as written by pigz. Block
+    boundaries do not depend on the number of workers, so the output bytes are the same for any worker count.
+    """
+    def __init__(self, output_file, max_workers:int, compression_level:int):
+        """
+        Initialize the ParallelGzipWriter class.
+        """
+        self.output_file = output_file
+        self.max_workers = max(1, max_workers)
+        self.compression_level = compression_level
+        self.block = bytearray()
+        self.pending_blocks = deque()
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='archive_gzip')
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.block += data
+        while len(self.block) >= GZIP_BLOCK_SIZE:
+            self.submit_block(block=bytes(self.block[:GZIP_BLOCK_SIZE]))
+            del self.block[:GZIP_BLOCK_SIZE]
+        return len(data)
+
+    def submit_block(self, block:bytes) -> None:
+        """
+        Compress a block on the pool, writing out the oldest blocks once enough are in flight.
+        """
+        # mtime=0 keeps the gzip headers free of timestamps
+        self.pending_blocks.append(self.executor.submit(gzip.compress, block, self.compression_level, mtime=0))
+        while len(self.pending_blocks) > self.max_workers * 2:
+            self.output_file.write(self.pending_blocks.popleft().result())
+
+    def close(self) -> None:
+        """
+        Compress the last block and write out every pending block. The output file is left open.
+        """
+        if not self.closed:
+            try:
+                if self.block:
+                    self.submit_block(block=bytes(self.block))
+                    self.block = bytearray()
+                while self.pending_blocks:
+                    self.output_file.write(self.pending_blocks.popleft().result())
+            finally:
+                self.executor.shutdown(wait=True, cancel_futures=True)
+        super().close()
+
+class ReleaseArchiveWriter():
+    """
+    Writes the members of a release bundle to a deterministic .zip or .tar.gz archive: members are sorted by path
+    and carry fixed timestamps, owners and permissions. Each member is streamed from its content straight into the
+    archive, compressed on the way. The gzip stream of a .tar.gz is compressed in parallel, block by block.
+    """
+    def __init__(self, archive_path:str, max_workers:int, compression_level:int=6):
+        """
+        Initialize the ReleaseArchiveWriter class.
+        """
+        self.archive_path = archive_path
+        self.archive_format = archive_format_for(archive_path=archive_path)
+        self.max_workers = max(1, max_workers)
+        self.compression_level = compression_level
+
+    def write(self, members:dict) -> int:
+        """
+        Write archive members, given as archive path -> readable binary stream, or None for a directory.
+        The archive is written to a temporary file and moved into place. Returns the archive size.
+        """
+        archive_dir = os.path.dirname(os.path.abspath(self.archive_path))
+        os.makedirs(archive_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=archive_dir, prefix='.release_archive.')
+        sorted_members = sorted(members.items())
+        try:
+            with os.fdopen(fd, 'wb') as archive_file:
+                if self.archive_format == 'zip':
+                    self.write_zip(archive_file=archive_file, members=sorted_members)
+                else:
+                    self.write_tar_gz(archive_file=archive_file, members=sorted_members)
+                archive_size = archive_file.tell()
+            # mkstemp creates the file readable by its owner only
+            os.chmod(temp_path, ARCHIVE_FILE_MODE)
+            os.replace(temp_path, self.archive_path)
+
+        except Exception:
+            os.unlink(temp_path)
+            raise
+
+        logger.info(f"Wrote {len(sorted_members)} members to {self.archive_path} ({archive_size} bytes)")
+        return archive_size
+
+    def write_tar_gz(self, archive_file, members:list) -> None:
+        """
+        Stream a GNU tar of the members through a parallel gzip writer.
+        """
+        gzip_writer = ParallelGzipWriter(output_file=archive_file, max_workers=self.max_workers,
+                                         compression_level=self.compression_level)
+        with gzip_writer, tarfile.open(fileobj=gzip_writer, mode='w|', format=tarfile.GNU_FORMAT) as tar_file:
+            for member_path, member_stream in members:
+                tar_info = tarfile.TarInfo(name=member_path)
+                tar_info.mtime = 0
+                tar_info.uid = tar_info.gid = 0
+                tar_info.uname = tar_info.gname = ''
+                if member_stream is None:
+                    tar_info.type = tarfile.DIRTYPE
+                    tar_info.mode = ARCHIVE_DIRECTORY_MODE
+                    tar_file.addfile(tar_info)
+                    continue
+                tar_info.mode = ARCHIVE_FILE_MODE
+                tar_info.size = member_stream.seek(0, io.SEEK_END)
+                member_stream.seek(0)
+                tar_file.addfile(tar_info, member_stream)
+
+    def zip_info(self, member_path:str, is_directory:bool) -> zipfile.ZipInfo:
+        """
+        Build the entry of a member with the fixed timestamp and permissions.
+        """
+        zip_info = zipfile.ZipInfo(filename=member_path + '/' if is_directory else member_path, date_time=ZIP_DATE_TIME)
+        zip_info.create_system = ZIP_CREATE_SYSTEM
+        if is_directory:
+            zip_info.external_attr = ((0o040000 | ARCHIVE_DIRECTORY_MODE) << 16) | ZIP_DIRECTORY_FLAG
+            return zip_info
+        zip_info.external_attr = (0o100000 | ARCHIVE_FILE_MODE) << 16
+        zip_info.compress_type = zipfile.ZIP_DEFLATED
+        # ZipInfo.compress_level is public from Python 3.13
+        if hasattr(zip_info, 'compress_level'):
+            zip_info.compress_level = self.compression_level
+        else:
+            zip_info._compresslevel = self.compression_level
+        return zip_info
+
+    def write_zip(self, archive_file, members:list) -> None:
+        """
+        Write a zip archive, streaming each member in order through zipfile, which adds the zip64 records a large
+        member or archive needs.
+        """
+        with zipfile.ZipFile(archive_file, mode='w', allowZip64=True) as zip_file:
+            for member_path, member_stream in members:
+                if member_stream is None:
+                    zip_file.writestr(self.zip_info(member_path=member_path, is_directory=True), b'')
+                    continue
+                zip_info = self.zip_info(member_path=member_path, is_directory=False)
+                # The size decides up front whether the entry needs zip64 fields
+                zip_info.file_size = member_stream.seek(0, io.SEEK_END)
+                member_stream.seek(0)
+                with zip_file.open(zip_info, mode='w') as member_file:
+                    shutil.copyfileobj(member_stream, member_file, ARCHIVE_CHUNK_SIZE)
@@ -0,0 +1,109 @@
+import os
+import fnmatch
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Characters making a rule segment a glob, matched with fnmatch
+GLOB_CHARACTERS = frozenset('*?[')
+
+def path_segments(file_path:str) -> list:
+    """
+    Split a changed file path into its normalised segments, e.g. ./datatrak_bgt_agt//tables/t.sql into
+    ['datatrak_bgt_agt', 'tables', 't.sql']. Windows separators are accepted.
+    """
+    normalised_path = os.path.normpath(file_path.replace('\\', '/')).replace(os.sep, '/')
+    return [segment for segment in normalised_path.split('/') if segment not in ('', '.')]
+
+class RouteNode():
+    """
+    Node of the routing trie: the rules ending at it, its children by exact segment and its glob children.
+    """
+    def __init__(self):
+        """
+        Initialize the RouteNode class.
+        """
+        self.children = {}
+        self.glob_children = []
+        # (release database, release file name) of the rules ending at this node
+        self.routes = []
+
+    def child(self, segment:str):
+        """
+        Return the child for a rule segment, creating it on first use.
+        """
+        if GLOB_CHARACTERS.isdisjoint(segment):
+            return self.children.setdefault(segment, RouteNode())
+        for glob_segment, glob_child in self.glob_children:
+            if glob_segment == segment:
+                return glob_child
+        glob_child = RouteNode()
+        self.glob_children.append((segment, glob_child))
+        return glob_child
+
+class ReleaseFileRouter():
+    """
+    Routes changed SQL files to the databases and release files they are copied into. The rules of the release
+    file mapping are paths under the source directory of every database, e.g. stored_procedures, views/reporting or
+    insert_statements/*_seed.sql, and are compiled once into a trie of path segments, so routing a file costs the
+    depth of its path whatever the number of rules and databases. A rule applies to everything below it, and the most
+    specific rule wins: the deepest one, then an exact segment over a glob.
+    """
+    def __init__(self, release_databases, release_file_mapping:dict):
+        """
+        Initialize the ReleaseFileRouter class from the release databases, each with its source_dir, and the
+        release file mapping, rule -> release file name.
+        """
+        self.root = RouteNode()
+        for release_database in release_databases:
+            database_node = self.root
+            for segment in path_segments(file_path=release_database['source_dir']):
+                database_node = database_node.child(segment=segment)
+            for rule, release_file_name in release_file_mapping.items():
+                rule_node = database_node
+                for segment in path_segments(file_path=rule):
+                    rule_node = rule_node.child(segment=segment)
+                rule_node.routes.append((release_database, release_file_name))
+
+    def route(self, file_path:str) -> list:
+        """
+        Return the (release database, release file name) routes of a changed file, empty when no rule matches.
+        """
+        routes = []
+        # Nodes matching the segments so far, exact matches first
+        matching_nodes = [self.root]
+        for segment in path_segments(file_path=file_path):
+            next_nodes = []
+            for matching_node in matching_nodes:
+                exact_child = matching_node.children.get(segment)
+                if exact_child:
+                    next_nodes.append(exact_child)
+            for matching_node in matching_nodes:
+                next_nodes.extend(
+                    glob_child for glob_segment, glob_child in matching_node.glob_children
+                    if fnmatch.fnmatchcase(segment, glob_segment)
+                )
+            if not next_nodes:
+                break
+            matching_nodes = next_nodes
+            deepest_routes = next((matching_node.routes for matching_node in matching_nodes if matching_node.routes), None)
+            if deepest_routes:
+                routes = deepest_routes
+        return list(routes)
+
+    def classify(self, file_paths) -> tuple:
+        """
+        Route a change list in one pass. Returns the (file path, release database, release file name) routes in
+        input order and the files no rule matches. Blank entries are ignored.
+        """
+        routed_files = []
+        unrouted_files = []
+        for file_path in file_paths:
+            if not file_path or not file_path.strip():
+                continue
+            file_routes = self.route(file_path=file_path)
+            if not file_routes:
+                unrouted_files.append(file_path)
+            for release_database, release_file_name in file_routes:
+                routed_files.append((file_path, release_database, release_file_name))
+        return routed_files, unrouted_files
@@ -0,0 +1,187 @@
+import logging
+from collections import OrderedDict
+from .output_backend import FileSystemOutputBackend
+from .exceptions import ReleaseBuildError
+from .sql_batch_indexer import SqlBatchIndexer
+
+logger = logging.getLogger(__name__)
+
+class ReleaseFileWriter():
+    """
+    Keeps one large-buffered binary append handle per release file for the duration of a copy run.
+    Content is written as UTF-8 bytes. With a sql_batch_indexer, the batches of every release file are indexed
+    as its content is written, and with a checksum_manifest its digests are updated. With a build_journal, every script
+    appended is journaled, for a build killed half way to resume after it.
+    """
+    def __init__(self, buffer_size, build_metrics=None, output_backend=None, sql_batch_indexer=None, release_file_headers=None,
+                 checksum_manifest=None, build_journal=None):
+        """
+        Initialize the ReleaseFileWriter class. Handles are opened through the output backend, on disk by default.
+        release_file_headers maps release file paths to the header already written, indexed before the content.
+        """
+        self.buffer_size = buffer_size
+        self.build_metrics = build_metrics
+        self.output_backend = output_backend or FileSystemOutputBackend()
+        self.release_file_handles = OrderedDict()
+        # Size of each release file when it was opened, to count the bytes appended
+        self.release_file_start_sizes = {}
+        # Release file path -> (source path, offset, length) of each script appended, in order
+        self.script_ranges = {}
+        self.sql_batch_indexer = sql_batch_indexer
+        self.release_file_headers = release_file_headers or {}
+        self.batch_tokenizers = {}
+        # Release file path -> batch index of the release files closed
+        self.batch_indexes = OrderedDict()
+        self.checksum_manifest = checksum_manifest
+        self.build_journal = build_journal
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+    @staticmethod
+    def group_copy_jobs(copy_jobs) -> OrderedDict:
+        """
+        Group (source, release file) jobs by release file, keeping the input order within each group.
+        Release files are distinct, so writing them one after another gives the same bytes as
+        interleaving the appends in input order.
+        """
+        grouped_jobs = OrderedDict()
+        for sql_file_path, sql_release_full_path in copy_jobs:
+            grouped_jobs.setdefault(sql_release_full_path, []).append(sql_file_path)
+        return grouped_jobs
+
+    def get_handle(self, release_file_path):
+        """
+        Return the append handle for a release file, opening it on first use.
+        """
+        release_file_handle = self.release_file_handles.get(release_file_path)
+        if release_file_handle is None:
+            release_file_handle = self.output_backend.open_append(file_path=release_file_path, buffer_size=self.buffer_size)
+            self.release_file_start_sizes[release_file_path] = release_file_handle.tell()
+            self.release_file_handles[release_file_path] = release_file_handle
+            if self.sql_batch_indexer:
+                self.batch_tokenizers[release_file_path] = self.sql_batch_indexer.create_tokenizer(
+                    release_file_header=self.release_file_headers.get(release_file_path),
+                    start_offset=release_file_handle.tell()
+                )
+            logger.info(f"Opened release file {release_file_path} for appending")
+        return release_file_handle
+
+    def resume_handle(self, release_file_path, completed_scripts, resume_offset:int) -> None:
+        """
+        Reopen a release file an interrupted build left staged, cut back to resume_offset, the end of the last
+        completed script. The header and the completed scripts are read back, not copied again, to index their
+        batches, digest them and note their script ranges as if this build had written them.
+        """
+        release_file_handle = self.output_backend.open_append(file_path=release_file_path, buffer_size=self.buffer_size)
+        release_file_handle.truncate(resume_offset)
+        release_file_handle.seek(resume_offset)
+        self.release_file_start_sizes[release_file_path] = resume_offset
+        self.release_file_handles[release_file_path] = release_file_handle
+        release_file_header = self.release_file_headers.get(release_file_path) or b''
+        batch_tokenizer = None
+        if self.sql_batch_indexer:
+            batch_tokenizer = self.sql_batch_indexer.create_tokenizer(release_file_header=release_file_header,
+                                                                      start_offset=len(release_file_header))
+            self.batch_tokenizers[release_file_path] = batch_tokenizer
+
+        with self.output_backend.open_read(file_path=release_file_path) as rf:
+            for completed_script in completed_scripts:
+                rf.seek(completed_script['offset'])
+                separator_length = completed_script['end'] - completed_script['offset'] - completed_script['length']
+                for data, source_path in ((rf.read(completed_script['length']), completed_script['source']),
+                                          (rf.read(separator_length), None)):
+                    if batch_tokenizer:
+                        batch_tokenizer.feed(data=data, source_path=source_path)
+                    if self.checksum_manifest:
+                        self.checksum_manifest.record_append(file_path=release_file_path, data=data, source_path=source_path)
+                self.record_script_range(release_file_path=release_file_path, source_path=completed_script['source'],
+                                         offset=completed_script['offset'], length=completed_script['length'])
+                self.output_backend.record_sources(file_path=release_file_path, source_paths=[completed_script['source']])
+        logger.info(f"Resumed release file {release_file_path} after {len(completed_scripts)} scripts")
+
+    def write(self, release_file_path, data:bytes, source_path=None) -> None:
+        """
+        Append bytes read from source_path, None for the separators, to a release file.
+        """
+        self.get_handle(release_file_path=release_file_path).write(data)
+        batch_tokenizer = self.batch_tokenizers.get(release_file_path)
+        if batch_tokenizer:
+            batch_tokenizer.feed(data=data, source_path=source_path)
+        if self.checksum_manifest:
+            self.checksum_manifest.record_append(file_path=release_file_path, data=data, source_path=source_path)
+
+    def append_content(self, release_file_path, file_content, source_path=None) -> None:
+        """
+        Append UTF-8 content followed by the blank line separator used between scripts.
+        source_path is the file the content was read from. Raises ReleaseBuildError when it cannot be written.
+        """
+        try:
+            release_file_handle = self.get_handle(release_file_path=release_file_path)
+            script_offset = release_file_handle.tell()
+            self.write(release_file_path=release_file_path, data=file_content, source_path=source_path)
+            self.finish_script(release_file_path=release_file_path, source_path=source_path, offset=script_offset)
+            if source_path:
+                self.output_backend.record_sources(file_path=release_file_path, source_paths=[source_path])
+
+        except Exception as e:
+            raise ReleaseBuildError(f"Error appending to {release_file_path}: {e}") from e
+
+    def finish_script(self, release_file_path, source_path, offset:int) -> None:
+        """
+        Append the blank line separator after a script written from offset, note its range and journal it.
+        """
+        release_file_handle = self.get_handle(release_file_path=release_file_path)
+        length = release_file_handle.tell() - offset
+        self.write(release_file_path=release_file_path, data=b'\n\n')
+        if not source_path:
+            return
+        self.record_script_range(release_file_path=release_file_path, source_path=source_path, offset=offset, length=length)
+        if self.build_journal:
+            self.build_journal.record_script(release_file_path=release_file_path, source_path=source_path, offset=offset,
+                                             length=length, end=release_file_handle.tell())
+
+    def record_script_range(self, release_file_path, source_path, offset:int, length:int) -> None:
+        """
+        Note where the content of a source file sits in a release file, separator excluded.
+        """
+        self.script_ranges.setdefault(release_file_path, []).append((source_path, offset, length))
+
+    def close(self) -> None:
+        """
+        Flush and close every open release file. Raises ReleaseBuildError once they are all closed when one of them
+        could not be flushed.
+        """
+        failed_release_files = []
+        while self.release_file_handles:
+            release_file_path, release_file_handle = self.release_file_handles.popitem(last=False)
+            try:
+                end_size = release_file_handle.tell()
+                release_file_handle.close()
+                self.count_appended_bytes(release_file_path=release_file_path, end_size=end_size)
+                batch_tokenizer = self.batch_tokenizers.pop(release_file_path, None)
+                if batch_tokenizer:
+                    self.batch_indexes[release_file_path] = SqlBatchIndexer.batch_index(
+                        release_file_path=release_file_path,
+                        release_file_size=end_size,
+                        batches=batch_tokenizer.finish()
+                    )
+                logger.info(f"Closed release file {release_file_path}")
+            except Exception as e:
+                logger.error(f"Failed to close release file {release_file_path}: {e}")
+                failed_release_files.append(release_file_path)
+        if failed_release_files:
+            raise ReleaseBuildError(f"Failed to close release files {', '.join(failed_release_files)}")
+
+    def count_appended_bytes(self, release_file_path, end_size) -> None:
+        """
+        Add the bytes appended to a closed release file to the build metrics.
+        """
+        start_size = self.release_file_start_sizes.pop(release_file_path, 0)
+        if self.build_metrics:
+            self.build_metrics.increment(counter_name='bytes_written', amount=end_size - start_size)
+            self.build_metrics.increment(counter_name='files_written')
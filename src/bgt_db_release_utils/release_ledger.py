@@ -0,0 +1,233 @@
+import os
+import sqlite3
+import logging
+import contextlib
+from datetime import datetime, timezone
+from .sql_dependency_analyzer import sql_object_key
+
+logger = logging.getLogger(__name__)
+
+LEDGER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS builds (
+    build_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    release_number TEXT NOT NULL,
+    release_path TEXT NOT NULL,
+    built_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS build_versions (
+    build_id INTEGER NOT NULL REFERENCES builds (build_id) ON DELETE CASCADE,
+    database TEXT NOT NULL,
+    old_version TEXT,
+    new_version TEXT NOT NULL,
+    PRIMARY KEY (build_id, database)
+);
+CREATE INDEX IF NOT EXISTS build_versions_by_version ON build_versions (database, new_version, build_id);
+CREATE TABLE IF NOT EXISTS build_inputs (
+    build_id INTEGER NOT NULL REFERENCES builds (build_id) ON DELETE CASCADE,
+    source_path TEXT NOT NULL,
+    release_file TEXT NOT NULL,
+    sha256 TEXT,
+    PRIMARY KEY (build_id, source_path, release_file)
+);
+CREATE INDEX IF NOT EXISTS build_inputs_by_source ON build_inputs (source_path, build_id);
+CREATE TABLE IF NOT EXISTS build_objects (
+    build_id INTEGER NOT NULL REFERENCES builds (build_id) ON DELETE CASCADE,
+    source_path TEXT NOT NULL,
+    object_key TEXT NOT NULL,
+    PRIMARY KEY (build_id, source_path, object_key)
+);
+CREATE INDEX IF NOT EXISTS build_objects_by_object ON build_objects (object_key, build_id);
+"""
+
+class ReleaseLedger():
+    """
+    Local SQLite history of the completed builds: the database versions of every release, the inputs with
+    their SHA-256, the release file each one landed in and the objects it defines. Answers the lookups
+    incremental and backfill builds need, such as the previous version of a database, the releases that
+    touched an object, or the inputs unchanged since a version.
+    Every call opens its own connection, so builds in forked processes share the ledger safely.
+    """
+    LEDGER_FORMAT_VERSION = 1
+
+    def __init__(self, ledger_path:str, default_schema:str='dbo', timeout:float=30.0):
+        """
+        Initialize the ReleaseLedger class. Object names without a schema are looked up in default_schema.
+        """
+        self.ledger_path = ledger_path
+        self.default_schema = default_schema.lower()
+        self.timeout = timeout
+        self.schema_ready = False
+
+    @contextlib.contextmanager
+    def connect(self):
+        """
+        Open a connection, creating the ledger on first use. The transaction is committed when the block
+        completes and rolled back when it raises.
+        """
+        if not self.schema_ready:
+            os.makedirs(os.path.dirname(os.path.abspath(self.ledger_path)), exist_ok=True)
+        connection = sqlite3.connect(self.ledger_path, timeout=self.timeout)
+        try:
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA foreign_keys = ON')
+            if not self.schema_ready:
+                # Concurrent builds read while one of them records
+                connection.execute('PRAGMA journal_mode = WAL')
+                ledger_version = connection.execute('PRAGMA user_version').fetchone()[0]
+                if ledger_version not in (0, self.LEDGER_FORMAT_VERSION):
+                    raise sqlite3.DatabaseError(f"Release ledger {self.ledger_path} has an unknown format {ledger_version}")
+                connection.executescript(LEDGER_SCHEMA)
+                connection.execute(f'PRAGMA user_version = {self.LEDGER_FORMAT_VERSION}')
+                self.schema_ready = True
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def source_key(self, source_path:str) -> str:
+        """
+        Normalise an input path so it is found whichever way it was given, e.g. with or without './'.
+        """
+        return os.path.normpath(source_path).replace(os.sep, '/')
+
+    def record_build(self, release_number, release_path:str, db_versions:dict, build_inputs) -> int:
+        """
+        Record a completed build. db_versions maps each database to its (old version, new version), and
+        build_inputs lists {'source', 'release_file', 'sha256', 'objects'} entries, objects being None when
+        the input was not scanned. Unscanned inputs take the objects recorded for the same content before.
+        Returns the build id.
+        """
+        with self.connect() as connection:
+            build_id = connection.execute(
+                'INSERT INTO builds (release_number, release_path, built_at) VALUES (?, ?, ?)',
+                (str(release_number), release_path.replace(os.sep, '/'), datetime.now(timezone.utc).isoformat(timespec='seconds'))
+            ).lastrowid
+            connection.executemany(
+                'INSERT INTO build_versions (build_id, database, old_version, new_version) VALUES (?, ?, ?, ?)',
+                [(build_id, database, old_version, new_version) for database, (old_version, new_version) in db_versions.items()]
+            )
+            for build_input in build_inputs:
+                source_path = self.source_key(source_path=build_input['source'])
+                connection.execute(
+                    'INSERT OR REPLACE INTO build_inputs (build_id, source_path, release_file, sha256) VALUES (?, ?, ?, ?)',
+                    (build_id, source_path, build_input['release_file'], build_input['sha256'])
+                )
+                if build_input['objects'] is not None:
+                    connection.executemany(
+                        'INSERT OR IGNORE INTO build_objects (build_id, source_path, object_key) VALUES (?, ?, ?)',
+                        [(build_id, source_path, object_key) for object_key in build_input['objects']]
+                    )
+                elif build_input['sha256']:
+                    connection.execute(
+                        'INSERT OR IGNORE INTO build_objects (build_id, source_path, object_key) '
+                        'SELECT ?, source_path, object_key FROM build_objects WHERE source_path = ? AND build_id = ('
+                        '    SELECT MAX(build_inputs.build_id) FROM build_inputs JOIN build_objects USING (build_id, source_path)'
+                        '    WHERE build_inputs.source_path = ? AND build_inputs.sha256 = ? AND build_inputs.build_id < ?)',
+                        (build_id, source_path, source_path, build_input['sha256'], build_id)
+                    )
+        logger.info(f"Recorded build {build_id} of release {release_number} in the release ledger {self.ledger_path}")
+        return build_id
+
+    def latest_version(self, database:str) -> str:
+        """
+        Return the last version built of a database, None when it was never built.
+        """
+        with self.connect() as connection:
+            row = connection.execute(
+                'SELECT new_version FROM build_versions WHERE database = ? ORDER BY build_id DESC LIMIT 1',
+                (database,)
+            ).fetchone()
+        return row['new_version'] if row else None
+
+    def previous_version(self, database:str, version:str) -> str:
+        """
+        Return the version of a database released before version: the last different version built before the
+        first build of version, or before now when version was never built. None when there is none.
+        """
+        with self.connect() as connection:
+            row = connection.execute(
+                'SELECT new_version FROM build_versions WHERE database = ? AND new_version != ? AND build_id < COALESCE('
+                '    (SELECT MIN(build_id) FROM build_versions WHERE database = ? AND new_version = ?), 9223372036854775807) '
+                'ORDER BY build_id DESC LIMIT 1',
+                (database, version, database, version)
+            ).fetchone()
+        return row['new_version'] if row else None
+
+    def version_build_id(self, connection, database:str, version:str) -> int:
+        """
+        Return the id of the last build of a database version, None when it was never built.
+        """
+        row = connection.execute(
+            'SELECT MAX(build_id) AS build_id FROM build_versions WHERE database = ? AND new_version = ?',
+            (database, version)
+        ).fetchone()
+        return row['build_id']
+
+    def input_hashes(self, database:str, version:str) -> dict:
+        """
+        Return the SHA-256 of every input of the last build of a database version, by source path.
+        """
+        with self.connect() as connection:
+            build_id = self.version_build_id(connection=connection, database=database, version=version)
+            rows = connection.execute('SELECT source_path, sha256 FROM build_inputs WHERE build_id = ?', (build_id,)).fetchall()
+        return {row['source_path']: row['sha256'] for row in rows}
+
+    def unchanged_inputs_since(self, database:str, version:str, current_hashes:dict) -> list:
+        """
+        Return the source paths of current_hashes (source path -> SHA-256) with the same content as in the
+        last build of a database version. Inputs that were not part of that build are not unchanged.
+        """
+        version_hashes = self.input_hashes(database=database, version=version)
+        return [
+            source_path for source_path, sha256 in current_hashes.items()
+            if sha256 and version_hashes.get(self.source_key(source_path=source_path)) == sha256
+        ]
+
+    def releases_touching_object(self, object_name:str) -> list:
+        """
+        Return the builds with an input defining an object, oldest first, as {'build_id', 'release_number', 'built_at',
+        'source', 'release_file', 'versions'} entries. object_name is matched like a name in a script, e.g. [dbo].[Proc].
+        """
+        object_key = sql_object_key(object_name=object_name, default_schema=self.default_schema)
+        return self.touching_builds(
+            'SELECT build_objects.build_id, build_objects.source_path FROM build_objects WHERE object_key = ?',
+            (object_key,)
+        )
+
+    def releases_touching_file(self, source_path:str) -> list:
+        """
+        Return the builds with an input file, oldest first, in the same form as releases_touching_object.
+        """
+        return self.touching_builds(
+            'SELECT build_id, source_path FROM build_inputs WHERE source_path = ?',
+            (self.source_key(source_path=source_path),)
+        )
+
+    def touching_builds(self, input_query:str, input_parameters:tuple) -> list:
+        """
+        Describe the builds of the (build id, source path) rows returned by input_query.
+        """
+        with self.connect() as connection:
+            rows = connection.execute(
+                'SELECT builds.build_id, builds.release_number, builds.built_at, build_inputs.source_path, build_inputs.release_file '
+                f'FROM ({input_query}) AS touched JOIN builds USING (build_id) '
+                'JOIN build_inputs ON build_inputs.build_id = touched.build_id AND build_inputs.source_path = touched.source_path '
+                'ORDER BY builds.build_id, build_inputs.release_file',
+                input_parameters
+            ).fetchall()
+            build_versions = {}
+            for build_id in {row['build_id'] for row in rows}:
+                build_versions[build_id] = {
+                    version_row['database']: version_row['new_version']
+                    for version_row in connection.execute(
+                        'SELECT database, new_version FROM build_versions WHERE build_id = ? ORDER BY database', (build_id,)
+                    )
+                }
+        return [{
+            'build_id': row['build_id'],
+            'release_number': row['release_number'],
+            'built_at': row['built_at'],
+            'source': row['source_path'],
+            'release_file': row['release_file'],
+            'versions': build_versions[row['build_id']]
+        } for row in rows]
@@ -1,16 +1,55 @@
+import io
 import os
-import sys
-import docx
+import json
 import logging
+import threading
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from .release_file_writer import ReleaseFileWriter
+from .build_manifest import BuildManifest
+from .release_file_router import ReleaseFileRouter
+from .sql_batch_indexer import SqlBatchIndexer
 
 logger = logging.getLogger(__name__)
 
+# Changed files up to this size are read ahead by the copy workers, larger ones are streamed in order
+COPY_INLINE_MAX_BYTES = 4 * 1024 * 1024
+
 class ReleaseResourceManager():
     def __init__(self, awb_agt_release_file_path, file_manager_ref, bgt_release_handler_ref):
         self.awb_agt_release_file_path = awb_agt_release_file_path
         self.release_dirs_with_db_paths = None
         self.file_manager_ref = file_manager_ref
         self.bgt_release_handler_ref = bgt_release_handler_ref
+        self.build_manifest = None
+        self.artifact_cache = None
+        self.build_journal = None
+        # Release file path -> fingerprint of the release files to store in the artifact cache once the build completes
+        self.release_file_fingerprints = {}
+        # Release file path -> deployment plan entry of the SQL release files restored from the artifact cache
+        # or completed by an interrupted build
+        self.cached_plan_entries = {}
+        self.deployment_plan_entries = {}
+        self.grouped_copy_jobs = None
+        # Changed files no rule of the release file mapping matches
+        self.unrouted_files = []
+        self.up_to_date_release_files = set()
+        self.dropped_duplicates = []
+        # Release file path -> batches of scripts that can be deployed concurrently, from the dependency analysis
+        self.deployment_batches = None
+        self.dependency_warnings = {}
+        # Release file path -> (source path, offset, length) of each script copied into it
+        self.script_ranges = {}
+        # Release file path -> header written by this build, indexed with the scripts copied after it
+        self.release_file_headers = {}
+        # Release file path -> batch index written next to it
+        self.batch_indexes = {}
+        # Release file path -> fingerprint of the release files staged until the copy completes them
+        self.staged_fingerprints = {}
+        # Release file path -> header size and completed scripts of the staged release files the copy resumes
+        self.resumed_release_files = {}
+        # Databases are analysed and copied concurrently
+        self.lock = threading.Lock()
     
     def create_empty_directories(self, database_names):
         """
@@ -21,7 +60,7 @@ class ReleaseResourceManager():
             try:
                 # Build the full path and create the directories
                 release_full_path_with_db_name = os.path.join(self.awb_agt_release_file_path, database_name)
-                os.makedirs(release_full_path_with_db_name, exist_ok=True)
+                self.file_manager_ref.output_backend.make_directory(directory_path=release_full_path_with_db_name)
                     
                 # Add the created directory to the list
                 created_directories.append(release_full_path_with_db_name)
@@ -31,94 +70,661 @@ class ReleaseResourceManager():
             
             except Exception as e:
                 logger.error(f"Failed to create directory {release_full_path_with_db_name}: {e}")
-                sys.exit(1)
+                raise
             # Try else will excute only when try block is successful
             #else:
                 #create_deploy_word(f"AWB_{awb_new_version}_AND_AGT_{agt_new_version}",file_version_number)
 
+        # Temporary files left by a build killed while writing, the staged release files are left for the copy to resume
+        self.file_manager_ref.output_backend.discard_staged_files(directory_path=self.awb_agt_release_file_path)
         if created_directories:
             self.release_dirs_with_db_paths = created_directories    
             # Return the list of created directories
             return created_directories
     
-    def generate_release_bash_and_permission_files(self, file_path, file_name):
+    def set_build_manifest(self, build_manifest) -> None:
+        """
+        Enable incremental builds against the manifest of the previous build.
+        """
+        self.build_manifest = build_manifest
+
+    def set_artifact_cache(self, artifact_cache) -> None:
+        """
+        Restore the release files built before from the same inputs, by this or another build, from the artifact cache.
+        """
+        self.artifact_cache = artifact_cache
+
+    def set_build_journal(self, build_journal) -> None:
+        """
+        Journal the progress of the build, and reuse the release files an interrupted build completed or left staged.
+        """
+        self.build_journal = build_journal
+
+    def input_file_hash(self, file_path:str) -> str:
+        """
+        Hash an input file for the build manifest or the artifact cache. Unreadable files hash to None.
+        Files read from git are identified by their blob id.
+        """
+        source_id = self.file_manager_ref.source_id(file_path=file_path)
+        if source_id:
+            return source_id
+        try:
+            return (self.build_manifest or self.artifact_cache).hash_file(file_path=file_path)
+        except OSError as e:
+            logger.warning(f"Unable to hash input file {file_path}: {e}")
+            return None
+
+    def release_file_fingerprint(self, release_file_path:str, inputs:list, settings=None) -> str:
+        """
+        Fingerprint a release file from the database versions, the build settings, its input files and the given settings.
+        """
+        return BuildManifest.fingerprint([
+            self.bgt_release_handler_ref.db_versions_dict,
+            self.bgt_release_handler_ref.build_settings,
+            self.file_manager_ref.template_engine.signature(),
+            release_file_path,
+            [[input_path, self.input_file_hash(file_path=input_path)] for input_path in inputs],
+            settings
+        ])
+
+    def reuse_release_file(self, release_file_path:str, inputs:list, settings=None) -> tuple:
+        """
+        Decide whether a release file has to be written, once per release file: it is skipped when the previous build
+        left it up to date or an interrupted build completed it, and restored when the artifact cache has it.
+        Returns the fingerprint to journal the file with once written, None when neither incremental builds nor the
+        artifact cache are enabled, and whether the file is already in place.
+        """
+        if not (self.build_manifest or self.artifact_cache):
+            return None, False
+        fingerprint = self.release_file_fingerprint(release_file_path=release_file_path, inputs=inputs, settings=settings)
+        reused = self.is_release_file_up_to_date(release_file_path=release_file_path, fingerprint=fingerprint, inputs=inputs) \
+            or self.restore_cached_artifact(release_file_path=release_file_path, fingerprint=fingerprint)
+        return fingerprint, reused
+
+    def is_release_file_up_to_date(self, release_file_path:str, fingerprint:str, inputs=None) -> bool:
+        """
+        Record a release file in the build manifest and check if the previous build already produced it.
+        """
+        if not self.build_manifest:
+            return False
+
+        self.build_manifest.record_release_file(release_file_path=release_file_path, fingerprint=fingerprint, inputs=inputs)
+        if self.build_manifest.is_up_to_date(release_file_path=release_file_path, fingerprint=fingerprint):
+            logger.info(f"Release file {release_file_path} is up to date, skipping.")
+            self.up_to_date_release_files.add(release_file_path)
+            return True
+        return self.resume_completed_file(release_file_path=release_file_path, fingerprint=fingerprint)
+
+    def resume_completed_file(self, release_file_path:str, fingerprint:str) -> bool:
+        """
+        Keep a release file an interrupted build completed from the same inputs, with the deployment plan entry,
+        batch index and checksum manifest entry it journaled.
+        """
+        completed_file = self.build_journal.completed_file(release_file_path=release_file_path, fingerprint=fingerprint) \
+            if self.build_journal else None
+        if not completed_file or not os.path.isfile(release_file_path):
+            return False
+
+        logger.info(f"Release file {release_file_path} was completed by an interrupted build, skipping.")
+        self.file_manager_ref.count(counter_name='journal_resumed_files')
+        with self.lock:
+            self.up_to_date_release_files.add(release_file_path)
+            if completed_file.get('plan_entry'):
+                self.cached_plan_entries[release_file_path] = completed_file['plan_entry']
+        if completed_file.get('batch_index'):
+            self.write_batch_index(release_file_path=release_file_path, batch_index=completed_file['batch_index'])
+        if self.file_manager_ref.checksum_manifest:
+            self.file_manager_ref.checksum_manifest.record_kept_file(file_path=release_file_path,
+                                                                    file_entry=completed_file.get('checksums'))
+        self.journal_completed_file(release_file_path=release_file_path, fingerprint=fingerprint,
+                                    plan_entry=completed_file.get('plan_entry'), batch_index=completed_file.get('batch_index'))
+        return True
+
+    def journal_completed_file(self, release_file_path:str, fingerprint:str, plan_entry=None, batch_index=None) -> None:
+        """
+        Journal a release file that is complete and in place, for a restarted build to keep it.
+        """
+        if not self.build_journal or not fingerprint:
+            return
+        checksum_manifest = self.file_manager_ref.checksum_manifest
+        self.build_journal.record_file_completed(
+            release_file_path=release_file_path,
+            fingerprint=fingerprint,
+            plan_entry=plan_entry,
+            batch_index=batch_index,
+            checksums=checksum_manifest.file_entry(file_path=release_file_path) if checksum_manifest else None
+        )
+
+    def resume_staged_release_file(self, release_file_path:str, fingerprint:str, header_path:str, sql_batch_indexer=None) -> bool:
+        """
+        Pick up a release file an interrupted build left staged from the same inputs: its header and the scripts
+        journaled as complete, whose bytes are all on disk, are kept and the copy appends the remaining scripts.
+        """
+        started_file = self.build_journal.started_file(release_file_path=release_file_path, fingerprint=fingerprint) \
+            if self.build_journal and fingerprint else None
+        if not started_file:
+            return False
+        output_backend = self.file_manager_ref.output_backend
+        try:
+            staged_size = os.path.getsize(output_backend.staging_path(file_path=release_file_path))
+        except OSError:
+            return False
+        header_size = started_file['header_size']
+        if staged_size < header_size:
+            return False
+        completed_scripts = []
+        for completed_script in started_file['scripts']:
+            if completed_script['end'] > staged_size:
+                break
+            completed_scripts.append(completed_script)
+
+        output_backend.begin_file(file_path=release_file_path)
+        with output_backend.open_read(file_path=release_file_path) as rf:
+            release_file_header = rf.read(header_size)
+        with self.lock:
+            self.staged_fingerprints[release_file_path] = fingerprint
+            self.resumed_release_files[release_file_path] = {'header_size': header_size, 'scripts': completed_scripts}
+        if self.file_manager_ref.checksum_manifest:
+            self.file_manager_ref.checksum_manifest.record_write(file_path=release_file_path, file_content=release_file_header,
+                                                                 source_paths=[header_path])
+        if sql_batch_indexer:
+            self.index_release_file_header(release_file_path=release_file_path, release_file_header=release_file_header,
+                                           sql_batch_indexer=sql_batch_indexer)
+        logger.info(f"Resuming release file {release_file_path} left by an interrupted build "
+                    f"after {len(completed_scripts)} scripts")
+        return True
+
+    def resume_release_file_copy(self, release_file_path:str, sql_file_paths, release_file_writer) -> list:
+        """
+        Reopen a resumed release file after the scripts the interrupted build completed, as long as they are the first
+        ones the copy plans, and return the changed files left to copy into it.
+        """
+        with self.lock:
+            resumed_release_file = self.resumed_release_files.pop(release_file_path)
+        completed_scripts = []
+        for completed_script, sql_file_path in zip(resumed_release_file['scripts'], sql_file_paths):
+            if completed_script['source'] != sql_file_path:
+                break
+            completed_scripts.append(completed_script)
+        resume_offset = completed_scripts[-1]['end'] if completed_scripts else resumed_release_file['header_size']
+
+        release_file_writer.resume_handle(release_file_path=release_file_path, completed_scripts=completed_scripts,
+                                          resume_offset=resume_offset)
+        self.file_manager_ref.count(counter_name='journal_resumed_scripts', amount=len(completed_scripts))
+        self.file_manager_ref.discard_decoded_sources(file_paths=sql_file_paths[:len(completed_scripts)])
+        return sql_file_paths[len(completed_scripts):]
+
+    def commit_release_files(self, release_file_paths) -> None:
+        """
+        Move the release files the copy completed into place and journal them with their deployment plan entry and
+        batch index.
+        """
+        for release_file_path in release_file_paths:
+            self.file_manager_ref.output_backend.commit_file(file_path=release_file_path)
+            with self.lock:
+                fingerprint = self.staged_fingerprints.pop(release_file_path, None)
+            self.journal_completed_file(
+                release_file_path=release_file_path,
+                fingerprint=fingerprint,
+                plan_entry=self.deployment_plan_entry(sql_release_full_path=release_file_path) if self.deployment_batches is not None else None,
+                batch_index=self.batch_indexes.get(release_file_path)
+            )
+
+    def restore_cached_artifact(self, release_file_path:str, fingerprint:str) -> bool:
+        """
+        Link a release file from the artifact cache when an artifact with the same fingerprint was built before.
+        Restored SQL release files are up to date for the rest of the build and keep their cached deployment plan entry.
+        Restored files keep their cached checksum manifest entry, so they are not read again to be digested.
+        Release files that are not restored are stored in the cache once the build completes.
+        """
+        if not self.artifact_cache:
+            return False
+
+        artifact_metadata = self.artifact_cache.restore(fingerprint=fingerprint, target_path=release_file_path)
+        if artifact_metadata is None:
+            self.file_manager_ref.count(counter_name='artifact_cache_misses')
+            with self.lock:
+                self.release_file_fingerprints[release_file_path] = fingerprint
+            return False
+
+        self.file_manager_ref.count(counter_name='artifact_cache_hits')
+        with self.lock:
+            self.up_to_date_release_files.add(release_file_path)
+            if artifact_metadata.get('plan_entry'):
+                self.cached_plan_entries[release_file_path] = artifact_metadata['plan_entry']
+        if artifact_metadata.get('batch_index'):
+            self.write_batch_index(release_file_path=release_file_path, batch_index=artifact_metadata['batch_index'])
+        if self.file_manager_ref.checksum_manifest:
+            self.file_manager_ref.checksum_manifest.record_kept_file(file_path=release_file_path,
+                                                                    file_entry=artifact_metadata.get('checksums'))
+        return True
+
+    def store_cached_artifacts(self) -> None:
+        """
+        Store the release files of the completed build that were not restored from the artifact cache, the SQL
+        release files with their deployment plan entry and batch index, every file with its checksum manifest entry,
+        then evict the least recently used artifacts.
+        """
+        if not self.artifact_cache:
+            return
+        checksum_manifest = self.file_manager_ref.checksum_manifest
+        for release_file_path, fingerprint in self.release_file_fingerprints.items():
+            artifact_metadata = {
+                'plan_entry': self.deployment_plan_entries.get(release_file_path),
+                'batch_index': self.batch_indexes.get(release_file_path),
+                'checksums': checksum_manifest.file_entry(file_path=release_file_path) if checksum_manifest else None
+            }
+            self.artifact_cache.store(fingerprint=fingerprint, artifact_path=release_file_path,
+                                      artifact_metadata={key: value for key, value in artifact_metadata.items() if value})
+        self.artifact_cache.evict()
+
+    def selected_release_dirs(self, release_dir_names=None) -> list:
+        """
+        Return the release directories of the databases named in release_dir_names, all of them for None.
+        """
+        return [
+            release_dir_db_path for release_dir_db_path in self.release_dirs_with_db_paths
+            if release_dir_names is None or os.path.basename(release_dir_db_path) in release_dir_names
+        ]
+
+    def selected_copy_jobs(self, release_dir_names=None):
+        """
+        Return the planned copies of the release files to write in the release directories named in release_dir_names,
+        all of them for None. Up to date release files are left out.
+        """
+        return OrderedDict(
+            (sql_release_full_path, sql_file_paths)
+            for sql_release_full_path, sql_file_paths in self.grouped_copy_jobs.items()
+            if sql_release_full_path not in self.up_to_date_release_files
+            and (release_dir_names is None or os.path.basename(os.path.dirname(sql_release_full_path)) in release_dir_names)
+        )
+
+    def generate_release_bash_and_permission_files(self, file_path, file_name, release_dir_names=None):
         """
         Create release bash files for each path in paths with appropriate modified data.
         """
-        bash_file_data = self.file_manager_ref.read_file_content(file_path=file_path)
-        for release_dir_db_path in self.release_dirs_with_db_paths:
-            replaced_file_content = self.bgt_release_handler_ref.file_replacements(file_content=bash_file_data, release_db_file_path=release_dir_db_path, sql_release_file_name=None)  
+        for release_dir_db_path in self.selected_release_dirs(release_dir_names=release_dir_names):
             bash_release_file_path = os.path.join(release_dir_db_path, file_name)
-            self.file_manager_ref.write_file_content(file_path=bash_release_file_path, file_content=replaced_file_content)
+            fingerprint, reused = self.reuse_release_file(release_file_path=bash_release_file_path, inputs=[file_path])
+            if reused:
+                continue
+
+            replaced_file_content = self.bgt_release_handler_ref.render_template(template_path=file_path, release_db_file_path=release_dir_db_path, sql_release_file_name=None)  
+            self.file_manager_ref.write_file_content(file_path=bash_release_file_path, file_content=replaced_file_content,
+                                                     source_paths=[file_path])
+            self.journal_completed_file(release_file_path=bash_release_file_path, fingerprint=fingerprint)
             
     
-    def generate_empty_release_sql_files(self, sql_release_files, sql_files_default_headers_path):
+    def generate_empty_release_sql_files(self, sql_release_files, sql_files_default_headers_path, release_dir_names=None,
+                                         sql_batch_indexer=None):
         """
         Create release files for each path in paths with appropriate header data.
+        In incremental builds, release files whose header and planned inputs are unchanged are left as they are,
+        and release files built before from the same header and inputs are restored from the artifact cache.
+        With a sql_batch_indexer, the headers of the release files the copy appends to are kept for their batch
+        index, and the release files left with their header only are indexed here.
+        The release files the copy appends to are staged until it completes them, a release file an interrupted
+        build left staged from the same inputs is resumed instead of written again.
         """      
-        default_sql_header_data = {
-            'with_create_data': self.file_manager_ref.read_file_content(sql_files_default_headers_path['create']),
-            'defalt_data': self.file_manager_ref.read_file_content(sql_files_default_headers_path['default'])
+        default_sql_header_paths = {
+            'with_create_data': sql_files_default_headers_path['create'],
+            'defalt_data': sql_files_default_headers_path['default']
         }
+        grouped_copy_jobs = self.grouped_copy_jobs or {}
         
-        for release_dir_db_path in self.release_dirs_with_db_paths:
+        for release_dir_db_path in self.selected_release_dirs(release_dir_names=release_dir_names):
             for sql_release_file_name in sql_release_files:
                 # Determine the appropriate header data
                 header_key = 'with_create_data' if sql_release_file_name == '1_datatrak_create_new_table_scripts.sql' else 'defalt_data'
-                header_content = default_sql_header_data[header_key]
+                header_path = default_sql_header_paths[header_key]
+
+                # Construct the full file path
+                sql_release_file_path = os.path.join(release_dir_db_path, sql_release_file_name)
+                sql_file_paths = grouped_copy_jobs.get(sql_release_file_path, [])
+                fingerprint, reused = self.reuse_release_file(release_file_path=sql_release_file_path,
+                                                              inputs=[header_path] + sql_file_paths)
+                if reused:
+                    self.file_manager_ref.discard_decoded_sources(file_paths=sql_file_paths)
+                    continue
+                if sql_file_paths and self.resume_staged_release_file(release_file_path=sql_release_file_path,
+                                                                      fingerprint=fingerprint, header_path=header_path,
+                                                                      sql_batch_indexer=sql_batch_indexer):
+                    continue
  
                 replaced_file_content = (
-                    self.bgt_release_handler_ref.file_replacements(
-                        file_content=header_content,
+                    self.bgt_release_handler_ref.render_template(
+                        template_path=header_path,
                         release_db_file_path=release_dir_db_path ,
                         sql_release_file_name=sql_release_file_name
                     )                                   
                 )
                 
-                # Construct the full file path
-                sql_release_file_path = os.path.join(release_dir_db_path, sql_release_file_name)
                 # Write the modified header data to the file
-                self.file_manager_ref.write_file_content(file_path=sql_release_file_path, file_content=replaced_file_content)
+                if sql_file_paths:
+                    self.file_manager_ref.output_backend.begin_file(file_path=sql_release_file_path)
+                self.file_manager_ref.write_file_content(file_path=sql_release_file_path, file_content=replaced_file_content,
+                                                         source_paths=[header_path])
+                if sql_batch_indexer:
+                    self.index_release_file_header(release_file_path=sql_release_file_path,
+                                                   release_file_header=replaced_file_content.encode('utf-8'),
+                                                   sql_batch_indexer=sql_batch_indexer)
+                if not sql_file_paths:
+                    self.journal_completed_file(release_file_path=sql_release_file_path, fingerprint=fingerprint,
+                                                batch_index=self.batch_indexes.get(sql_release_file_path))
+                elif self.build_journal and fingerprint:
+                    with self.lock:
+                        self.staged_fingerprints[sql_release_file_path] = fingerprint
+                    self.build_journal.record_file_started(release_file_path=sql_release_file_path, fingerprint=fingerprint,
+                                                           header_size=len(replaced_file_content.encode('utf-8')))
+
+    def index_release_file_header(self, release_file_path:str, release_file_header:bytes, sql_batch_indexer) -> None:
+        """
+        Keep the header of a release file for the batch index written by the copy, or write the index of the
+        header alone when no changed file is copied into the release file.
+        """
+        if (self.grouped_copy_jobs or {}).get(release_file_path):
+            with self.lock:
+                self.release_file_headers[release_file_path] = release_file_header
+            return
+        batch_tokenizer = sql_batch_indexer.create_tokenizer(release_file_header=release_file_header,
+                                                             start_offset=len(release_file_header))
+        self.write_batch_index(
+            release_file_path=release_file_path,
+            batch_index=SqlBatchIndexer.batch_index(release_file_path=release_file_path, release_file_size=len(release_file_header),
+                                                    batches=batch_tokenizer.finish())
+        )
+
+    def write_batch_index(self, release_file_path:str, batch_index:dict) -> None:
+        """
+        Write the batch index of a release file next to it.
+        """
+        with self.lock:
+            self.batch_indexes[release_file_path] = batch_index
+        self.file_manager_ref.write_file_content(file_path=SqlBatchIndexer.batch_index_path(release_file_path=release_file_path),
+                                                 file_content=json.dumps(batch_index, indent=2) + '\n')
                 
-    def get_release_sql_filename(sql, sql_file_changed_path, release_file_mapping):
+    def plan_sql_copy_jobs(self, sql_file_changed_paths, release_file_mapping):
+        """
+        Work out which release file each changed SQL file is appended to, grouped by release file
+        in input order. The changed files no rule of the release file mapping matches are reported and left out.
+        """
+        logger.info(f"sql_file_changed_paths:{sql_file_changed_paths}")
+        release_file_router = ReleaseFileRouter(release_databases=self.bgt_release_handler_ref.release_databases,
+                                                release_file_mapping=release_file_mapping)
+        routed_files, self.unrouted_files = release_file_router.classify(file_paths=sql_file_changed_paths)
+        if self.unrouted_files:
+            logger.warning(f"No matching release file for {len(self.unrouted_files)} changed files: {self.unrouted_files}")
+
+        copy_jobs = []
+        for sql_file_path, release_database, release_sql_file_name in routed_files:
+            release_dir_db_path = os.path.join(self.awb_agt_release_file_path, release_database['release_dir'])
+            if release_dir_db_path in self.release_dirs_with_db_paths:
+                copy_jobs.append((sql_file_path, os.path.join(release_dir_db_path, release_sql_file_name)))
+
+        self.grouped_copy_jobs = ReleaseFileWriter.group_copy_jobs(copy_jobs=copy_jobs)
+        return self.grouped_copy_jobs
+
+    def dedupe_sql_definitions(self, sql_definition_deduplicator) -> None:
+        """
+        Leave out of the planned copies the files listed again and the scripts superseded by a later definition
+        of the same object, and report them in the build manifest and the output backend.
+        """
+        self.grouped_copy_jobs, self.dropped_duplicates = sql_definition_deduplicator.dedupe(grouped_copy_jobs=self.grouped_copy_jobs)
+        # A file listed again is still copied once, its decoded content is kept for that copy
+        kept_paths = {sql_file_path for sql_file_paths in self.grouped_copy_jobs.values() for sql_file_path in sql_file_paths}
+        self.file_manager_ref.discard_decoded_sources(file_paths=[
+            dropped_duplicate['source'] for dropped_duplicate in self.dropped_duplicates
+            if dropped_duplicate['source'] not in kept_paths
+        ])
+        if self.build_manifest:
+            self.build_manifest.record_dropped_duplicates(dropped_duplicates=self.dropped_duplicates)
+        self.file_manager_ref.output_backend.record_dropped_duplicates(dropped_duplicates=self.dropped_duplicates)
+
+    def analyze_sql_dependencies(self, sql_dependency_analyzer, release_dir_names=None) -> None:
+        """
+        Order the planned copies of each release file by the dependencies between the scripts, and keep
+        the deployment batches for the deployment plan. Release files that are up to date are left as they are.
+        Objects are only looked up within a database, so each database can be analysed on its own.
+        """
+        grouped_copy_jobs = self.selected_copy_jobs(release_dir_names=release_dir_names)
+        ordered_copy_jobs, deployment_batches = sql_dependency_analyzer.analyze(grouped_copy_jobs=grouped_copy_jobs)
+        with self.lock:
+            if self.deployment_batches is None:
+                self.deployment_batches = OrderedDict()
+            self.deployment_batches.update(deployment_batches)
+            for sql_release_full_path in grouped_copy_jobs:
+                self.dependency_warnings[sql_release_full_path] = sql_dependency_analyzer.warnings.get(sql_release_full_path, [])
+                self.grouped_copy_jobs[sql_release_full_path] = ordered_copy_jobs[sql_release_full_path]
+
+    def write_deployment_plan(self, plan_file_name:str, release_file_order) -> None:
+        """
+        Write the deployment plan next to the database directories: for every release file, the batches of scripts
+        that can run concurrently, each script with the objects it defines and its byte range in the release file.
+        Up to date release files keep the entries of the previous plan, or the entries cached with them.
+        """
+        plan_path = os.path.join(self.awb_agt_release_file_path, plan_file_name)
+        previous_release_files = {}
+        if self.up_to_date_release_files - set(self.cached_plan_entries):
+            previous_release_files = self.load_previous_deployment_plan(plan_path=plan_path)
+
+        release_file_index = {release_file_name: index for index, release_file_name in enumerate(release_file_order)}
+        release_files = []
+        for sql_release_full_path in self.grouped_copy_jobs:
+            relative_release_path = os.path.relpath(sql_release_full_path, self.awb_agt_release_file_path).replace(os.sep, '/')
+            if sql_release_full_path in self.up_to_date_release_files:
+                if sql_release_full_path in self.cached_plan_entries:
+                    release_files.append(self.cached_plan_entries[sql_release_full_path])
+                elif relative_release_path in previous_release_files:
+                    release_files.append(previous_release_files[relative_release_path])
+                else:
+                    logger.warning(f"No previous deployment plan entry for {relative_release_path}")
+                continue
+
+            self.deployment_plan_entries[sql_release_full_path] = self.deployment_plan_entry(sql_release_full_path=sql_release_full_path)
+            release_files.append(self.deployment_plan_entries[sql_release_full_path])
+
+        release_dir_index = {release_dir_db_path: index for index, release_dir_db_path in enumerate(self.release_dirs_with_db_paths)}
+        release_files.sort(key=lambda release_file: (
+            release_dir_index.get(os.path.join(self.awb_agt_release_file_path, release_file['database']), len(release_dir_index)),
+            release_file_index.get(release_file['release_file'], len(release_file_index))
+        ))
+        deployment_plan = {
+            'version': 1,
+            'release_files': release_files,
+            'warnings': [warning for release_file in release_files for warning in release_file.get('warnings', [])]
+        }
+        self.file_manager_ref.write_file_content(file_path=plan_path, file_content=json.dumps(deployment_plan, indent=2) + '\n')
+
+    def deployment_plan_entry(self, sql_release_full_path:str) -> dict:
+        """
+        Describe a release file written by this build for the deployment plan: its batches of scripts, each script
+        with its byte range in the release file, and the warnings of the dependency analysis.
+        """
+        script_ranges = {
+            sql_file_path: (offset, length)
+            for sql_file_path, offset, length in self.script_ranges.get(sql_release_full_path, [])
+        }
+        batches = []
+        for batch in self.deployment_batches.get(sql_release_full_path, []):
+            plan_batch = []
+            for script in batch:
+                offset, length = script_ranges.get(script['source'], (None, None))
+                plan_batch.append(dict(script, offset=offset, length=length))
+            batches.append(plan_batch)
+        return {
+            'path': os.path.relpath(sql_release_full_path, self.awb_agt_release_file_path).replace(os.sep, '/'),
+            'database': os.path.basename(os.path.dirname(sql_release_full_path)),
+            'release_file': os.path.basename(sql_release_full_path),
+            'batches': batches,
+            'warnings': self.dependency_warnings.get(sql_release_full_path, [])
+        }
+
+    def load_previous_deployment_plan(self, plan_path:str) -> dict:
+        """
+        Read the release file entries of the deployment plan written by the previous build, by release file path.
+        """
+        try:
+            with open(plan_path, 'r', encoding='utf-8') as rf:
+                previous_plan = json.load(rf)
+            return {release_file['path']: release_file for release_file in previous_plan.get('release_files', [])}
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"Unable to read the previous deployment plan {plan_path}: {e}")
+            return {}
+
+    def ledger_build_inputs(self) -> list:
         """
-        Map the input file path to the correct release file name based on the directory.
+        List the changed SQL files copied into the release files for the release ledger, each with its SHA-256,
+        its release file relative to the release directory and the objects the dependency analysis found in it.
+        Files read from disk reuse the hashes of the build manifest.
+        """
+        release_file_batches = {
+            sql_release_full_path: plan_entry['batches'] for sql_release_full_path, plan_entry in self.cached_plan_entries.items()
+        }
+        release_file_batches.update(self.deployment_batches or {})
+        script_objects = {
+            (sql_release_full_path, script['source']): script['objects']
+            for sql_release_full_path, batches in release_file_batches.items()
+            for batch in batches
+            for script in batch
+        }
+        input_hashes = {}
+        build_inputs = []
+        for sql_release_full_path, sql_file_paths in self.grouped_copy_jobs.items():
+            relative_release_path = os.path.relpath(sql_release_full_path, self.awb_agt_release_file_path).replace(os.sep, '/')
+            for sql_file_path in sql_file_paths:
+                if sql_file_path not in input_hashes:
+                    input_hashes[sql_file_path] = self.ledger_input_hash(file_path=sql_file_path)
+                build_inputs.append({
+                    'source': sql_file_path,
+                    'release_file': relative_release_path,
+                    'sha256': input_hashes[sql_file_path],
+                    'objects': script_objects.get((sql_release_full_path, sql_file_path))
+                })
+        return build_inputs
+
+    def ledger_input_hash(self, file_path:str) -> str:
         """
-        logger.info(f"sql_file_path:{sql_file_changed_path}")
-        # Ex: ./datatrak_bgt_agt/stored_procedures/<sp_name.sql>
-        parts = sql_file_changed_path.split(os.sep)    
-        if len(parts)<2:
-            logger.warning(f"Invalide file path structure: {sql_file_changed_path}")
+        Return the SHA-256 of a changed SQL file as it was read, None when it cannot be read.
+        """
+        try:
+            if self.build_manifest and not self.file_manager_ref.source_id(file_path=file_path):
+                return self.build_manifest.hash_file(file_path=file_path)
+            return self.file_manager_ref.source_sha256(file_path=file_path)
+        except OSError as e:
+            logger.warning(f"Unable to hash input file {file_path} for the release ledger: {e}")
             return None
-        sql_directory_name = parts[1]  # Get the directory name (e.g., 'stored_procedures')
-        release_db_name = parts[0]  # Get the DB name (e.g., 'datatrak_bgt_agt')
 
-        # Return the corresponding release file name or None if not found
-        return release_file_mapping.get(sql_directory_name, None), release_db_name
-    
-    
-    def copy_sql_files_to_release_files(self, sql_file_changed_paths, release_file_mapping):
+    def copy_sql_files_to_release_files(self, sql_file_changed_paths, release_file_mapping, max_workers=None, buffer_size=None,
+                                        inline_max_bytes=None, release_dir_names=None, sql_batch_indexer=None):
         """
         Copy the contents of a file to the appropriate release file based on its directory.
+        Jobs are grouped by release file up front and each release file is opened once.
+        With max_workers > 1 the files up to inline_max_bytes are read and transcoded on a thread pool,
+        but every release file still receives its contents in input order.
+        With a sql_batch_indexer, the batches of every release file are indexed while it is written.
+        Release files resumed from an interrupted build only receive the scripts it did not complete. Once copied,
+        the release files are moved into place and what an interrupted build left in the directories is removed.
         """
-        logger.info(f"sql_file_changed_paths:{sql_file_changed_paths}")
-        for sql_file_path in sql_file_changed_paths:
-            logger.info(f"sql_file_path:{sql_file_path}")
-            release_sql_file_name, release_db_name = self.get_release_sql_filename(sql_file_changed_path=sql_file_path, release_file_mapping=release_file_mapping)
-            if release_sql_file_name:
-                for release_dir_db_path in self.release_dirs_with_db_paths:
-                    if release_db_name in release_dir_db_path:
-                        sql_release_full_path = os.path.join(release_dir_db_path,release_sql_file_name)
-                        self.file_manager_ref.copy_file(target_file_path=sql_file_path, final_release_path=sql_release_full_path)
+        if self.grouped_copy_jobs is None:
+            self.plan_sql_copy_jobs(sql_file_changed_paths=sql_file_changed_paths, release_file_mapping=release_file_mapping)
+        grouped_copy_jobs = self.selected_copy_jobs(release_dir_names=release_dir_names)
+
+        with ReleaseFileWriter(buffer_size=buffer_size or io.DEFAULT_BUFFER_SIZE,
+                               build_metrics=self.file_manager_ref.build_metrics,
+                               output_backend=self.file_manager_ref.output_backend,
+                               sql_batch_indexer=sql_batch_indexer,
+                               release_file_headers=self.release_file_headers,
+                               checksum_manifest=self.file_manager_ref.checksum_manifest,
+                               build_journal=self.build_journal) as release_file_writer:
+            for sql_release_full_path in list(grouped_copy_jobs):
+                if sql_release_full_path in self.resumed_release_files:
+                    grouped_copy_jobs[sql_release_full_path] = self.resume_release_file_copy(
+                        release_file_path=sql_release_full_path,
+                        sql_file_paths=grouped_copy_jobs[sql_release_full_path],
+                        release_file_writer=release_file_writer
+                    )
+            if not max_workers or max_workers <= 1:
+                for sql_release_full_path, sql_file_paths in grouped_copy_jobs.items():
+                    for sql_file_path in sql_file_paths:
+                        self.file_manager_ref.copy_file(
+                            target_file_path=sql_file_path,
+                            final_release_path=sql_release_full_path,
+                            release_file_writer=release_file_writer
+                        )
             else:
-                logger.warning(f"No matching release file for {sql_file_changed_paths}")
-                
+                self.copy_sql_files_concurrently(
+                    grouped_copy_jobs=grouped_copy_jobs,
+                    release_file_writer=release_file_writer,
+                    max_workers=max_workers,
+                    inline_max_bytes=inline_max_bytes or COPY_INLINE_MAX_BYTES
+                )
+        with self.lock:
+            self.script_ranges.update(release_file_writer.script_ranges)
+        for release_file_path, batch_index in release_file_writer.batch_indexes.items():
+            self.write_batch_index(release_file_path=release_file_path, batch_index=batch_index)
+        self.commit_release_files(release_file_paths=grouped_copy_jobs)
+        for release_dir_db_path in self.selected_release_dirs(release_dir_names=release_dir_names):
+            self.file_manager_ref.output_backend.discard_staged_files(directory_path=release_dir_db_path)
+
+    def copy_sql_files_concurrently(self, grouped_copy_jobs, release_file_writer, max_workers, inline_max_bytes):
+        """
+        Read and transcode the smaller source files on a worker pool and append them in submission order.
+        Larger files are streamed chunk by chunk when their turn comes, so they are never held in memory.
+        Only a bounded window of read files is kept in memory at any time.
+        """
+        pending_reads = deque()
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='sql_copy') as executor:
+            for sql_release_full_path, sql_file_paths in grouped_copy_jobs.items():
+                for sql_file_path in sql_file_paths:
+                    read_future = None
+                    if self.is_inline_copy(sql_file_path=sql_file_path, inline_max_bytes=inline_max_bytes):
+                        read_future = executor.submit(self.file_manager_ref.read_source_bytes, sql_file_path)
+                    pending_reads.append((sql_release_full_path, sql_file_path, read_future))
+                    if len(pending_reads) >= max_workers * 2:
+                        self.append_next_read(pending_reads=pending_reads, release_file_writer=release_file_writer)
+
+            while pending_reads:
+                self.append_next_read(pending_reads=pending_reads, release_file_writer=release_file_writer)
+
+    def is_inline_copy(self, sql_file_path, inline_max_bytes) -> bool:
+        """
+        Check if a source file is small enough to be read whole by a copy worker.
+        Files whose size is unknown are left to the worker, which reports the error.
+        """
+        try:
+            return self.file_manager_ref.source_size(file_path=sql_file_path) <= inline_max_bytes
+        except (OSError, ValueError):
+            return True
+
+    def append_next_read(self, pending_reads, release_file_writer):
+        """
+        Wait for the oldest pending read and append its content to the release file,
+        or stream the file now when it was too large to be read ahead.
+        """
+        sql_release_full_path, sql_file_path, read_future = pending_reads.popleft()
+        if read_future is None:
+            self.file_manager_ref.copy_file(
+                target_file_path=sql_file_path,
+                final_release_path=sql_release_full_path,
+                release_file_writer=release_file_writer
+            )
+            return
+
+        release_file_writer.append_content(release_file_path=sql_release_full_path, file_content=read_future.result(),
+                                           source_path=sql_file_path)
+
     def generate_deploy_guide_word_doc(self, release_number, deploy_guide_word_path, word_doc_name):
         # Dictionary to map placeholders to replacement values
         replace_dict = {
             'file_name': self.awb_agt_release_file_path,
             'version': release_number
         }
-        
+
+        fingerprint, reused = self.reuse_release_file(release_file_path=word_doc_name, inputs=[deploy_guide_word_path],
+                                                      settings=replace_dict)
+        if reused:
+            return
+
         self.file_manager_ref.write_to_deploy_guide_word(deploy_guide_word_path=deploy_guide_word_path, replace_dict=replace_dict,
-                                                         word_doc_name=word_doc_name)
\ No newline at end of file
+                                                         word_doc_name=word_doc_name)
+        self.journal_completed_file(release_file_path=word_doc_name, fingerprint=fingerprint)
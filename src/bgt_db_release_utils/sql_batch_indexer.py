@@ -0,0 +1,270 @@
+import os
+import re
+import logging
+from collections import deque
+from .sql_dependency_analyzer import SQL_COMMENT_OR_STRING_PATTERN, SQL_DEFINITION_PATTERN, sql_object_key
+
+logger = logging.getLogger(__name__)
+
+# Sidecar index written next to every release file the changed SQL files are copied into
+BATCH_INDEX_SUFFIX = '.batches.json'
+BATCH_INDEX_FORMAT_VERSION = 1
+
+# A GO separator: alone on its line, with an optional repeat count and trailing comment, as sqlcmd reads it
+GO_LINE = rb'[ \t]*GO(?:[ \t]+%s)?[ \t]*(?:--[^\n]*)?\r?(?=\n|\Z)'
+GO_LINE_PATTERN = re.compile(GO_LINE % rb'(?P<count>\d+)', re.IGNORECASE)
+
+# Skips, in one match, the code, the line comments, the block comments without a nested one and the complete string
+# literals and quoted names up to the next token that changes the tokeniser state: a GO line, or a comment, literal
+# or name that does not end in the text
+SQL_BATCH_SCAN_PATTERN = re.compile(
+    rb'''(?:[^'"\[\-/\n]++|'[^']*+'|"[^"]*+"|\[[^\]]*+\]|--[^\n]*+(?=\n)|/\*(?:[^*/]++|\*(?!/)|/(?!\*))*+\*/'''
+    rb'''|-(?!-)|/(?!\*)|\n(?!''' + GO_LINE % rb'\d+' + rb'''))*+'''
+    rb'''(?:\n(?P<go>''' + GO_LINE % rb'(?P<count>\d+)' + rb''')|(?P<line_comment>--)|(?P<block_comment>/\*)|(?P<quote>['"\[]))?''',
+    re.IGNORECASE
+)
+SQL_BLOCK_COMMENT_TOKEN_PATTERN = re.compile(rb'/\*|\*/')
+SQL_QUOTE_ENDS = {b"'": b"'", b'"': b'"', b'[': b']'}
+
+# A line longer than this is tokenised before its end is read, it cannot be a GO line
+MAX_PENDING_LINE_BYTES = 64 * 1024
+
+# Bytes kept after the last CREATE or ALTER keyword of a batch when looking for its objects, enough for the keyword,
+# the object type and a four-part name
+SQL_DEFINITION_MAX_BYTES = 1024
+
+class SqlBatchTokenizer():
+    """
+    Splits the stream of bytes appended to one release file into the batches sqlcmd runs, in a single pass over the
+    data as it is written. Tracks line and nested block comments, string literals and quoted names across chunks,
+    so a GO inside them is not a separator. Each batch is described by its byte range, the changed files its bytes
+    came from and the objects it defines, found in its first object_scan_bytes.
+    """
+    def __init__(self, default_schema:str='dbo', object_scan_bytes:int=64 * 1024, start_offset:int=0):
+        """
+        Initialize the SqlBatchTokenizer class for a stream starting at start_offset in the release file.
+        """
+        self.default_schema = default_schema.lower()
+        self.object_scan_bytes = object_scan_bytes
+        # Comment, literal or quoted name open at the end of the text tokenised so far: None, '--', '/*' or its quote
+        self.state = None
+        self.comment_depth = 0
+        self.at_line_start = True
+        # End of the last line received, tokenised with the next chunk
+        self.pending = b''
+        self.fed_offset = start_offset
+        self.processed_offset = start_offset
+        # (offset, source path) where the bytes of each source start
+        self.source_marks = deque()
+        self.batch_start = start_offset
+        self.batch_has_content = False
+        self.batch_head = b''
+        self.batches = []
+
+    def feed(self, data:bytes, source_path:str=None) -> None:
+        """
+        Tokenise the next bytes of the stream, read from source_path, None for the header and the separators.
+        """
+        if not data:
+            return
+        if not self.source_marks or self.source_marks[-1][1] != source_path:
+            self.source_marks.append((self.fed_offset, source_path))
+        self.fed_offset += len(data)
+
+        text = self.pending + data if self.pending else data
+        last_newline = text.rfind(b'\n')
+        if last_newline + 1 < len(text) and len(text) - last_newline - 1 <= MAX_PENDING_LINE_BYTES:
+            self.pending = text[last_newline + 1:]
+            text = text[:last_newline + 1]
+        else:
+            self.pending = b''
+        if text:
+            self.process(text=text)
+
+    def finish(self) -> list:
+        """
+        Tokenise the end of the stream and return the batches, each a dict with its offset, length, repeat count
+        (GO <count>), sources and objects. Batches holding only blanks are left out.
+        """
+        if self.pending:
+            text, self.pending = self.pending, b''
+            self.process(text=text)
+        self.close_batch(batch_end=self.processed_offset, next_batch_start=self.processed_offset)
+        return self.batches
+
+    def process(self, text:bytes) -> None:
+        """
+        Tokenise complete lines, or the start of a very long line, and close a batch at every GO line.
+        """
+        text_offset = self.processed_offset
+        position = 0
+        # Start of the bytes of the current batch in text
+        segment_start = 0
+        if self.state is None and self.at_line_start:
+            go_match = GO_LINE_PATTERN.match(text, 0)
+            if go_match:
+                position, segment_start = self.split_batch(text=text, text_offset=text_offset, segment_start=segment_start,
+                                                           go_match=go_match, go_group=0)
+
+        while position < len(text):
+            if self.state is None:
+                scan_match = SQL_BATCH_SCAN_PATTERN.match(text, position)
+                token_name = scan_match.lastgroup
+                if token_name == 'go' or token_name == 'count':
+                    position, segment_start = self.split_batch(text=text, text_offset=text_offset, segment_start=segment_start,
+                                                               go_match=scan_match, go_group='go')
+                elif token_name == 'line_comment':
+                    self.state = b'--'
+                    position = scan_match.end()
+                elif token_name == 'block_comment':
+                    self.state = b'/*'
+                    self.comment_depth = 1
+                    position = scan_match.end()
+                elif token_name == 'quote':
+                    self.state = scan_match.group('quote')
+                    position = scan_match.end()
+                else:
+                    position = len(text)
+            elif self.state == b'--':
+                line_end = text.find(b'\n', position)
+                position = len(text) if line_end == -1 else line_end
+                if line_end != -1:
+                    self.state = None
+            elif self.state == b'/*':
+                position = self.skip_block_comment(text=text, position=position)
+            else:
+                quote_end = text.find(SQL_QUOTE_ENDS[self.state], position)
+                position = len(text) if quote_end == -1 else quote_end + 1
+                if quote_end != -1:
+                    self.state = None
+
+        self.add_to_batch(segment=text[segment_start:])
+        self.processed_offset = text_offset + len(text)
+        self.at_line_start = text.endswith(b'\n')
+
+    def skip_block_comment(self, text:bytes, position:int) -> int:
+        """
+        Skip the rest of a block comment, comments nest in T-SQL. Returns the position after it, or the end of text.
+        """
+        for comment_token in SQL_BLOCK_COMMENT_TOKEN_PATTERN.finditer(text, position):
+            self.comment_depth += 1 if comment_token.group() == b'/*' else -1
+            if not self.comment_depth:
+                self.state = None
+                return comment_token.end()
+        return len(text)
+
+    def split_batch(self, text:bytes, text_offset:int, segment_start:int, go_match, go_group) -> tuple:
+        """
+        Close the current batch before a GO line and start the next one after it.
+        Returns the position to tokenise from, the newline ending the GO line, and the start of the next batch in text.
+        """
+        go_start, go_end = go_match.start(go_group), go_match.end(go_group)
+        self.add_to_batch(segment=text[segment_start:go_start])
+        next_segment_start = go_end + 1 if text[go_end:go_end + 1] == b'\n' else go_end
+        self.close_batch(batch_end=text_offset + go_start, next_batch_start=text_offset + next_segment_start,
+                         repeat_count=int(go_match.group('count') or 1))
+        return go_end, next_segment_start
+
+    def add_to_batch(self, segment:bytes) -> None:
+        """
+        Note the bytes of the current batch: whether it holds anything but blanks, and its first bytes.
+        """
+        if not self.batch_has_content and segment.strip():
+            self.batch_has_content = True
+        if len(self.batch_head) < self.object_scan_bytes:
+            self.batch_head += segment[:self.object_scan_bytes - len(self.batch_head)]
+
+    def close_batch(self, batch_end:int, next_batch_start:int, repeat_count:int=1) -> None:
+        """
+        Record the current batch if it holds anything but blanks, and start the next one.
+        """
+        if self.batch_has_content:
+            self.batches.append({
+                'offset': self.batch_start,
+                'length': batch_end - self.batch_start,
+                'repeat': repeat_count,
+                'sources': self.batch_sources(batch_end=batch_end),
+                'objects': self.batch_objects()
+            })
+        # Marks of sources ending before the next batch are no longer needed
+        while len(self.source_marks) > 1 and self.source_marks[1][0] <= next_batch_start:
+            self.source_marks.popleft()
+        self.batch_start = next_batch_start
+        self.batch_has_content = False
+        self.batch_head = b''
+
+    def batch_sources(self, batch_end:int) -> list:
+        """
+        Return the changed files with bytes in the current batch, in stream order.
+        """
+        batch_sources = []
+        for mark_index, (mark_offset, source_path) in enumerate(self.source_marks):
+            mark_end = self.source_marks[mark_index + 1][0] if mark_index + 1 < len(self.source_marks) else self.fed_offset
+            if source_path and mark_offset < batch_end and mark_end > self.batch_start and source_path not in batch_sources:
+                batch_sources.append(source_path)
+        return batch_sources
+
+    def batch_objects(self) -> list:
+        """
+        Return the keys of the objects the current batch defines, in order. CREATE PROCEDURE, VIEW, FUNCTION and
+        TRIGGER start their batch, so its first bytes are enough. Comments and strings are only blanked out up to the
+        last CREATE or ALTER keyword, the rest of the batch defines nothing.
+        """
+        lowered_head = self.batch_head.lower()
+        last_keyword = max(lowered_head.rfind(b'create'), lowered_head.rfind(b'alter'))
+        if last_keyword == -1:
+            return []
+        definition_head = self.batch_head[:last_keyword + SQL_DEFINITION_MAX_BYTES]
+        batch_code = SQL_COMMENT_OR_STRING_PATTERN.sub(' ', definition_head.decode('utf-8', errors='replace'))
+        batch_objects = []
+        for definition in SQL_DEFINITION_PATTERN.finditer(batch_code):
+            if definition.group(1).upper() == 'ALTER' and definition.group(2).upper() == 'TABLE':
+                continue
+            object_key = sql_object_key(object_name=definition.group(3), default_schema=self.default_schema)
+            if object_key and object_key not in batch_objects:
+                batch_objects.append(object_key)
+        return batch_objects
+
+class SqlBatchIndexer():
+    """
+    Indexes the batches of the release files while the changed SQL files are copied into them, so a deployment
+    that fails can resume from the failed batch, or run independent batches concurrently, instead of replaying the
+    whole release file. The index of a release file is written next to it, see BATCH_INDEX_SUFFIX.
+    """
+    def __init__(self, default_schema:str='dbo', object_scan_bytes:int=64 * 1024):
+        """
+        Initialize the SqlBatchIndexer class. Objects are looked for in the first object_scan_bytes of every batch.
+        """
+        self.default_schema = default_schema
+        self.object_scan_bytes = object_scan_bytes
+
+    def create_tokenizer(self, release_file_header:bytes=None, start_offset:int=0) -> SqlBatchTokenizer:
+        """
+        Return a tokenizer for the content appended to a release file at start_offset. The header written before it
+        is tokenised first when it is known, otherwise the index starts at start_offset.
+        """
+        if release_file_header is not None and len(release_file_header) == start_offset:
+            sql_batch_tokenizer = SqlBatchTokenizer(default_schema=self.default_schema, object_scan_bytes=self.object_scan_bytes)
+            sql_batch_tokenizer.feed(data=release_file_header)
+            return sql_batch_tokenizer
+        return SqlBatchTokenizer(default_schema=self.default_schema, object_scan_bytes=self.object_scan_bytes,
+                                 start_offset=start_offset)
+
+    @staticmethod
+    def batch_index_path(release_file_path:str) -> str:
+        """
+        Return the path of the batch index of a release file.
+        """
+        return release_file_path + BATCH_INDEX_SUFFIX
+
+    @staticmethod
+    def batch_index(release_file_path:str, release_file_size:int, batches:list) -> dict:
+        """
+        Describe the batches of a release file for the sidecar index.
+        """
+        return {
+            'version': BATCH_INDEX_FORMAT_VERSION,
+            'release_file': os.path.basename(release_file_path),
+            'size': release_file_size,
+            'batches': batches
+        }
@@ -0,0 +1,165 @@
+import os
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from .sql_dependency_analyzer import (
+    SQL_COMMENT_OR_STRING_PATTERN,
+    SQL_DEFINITION_PATTERN,
+    SQL_DROP_PATTERN,
+    SQL_OBJECT_NAME_PATTERN,
+    sql_object_key
+)
+
+logger = logging.getLogger(__name__)
+
+# Programmable objects that a later definition replaces entirely
+REPLACEABLE_OBJECT_TYPES = ('PROCEDURE', 'PROC', 'VIEW', 'FUNCTION', 'TRIGGER')
+
+class SqlDefinitionDeduplicator():
+    """
+    Drops redundant copies from the planned copies of each release file: a file listed more than once, and scripts
+    (re)defining a procedure, view, function or trigger that a later script of the same release file replaces.
+    A definition replaces the earlier ones completely when it is a CREATE OR ALTER, or a CREATE preceded by its own
+    DROP. When the final definition is a plain ALTER, the earliest CREATE is kept so the object exists to be altered,
+    and when it is a plain CREATE nothing is dropped. Scripts defining anything else, or several objects, and the
+    definitions of an object that another script drops are always kept.
+    """
+    def __init__(self, file_manager, max_script_bytes:int, max_workers:int=1, default_schema:str='dbo'):
+        """
+        Initialize the SqlDefinitionDeduplicator class. Scripts larger than max_script_bytes are not scanned and kept.
+        """
+        self.file_manager = file_manager
+        self.max_script_bytes = max_script_bytes
+        self.max_workers = max(1, max_workers)
+        self.default_schema = default_schema.lower()
+
+    def scan_script(self, sql_text:str) -> tuple:
+        """
+        Return the object a script defines when it only defines one procedure, view, function or trigger, else None,
+        how it defines it, 'replace', 'create' or 'alter', and the objects the script drops.
+        """
+        sql_text = SQL_COMMENT_OR_STRING_PATTERN.sub(' ', sql_text)
+        # Object key -> position of its first DROP in the script
+        drop_positions = {}
+        for drop in SQL_DROP_PATTERN.finditer(sql_text):
+            for object_name in SQL_OBJECT_NAME_PATTERN.findall(drop.group(1)):
+                drop_positions.setdefault(sql_object_key(object_name=object_name, default_schema=self.default_schema),
+                                          drop.start())
+
+        target_objects = set()
+        definition_kinds = set()
+        is_replaceable = True
+        for definition in SQL_DEFINITION_PATTERN.finditer(sql_text):
+            if definition.group(1).upper() == 'ALTER' and definition.group(2).upper() == 'TABLE':
+                continue
+            if definition.group(2).upper() not in REPLACEABLE_OBJECT_TYPES:
+                is_replaceable = False
+                break
+            object_key = sql_object_key(object_name=definition.group(3), default_schema=self.default_schema)
+            target_objects.add(object_key)
+            definition_verb = ' '.join(definition.group(1).upper().split())
+            if definition_verb == 'CREATE OR ALTER' \
+                or (definition_verb == 'CREATE' and drop_positions.get(object_key, len(sql_text)) < definition.start()):
+                definition_kinds.add('replace')
+            else:
+                definition_kinds.add(definition_verb.lower())
+
+        dropped_objects = set(drop_positions) - {None}
+        if not is_replaceable or len(target_objects) != 1:
+            return None, None, dropped_objects
+        definition_kind = next(kind for kind in ('replace', 'create', 'alter') if kind in definition_kinds)
+        return target_objects.pop(), definition_kind, dropped_objects
+
+    def scan_source(self, sql_file_path:str) -> tuple:
+        """
+        Read and scan a changed SQL file. Files too large or unreadable give no object and no drops.
+        """
+        try:
+            if self.file_manager.source_size(file_path=sql_file_path) > self.max_script_bytes:
+                return None, None, set()
+            return self.scan_script(sql_text=self.file_manager.peek_source_bytes(file_path=sql_file_path).decode('utf-8'))
+
+        except Exception as e:
+            logger.warning(f"Unable to scan {sql_file_path} for its object definition: {e}")
+            return None, None, set()
+
+    def dedupe(self, grouped_copy_jobs) -> tuple:
+        """
+        Dedupe the planned copies, given as release file path -> source paths in input order.
+        Returns the copies left, in input order, and the dropped copies as
+        {'release_file', 'source', 'kept', 'object'} entries, object being None for a file listed again.
+        """
+        scanned_paths = list(OrderedDict.fromkeys(
+            sql_file_path for sql_file_paths in grouped_copy_jobs.values() for sql_file_path in sql_file_paths
+        ))
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='sql_dedupe') as executor:
+            scan_results = dict(zip(scanned_paths, executor.map(self.scan_source, scanned_paths)))
+
+        deduped_copy_jobs = OrderedDict()
+        dropped_duplicates = []
+        for sql_release_full_path, sql_file_paths in grouped_copy_jobs.items():
+            # Position of the last copy of each file
+            last_path_positions = {}
+            for position, sql_file_path in enumerate(sql_file_paths):
+                last_path_positions[os.path.normpath(sql_file_path)] = position
+            copied_positions = [
+                position for position, sql_file_path in enumerate(sql_file_paths)
+                if last_path_positions[os.path.normpath(sql_file_path)] == position
+            ]
+            superseded_positions = self.superseded_definitions(sql_file_paths=sql_file_paths, copied_positions=copied_positions,
+                                                               scan_results=scan_results)
+
+            kept_paths = []
+            for position, sql_file_path in enumerate(sql_file_paths):
+                last_path_position = last_path_positions[os.path.normpath(sql_file_path)]
+                if last_path_position != position:
+                    dropped_duplicates.append({'release_file': sql_release_full_path, 'source': sql_file_path,
+                                               'kept': sql_file_paths[last_path_position], 'object': None})
+                elif position in superseded_positions:
+                    dropped_duplicates.append({'release_file': sql_release_full_path, 'source': sql_file_path,
+                                               'kept': sql_file_paths[superseded_positions[position]],
+                                               'object': scan_results[sql_file_path][0]})
+                else:
+                    kept_paths.append(sql_file_path)
+            deduped_copy_jobs[sql_release_full_path] = kept_paths
+
+        for dropped_duplicate in dropped_duplicates:
+            logger.warning(f"Dropping {dropped_duplicate['source']} from {dropped_duplicate['release_file']}, "
+                           f"{dropped_duplicate['object'] or 'the file'} is copied from {dropped_duplicate['kept']}")
+        return deduped_copy_jobs, dropped_duplicates
+
+    @staticmethod
+    def superseded_definitions(sql_file_paths, copied_positions, scan_results) -> dict:
+        """
+        Find the definitions of one release file that a later definition of the same object replaces, among the
+        copied positions. Returns the position of each superseded definition -> position of the definition kept.
+        """
+        # Object key -> [(position, definition kind)] in input order, and the positions of the scripts dropping it
+        object_definitions = OrderedDict()
+        drop_positions = {}
+        for position in copied_positions:
+            target_object, definition_kind, dropped_objects = scan_results[sql_file_paths[position]]
+            if target_object:
+                object_definitions.setdefault(target_object, []).append((position, definition_kind))
+            for object_key in dropped_objects:
+                drop_positions.setdefault(object_key, set()).add(position)
+
+        superseded_positions = {}
+        for target_object, definitions in object_definitions.items():
+            final_position, final_kind = definitions[-1]
+            # Another script dropping the object depends on the definitions around it
+            if len(definitions) < 2 or final_kind == 'create' \
+                or drop_positions.get(target_object, set()) - {position for position, _ in definitions}:
+                continue
+            kept_positions = {final_position}
+            if final_kind == 'alter':
+                replacing_positions = [position for position, kind in definitions[:-1] if kind == 'replace']
+                creating_positions = [position for position, kind in definitions[:-1] if kind == 'create']
+                if replacing_positions:
+                    kept_positions.add(replacing_positions[-1])
+                elif creating_positions:
+                    kept_positions.add(creating_positions[0])
+            for position, _ in definitions:
+                if position not in kept_positions:
+                    superseded_positions[position] = final_position
+        return superseded_positions
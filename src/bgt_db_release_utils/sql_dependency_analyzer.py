@@ -0,0 +1,321 @@
+import os
+import re
+import heapq
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Comments and string literals, blanked out before names are scanned
+SQL_COMMENT_OR_STRING_PATTERN = re.compile(r"--[^\n]*|/\*.*?\*/|N?'(?:[^']|'')*'", re.DOTALL)
+
+# One part of a T-SQL object name, and a name of up to four parts (server.database.schema.object)
+SQL_NAME_PART = r'(?:\[[^\]]+\]|"[^"]+"|[A-Za-z_@#][\w@#$]*)'
+SQL_OBJECT_NAME = rf'{SQL_NAME_PART}(?:\s*\.\s*{SQL_NAME_PART}){{0,3}}'
+
+# Statements defining an object. ALTER TABLE only changes a table, it is a reference to it.
+SQL_DEFINITION_PATTERN = re.compile(
+    rf'\b(CREATE(?:\s+OR\s+ALTER)?|ALTER)\s+(PROCEDURE|PROC|VIEW|FUNCTION|TRIGGER|TABLE|TYPE|SYNONYM|SEQUENCE)\s+({SQL_OBJECT_NAME})',
+    re.IGNORECASE
+)
+# Names in the positions that name an object: after FROM, JOIN, EXEC, REFERENCES..., the table of an index or trigger,
+# the securable of a GRANT, and schema qualified function calls. Column names and aliases are not references.
+SQL_REFERENCE_PATTERN = re.compile(
+    rf'\b(?:FROM|JOIN|APPLY|INTO|UPDATE|MERGE|REFERENCES|(?:ALTER|TRUNCATE)\s+TABLE|EXEC(?:UTE)?(?:\s+@\w+\s*=)?)\s+'
+    rf'(?!(?:ON|AS|SELECT|SET|VALUES|WITH)\b)({SQL_OBJECT_NAME})'
+    rf'|\b(?:INDEX|TRIGGER)\s+{SQL_OBJECT_NAME}\s+ON\s+({SQL_OBJECT_NAME})'
+    rf'|\bON\s+(?:OBJECT\s*::\s*)?({SQL_OBJECT_NAME})\s+TO\b'
+    rf'|({SQL_NAME_PART}(?:\s*\.\s*{SQL_NAME_PART}){{1,3}})\s*\(',
+    re.IGNORECASE
+)
+# Statements dropping objects, which must run before the scripts defining them again
+SQL_DROP_PATTERN = re.compile(
+    rf'\bDROP\s+(?:PROCEDURE|PROC|VIEW|FUNCTION|TRIGGER|TABLE|TYPE|SYNONYM|SEQUENCE)\s+(?:IF\s+EXISTS\s+)?'
+    rf'({SQL_OBJECT_NAME}(?:\s*,\s*{SQL_OBJECT_NAME})*)',
+    re.IGNORECASE
+)
+SQL_OBJECT_NAME_PATTERN = re.compile(SQL_OBJECT_NAME)
+SQL_NAME_PART_PATTERN = re.compile(SQL_NAME_PART)
+
+def sql_object_key(object_name:str, default_schema:str) -> str:
+    """
+    Normalise an object name to schema.object in lower case, with default_schema when none is given.
+    Returns None for temporary tables and variables.
+    """
+    name_parts = [name_part.strip('[]"').lower() for name_part in SQL_NAME_PART_PATTERN.findall(object_name)]
+    if not name_parts or name_parts[-1].startswith(('#', '@')):
+        return None
+    schema_name = name_parts[-2] if len(name_parts) > 1 and name_parts[-2] else default_schema
+    return f"{schema_name}.{name_parts[-1]}"
+
+class SqlDependencyAnalyzer():
+    """
+    Finds the objects each changed SQL script defines, drops and references, and builds from that a dependency graph
+    per database: a script depends on the scripts defining what it references, and a script defining an object on the
+    scripts dropping it. Scripts are grouped into batches of scripts that do not depend on each other, which the
+    deploy stage can run concurrently. With reorder, scripts are also ordered topologically inside each release file,
+    otherwise they keep their input order. Release files keep their numbered order either way.
+    """
+    def __init__(self, file_manager, release_file_order, max_script_bytes:int, max_workers:int=1, default_schema:str='dbo',
+                 reorder:bool=False):
+        """
+        Initialize the SqlDependencyAnalyzer class. release_file_order lists the release file names in deployment order.
+        Scripts larger than max_script_bytes are not scanned, they are deployed alone, after the scripts before them.
+        """
+        self.file_manager = file_manager
+        self.release_file_order = {release_file_name: index for index, release_file_name in enumerate(release_file_order)}
+        self.max_script_bytes = max_script_bytes
+        self.max_workers = max(1, max_workers)
+        self.default_schema = default_schema.lower()
+        self.reorder = reorder
+        # Release file path -> warnings about its scripts
+        self.warnings = {}
+
+    def object_key(self, object_name:str) -> str:
+        """
+        Normalise an object name to schema.object in lower case, with the default schema when none is given.
+        """
+        return sql_object_key(object_name=object_name, default_schema=self.default_schema)
+
+    def scan_script(self, sql_text:str) -> tuple:
+        """
+        Return the objects a script defines, the objects it references and the objects it drops, as sets of object keys.
+        """
+        sql_text = SQL_COMMENT_OR_STRING_PATTERN.sub(' ', sql_text)
+        defined_objects = set()
+        for definition in SQL_DEFINITION_PATTERN.finditer(sql_text):
+            if definition.group(1).upper() == 'ALTER' and definition.group(2).upper() == 'TABLE':
+                continue
+            object_key = self.object_key(object_name=definition.group(3))
+            if object_key:
+                defined_objects.add(object_key)
+
+        # Scripts repeat the same names many times, each distinct name is normalised once
+        referenced_names = {
+            next(object_name for object_name in reference.groups() if object_name)
+            for reference in SQL_REFERENCE_PATTERN.finditer(sql_text)
+        }
+        referenced_objects = {self.object_key(object_name=object_name) for object_name in referenced_names}
+        referenced_objects.discard(None)
+
+        dropped_objects = {
+            self.object_key(object_name=object_name)
+            for drop in SQL_DROP_PATTERN.finditer(sql_text)
+            for object_name in SQL_OBJECT_NAME_PATTERN.findall(drop.group(1))
+        }
+        dropped_objects.discard(None)
+        return defined_objects, referenced_objects - defined_objects, dropped_objects
+
+    def scan_source(self, sql_file_path:str) -> tuple:
+        """
+        Read and scan a changed SQL file. Returns None for a file too large or unreadable to scan.
+        """
+        try:
+            if self.file_manager.source_size(file_path=sql_file_path) > self.max_script_bytes:
+                logger.info(f"Not scanning {sql_file_path} for dependencies, it is larger than {self.max_script_bytes} bytes")
+                return None
+            sql_text = self.file_manager.peek_source_bytes(file_path=sql_file_path).decode('utf-8')
+            return self.scan_script(sql_text=sql_text)
+
+        except Exception as e:
+            logger.warning(f"Unable to scan {sql_file_path} for dependencies: {e}")
+            return None
+
+    def analyze(self, grouped_copy_jobs) -> tuple:
+        """
+        Analyse the planned copies, given as release file path -> source paths in input order.
+        Returns the copies in dependency order and the deployment plan of every release file, as
+        release file path -> list of batches, each a list of {'source', 'objects'} scripts.
+        """
+        scripts = [
+            (sql_release_full_path, sql_file_path)
+            for sql_release_full_path, sql_file_paths in grouped_copy_jobs.items()
+            for sql_file_path in sql_file_paths
+        ]
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='sql_scan') as executor:
+            scan_results = list(executor.map(self.scan_source, [sql_file_path for _, sql_file_path in scripts]))
+
+        # Release file path -> [(source path, scan result)] in input order
+        release_file_scripts = OrderedDict((sql_release_full_path, []) for sql_release_full_path in grouped_copy_jobs)
+        # Database directory -> object key -> release files defining it
+        object_definitions = {}
+        for (sql_release_full_path, sql_file_path), scan_result in zip(scripts, scan_results):
+            release_file_scripts[sql_release_full_path].append((sql_file_path, scan_result))
+            if scan_result:
+                database_definitions = object_definitions.setdefault(os.path.dirname(sql_release_full_path), {})
+                for object_key in scan_result[0]:
+                    database_definitions.setdefault(object_key, set()).add(sql_release_full_path)
+
+        ordered_copy_jobs = OrderedDict()
+        deployment_batches = OrderedDict()
+        for sql_release_full_path, release_scripts in release_file_scripts.items():
+            self.check_release_file_order(
+                sql_release_full_path=sql_release_full_path,
+                release_scripts=release_scripts,
+                database_definitions=object_definitions.get(os.path.dirname(sql_release_full_path), {})
+            )
+            script_order, script_levels = self.order_release_file(sql_release_full_path=sql_release_full_path,
+                                                                  release_scripts=release_scripts)
+            ordered_copy_jobs[sql_release_full_path] = [release_scripts[script_index][0] for script_index in script_order]
+
+            batches = []
+            for script_index in script_order:
+                sql_file_path, scan_result = release_scripts[script_index]
+                while len(batches) <= script_levels[script_index]:
+                    batches.append([])
+                batches[script_levels[script_index]].append({
+                    'source': sql_file_path,
+                    'objects': sorted(scan_result[0]) if scan_result else None
+                })
+            deployment_batches[sql_release_full_path] = batches
+        return ordered_copy_jobs, deployment_batches
+
+    def order_release_file(self, sql_release_full_path:str, release_scripts:list) -> tuple:
+        """
+        Order the scripts of one release file so every script comes after the scripts defining what it references
+        and the scripts dropping what it defines, keeping the input order where the graph allows, or keep the input
+        order without reorder. Returns the script indexes in order and the batch level of
+        each script. Scripts that were not scanned keep their input position and are deployed alone, splitting the
+        release file into segments ordered one after the other.
+        """
+        script_order = []
+        script_levels = [0] * len(release_scripts)
+        segment = []
+        next_level = 0
+        # A final unscanned entry closes the last segment
+        for script_index, (_, scan_result) in enumerate(release_scripts + [(None, None)]):
+            if scan_result is not None:
+                segment.append(script_index)
+                continue
+            next_level = self.order_segment(sql_release_full_path=sql_release_full_path, release_scripts=release_scripts,
+                                            segment=segment, first_level=next_level, script_order=script_order,
+                                            script_levels=script_levels)
+            segment = []
+            if script_index < len(release_scripts):
+                script_order.append(script_index)
+                script_levels[script_index] = next_level
+                next_level += 1
+
+        # References that cross an unscanned script, close a cycle or keep their input order still run before their
+        # definition, as do definitions before a drop of the object
+        order_positions = {script_index: position for position, script_index in enumerate(script_order)}
+        definers = {}
+        for script_index, (_, scan_result) in enumerate(release_scripts):
+            for object_key in (scan_result[0] if scan_result else ()):
+                definers.setdefault(object_key, []).append(order_positions[script_index])
+        for script_index in script_order:
+            sql_file_path, scan_result = release_scripts[script_index]
+            for object_key in sorted(scan_result[1] if scan_result else ()):
+                if min(definers.get(object_key, [-1])) > order_positions[script_index]:
+                    self.warn(sql_release_full_path=sql_release_full_path,
+                              message=f"{sql_file_path} references {object_key}, which is only defined after it in {sql_release_full_path}")
+            for object_key in sorted(scan_result[2] if scan_result else ()):
+                if any(position < order_positions[script_index] for position in definers.get(object_key, ())):
+                    self.warn(sql_release_full_path=sql_release_full_path,
+                              message=f"{sql_file_path} drops {object_key}, which is defined before it in {sql_release_full_path}")
+        return script_order, script_levels
+
+    def order_segment(self, sql_release_full_path:str, release_scripts:list, segment:list, first_level:int,
+                      script_order:list, script_levels:list) -> int:
+        """
+        Order the scanned scripts between two unscanned ones with Kahn's algorithm, taking the earliest script in
+        input order among the ready ones, and give them batch levels from first_level. Scripts in a dependency cycle
+        keep their input order and are deployed one at a time. Without reorder, the scripts keep their input order and
+        only dependencies on earlier scripts raise their level. Returns the level after the segment.
+        """
+        definers = {}
+        droppers = {}
+        for script_index in segment:
+            for object_key in release_scripts[script_index][1][0]:
+                definers.setdefault(object_key, []).append(script_index)
+            for object_key in release_scripts[script_index][1][2]:
+                droppers.setdefault(object_key, []).append(script_index)
+
+        segment_dependencies = {}
+        for script_index in segment:
+            defined_objects, referenced_objects, _ = release_scripts[script_index][1]
+            script_dependencies = set()
+            for object_key in referenced_objects:
+                script_dependencies.update(definers.get(object_key, ()))
+            for object_key in defined_objects:
+                script_dependencies.update(droppers.get(object_key, ()))
+            script_dependencies.discard(script_index)
+            segment_dependencies[script_index] = script_dependencies
+
+        if not self.reorder:
+            segment_levels = {}
+            for script_index in segment:
+                segment_levels[script_index] = max(
+                    (segment_levels[dependency_index] + 1 for dependency_index in segment_dependencies[script_index]
+                     if dependency_index < script_index),
+                    default=first_level
+                )
+            script_order.extend(segment)
+            for script_index in segment:
+                script_levels[script_index] = segment_levels[script_index]
+            return max((level + 1 for level in segment_levels.values()), default=first_level)
+
+        dependents = {script_index: [] for script_index in segment}
+        pending_counts = {}
+        for script_index in segment:
+            script_dependencies = segment_dependencies[script_index]
+            pending_counts[script_index] = len(script_dependencies)
+            for dependency_index in script_dependencies:
+                dependents[dependency_index].append(script_index)
+        ready_scripts = [script_index for script_index in segment if not pending_counts[script_index]]
+        heapq.heapify(ready_scripts)
+
+        ordered_indexes = []
+        segment_levels = {script_index: first_level for script_index in segment}
+        while ready_scripts:
+            script_index = heapq.heappop(ready_scripts)
+            ordered_indexes.append(script_index)
+            for dependent_index in dependents[script_index]:
+                segment_levels[dependent_index] = max(segment_levels[dependent_index], segment_levels[script_index] + 1)
+                pending_counts[dependent_index] -= 1
+                if not pending_counts[dependent_index]:
+                    heapq.heappush(ready_scripts, dependent_index)
+
+        next_level = max((segment_levels[script_index] + 1 for script_index in ordered_indexes), default=first_level)
+        if len(ordered_indexes) < len(segment):
+            ordered_set = set(ordered_indexes)
+            cycle_indexes = [script_index for script_index in segment if script_index not in ordered_set]
+            self.warn(sql_release_full_path=sql_release_full_path,
+                      message=f"Dependency cycle in {sql_release_full_path} between "
+                              f"{[release_scripts[script_index][0] for script_index in cycle_indexes]}, keeping their input order")
+            for script_index in cycle_indexes:
+                ordered_indexes.append(script_index)
+                segment_levels[script_index] = next_level
+                next_level += 1
+
+        script_order.extend(ordered_indexes)
+        for script_index in ordered_indexes:
+            script_levels[script_index] = segment_levels[script_index]
+        return next_level
+
+    def check_release_file_order(self, sql_release_full_path:str, release_scripts:list, database_definitions:dict) -> None:
+        """
+        Warn about scripts referencing objects only defined in a later release file, which deploys after them.
+        """
+        release_file_index = self.release_file_order.get(os.path.basename(sql_release_full_path))
+        if release_file_index is None:
+            return
+        for sql_file_path, scan_result in release_scripts:
+            if not scan_result:
+                continue
+            for object_key in sorted(scan_result[1]):
+                defining_indexes = [
+                    self.release_file_order.get(os.path.basename(defining_release_file), -1)
+                    for defining_release_file in database_definitions.get(object_key, ())
+                ]
+                if defining_indexes and min(defining_indexes) > release_file_index:
+                    self.warn(sql_release_full_path=sql_release_full_path,
+                              message=f"{sql_file_path} references {object_key}, which is only defined in a later release file")
+
+    def warn(self, sql_release_full_path:str, message:str) -> None:
+        """
+        Log a warning and keep it with its release file for the deployment plan.
+        """
+        logger.warning(message)
+        self.warnings.setdefault(sql_release_full_path, []).append(message)
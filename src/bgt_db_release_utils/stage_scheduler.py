@@ -0,0 +1,88 @@
+import logging
+from collections import OrderedDict
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from .exceptions import ReleaseInputError, ReleaseStageError
+
+logger = logging.getLogger(__name__)
+
+class StageScheduler():
+    """
+    Runs the release stages as a task graph. A stage starts as soon as all the stages it depends on
+    have succeeded, so independent stages run concurrently.
+    """
+    def __init__(self, max_workers:int, build_metrics=None):
+        """
+        Initialize the StageScheduler class.
+        """
+        self.max_workers = max(1, max_workers)
+        self.build_metrics = build_metrics
+        # Stage name -> (stage function, names of the stages it depends on), in declaration order
+        self.stages = OrderedDict()
+
+    def add_stage(self, stage_name:str, stage_function, depends_on=()) -> None:
+        """
+        Declare a stage. Dependencies must be declared first, which keeps the graph free of cycles.
+        """
+        if stage_name in self.stages:
+            raise ValueError(f"Stage {stage_name} is already declared.")
+        unknown_stages = [dependency for dependency in depends_on if dependency not in self.stages]
+        if unknown_stages:
+            raise ValueError(f"Stage {stage_name} depends on undeclared stages: {unknown_stages}")
+        self.stages[stage_name] = (stage_function, tuple(depends_on))
+
+    def ordered_stages(self) -> list:
+        """
+        Return (stage name, stage function) pairs in declaration order, a valid order to run them one by one.
+        """
+        return [(stage_name, stage_function) for stage_name, (stage_function, _) in self.stages.items()]
+
+    def run_stage(self, stage_name:str, stage_function) -> None:
+        """
+        Run one stage, timed in the build metrics when they are collected.
+        """
+        stage_timer = self.build_metrics.stage(stage_name) if self.build_metrics else nullcontext()
+        with stage_timer:
+            logger.info(f"Starting stage {stage_name}")
+            stage_function()
+
+    def run(self) -> None:
+        """
+        Run every stage. After the first failure no further stage is started, the running ones are waited for,
+        and the error of the failed stage is raised: input and stage errors as they are, others wrapped in a
+        ReleaseStageError.
+        """
+        pending_dependencies = {stage_name: set(depends_on) for stage_name, (_, depends_on) in self.stages.items()}
+        running_stages = {}
+        failed_stages = []
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='release_stage') as executor:
+            def start_ready_stages():
+                for stage_name in [name for name, dependencies in pending_dependencies.items() if not dependencies]:
+                    del pending_dependencies[stage_name]
+                    stage_function = self.stages[stage_name][0]
+                    running_stages[executor.submit(self.run_stage, stage_name, stage_function)] = stage_name
+
+            start_ready_stages()
+            while running_stages:
+                done_stages, _ = wait(running_stages, return_when=FIRST_COMPLETED)
+                for stage_future in done_stages:
+                    stage_name = running_stages.pop(stage_future)
+                    stage_error = stage_future.exception()
+                    if stage_error:
+                        logger.error(f"Stage {stage_name} failed: {stage_error}")
+                        failed_stages.append((stage_name, stage_error))
+                        continue
+                    for dependencies in pending_dependencies.values():
+                        dependencies.discard(stage_name)
+
+                if not failed_stages:
+                    start_ready_stages()
+
+        if failed_stages:
+            if pending_dependencies:
+                logger.error(f"Stages not run after the failure of {failed_stages[0][0]}: {list(pending_dependencies)}")
+            stage_name, stage_error = failed_stages[0]
+            if isinstance(stage_error, (ReleaseInputError, ReleaseStageError)):
+                raise stage_error
+            raise ReleaseStageError(stage_name=stage_name, stage_error=stage_error) from stage_error
@@ -0,0 +1,86 @@
+import re
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Placeholders found in the templates and the render context value each one is replaced with
+DEFAULT_TEMPLATE_PLACEHOLDERS = {
+    'title_based_on_script': 'sql_release_file_name',
+    'strdatetime': 'build_datetime',
+    'deployment_db_name': 'release_db_name',
+    'old_version': 'old_version',
+    'new_version': 'new_version',
+}
+
+DEFAULT_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+class TemplateEngine():
+    """
+    Replaces every template placeholder in a single scan of the content.
+    """
+    def __init__(self, placeholders=None, extra_values=None, datetime_format=DEFAULT_DATETIME_FORMAT, release_number=None):
+        """
+        Initialize the TemplateEngine class.
+        placeholders maps placeholder text to a render context key, extra_values maps additional
+        placeholder text to a fixed replacement.
+        """
+        self.placeholders = dict(placeholders or DEFAULT_TEMPLATE_PLACEHOLDERS)
+        self.extra_values = dict(extra_values or {})
+
+        # Build wide values, computed once per run
+        self.base_context = {
+            'build_datetime': datetime.now().strftime(datetime_format),
+            'release_number': release_number,
+        }
+
+        # Longest placeholders first so a placeholder that prefixes another one never shadows it
+        placeholder_names = sorted(set(self.placeholders) | set(self.extra_values), key=len, reverse=True)
+        self.placeholder_pattern = re.compile('|'.join(re.escape(name) for name in placeholder_names))
+
+    def signature(self) -> dict:
+        """
+        Describe the placeholder configuration, so incremental builds notice when it changes.
+        The release number is part of it when a placeholder is replaced with it. The build time is not: release files
+        kept by an incremental build or restored from the artifact cache keep the header timestamp of the build that
+        rendered them.
+        """
+        template_signature = {'placeholders': self.placeholders, 'extra_values': self.extra_values}
+        if 'release_number' in self.placeholders.values():
+            template_signature['release_number'] = self.base_context['release_number']
+        return template_signature
+
+    def build_context(self, release_db_name=None, db_version_tuple=None, sql_release_file_name=None) -> dict:
+        """
+        Build the placeholder replacements for one release file. Placeholders without a value
+        are left untouched, as for bash and permission templates that have no title.
+        """
+        context_values = dict(self.base_context)
+        if release_db_name is not None:
+            context_values['release_db_name'] = release_db_name
+        if db_version_tuple is not None:
+            old_version, new_version = db_version_tuple
+            context_values['old_version'] = f"'{old_version}'"
+            context_values['new_version'] = f"'{new_version}'"
+        if sql_release_file_name is not None:
+            context_values['sql_release_file_name'] = sql_release_file_name
+        else:
+            # Timestamps are only stamped into SQL release file headers
+            context_values.pop('build_datetime')
+
+        render_context = {
+            placeholder: context_values[context_key]
+            for placeholder, context_key in self.placeholders.items()
+            if context_values.get(context_key) is not None
+        }
+        render_context.update(self.extra_values)
+        return render_context
+
+    def render(self, file_content:str, render_context:dict) -> str:
+        """
+        Replace all placeholders in one pass over the content.
+        """
+        return self.placeholder_pattern.sub(
+            lambda match: render_context.get(match.group(0), match.group(0)),
+            file_content
+        )
@@ -0,0 +1,161 @@
+import os
+import json
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+class CompiledTemplate():
+    """
+    A template split into literal text segments and the placeholder slots between them.
+    """
+    def __init__(self, literals, slots):
+        """
+        Initialize the CompiledTemplate class. There is always one more literal than slots.
+        """
+        self.literals = literals
+        self.slots = slots
+
+    def render(self, render_context:dict) -> str:
+        """
+        Fill the placeholder slots from the render context. Placeholders without a value are kept as is.
+        """
+        rendered_parts = [self.literals[0]]
+        for slot, literal in zip(self.slots, self.literals[1:]):
+            rendered_parts.append(render_context.get(slot, slot))
+            rendered_parts.append(literal)
+        return ''.join(rendered_parts)
+
+class TemplateRegistry():
+    """
+    Loads and compiles each template once and keeps it for every database and release file of the run.
+    """
+    PACK_FORMAT_VERSION = 1
+
+    def __init__(self, file_manager):
+        """
+        Initialize the TemplateRegistry class.
+        """
+        self.file_manager = file_manager
+        self.template_engine = file_manager.template_engine
+        self.compiled_templates = {}
+        # Template path -> (size, mtime) of the file each compiled template was made from
+        self.template_stats = {}
+        self.packed_templates = {}
+        self.lock = threading.Lock()
+
+    def compile_template(self, file_content:str) -> CompiledTemplate:
+        """
+        Split template content on the placeholders known to the template engine.
+        """
+        literals = []
+        slots = []
+        literal_start = 0
+        for match in self.template_engine.placeholder_pattern.finditer(file_content):
+            literals.append(file_content[literal_start:match.start()])
+            slots.append(match.group(0))
+            literal_start = match.end()
+        literals.append(file_content[literal_start:])
+        return CompiledTemplate(literals=literals, slots=slots)
+
+    def get_template(self, template_path:str) -> CompiledTemplate:
+        """
+        Return the compiled template, loading it from the template pack or from disk on first use,
+        or again when the template file changed since, as a registry kept by a long running process can see.
+        """
+        with self.lock:
+            template_stat = self.template_stat(template_path=template_path)
+            compiled_template = self.compiled_templates.get(template_path)
+            if compiled_template and self.template_stats.get(template_path) == template_stat:
+                return compiled_template
+
+            compiled_template = self.get_packed_template(template_path=template_path)
+            if not compiled_template:
+                file_content = self.file_manager.read_file_content(file_path=template_path)
+                compiled_template = self.compile_template(file_content=file_content)
+                logger.info(f"Compiled template {template_path} with {len(compiled_template.slots)} placeholders")
+
+            self.compiled_templates[template_path] = compiled_template
+            self.template_stats[template_path] = template_stat
+            return compiled_template
+
+    def template_stat(self, template_path:str) -> tuple:
+        """
+        Return the size and modification time of a template file, None when it cannot be read.
+        """
+        try:
+            template_stat = os.stat(template_path)
+        except OSError:
+            return None
+        return template_stat.st_size, template_stat.st_mtime_ns
+
+    def get_packed_template(self, template_path:str) -> CompiledTemplate:
+        """
+        Return a template from the loaded pack if the template file has not changed since the pack was built.
+        """
+        packed_template = self.packed_templates.get(template_path)
+        if not packed_template:
+            return None
+
+        try:
+            template_stat = os.stat(template_path)
+        except OSError:
+            return None
+        if template_stat.st_size != packed_template['size'] or template_stat.st_mtime_ns != packed_template['mtime_ns']:
+            logger.info(f"Template {template_path} changed since the template pack was built.")
+            return None
+
+        logger.info(f"Loaded template {template_path} from the template pack")
+        return CompiledTemplate(literals=packed_template['literals'], slots=packed_template['slots'])
+
+    def load_pack(self, pack_path:str) -> None:
+        """
+        Load precompiled templates from a template pack. A missing or outdated pack is ignored.
+        """
+        try:
+            with open(pack_path, 'r', encoding='utf-8') as rf:
+                pack_data = json.load(rf)
+
+            if pack_data.get('version') != self.PACK_FORMAT_VERSION \
+                or pack_data.get('engine') != self.template_engine.signature():
+                    logger.info(f"Ignoring template pack {pack_path} built with different placeholders.")
+                    return
+
+            with self.lock:
+                self.packed_templates = pack_data.get('templates', {})
+            logger.info(f"Loaded template pack {pack_path} with {len(self.packed_templates)} templates")
+
+        except FileNotFoundError:
+            logger.info(f"No template pack found at {pack_path}")
+        except Exception as e:
+            logger.warning(f"Failed to load template pack {pack_path}: {e}")
+
+    def save_pack(self, pack_path:str, template_paths) -> None:
+        """
+        Compile the given templates and write them to a template pack.
+        """
+        packed_templates = {}
+        for template_path in template_paths:
+            compiled_template = self.get_template(template_path=template_path)
+            template_stat = os.stat(template_path)
+            packed_templates[template_path] = {
+                'size': template_stat.st_size,
+                'mtime_ns': template_stat.st_mtime_ns,
+                'literals': compiled_template.literals,
+                'slots': compiled_template.slots
+            }
+
+        pack_data = {
+            'version': self.PACK_FORMAT_VERSION,
+            'engine': self.template_engine.signature(),
+            'templates': packed_templates
+        }
+        pack_dir = os.path.dirname(pack_path) or '.'
+        fd, temp_path = tempfile.mkstemp(dir=pack_dir, prefix='.template_pack.')
+        with os.fdopen(fd, 'w', encoding='utf-8') as wf:
+            json.dump(pack_data, wf)
+        # The pack ships in the image and is read by whichever user runs the build
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, pack_path)
+        logger.info(f"Saved template pack {pack_path} with {len(packed_templates)} templates")
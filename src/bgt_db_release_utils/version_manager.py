@@ -1,20 +1,24 @@
 import os
-import sys
 import re
 import logging
+from .exceptions import ReleaseInputError
 
 logger = logging.getLogger(__name__)
 
 class VersionManager():
-    def __init__(self, files_changed_with_tags, agt_file_data, awb_file_data):
+    def __init__(self, files_changed_with_tags, version_files_data:dict, release_databases, release_ledger=None):
         self.files_changed_with_tags = files_changed_with_tags
-        self.agt_file_data = agt_file_data
-        self.awb_file_data = awb_file_data
+        # Database key -> content of its version file, None when the versions come from the input tags
+        self.version_files_data = version_files_data or {}
+        # Databases of the release, each with its key and the prefix of its version in the tags
+        self.release_databases = release_databases
+        # Previous versions missing from the version files are taken from the builds recorded in the ledger
+        self.release_ledger = release_ledger
     
     def fetch_db_versions(self) -> dict:
         db_versions = {}
         
-        if self.agt_file_data and self.awb_file_data:
+        if self.version_files_data and all(self.version_files_data.values()):
             db_versions = self.fetch_versions_from_file()
             logger.info(f"inside fetch_db_versions{db_versions}")
         else:
@@ -25,26 +29,31 @@ class VersionManager():
     def fetch_versions_from_input(self) -> dict:
         db_versions = {}
 
-        # Extrace previous and current versions from input string
+        # Extrace previous and current versions from input string, e.g. AGT_1.0.15-b1_and_AWB_1.0.15-b1
         previous_version, current_version = self.files_changed_with_tags[-2:]
         try:
-            # Extract AGT and AWB old and new versions
             split_previous_version = previous_version.split('_and_')
-            agt_old_version = split_previous_version[0].split('AGT_',1)[1]
-            awb_old_version = split_previous_version[1].split('AWB_', 1)[1]
-                
             split_current_version = current_version.split('_and_')
-            agt_new_version = split_current_version[0].split('AGT_', 1)[1].replace('-b', '-B')
-            awb_new_version = split_current_version[1].split('AWB_', 1)[1].replace('-b', '-B')     
-                
-            db_versions['agt'] = (agt_old_version, agt_new_version)
-            db_versions['awb'] = (awb_old_version, awb_new_version)       
+            for release_database in self.release_databases:
+                # Extract the old and new versions of each database from the part with its prefix
+                tag_prefix = f"{release_database['tag_prefix']}_"
+                old_version = self.tag_version(tag_parts=split_previous_version, tag_prefix=tag_prefix)
+                new_version = self.tag_version(tag_parts=split_current_version, tag_prefix=tag_prefix).replace('-b', '-B')
+                db_versions[release_database['key']] = (old_version, new_version)
 
             return db_versions
         
         except Exception as e:
-            logger.error(f"Error parsing versions from input: {e}")
-            sys.exit(1)
+            raise ReleaseInputError(f"Error parsing versions from input: {e}") from e
+
+    def tag_version(self, tag_parts:list, tag_prefix:str) -> str:
+        """
+        Return the version following tag_prefix in the parts of a release tag.
+        """
+        for tag_part in tag_parts:
+            if tag_prefix in tag_part:
+                return tag_part.split(tag_prefix, 1)[1]
+        raise ValueError(f"No {tag_prefix} version in {'_and_'.join(tag_parts)}")
     
     def parse_db_version_from_file(self, file_data:str) -> tuple:
         new_version_pattern = r"new_version=(.+)"
@@ -54,6 +63,7 @@ class VersionManager():
             # Search for new and old versions using regular expressions
             new_version_match = re.search(new_version_pattern,file_data)
             old_version_match = re.search(old_version_pattern,file_data)
+            old_version = None
             
             # Extract new and old version if available
             if new_version_match:
@@ -66,14 +76,34 @@ class VersionManager():
         
         except Exception as e:
             logger.error(f"Error reading version information: {e}")
-            
+            raise ReleaseInputError(f"Error reading version information: {e}") from e
+
     def fetch_versions_from_file(self) -> dict:
         try:
             db_versions = {}
-            db_versions['agt'] = self.parse_db_version_from_file(file_data=self.agt_file_data)
-            db_versions['awb'] = self.parse_db_version_from_file(file_data=self.awb_file_data)
+            for db_name, file_data in self.version_files_data.items():
+                db_versions[db_name] = self.parse_db_version_from_file(file_data=file_data)
+            for db_name, (old_version, new_version) in db_versions.items():
+                if not old_version:
+                    db_versions[db_name] = (self.fetch_previous_version(db_name=db_name, new_version=new_version), new_version)
             logger.info(f"inside fetch_versions_from_file{db_versions}")
             return db_versions            
         
         except Exception as e:
-            logger.error(f"Error parsing versions: {e}")
\ No newline at end of file
+            logger.error(f"Error parsing versions: {e}")
+            raise
+
+    def fetch_previous_version(self, db_name:str, new_version:str) -> str:
+        """
+        Look up the version released before new_version in the release ledger, for a version file without old_version.
+        """
+        previous_version = None
+        if self.release_ledger:
+            try:
+                previous_version = self.release_ledger.previous_version(database=db_name, version=new_version)
+            except Exception as e:
+                logger.warning(f"Unable to read the previous {db_name} version from the release ledger: {e}")
+        if not previous_version:
+            raise ReleaseInputError(f"No old_version for {db_name} in its version file or in the release ledger")
+        logger.info(f"Previous {db_name} version {previous_version} taken from the release ledger")
+        return previous_version
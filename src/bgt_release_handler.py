@@ -1,10 +1,15 @@
 import os
-import sys
 import logging
 from bgt_db_release_utils import (
         VersionManager,
         FilesManager,
-        ReleaseResourceManager
+        ReleaseResourceManager,
+        BuildManifest,
+        BuildJournal,
+        TemplateRegistry,
+        ChecksumManifest,
+        FileSystemOutputBackend,
+        ReleaseInputError
     )
 
 logger = logging.getLogger(__name__)
@@ -13,9 +18,12 @@ class BGTReleaseHandler():
     """
     A handler class for managing BGT database release processes.
     """
-    def __init__(self, files_changed_with_tags, release_number):
+    def __init__(self, files_changed_with_tags, release_number, encoding_cache=None, template_engine=None, template_registry=None,
+                 build_metrics=None, source_reader=None, output_backend=None, release_ledger=None,
+                 artifact_cache=None, build_settings=None):
         """
         Initialize the release handler with file changes and release details.
+        build_settings are the settings that change the release files, part of the fingerprint of each of them.
         """
         self.files_changed_with_tags = files_changed_with_tags
         self.release_number = release_number
@@ -27,16 +35,34 @@ class BGTReleaseHandler():
         self.release_dirs_with_db_name = None
         
         # Initialize utility managers
-        self.file_manager = FilesManager()
+        self.file_manager = FilesManager(encoding_cache=encoding_cache, template_engine=template_engine,
+                                         build_metrics=build_metrics, source_reader=source_reader,
+                                         output_backend=output_backend)
+        self.template_registry = template_registry or TemplateRegistry(file_manager=self.file_manager)
         self.version_manager = None 
         self.release_manager = None
+        self.build_manifest = None
+        self.build_journal = None
+        self.release_ledger = release_ledger
+        self.artifact_cache = artifact_cache
+        self.build_settings = build_settings or []
+        self.checksum_manifest = None
+        self.release_databases = None
     
+    def list_source_changes(self, file_suffixes) -> None:
+        """
+        Take the changed files, and the version tags when the refs are release tags, from the git source
+        instead of the command line.
+        """
+        source_reader = self.file_manager.source_reader
+        self.files_changed_with_tags = source_reader.list_changed_files(file_suffixes=file_suffixes) + source_reader.version_tags()
+
     def check_version_in_input(self) -> bool:
         """
         Check if version information exists in the input. If not, prepare to process file paths.
         """
-        if len(self.files_changed_with_tags) > 2 and not os.path.isfile(self.files_changed_with_tags[-2])\
-            and not os.path.isfile(self.files_changed_with_tags[-1]):
+        if len(self.files_changed_with_tags) > 2 and not self.file_manager.source_exists(self.files_changed_with_tags[-2])\
+            and not self.file_manager.source_exists(self.files_changed_with_tags[-1]):
                  # Exclude last two inputs as they are assumed to be version strings
                 self.sql_file_changed_paths = self.files_changed_with_tags[:-2] 
                 return True
@@ -45,26 +71,41 @@ class BGTReleaseHandler():
                 self.sql_file_changed_paths = self.files_changed_with_tags
                 return False
             
-    def get_versions_file_data(self, version_file_paths:dict) -> tuple:
+    def set_release_databases(self, release_databases) -> None:
+        """
+        Set the databases of the release, each with its key, version tag prefix, source and release directories.
         """
-        Retrieve content from version files.
+        self.release_databases = release_databases
+        self.file_manager.set_release_db_keys(release_db_keys={
+            release_database['release_dir']: release_database['key'] for release_database in release_databases
+        })
+
+    def get_versions_file_data(self, version_file_paths:dict) -> dict:
+        """
+        Retrieve content from version files, by database key.
         """
-        agt_file_data = self.file_manager.read_file_content(file_path=version_file_paths['agt'])
-        awb_file_data = self.file_manager.read_file_content(file_path=version_file_paths['awb']) 
+        versions_file_data = {}
+        for db_name, version_file_path in version_file_paths.items():
+            if self.file_manager.source_reader:
+                # Version files are read from the same ref as the changed files
+                versions_file_data[db_name] = self.file_manager.read_source_content(source_file_path=version_file_path)
+            else:
+                versions_file_data[db_name] = self.file_manager.read_file_content(file_path=version_file_path)
         
-        if agt_file_data and awb_file_data:
-            return agt_file_data, awb_file_data
-        else:
-            sys.exit(1)
+        missing_db_names = [db_name for db_name, file_data in versions_file_data.items() if not file_data]
+        if missing_db_names:
+            raise ReleaseInputError(f"Failed to read the version files of {', '.join(missing_db_names)}.")
+        return versions_file_data
     
-    def initialize_version_manager(self, agt_file_data:str, awb_file_data:str) -> None:
+    def initialize_version_manager(self, version_files_data:dict) -> None:
         """
-        Initialize the VersionManager with AGT and AWB data.
+        Initialize the VersionManager with the version files of the databases, None to use the input tags.
         """
         self.version_manager = VersionManager(
                 files_changed_with_tags=self.files_changed_with_tags,
-                agt_file_data=agt_file_data,
-                awb_file_data=awb_file_data
+                version_files_data=version_files_data,
+                release_databases=self.release_databases,
+                release_ledger=self.release_ledger
             )
     
     def get_db_versions(self) -> dict: 
@@ -76,8 +117,7 @@ class BGTReleaseHandler():
         if db_versions_dict:
             return db_versions_dict
         else:
-            logger.error("No database versions found.")
-            sys.exit(1)
+            raise ReleaseInputError("No database versions found.")
 
     def set_db_versions_dict(self, db_versions_dict) -> None:
         """
@@ -85,18 +125,17 @@ class BGTReleaseHandler():
         """
         self.db_versions_dict = db_versions_dict
     
-    def generate_awb_agt_release_file_path(self, release_dir_name:str) -> str:
+    def generate_release_bundle_path(self, release_dir_name:str, bundle_name:str) -> str:
         """
-        Generate a path for the AWB and AGT release file.
+        Generate the path of the release bundle, bundle_name being formatted with the new version of every database.
         """
-        agt_new_version = self.db_versions_dict['agt'][1]
-        awb_new_version = self.db_versions_dict['awb'][1]           
-        
-        # Generate the file path
-        awb_agt_release_file_name =  f"AWB_{awb_new_version}_AGT_{agt_new_version}"
-        awb_agt_release_file_path = os.path.join(release_dir_name, awb_agt_release_file_name)
+        new_versions = {db_name: db_versions[1] for db_name, db_versions in self.db_versions_dict.items()}
+        try:
+            release_bundle_name = bundle_name.format(**new_versions)
+        except KeyError as e:
+            raise ReleaseInputError(f"No version of {e} for the release bundle name {bundle_name}") from e
         
-        return awb_agt_release_file_path
+        return os.path.join(release_dir_name, release_bundle_name)
     
     def initialize_release_path_and_resource_manager(self, awb_agt_release_file_path:str) -> None:
         """
@@ -109,10 +148,80 @@ class BGTReleaseHandler():
                     file_manager_ref=self.file_manager,
                     bgt_release_handler_ref=self
                 )
+            if self.artifact_cache:
+                self.release_resource_manager.set_artifact_cache(artifact_cache=self.artifact_cache)
         else:
-            logger.error("Failed to initialize the release path.")
-            sys.exit(1)
+            raise ReleaseInputError("Failed to initialize the release path.")
         
+    def initialize_build_manifest(self, build_journal:bool=False) -> None:
+        """
+        Load the manifest of the previous build of this bundle to enable incremental builds.
+        With build_journal, the progress of the build is journaled next to the bundle and the work an interrupted
+        build journaled is resumed. Without it, the journal of an interrupted build is discarded, the release files
+        may have been written since.
+        """
+        self.build_manifest = BuildManifest(manifest_path=f"{self.awb_agt_release_file_path}.manifest.json")
+        self.build_manifest.load()
+        self.build_manifest.set_build_info(release_number=self.release_number, db_versions=self.db_versions_dict)
+        self.release_resource_manager.set_build_manifest(build_manifest=self.build_manifest)
+
+        self.build_journal = BuildJournal(journal_path=f"{self.awb_agt_release_file_path}.journal")
+        if not build_journal:
+            self.build_journal.remove()
+            self.build_journal = None
+            return
+        self.build_journal.load()
+        self.release_resource_manager.set_build_journal(build_journal=self.build_journal)
+
+    def save_build_manifest(self) -> None:
+        """
+        Save the manifest of a completed build next to the release bundle, it replaces the journal of the build.
+        """
+        if self.build_manifest:
+            self.build_manifest.save()
+        if self.build_journal:
+            self.build_journal.remove()
+
+    def initialize_checksum_manifest(self, manifest_file_name:str, algorithms) -> None:
+        """
+        Digest the files of the release bundle as they are written, for the checksum manifest written at its root.
+        """
+        self.checksum_manifest = ChecksumManifest(bundle_path=self.awb_agt_release_file_path, manifest_file_name=manifest_file_name,
+                                                  algorithms=algorithms)
+        self.file_manager.set_checksum_manifest(checksum_manifest=self.checksum_manifest)
+
+    def write_checksum_manifest(self) -> None:
+        """
+        Write the checksum manifest once every other file of the bundle is complete. A release directory may hold
+        files this build left in place, they are added with the digests the build manifest recorded for them.
+        """
+        if isinstance(self.file_manager.output_backend, FileSystemOutputBackend):
+            self.checksum_manifest.add_existing_files(build_manifest=self.build_manifest)
+            self.file_manager.count(counter_name='checksum_manifest_files_hashed', amount=self.checksum_manifest.hashed_count)
+        self.file_manager.write_file_content(
+            file_path=os.path.join(self.awb_agt_release_file_path, self.checksum_manifest.manifest_file_name),
+            file_content=self.checksum_manifest.to_json()
+        )
+        if self.build_manifest:
+            self.checksum_manifest.record_bundle_files(build_manifest=self.build_manifest)
+
+    def store_cached_artifacts(self) -> None:
+        """
+        Store the release files built from scratch in the artifact cache, for later builds from the same inputs.
+        """
+        self.release_resource_manager.store_cached_artifacts()
+
+    def record_release_ledger(self) -> None:
+        """
+        Record the completed build, its versions and its inputs, in the release ledger.
+        """
+        self.release_ledger.record_build(
+            release_number=self.release_number,
+            release_path=self.awb_agt_release_file_path,
+            db_versions=self.db_versions_dict,
+            build_inputs=self.release_resource_manager.ledger_build_inputs()
+        )
+
     def create_empty_release_directories(self, release_db_dir_names:str) -> str:
         """
         Create empty directories for release.
@@ -123,8 +232,7 @@ class BGTReleaseHandler():
         if release_directories:
             return release_directories
         else:
-            logger.error("Failed to create release directories.")
-            sys.exit(1)
+            raise ReleaseInputError("Failed to create release directories.")
     
     def set_release_dirs_with_db_name(self, release_dirs_with_db_name:str) -> str:
         """
@@ -132,6 +240,15 @@ class BGTReleaseHandler():
         """
         self.release_dirs_with_db_name = release_dirs_with_db_name
         
+    def plan_sql_release_file_copies(self, release_file_mapping) -> None:
+        """
+        Work out which release file each changed SQL file is copied into.
+        """
+        self.release_resource_manager.plan_sql_copy_jobs(
+            sql_file_changed_paths=self.sql_file_changed_paths,
+            release_file_mapping=release_file_mapping
+        )
+
     def file_replacements(self, file_content:str, release_db_file_path:str, sql_release_file_name:str) -> str:
         """
         Apply replacements to file content.
@@ -143,6 +260,24 @@ class BGTReleaseHandler():
                 sql_release_file_name=sql_release_file_name
             )
 
+
+    def render_template(self, template_path:str, release_db_file_path:str, sql_release_file_name:str) -> str:
+        """
+        Render a compiled template for a release file of a database.
+        """
+        compiled_template = self.template_registry.get_template(template_path=template_path)
+        render_context = self.file_manager.build_render_context(
+                db_versions_dict=self.db_versions_dict,
+                release_dir_with_db_name=release_db_file_path,
+                sql_release_file_name=sql_release_file_name
+            )
+        return compiled_template.render(render_context=render_context)
+
+    def load_template_pack(self, template_pack_path:str) -> None:
+        """
+        Load precompiled templates shipped with the image.
+        """
+        self.template_registry.load_pack(pack_path=template_pack_path)
     
     def create_deploy_guide_word_doc(self,deploy_guide_word_path, word_doc_name):
         """
@@ -152,33 +287,73 @@ class BGTReleaseHandler():
                                                                      deploy_guide_word_path=deploy_guide_word_path,
                                                                      word_doc_name=word_doc_name)
     
-    def create_release_bash_permission_files(self, release_template_file_names, release_templeate_path):
+    def create_release_bash_permission_files(self, release_template_file_names, release_templeate_path, release_dir_names=None):
         """
-        Create bash and permission files for the release.
+        Create bash and permission files for the release, in the release directories named in release_dir_names or all of them.
         """
         for release_template_file_name in release_template_file_names:
             release_template_file_path = os.path.join(release_templeate_path,release_template_file_name) 
             self.release_resource_manager.generate_release_bash_and_permission_files(
                     file_path=release_template_file_path,
-                    file_name=release_template_file_name
+                    file_name=release_template_file_name,
+                    release_dir_names=release_dir_names
                 )
             
-    def create_empty_sql_release_files(self, sql_release_files, sql_files_default_headers_path):
+    def create_empty_sql_release_files(self, sql_release_files, sql_files_default_headers_path, release_dir_names=None,
+                                       sql_batch_indexer=None):
         """
-        Create empty SQL release files with headers.
+        Create empty SQL release files with headers, in the release directories named in release_dir_names or all of them.
         """
         self.release_resource_manager.generate_empty_release_sql_files(
             sql_release_files=sql_release_files,
-            sql_files_default_headers_path=sql_files_default_headers_path
+            sql_files_default_headers_path=sql_files_default_headers_path,
+            release_dir_names=release_dir_names,
+            sql_batch_indexer=sql_batch_indexer
         )
         
-    def copy_sql_files_changed_to_release_file(self, release_file_mapping):
+    def detect_sql_file_encodings(self, encoding_prepass) -> None:
+        """
+        Detect the encodings of the planned SQL files ahead of the dedupe and the copy.
+        """
+        sql_file_paths = [
+            sql_file_path
+            for sql_file_paths in self.release_resource_manager.grouped_copy_jobs.values()
+            for sql_file_path in sql_file_paths
+        ]
+        encoding_prepass.run(file_paths=sql_file_paths)
+
+    def dedupe_sql_definitions(self, sql_definition_deduplicator) -> None:
+        """
+        Drop the planned SQL files superseded by a later definition of the same object.
+        """
+        self.release_resource_manager.dedupe_sql_definitions(sql_definition_deduplicator=sql_definition_deduplicator)
+
+    def analyze_sql_dependencies(self, sql_dependency_analyzer, release_dir_names=None) -> None:
         """
-        Copy changed SQL files to the release directory.
+        Order the changed SQL files of each release file by their dependencies.
+        """
+        self.release_resource_manager.analyze_sql_dependencies(sql_dependency_analyzer=sql_dependency_analyzer,
+                                                               release_dir_names=release_dir_names)
+
+    def write_deployment_plan(self, plan_file_name, release_file_order) -> None:
+        """
+        Write the deployment plan of the SQL release files into the release bundle.
+        """
+        self.release_resource_manager.write_deployment_plan(plan_file_name=plan_file_name, release_file_order=release_file_order)
+
+    def copy_sql_files_changed_to_release_file(self, release_file_mapping, max_workers=None, buffer_size=None, inline_max_bytes=None,
+                                               release_dir_names=None, sql_batch_indexer=None):
+        """
+        Copy changed SQL files to the release directory, to the release directories named in release_dir_names or all of them.
         """
         
         self.release_resource_manager.copy_sql_files_to_release_files(
             sql_file_changed_paths=self.sql_file_changed_paths, 
-            release_file_mapping=release_file_mapping
+            release_file_mapping=release_file_mapping,
+            max_workers=max_workers,
+            buffer_size=buffer_size,
+            inline_max_bytes=inline_max_bytes,
+            release_dir_names=release_dir_names,
+            sql_batch_indexer=sql_batch_indexer
         )
     
\ No newline at end of file
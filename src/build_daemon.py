@@ -0,0 +1,202 @@
+import io
+import os
+import sys
+import json
+import signal
+import socket
+import logging
+import importlib
+import argparse
+import socketserver
+import config
+import main
+from bgt_db_release_utils import MemoryOutputBackend, ReleaseBuildError, ReleaseStageError
+from release_builder import ReleaseBuilder
+
+logger = logging.getLogger(__name__)
+
+class BuildRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Reads one build request, a JSON line with the working directory and the main.py arguments,
+    and answers with one JSON line describing the result. Runs in a process forked for the request.
+    """
+    def handle(self):
+        try:
+            build_request = json.loads(self.rfile.readline())
+            build_response = self.server.run_build(
+                working_dir=build_request['working_dir'],
+                arguments=build_request['arguments']
+            )
+        except (ValueError, KeyError, TypeError) as e:
+            build_response = {'status': 'failed', 'error_type': 'InvalidRequest', 'error': f"Invalid build request: {e}"}
+        except OSError as e:
+            # The working directory or its log file is unusable, the client still gets an answer
+            build_response = {'status': 'failed', 'error_type': type(e).__name__, 'error': str(e), 'stage': None}
+        self.wfile.write(json.dumps(build_response).encode('utf-8') + b'\n')
+
+class BuildDaemon(socketserver.ForkingMixIn, socketserver.UnixStreamServer):
+    """
+    Local build service. Every request is built in a process forked from the server, which inherits the imports,
+    the compiled templates and the encoding cache already loaded, and can change to the working directory of the
+    request without affecting the other builds. Requests are served concurrently.
+    """
+    def __init__(self, socket_path:str, release_builder, max_children:int):
+        """
+        Initialize the BuildDaemon class and listen on socket_path, readable by the owner only.
+        """
+        self.release_builder = release_builder
+        self.max_children = max(1, max_children)
+        remove_stale_socket(socket_path=socket_path)
+        os.makedirs(os.path.dirname(os.path.abspath(socket_path)), exist_ok=True)
+        super().__init__(socket_path, BuildRequestHandler)
+        os.chmod(socket_path, 0o600)
+
+    def finish_request(self, request, client_address):
+        """
+        Serve the request in the forked process. The process terminates on SIGTERM instead of exiting like the server.
+        """
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        super().finish_request(request, client_address)
+
+    def service_actions(self):
+        """
+        Between requests, reap finished builds and pick up the encodings they cached.
+        """
+        super().service_actions()
+        self.release_builder.encoding_cache.reload_if_changed()
+
+    def run_build(self, working_dir:str, arguments:list) -> dict:
+        """
+        Run a build in the forked process, with the same arguments and log file as main.py in working_dir.
+        """
+        os.chdir(working_dir)
+        build_log_handler = logging.FileHandler('bgt_release_handler.log', mode='w')
+        build_log_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        logging.getLogger().addHandler(build_log_handler)
+        try:
+            arguments = parse_build_arguments(arguments=arguments)
+        except ValueError as e:
+            return {'status': 'failed', 'error_type': 'InvalidRequest', 'error': str(e)}
+
+        # A dry run keeps the bundle in memory and answers with its manifest
+        dry_run_backend = MemoryOutputBackend() if arguments.dry_run else None
+        try:
+            build_metrics = self.release_builder.build(
+                release_number=arguments.release_number,
+                files_changed_with_tags=arguments.files_changed_with_tags,
+                git_from_ref=arguments.git_from_ref,
+                git_to_ref=arguments.git_to_ref,
+                git_repo_path=arguments.git_repo_path,
+                archive_path=arguments.archive_path,
+                output_backend=dry_run_backend
+            )
+        except ReleaseBuildError as e:
+            return {
+                'status': 'failed',
+                'error_type': type(e).__name__,
+                'error': str(e),
+                'stage': e.stage_name if isinstance(e, ReleaseStageError) else None
+            }
+
+        build_response = {'status': 'succeeded', 'metrics': build_metrics.report()}
+        if dry_run_backend:
+            build_response['manifest'] = dry_run_backend.manifest()
+        return build_response
+
+    def server_close(self):
+        """
+        Stop listening and remove the socket file.
+        """
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+def parse_build_arguments(arguments:list):
+    """
+    Parse the main.py arguments of a build request. Raises ValueError instead of exiting on invalid arguments.
+    """
+    usage_output = io.StringIO()
+    stderr = sys.stderr
+    try:
+        sys.stderr = usage_output
+        return main.parse_arguments(argv=arguments)
+    except SystemExit:
+        raise ValueError(usage_output.getvalue().strip() or "Invalid build arguments")
+    finally:
+        sys.stderr = stderr
+
+def remove_stale_socket(socket_path:str) -> None:
+    """
+    Remove the socket left by a daemon that is no longer running. Raises OSError if a daemon still answers on it.
+    """
+    if not os.path.exists(socket_path):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe_socket:
+        try:
+            probe_socket.connect(socket_path)
+        except OSError:
+            os.unlink(socket_path)
+            return
+    raise OSError(f"A build daemon is already listening on {socket_path}")
+
+def submit_build(socket_path:str, arguments:list, working_dir:str=None) -> dict:
+    """
+    Send a build request to a running daemon and wait for the result.
+    """
+    build_request = {'working_dir': os.path.abspath(working_dir or os.getcwd()), 'arguments': list(arguments)}
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client_socket:
+        client_socket.connect(socket_path)
+        client_socket.sendall(json.dumps(build_request).encode('utf-8') + b'\n')
+        with client_socket.makefile('rb') as response_stream:
+            return json.loads(response_stream.readline())
+
+def serve(socket_path:str, max_children:int) -> None:
+    """
+    Load the build state once and serve build requests until interrupted or terminated.
+    """
+    # Loaded by the server so every build process inherits the import
+    try:
+        importlib.import_module('docx')
+    except ImportError:
+        pass
+    release_builder = ReleaseBuilder()
+    # Stop like on Ctrl+C, so the socket file is removed. The build processes reset it once forked.
+    signal.signal(signal.SIGTERM, lambda signal_number, frame: sys.exit(0))
+    with BuildDaemon(socket_path=socket_path, release_builder=release_builder, max_children=max_children) as build_daemon:
+        logger.info(f"Build daemon listening on {socket_path}")
+        try:
+            build_daemon.serve_forever()
+        except KeyboardInterrupt:
+            logger.info("Build daemon stopped")
+
+if __name__ == '__main__':
+    # python build_daemon.py serve [--socket <path>]
+    # python build_daemon.py submit [--socket <path>] -- <main.py arguments>
+    parser = argparse.ArgumentParser(description="Warm BGT release build daemon.")
+    parser.add_argument('command', choices=['serve', 'submit'])
+    parser.add_argument('--socket', dest='socket_path', default=config.BUILD_DAEMON_SOCKET, help="Unix socket of the daemon")
+    parser.add_argument('build_arguments', nargs=argparse.REMAINDER, help="With submit, the main.py arguments of the build")
+    daemon_arguments = parser.parse_args()
+    build_arguments = daemon_arguments.build_arguments
+    if build_arguments[:1] == ['--']:
+        build_arguments = build_arguments[1:]
+
+    if daemon_arguments.command == 'serve':
+        logging.basicConfig(level=config.LOG_LEVEL, format='%(asctime)s - %(levelname)s - %(message)s')
+        serve(socket_path=daemon_arguments.socket_path, max_children=config.BUILD_DAEMON_MAX_CHILDREN)
+        sys.exit(0)
+
+    # Invalid arguments are reported here, before reaching the daemon
+    submitted_arguments = main.parse_arguments(argv=build_arguments)
+    build_response = submit_build(socket_path=daemon_arguments.socket_path, arguments=build_arguments)
+    if build_response['status'] != 'succeeded':
+        print(f"Build failed: {build_response.get('error')}", file=sys.stderr)
+        sys.exit(1)
+    if 'manifest' in build_response:
+        manifest_json = json.dumps(build_response['manifest'], indent=2) + '\n'
+        if submitted_arguments.manifest_path == '-':
+            sys.stdout.write(manifest_json)
+        else:
+            with open(submitted_arguments.manifest_path, 'w', encoding='utf-8') as wf:
+                wf.write(manifest_json)
+    sys.exit(0)
@@ -0,0 +1,30 @@
+import logging
+import os
+import sys
+import config
+from bgt_db_release_utils import FilesManager, TemplateEngine, TemplateRegistry
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def build_template_pack(template_pack_path):
+    """
+    Precompile every release template into a template pack so release builds can skip parsing them.
+    """
+    files_manager = FilesManager(
+            template_engine=TemplateEngine(
+                placeholders=config.TEMPLATE_PLACEHOLDERS,
+                extra_values=config.TEMPLATE_EXTRA_VALUES,
+                datetime_format=config.TEMPLATE_DATETIME_FORMAT
+            )
+        )
+    template_registry = TemplateRegistry(file_manager=files_manager)
+    
+    template_file_names = config.RELEASE_TEMPLATE_FILES + [config.DEFAULT_HEADER_FILE, config.DEFAULT_HEADER_FILE_WITH_CREATE]
+    template_paths = [os.path.join(config.BASE_TEMPLATE_PATH, template_file_name) for template_file_name in template_file_names]
+    template_registry.save_pack(pack_path=template_pack_path, template_paths=template_paths)
+
+if __name__ == '__main__':
+    # python build_template_pack.py [<template_pack_path>]
+    template_pack_path = sys.argv[1] if len(sys.argv) > 1 else config.TEMPLATE_PACK_PATH
+    build_template_pack(template_pack_path=template_pack_path)
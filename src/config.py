@@ -1,15 +1,41 @@
 # Configuration file for paths and other constants
+import os
 
 # Base directories
 BASE_RELEASE_DIR = 'release'
 BASE_TEMPLATE_PATH = '/app/file_templates'#'./src/file_templates' 
-BASE_RELEASE_DB = ['datatrak_bgt_agt','datatrak_bgt_awb']
+
+# Databases of the release, in deployment order. Each database has:
+#   key           name of its versions in the build, e.g. in the release ledger and RELEASE_BUNDLE_NAME
+#   tag_prefix    prefix of its version in the release tags, e.g. AGT in AGT_1.0.16-b1_and_AWB_1.0.16-b1
+#   source_dir    top directory of its changed SQL files, e.g. datatrak_bgt_agt/stored_procedures/<sp_name>.sql
+#   version_path  version file with its old_version= and new_version=
+#   release_dir   directory of its release files in the bundle
+# Every database is built by its own stages, so the build takes as long as the largest database.
+RELEASE_DATABASES = [
+    {
+        'key': 'agt',
+        'tag_prefix': 'AGT',
+        'source_dir': 'datatrak_bgt_agt',
+        'version_path': './datatrak_bgt_agt/version.txt',
+        'release_dir': 'datatrak_bgt_agt'
+    },
+    {
+        'key': 'awb',
+        'tag_prefix': 'AWB',
+        'source_dir': 'datatrak_bgt_awb',
+        'version_path': './datatrak_bgt_awb/version.txt',
+        'release_dir': 'datatrak_bgt_awb'
+    },
+]
+
+# Name of the release bundle directory, formatted with the new version of every database by key
+RELEASE_BUNDLE_NAME = 'AWB_{awb}_AGT_{agt}'
+
+BASE_RELEASE_DB = [release_database['release_dir'] for release_database in RELEASE_DATABASES]
 
 # Version paths
-VERSION_PATHS = {
-    'agt': './datatrak_bgt_agt/version.txt',
-    'awb': './datatrak_bgt_awb/version.txt'
-}
+VERSION_PATHS = {release_database['key']: release_database['version_path'] for release_database in RELEASE_DATABASES}
 
 # Release filenames
 RELEASE_FILES = [
@@ -30,6 +56,9 @@ RELEASE_TEMPLATE_FILES = [
     '9_new_datatrak_mis_version_update_scripts.sql'
 ]
 
+# Release file of the changed SQL files, by path under the source_dir of their database. A rule applies to the files
+# below it, in nested folders too, and may use globs, e.g. 'views/reporting' or 'insert_statements/*_seed.sql'.
+# The most specific rule wins: the deepest one, then an exact folder name over a glob.
 RELEASE_FILE_MAPPING = {
     'tables': '1_datatrak_create_new_table_scripts.sql',
     'alter_table':'2_datatrak_alter_table_scripts.sql',
@@ -45,4 +74,135 @@ RELEASE_FILE_MAPPING = {
 DEFAULT_HEADER_FILE = 'default_header.txt'
 DEFAULT_HEADER_FILE_WITH_CREATE = 'defalt_header_with_create.txt'
 
-RELEASE_DOCX = 'BGT MsSQL DBs Release Deployment Guide.docx'
\ No newline at end of file
+# Template placeholders mapped to the render context value that replaces them.
+# Context values: sql_release_file_name, build_datetime, release_db_name, old_version, new_version, release_number
+TEMPLATE_PLACEHOLDERS = {
+    'title_based_on_script': 'sql_release_file_name',
+    'strdatetime': 'build_datetime',
+    'deployment_db_name': 'release_db_name',
+    'old_version': 'old_version',
+    'new_version': 'new_version',
+}
+
+# Additional placeholders replaced with fixed text in every template
+TEMPLATE_EXTRA_VALUES = {}
+
+TEMPLATE_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Precompiled templates built into the image by build_template_pack.py
+TEMPLATE_PACK_PATH = os.path.join(BASE_TEMPLATE_PATH, 'templates.pack.json')
+
+RELEASE_DOCX = 'BGT MsSQL DBs Release Deployment Guide.docx'
+
+# Number of threads reading and decoding changed SQL files during the copy (1 = serial copy)
+COPY_MAX_WORKERS = int(os.environ.get('BGT_COPY_MAX_WORKERS', min(32, (os.cpu_count() or 1) + 4)))
+
+# Number of release stages (templates, deploy guide, SQL files of each database, ...) run concurrently
+STAGE_MAX_WORKERS = int(os.environ.get('BGT_STAGE_MAX_WORKERS', max(4, len(RELEASE_DATABASES) + 2)))
+
+# Encoding prepass: the encodings of the changed SQL files are detected on a process pool before the copy.
+# Change sets leaving fewer than ENCODING_PREPASS_MIN_FILES samples to chardet are detected in process.
+ENCODING_PREPASS = os.environ.get('BGT_ENCODING_PREPASS', '1') != '0'
+ENCODING_PREPASS_MAX_WORKERS = int(os.environ.get('BGT_ENCODING_PREPASS_MAX_WORKERS', os.cpu_count() or 1))
+ENCODING_PREPASS_MIN_FILES = int(os.environ.get('BGT_ENCODING_PREPASS_MIN_FILES', 64))
+# Samples or files sent to a worker process at a time
+ENCODING_PREPASS_BATCH_SIZE = 32
+# Workers are started from a fork server, they do not inherit the threads of the running stages
+ENCODING_PREPASS_START_METHOD = 'forkserver' if os.name == 'posix' else 'spawn'
+# Also decode the files up to COPY_INLINE_MAX_BYTES in the pool. Decoded files wait in memory for the copy,
+# at most ENCODING_PREPASS_DECODE_MAX_BYTES of source in total.
+ENCODING_PREPASS_DECODE = os.environ.get('BGT_ENCODING_PREPASS_DECODE', '0') == '1'
+ENCODING_PREPASS_DECODE_MAX_BYTES = int(os.environ.get('BGT_ENCODING_PREPASS_DECODE_MAX_BYTES', 256 * 1024 * 1024))
+
+# Write buffer of each release file handle kept open during the copy
+RELEASE_FILE_BUFFER_SIZE = 1024 * 1024
+
+# Changed SQL files up to this size are read ahead by the copy threads, larger files
+# (data insertion scripts) are streamed in chunks straight into their release file
+COPY_INLINE_MAX_BYTES = int(os.environ.get('BGT_COPY_INLINE_MAX_BYTES', 4 * 1024 * 1024))
+
+# Drop the changed SQL files listed more than once, and the scripts defining a procedure, view, function or trigger
+# that a later CREATE OR ALTER, or DROP and CREATE, of the same release file replaces. A final plain ALTER keeps the
+# earliest CREATE. Off by default, dropped files are reported in the build manifest.
+SQL_DEDUPE_DEFINITIONS = os.environ.get('BGT_SQL_DEDUPE_DEFINITIONS', '0') == '1'
+
+# Dependency analysis: DEPLOYMENT_PLAN_FILE lists the batches of scripts of each release file that can be deployed
+# concurrently. With SQL_DEPENDENCY_REORDER, the changed SQL files of each release file are ordered so objects are
+# dropped before being defined again and defined before the scripts referencing them; otherwise they keep their
+# input order. Both are off by default, reordering does not need the plan. Scripts larger than SQL_DEPENDENCY_MAX_SCRIPT_BYTES are not scanned and deploy alone, in their input position.
+SQL_DEPENDENCY_ANALYSIS = os.environ.get('BGT_SQL_DEPENDENCY_ANALYSIS', '0') == '1'
+SQL_DEPENDENCY_REORDER = os.environ.get('BGT_SQL_DEPENDENCY_REORDER', '0') == '1'
+SQL_DEPENDENCY_MAX_SCRIPT_BYTES = COPY_INLINE_MAX_BYTES
+# Schema of object names written without one
+SQL_DEFAULT_SCHEMA = 'dbo'
+DEPLOYMENT_PLAN_FILE = 'deployment_plan.json'
+
+# Batch index: the copy splits every SQL release file into the batches sqlcmd runs (GO separators outside comments
+# and strings) as it writes it, and writes <release file>.batches.json next to it with the byte range, the changed
+# files and the objects of each batch, so a deployment can resume from a failed batch. Off by default.
+SQL_BATCH_INDEX = os.environ.get('BGT_SQL_BATCH_INDEX', '0') == '1'
+
+# Checksum manifest: the files of the bundle are digested as they are written and CHECKSUM_MANIFEST_FILE, at the root
+# of the bundle, lists every file with its size, digests and the changed files its bytes came from, so the deployment
+# verifies the bundle without hashing it again. Off by default. Algorithms are hashlib names, e.g. sha256,blake2b.
+CHECKSUM_MANIFEST = os.environ.get('BGT_CHECKSUM_MANIFEST', '0') == '1'
+CHECKSUM_MANIFEST_FILE = 'MANIFEST.json'
+CHECKSUM_MANIFEST_ALGORITHMS = [
+    algorithm.strip() for algorithm in os.environ.get('BGT_CHECKSUM_MANIFEST_ALGORITHMS', 'sha256').split(',') if algorithm.strip()
+]
+
+# Write the release bundle straight into a deterministic .zip or .tar.gz archive instead of the release directory
+# (also --archive). Release files appended to during the build are spooled in memory up to ARCHIVE_SPOOL_MAX_BYTES
+# each, larger ones spill to temporary files; every member is then streamed once into the archive. The gzip stream
+# of a .tar.gz is compressed on ARCHIVE_MAX_WORKERS threads.
+RELEASE_ARCHIVE_PATH = os.environ.get('BGT_RELEASE_ARCHIVE', '')
+ARCHIVE_MAX_WORKERS = int(os.environ.get('BGT_ARCHIVE_MAX_WORKERS', os.cpu_count() or 1))
+ARCHIVE_COMPRESSION_LEVEL = int(os.environ.get('BGT_ARCHIVE_COMPRESSION_LEVEL', 6))
+ARCHIVE_SPOOL_MAX_BYTES = 8 * 1024 * 1024
+
+# Local cache directory shared by pipeline runs on the same runner
+CACHE_DIR = os.environ.get('BGT_RELEASE_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'bgt_db_release_builder'))
+
+# Warm build daemon (build_daemon.py): builds requested over a Unix socket run in processes forked from a server
+# that keeps the imports, the compiled templates and the encoding cache loaded, at most BUILD_DAEMON_MAX_CHILDREN at once
+BUILD_DAEMON_SOCKET = os.environ.get('BGT_BUILD_DAEMON_SOCKET', os.path.join(CACHE_DIR, 'build_daemon.sock'))
+BUILD_DAEMON_MAX_CHILDREN = int(os.environ.get('BGT_BUILD_DAEMON_MAX_CHILDREN', 4))
+
+# Release ledger: every completed build is recorded in a local SQLite database with its database versions,
+# its inputs and their SHA-256, and the release file each input landed in (see query_release_ledger.py).
+# With the ledger, a version file without old_version takes the previous version from it. Off by default.
+RELEASE_LEDGER = os.environ.get('BGT_RELEASE_LEDGER', '0') == '1'
+RELEASE_LEDGER_PATH = os.environ.get('BGT_RELEASE_LEDGER_PATH', os.path.join(CACHE_DIR, 'release_ledger.sqlite3'))
+
+# Artifact cache: release files, bash and permission files and the deploy guide are cached by the fingerprint of
+# their inputs, templates and versions and of the builder, and reflinked or copied into the bundle by later builds from
+# the same inputs, in any working directory. Least recently used artifacts are evicted past ARTIFACT_CACHE_MAX_BYTES.
+# Off by default.
+ARTIFACT_CACHE = os.environ.get('BGT_ARTIFACT_CACHE', '0') == '1'
+ARTIFACT_CACHE_DIR = os.environ.get('BGT_ARTIFACT_CACHE_DIR', os.path.join(CACHE_DIR, 'artifacts'))
+ARTIFACT_CACHE_MAX_BYTES = int(os.environ.get('BGT_ARTIFACT_CACHE_MAX_BYTES', 2 * 1024 * 1024 * 1024))
+
+# Encoding detection cache
+ENCODING_CACHE_PATH = os.path.join(CACHE_DIR, 'encoding_cache.json')
+ENCODING_CACHE_MAX_ENTRIES = 50000
+
+# Incremental builds: keep release files whose inputs are unchanged since the previous build.
+# Kept release files keep the header timestamp of the build that wrote them, so they are off by default.
+INCREMENTAL_BUILD = os.environ.get('BGT_INCREMENTAL_BUILD', '0') == '1'
+
+# Build journal of incremental builds: <bundle>.journal records every release file and script completed, so a build
+# killed half way resumes where it stopped. SQL release files are written to <release file>.partial and renamed into
+# place once complete either way, a killed build never leaves a release file half written.
+BUILD_JOURNAL = os.environ.get('BGT_BUILD_JOURNAL', '1') != '0'
+
+# Logging level of the release build, e.g. INFO to keep the stage breadcrumbs
+LOG_LEVEL = os.environ.get('BGT_LOG_LEVEL', 'ERROR').upper()
+
+# Build metrics reports, only written when a path is configured.
+# Point the Prometheus textfile at the node exporter textfile collector directory to trend builds.
+METRICS_JSON_PATH = os.environ.get('BGT_METRICS_JSON_PATH', '')
+METRICS_PROMETHEUS_PATH = os.environ.get('BGT_METRICS_PROMETHEUS_PATH', '')
+
+# Git input mode (--git-from/--git-to): changed files are read from the object store of the local repository
+GIT_EXECUTABLE = os.environ.get('BGT_GIT_EXECUTABLE', 'git')
+GIT_SOURCE_FILE_SUFFIXES = ('.sql',)
@@ -1,118 +1,127 @@
 import logging
+import argparse
 import sys
-import os
 import config
-from bgt_release_handler import BGTReleaseHandler
+from bgt_db_release_utils import MemoryOutputBackend, ReleaseBuildError
+from bgt_db_release_utils.release_archive import archive_format_for
+from release_builder import ReleaseBuilder, resolve_versions, create_release_directories, add_release_stages
+
+# The build steps moved to release_builder are still importable from here
+__all__ = [
+    'configure_logging',
+    'main',
+    'write_dry_run_manifest',
+    'parse_arguments',
+    'resolve_versions',
+    'create_release_directories',
+    'add_release_stages'
+]
 
-# Set up logging configuration to log INFO and higher levels to both console and a file
-logging.basicConfig(
-    level=logging.ERROR,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),                       # Log to console
-        logging.FileHandler('bgt_release_handler.log', mode='w')      # 'w' mode to overwrite file on each run
-    ]
-)
 logger = logging.getLogger(__name__)
 
-def main(files_changed_with_tags, release_number):
+def configure_logging():
+    """
+    Log the configured level (BGT_LOG_LEVEL) and higher to both console and a file.
+    Called from the command line only: the encoding prepass workers import this module, and must not
+    truncate the log of the running build.
+    """
+    logging.basicConfig(
+        level=config.LOG_LEVEL,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler(),                       # Log to console
+            logging.FileHandler('bgt_release_handler.log', mode='w')      # 'w' mode to overwrite file on each run
+        ]
+    )
+
+def main(files_changed_with_tags, release_number, git_from_ref=None, git_to_ref=None, git_repo_path='.', archive_path=None,
+         output_backend=None):
     """
     Main function to create release directories, generate release files, and copy the input files to the release files.
+    With git_from_ref and git_to_ref the changed files and versions come from the local git repository instead.
+    With archive_path the bundle is written as a .zip or .tar.gz archive instead of the release directory.
+    An output_backend, such as a MemoryOutputBackend for a dry run, replaces both.
+    Returns True when the release was built, the error is logged otherwise. ReleaseBuilder raises it instead.
     """
-    # Initialize object for BGTReleaseHandler  
-    release_handler = BGTReleaseHandler(
-            files_changed_with_tags=files_changed_with_tags, 
-            release_number=release_number
-        )
     try:
-        # Initialize variables with default values
-        agt_file_data, awb_file_data = None, None
-        
-        # Check if version information is provided in the input
-        if not release_handler.check_version_in_input():
-            agt_file_data, awb_file_data = release_handler.get_versions_file_data(version_file_paths=config.VERSION_PATHS)
-            
-            # Raise error if both data files are missing
-            if not agt_file_data and not awb_file_data:
-                raise ValueError("Both AGT and AWB version data files are missing.")
-        
-        logger.info(f"Initializing version manager with AGT:{agt_file_data} and AWB:{awb_file_data} file data.")    
-        release_handler.initialize_version_manager(agt_file_data=agt_file_data, awb_file_data=awb_file_data)
-        
-        # Retrieve database versions
-        db_versions_dict = release_handler.get_db_versions()
-        if not db_versions_dict:
-            raise ValueError("No database versions found.")
-        
-        logger.info("Setting database versions in the release handler.")
-        release_handler.set_db_versions_dict(db_versions_dict=db_versions_dict)
-        
-        # Generate release file path for AWB and AGT
-        awb_agt_release_file_path = release_handler.generate_awb_agt_release_file_path(release_dir_name=config.BASE_RELEASE_DIR)
-        if not awb_agt_release_file_path:
-            raise ValueError("Failed to create release file path for AWB and AGT.")
-        
-        logger.info("Initializing release path and resource manager.")
-        release_handler.initialize_release_path_and_resource_manager(awb_agt_release_file_path=awb_agt_release_file_path)
-        
-        # Create release directories
-        logger.info("Creating release directories with database names.")
-        release_dirs_with_db_name = release_handler.create_empty_release_directories(release_db_dir_names=config.BASE_RELEASE_DB)
-        if not release_dirs_with_db_name:
-            raise ValueError("Failed to create release directories for databases.")
-        
-        logger.info("Setting release directories with database names.")
-        release_handler.set_release_dirs_with_db_name(release_dirs_with_db_name=release_dirs_with_db_name)
-
-        # Create bash permission files for the release
-        logger.info("Creating release bash permission files.")
-        release_handler.create_release_bash_permission_files(
-            release_template_file_names=config.RELEASE_TEMPLATE_FILES,
-            release_templeate_path=config.BASE_TEMPLATE_PATH
+        ReleaseBuilder().build(
+            release_number=release_number,
+            files_changed_with_tags=files_changed_with_tags,
+            git_from_ref=git_from_ref,
+            git_to_ref=git_to_ref,
+            git_repo_path=git_repo_path,
+            archive_path=archive_path,
+            output_backend=output_backend
         )
-        
-        # Set up default header templates for SQL files
-        logger.info("Setting up SQL files' default header templates.")
-        sql_files_default_headers_path = {
-            'create': os.path.join(config.BASE_TEMPLATE_PATH, config.DEFAULT_HEADER_FILE_WITH_CREATE),
-            'default': os.path.join(config.BASE_TEMPLATE_PATH, config.DEFAULT_HEADER_FILE)
-        }
+        return True
+    except ReleaseBuildError:
+        # Logged by the builder
+        return False
 
-        # Create deployment guide in Word format
-        logger.info("Creating deployment guide.")
-        deploy_guide_word_file_path = os.path.join(config.BASE_TEMPLATE_PATH, config.RELEASE_DOCX)
-        release_handler.create_deploy_guide_word_doc(
-            deploy_guide_word_path=deploy_guide_word_file_path,
-            word_doc_name=config.RELEASE_DOCX
-        )
-        
-        # Create empty SQL release files
-        logger.info("Creating empty SQL release files.")
-        release_handler.create_empty_sql_release_files(
-            sql_release_files=config.RELEASE_FILES,
-            sql_files_default_headers_path=sql_files_default_headers_path
-        )
-        
-        logger.info("Copying SQL files to the release directory.")
-        release_handler.copy_sql_files_changed_to_release_file(release_file_mapping=config.RELEASE_FILE_MAPPING)
+def write_dry_run_manifest(output_backend, manifest_path):
+    """
+    Write the manifest of a dry run bundle, to stdout for '-'.
+    """
+    if manifest_path == '-':
+        output_backend.write_manifest(output_file=sys.stdout)
+        return
+    with open(manifest_path, 'w', encoding='utf-8') as wf:
+        output_backend.write_manifest(output_file=wf)
+
+def parse_arguments(argv=None):
+    """
+    Parse the command line. The positional form is kept for existing pipelines:
+    python main.py <release_num> <files_changed 1,2,3..> <Prev tag> <Input Tag>
+    python main.py <release_num> --git-from <Prev ref> --git-to <Input ref> [--git-repo <path>]
+    Either form takes --archive <path.zip|path.tar.gz> to write the bundle as an archive,
+    or --dry-run [--manifest <path>] to only report what the bundle would contain.
+    """
+    parser = argparse.ArgumentParser(description="Build the BGT database release bundle.")
+    parser.add_argument('release_number', help="Release number")
+    parser.add_argument('files_changed_with_tags', nargs='*',
+                        help="Changed SQL files, optionally followed by the previous and the new version tag")
+    parser.add_argument('--git-from', dest='git_from_ref', help="Ref of the previous release, changed files are listed from git")
+    parser.add_argument('--git-to', dest='git_to_ref', help="Ref of the new release, changed files are read from its git objects")
+    parser.add_argument('--git-repo', dest='git_repo_path', default='.', help="Local git repository (default: current directory)")
+    parser.add_argument('--archive', dest='archive_path', default=config.RELEASE_ARCHIVE_PATH or None,
+                        help="Write the bundle as a .zip or .tar.gz archive instead of the release directory")
+    parser.add_argument('--dry-run', dest='dry_run', action='store_true',
+                        help="Build the bundle in memory only and print its manifest")
+    parser.add_argument('--manifest', dest='manifest_path', default='-',
+                        help="With --dry-run, write the manifest to this file instead of stdout")
+    arguments = parser.parse_args(argv)
+
+    if bool(arguments.git_from_ref) != bool(arguments.git_to_ref):
+        parser.error("--git-from and --git-to must be given together.")
+    if arguments.git_from_ref and arguments.files_changed_with_tags:
+        parser.error("Changed files cannot be combined with --git-from/--git-to.")
+    if arguments.dry_run:
+        arguments.archive_path = None
+    elif arguments.archive_path:
+        try:
+            archive_format_for(archive_path=arguments.archive_path)
+        except ValueError as e:
+            parser.error(str(e))
+    return arguments
 
-        logger.info("Release process completed successfully.")
-    except ValueError as ve:
-        logger.error("ValueError encountered: %s", ve, exc_info=True)
-    except Exception as e:
-        logger.error("Unexpected error occurred: %s", e, exc_info=True)
-    
 if __name__ == '__main__':
+    configure_logging()
+
     # Validate command-line arguments
-    if len(sys.argv) < 2:
-        logging.error("No changes have been made to any sql files.")
-        sys.exit(1)      
-    
-    # Extract release number and files changed from arguments    
-    #python main.py <release_num> <files_changed 1,2,3..> <Prev tag> <Input Tag>
-    files_changed_with_tags = sys.argv[2:]
-    #extract release number as str
-    release_number = sys.argv[1:2][0]
+    arguments = parse_arguments()
     
-    logger.info("Starting the release process with release number: %s and files: %s", release_number, files_changed_with_tags)
-    main(files_changed_with_tags=files_changed_with_tags, release_number=release_number)
\ No newline at end of file
+    logger.info("Starting the release process with release number: %s and files: %s", arguments.release_number, arguments.files_changed_with_tags)
+    # A dry run keeps the bundle in memory and only reports its manifest
+    dry_run_backend = MemoryOutputBackend() if arguments.dry_run else None
+    release_built = main(
+        files_changed_with_tags=arguments.files_changed_with_tags,
+        release_number=arguments.release_number,
+        git_from_ref=arguments.git_from_ref,
+        git_to_ref=arguments.git_to_ref,
+        git_repo_path=arguments.git_repo_path,
+        archive_path=arguments.archive_path,
+        output_backend=dry_run_backend
+    )
+    if dry_run_backend and release_built:
+        write_dry_run_manifest(output_backend=dry_run_backend, manifest_path=arguments.manifest_path)
+    sys.exit(0 if release_built else 1)
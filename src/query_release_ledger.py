@@ -0,0 +1,55 @@
+import sys
+import json
+import argparse
+import config
+from bgt_db_release_utils import FilesManager, ReleaseLedger
+
+def unchanged_inputs(release_ledger, database:str, version:str, file_paths:list) -> list:
+    """
+    Return the files of the working tree with the same content as in the last build of a database version.
+    """
+    file_manager = FilesManager()
+    return release_ledger.unchanged_inputs_since(
+        database=database,
+        version=version,
+        current_hashes={file_path: file_manager.source_sha256(file_path=file_path) for file_path in file_paths}
+    )
+
+if __name__ == '__main__':
+    # python query_release_ledger.py previous-version agt [<version>]
+    # python query_release_ledger.py touched <object name, e.g. dbo.usp_proc> | --file <changed file>
+    # python query_release_ledger.py unchanged agt <version> <changed files...>
+    parser = argparse.ArgumentParser(description="Query the local BGT release ledger.")
+    parser.add_argument('--ledger', dest='ledger_path', default=config.RELEASE_LEDGER_PATH, help="SQLite release ledger")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    previous_parser = subparsers.add_parser('previous-version', help="Version released before a version, or the last version built")
+    previous_parser.add_argument('database', help="Database key, e.g. agt")
+    previous_parser.add_argument('version', nargs='?', help="Version of the database")
+    touched_parser = subparsers.add_parser('touched', help="Releases that touched an object or a changed file")
+    touched_parser.add_argument('object_name', nargs='?', help="Object name as written in a script")
+    touched_parser.add_argument('--file', dest='source_path', help="Changed SQL file instead of an object")
+    unchanged_parser = subparsers.add_parser('unchanged', help="Changed files with the same content as in a version")
+    unchanged_parser.add_argument('database', help="Database key, e.g. agt")
+    unchanged_parser.add_argument('version', help="Version of the database")
+    unchanged_parser.add_argument('file_paths', nargs='+', help="Changed SQL files in the working tree")
+    arguments = parser.parse_args()
+
+    release_ledger = ReleaseLedger(ledger_path=arguments.ledger_path, default_schema=config.SQL_DEFAULT_SCHEMA)
+    if arguments.command == 'previous-version':
+        if arguments.version:
+            query_result = release_ledger.previous_version(database=arguments.database, version=arguments.version)
+        else:
+            query_result = release_ledger.latest_version(database=arguments.database)
+    elif arguments.command == 'touched':
+        if bool(arguments.object_name) == bool(arguments.source_path):
+            touched_parser.error("Give either an object name or --file.")
+        if arguments.source_path:
+            query_result = release_ledger.releases_touching_file(source_path=arguments.source_path)
+        else:
+            query_result = release_ledger.releases_touching_object(object_name=arguments.object_name)
+    else:
+        query_result = unchanged_inputs(release_ledger=release_ledger, database=arguments.database,
+                                        version=arguments.version, file_paths=arguments.file_paths)
+    json.dump(query_result, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+    sys.exit(0 if query_result else 1)
@@ -0,0 +1,448 @@
+import os
+import hashlib
+import logging
+import config
+from bgt_release_handler import BGTReleaseHandler
+from bgt_db_release_utils import (
+        FilesManager,
+        EncodingCache,
+        TemplateEngine,
+        TemplateRegistry,
+        BuildMetrics,
+        GitSourceReader,
+        StageScheduler,
+        EncodingPrepass,
+        FileSystemOutputBackend,
+        ArchiveOutputBackend,
+        MemoryOutputBackend,
+        SqlDependencyAnalyzer,
+        SqlDefinitionDeduplicator,
+        SqlBatchIndexer,
+        ReleaseLedger,
+        ArtifactCache,
+        ReleaseBuildError,
+        ReleaseInputError
+    )
+
+logger = logging.getLogger(__name__)
+
+def resolve_versions(release_handler):
+    """
+    Resolve the old and new database versions from the input tags or the version files.
+    """
+    release_handler.set_release_databases(release_databases=config.RELEASE_DATABASES)
+
+    # Initialize variables with default values
+    version_files_data = None
+    
+    # Check if version information is provided in the input
+    if not release_handler.check_version_in_input():
+        version_files_data = release_handler.get_versions_file_data(version_file_paths=config.VERSION_PATHS)
+        
+        # Raise error if every data file is missing
+        if not any(version_files_data.values()):
+            raise ReleaseInputError("The version data files of every database are missing.")
+    
+    logger.info(f"Initializing version manager with version file data: {version_files_data}.")    
+    release_handler.initialize_version_manager(version_files_data=version_files_data)
+    
+    # Retrieve database versions
+    db_versions_dict = release_handler.get_db_versions()
+    if not db_versions_dict:
+        raise ReleaseInputError("No database versions found.")
+    
+    logger.info("Setting database versions in the release handler.")
+    release_handler.set_db_versions_dict(db_versions_dict=db_versions_dict)
+
+def create_release_directories(release_handler):
+    """
+    Create the release bundle directory with a directory per database.
+    """
+    # Generate the release bundle path from the new database versions
+    awb_agt_release_file_path = release_handler.generate_release_bundle_path(release_dir_name=config.BASE_RELEASE_DIR,
+                                                                             bundle_name=config.RELEASE_BUNDLE_NAME)
+    if not awb_agt_release_file_path:
+        raise ReleaseInputError("Failed to create the release bundle path.")
+    
+    logger.info("Initializing release path and resource manager.")
+    release_handler.initialize_release_path_and_resource_manager(awb_agt_release_file_path=awb_agt_release_file_path)
+    
+    # Create release directories
+    logger.info("Creating release directories with database names.")
+    release_dirs_with_db_name = release_handler.create_empty_release_directories(release_db_dir_names=config.BASE_RELEASE_DB)
+    if not release_dirs_with_db_name:
+        raise ReleaseInputError("Failed to create release directories for databases.")
+    
+    logger.info("Setting release directories with database names.")
+    release_handler.set_release_dirs_with_db_name(release_dirs_with_db_name=release_dirs_with_db_name)
+
+    # Digest the bundle files from the first one written
+    if config.CHECKSUM_MANIFEST:
+        release_handler.initialize_checksum_manifest(manifest_file_name=config.CHECKSUM_MANIFEST_FILE,
+                                                     algorithms=config.CHECKSUM_MANIFEST_ALGORITHMS)
+
+def add_release_stages(stage_scheduler, release_handler, use_git_source=False, incremental_build=None):
+    """
+    Declare the release stages and the stages each one needs to have finished.
+    The release files of every database are built by stages of their own, see add_database_stages.
+    incremental_build defaults to config.INCREMENTAL_BUILD.
+    """
+    if incremental_build is None:
+        incremental_build = config.INCREMENTAL_BUILD
+    version_dependencies = []
+    if use_git_source:
+        stage_scheduler.add_stage('list_git_changes', lambda: release_handler.list_source_changes(
+            file_suffixes=config.GIT_SOURCE_FILE_SUFFIXES
+        ))
+        version_dependencies.append('list_git_changes')
+
+    # Use the precompiled templates shipped with the image when they are still current
+    stage_scheduler.add_stage('load_template_pack', lambda: release_handler.load_template_pack(
+        template_pack_path=config.TEMPLATE_PACK_PATH
+    ))
+    stage_scheduler.add_stage('resolve_versions', lambda: resolve_versions(release_handler=release_handler),
+                              depends_on=version_dependencies)
+    stage_scheduler.add_stage('create_release_directories', lambda: create_release_directories(release_handler=release_handler),
+                              depends_on=['resolve_versions'])
+
+    # Only regenerate release files whose inputs changed since the previous build
+    release_file_dependencies = ['create_release_directories']
+    if incremental_build:
+        stage_scheduler.add_stage('load_build_manifest', lambda: release_handler.initialize_build_manifest(
+            build_journal=config.BUILD_JOURNAL
+        ), depends_on=['create_release_directories'])
+        release_file_dependencies = ['load_build_manifest']
+
+    stage_scheduler.add_stage('plan_sql_copies', lambda: release_handler.plan_sql_release_file_copies(
+        release_file_mapping=config.RELEASE_FILE_MAPPING
+    ), depends_on=['create_release_directories'])
+
+    # Create deployment guide in Word format
+    stage_scheduler.add_stage('create_deploy_guide', lambda: release_handler.create_deploy_guide_word_doc(
+        deploy_guide_word_path=os.path.join(config.BASE_TEMPLATE_PATH, config.RELEASE_DOCX),
+        word_doc_name=config.RELEASE_DOCX
+    ), depends_on=release_file_dependencies)
+
+    # Detect the encodings of the planned files on a process pool, the dedupe and the copy then skip detection
+    planned_copy_dependencies = ['plan_sql_copies']
+    if config.ENCODING_PREPASS:
+        encoding_prepass = EncodingPrepass(
+            file_manager=release_handler.file_manager,
+            max_workers=config.ENCODING_PREPASS_MAX_WORKERS,
+            min_pool_files=config.ENCODING_PREPASS_MIN_FILES,
+            batch_size=config.ENCODING_PREPASS_BATCH_SIZE,
+            start_method=config.ENCODING_PREPASS_START_METHOD,
+            decode=config.ENCODING_PREPASS_DECODE,
+            decode_max_file_bytes=config.COPY_INLINE_MAX_BYTES,
+            decode_max_bytes=config.ENCODING_PREPASS_DECODE_MAX_BYTES
+        )
+        stage_scheduler.add_stage('detect_encodings', lambda: release_handler.detect_sql_file_encodings(
+            encoding_prepass=encoding_prepass
+        ), depends_on=['plan_sql_copies'])
+        planned_copy_dependencies = ['detect_encodings']
+
+    # Leave out the definitions a later script replaces, the build manifest records the files dropped
+    if config.SQL_DEDUPE_DEFINITIONS:
+        sql_definition_deduplicator = SqlDefinitionDeduplicator(
+            file_manager=release_handler.file_manager,
+            max_script_bytes=config.SQL_DEPENDENCY_MAX_SCRIPT_BYTES,
+            max_workers=config.COPY_MAX_WORKERS,
+            default_schema=config.SQL_DEFAULT_SCHEMA
+        )
+        stage_scheduler.add_stage('dedupe_sql_definitions', lambda: release_handler.dedupe_sql_definitions(
+            sql_definition_deduplicator=sql_definition_deduplicator
+        ), depends_on=release_file_dependencies + planned_copy_dependencies)
+        planned_copy_dependencies = ['dedupe_sql_definitions']
+
+    # The analysis only looks objects up within a database, one analyzer serves every database
+    sql_dependency_analyzer = None
+    if config.SQL_DEPENDENCY_ANALYSIS or config.SQL_DEPENDENCY_REORDER:
+        sql_dependency_analyzer = SqlDependencyAnalyzer(
+            file_manager=release_handler.file_manager,
+            release_file_order=config.RELEASE_FILES,
+            max_script_bytes=config.SQL_DEPENDENCY_MAX_SCRIPT_BYTES,
+            max_workers=config.COPY_MAX_WORKERS,
+            default_schema=config.SQL_DEFAULT_SCHEMA,
+            reorder=config.SQL_DEPENDENCY_REORDER
+        )
+
+    # Index the batches of every release file while it is written, for deployments resuming from a failed batch
+    sql_batch_indexer = None
+    if config.SQL_BATCH_INDEX:
+        sql_batch_indexer = SqlBatchIndexer(default_schema=config.SQL_DEFAULT_SCHEMA)
+
+    release_dependencies = ['create_deploy_guide']
+    copy_stage_names = []
+    for release_database in config.RELEASE_DATABASES:
+        database_stage_names = add_database_stages(
+            stage_scheduler=stage_scheduler,
+            release_handler=release_handler,
+            release_database=release_database,
+            release_file_dependencies=release_file_dependencies,
+            planned_copy_dependencies=planned_copy_dependencies,
+            sql_dependency_analyzer=sql_dependency_analyzer,
+            sql_batch_indexer=sql_batch_indexer
+        )
+        release_dependencies.extend(database_stage_names)
+        copy_stage_names.append(database_stage_names[-1])
+
+    if config.SQL_DEPENDENCY_ANALYSIS:
+        # The plan carries the byte range of every script, known once they are copied
+        stage_scheduler.add_stage('write_deployment_plan', lambda: release_handler.write_deployment_plan(
+            plan_file_name=config.DEPLOYMENT_PLAN_FILE,
+            release_file_order=config.RELEASE_FILES
+        ), depends_on=copy_stage_names)
+        release_dependencies.append('write_deployment_plan')
+
+    # Written last, it covers every other file of the bundle. The build manifest keeps the digests for the next build.
+    if config.CHECKSUM_MANIFEST:
+        stage_scheduler.add_stage('write_checksum_manifest', release_handler.write_checksum_manifest,
+                                  depends_on=list(release_dependencies))
+        release_dependencies.append('write_checksum_manifest')
+
+    stage_scheduler.add_stage('save_build_manifest', release_handler.save_build_manifest,
+                              depends_on=release_dependencies)
+
+    # Cache the files generated by this build once the bundle is complete, restored files are cached already
+    if release_handler.artifact_cache:
+        stage_scheduler.add_stage('store_cached_artifacts', release_handler.store_cached_artifacts,
+                                  depends_on=release_dependencies)
+
+def add_database_stages(stage_scheduler, release_handler, release_database, release_file_dependencies,
+                        planned_copy_dependencies, sql_dependency_analyzer=None, sql_batch_indexer=None) -> list:
+    """
+    Declare the stages building the release directory of one database, named after its key, e.g. copy_sql_files:agt.
+    Every database has its own chain of stages, so the databases are built concurrently and the build takes as long
+    as the largest one. The SQL copy depends on the empty SQL files so headers are written before content is appended.
+    Returns the names of the stages the end of the build waits for, the SQL copy last.
+    """
+    release_dir_names = [release_database['release_dir']]
+    stage_suffix = f":{release_database['key']}"
+    # Set up default header templates for SQL files
+    sql_files_default_headers_path = {
+        'create': os.path.join(config.BASE_TEMPLATE_PATH, config.DEFAULT_HEADER_FILE_WITH_CREATE),
+        'default': os.path.join(config.BASE_TEMPLATE_PATH, config.DEFAULT_HEADER_FILE)
+    }
+
+    # Create bash permission files for the release
+    stage_scheduler.add_stage('create_bash_permission_files' + stage_suffix, lambda: release_handler.create_release_bash_permission_files(
+        release_template_file_names=config.RELEASE_TEMPLATE_FILES,
+        release_templeate_path=config.BASE_TEMPLATE_PATH,
+        release_dir_names=release_dir_names
+    ), depends_on=release_file_dependencies + ['load_template_pack'])
+
+    # Create empty SQL release files, their fingerprints cover the planned copies
+    stage_scheduler.add_stage('create_empty_sql_files' + stage_suffix, lambda: release_handler.create_empty_sql_release_files(
+        sql_release_files=config.RELEASE_FILES,
+        sql_files_default_headers_path=sql_files_default_headers_path,
+        release_dir_names=release_dir_names,
+        sql_batch_indexer=sql_batch_indexer
+    ), depends_on=release_file_dependencies + ['load_template_pack'] + planned_copy_dependencies)
+    copy_dependencies = ['create_empty_sql_files' + stage_suffix]
+
+    # Order the scripts of each release file by their dependencies, after the prepass so they are read decoded
+    if sql_dependency_analyzer:
+        stage_scheduler.add_stage('analyze_sql_dependencies' + stage_suffix, lambda: release_handler.analyze_sql_dependencies(
+            sql_dependency_analyzer=sql_dependency_analyzer,
+            release_dir_names=release_dir_names
+        ), depends_on=copy_dependencies)
+        copy_dependencies = ['analyze_sql_dependencies' + stage_suffix]
+
+    stage_scheduler.add_stage('copy_sql_files' + stage_suffix, lambda: release_handler.copy_sql_files_changed_to_release_file(
+        release_file_mapping=config.RELEASE_FILE_MAPPING,
+        max_workers=config.COPY_MAX_WORKERS,
+        buffer_size=config.RELEASE_FILE_BUFFER_SIZE,
+        inline_max_bytes=config.COPY_INLINE_MAX_BYTES,
+        release_dir_names=release_dir_names,
+        sql_batch_indexer=sql_batch_indexer
+    ), depends_on=copy_dependencies)
+    return ['create_bash_permission_files' + stage_suffix] + copy_dependencies + ['copy_sql_files' + stage_suffix]
+
+
+def build_settings() -> list:
+    """
+    The settings that change the SQL release files without being among their inputs. They are part of the fingerprint
+    of every release file, so changing one rebuilds the release files instead of keeping or restoring stale ones.
+    """
+    return [
+        config.SQL_DEDUPE_DEFINITIONS,
+        config.SQL_DEPENDENCY_ANALYSIS,
+        config.SQL_DEPENDENCY_REORDER,
+        config.SQL_DEPENDENCY_MAX_SCRIPT_BYTES,
+        config.SQL_DEFAULT_SCHEMA,
+        config.SQL_BATCH_INDEX
+    ]
+
+def builder_version() -> str:
+    """
+    Identify the builder for the artifact cache, from its source code. Artifacts cached by another version of the
+    builder are never reused.
+    """
+    sha256 = hashlib.sha256()
+    source_root = os.path.dirname(os.path.abspath(__file__))
+    for source_dir in (source_root, os.path.join(source_root, 'bgt_db_release_utils')):
+        for source_name in sorted(os.listdir(source_dir)):
+            if source_name.endswith('.py'):
+                sha256.update(source_name.encode('utf-8'))
+                with open(os.path.join(source_dir, source_name), 'rb') as rf:
+                    sha256.update(rf.read())
+    return sha256.hexdigest()
+
+def write_build_metrics(build_metrics, build_succeeded):
+    """
+    Finish the build metrics and write the configured reports.
+    """
+    build_metrics.finish(succeeded=build_succeeded)
+    if config.METRICS_JSON_PATH:
+        build_metrics.write_json_report(file_path=config.METRICS_JSON_PATH)
+    if config.METRICS_PROMETHEUS_PATH:
+        build_metrics.write_prometheus_textfile(file_path=config.METRICS_PROMETHEUS_PATH)
+
+class ReleaseBuilder():
+    """
+    Builds release bundles in process and raises a ReleaseBuildError when a build fails, it never exits the
+    interpreter. The encoding cache, the compiled templates and the imports are kept between builds, so a long
+    running process such as build_daemon.py only loads them once.
+    Paths are relative to the working directory, so a process runs one build at a time.
+    """
+    def __init__(self, encoding_cache=None, template_registry=None, release_ledger=None, artifact_cache=None):
+        """
+        Initialize the ReleaseBuilder class, loading the encoding cache and the template pack.
+        Completed builds are recorded in release_ledger, by default the ledger of config.RELEASE_LEDGER_PATH.
+        Release directories reuse the files of artifact_cache, by default the cache of config.ARTIFACT_CACHE_DIR.
+        """
+        self.encoding_cache = encoding_cache
+        if self.encoding_cache is None:
+            self.encoding_cache = EncodingCache(
+                    cache_path=config.ENCODING_CACHE_PATH,
+                    max_entries=config.ENCODING_CACHE_MAX_ENTRIES
+                )
+            self.encoding_cache.load()
+
+        # Compiled templates do not depend on the release, they are shared by every build
+        self.template_registry = template_registry
+        if self.template_registry is None:
+            self.template_registry = TemplateRegistry(file_manager=FilesManager(template_engine=self.create_template_engine()))
+            self.template_registry.load_pack(pack_path=config.TEMPLATE_PACK_PATH)
+
+        self.release_ledger = release_ledger
+        if self.release_ledger is None and config.RELEASE_LEDGER:
+            self.release_ledger = ReleaseLedger(ledger_path=config.RELEASE_LEDGER_PATH, default_schema=config.SQL_DEFAULT_SCHEMA)
+
+        self.artifact_cache = artifact_cache
+        if self.artifact_cache is None and config.ARTIFACT_CACHE:
+            self.artifact_cache = ArtifactCache(
+                    cache_dir=config.ARTIFACT_CACHE_DIR,
+                    max_bytes=config.ARTIFACT_CACHE_MAX_BYTES,
+                    builder_version=builder_version()
+                )
+
+    def create_template_engine(self, release_number=None) -> TemplateEngine:
+        """
+        Compile the template placeholders, once per build for the build time and release number.
+        """
+        return TemplateEngine(
+                placeholders=config.TEMPLATE_PLACEHOLDERS,
+                extra_values=config.TEMPLATE_EXTRA_VALUES,
+                datetime_format=config.TEMPLATE_DATETIME_FORMAT,
+                release_number=release_number
+            )
+
+    def create_output_backend(self, archive_path=None):
+        """
+        Write the bundle into the release directory, or straight into an archive.
+        """
+        if not archive_path:
+            return FileSystemOutputBackend()
+        return ArchiveOutputBackend(
+                archive_path=archive_path,
+                release_root=config.BASE_RELEASE_DIR,
+                max_workers=config.ARCHIVE_MAX_WORKERS,
+                compression_level=config.ARCHIVE_COMPRESSION_LEVEL,
+                spool_max_bytes=config.ARCHIVE_SPOOL_MAX_BYTES
+            )
+
+    def record_release_ledger(self, release_handler) -> None:
+        """
+        Record a completed build in the release ledger. The bundle is already written, a ledger error is only logged.
+        """
+        try:
+            release_handler.record_release_ledger()
+        except Exception as e:
+            logger.error(f"Failed to record the build in the release ledger {self.release_ledger.ledger_path}: {e}")
+
+    def build(self, release_number, files_changed_with_tags=(), git_from_ref=None, git_to_ref=None, git_repo_path='.',
+              archive_path=None, output_backend=None) -> BuildMetrics:
+        """
+        Build a release bundle: create release directories, generate release files, and copy the changed files to them.
+        With git_from_ref and git_to_ref the changed files and versions come from the local git repository instead.
+        With archive_path the bundle is written as a .zip or .tar.gz archive instead of the release directory.
+        An output_backend, such as a MemoryOutputBackend for a dry run, replaces both.
+        Returns the build metrics. Raises ReleaseInputError for unusable inputs and ReleaseStageError when a stage fails.
+        """
+        # Per stage timings and counters, written as JSON and Prometheus textfile reports
+        build_metrics = BuildMetrics(release_number=release_number)
+        build_succeeded = False
+        source_reader = None
+        if output_backend is None:
+            output_backend = self.create_output_backend(archive_path=archive_path)
+        try:
+            # Read the changed files from git objects instead of the working tree
+            if git_from_ref and git_to_ref:
+                source_reader = GitSourceReader(
+                        repo_path=git_repo_path,
+                        from_ref=git_from_ref,
+                        to_ref=git_to_ref,
+                        git_executable=config.GIT_EXECUTABLE,
+                        version_tag_prefixes=[release_database['tag_prefix'] for release_database in config.RELEASE_DATABASES]
+                    )
+
+            release_handler = BGTReleaseHandler(
+                    files_changed_with_tags=list(files_changed_with_tags),
+                    release_number=release_number,
+                    encoding_cache=self.encoding_cache,
+                    template_engine=self.create_template_engine(release_number=release_number),
+                    template_registry=self.template_registry,
+                    build_metrics=build_metrics,
+                    source_reader=source_reader,
+                    output_backend=output_backend,
+                    release_ledger=self.release_ledger,
+                    # Cached files are linked into the release directory, archives and dry runs render everything
+                    artifact_cache=self.artifact_cache if isinstance(output_backend, FileSystemOutputBackend) else None,
+                    build_settings=build_settings()
+                )
+
+            # Declare the release stages with their dependencies and run independent stages concurrently.
+            # Only a release directory can be built incrementally.
+            stage_scheduler = StageScheduler(max_workers=config.STAGE_MAX_WORKERS, build_metrics=build_metrics)
+            add_release_stages(
+                stage_scheduler=stage_scheduler,
+                release_handler=release_handler,
+                use_git_source=source_reader is not None,
+                incremental_build=config.INCREMENTAL_BUILD and isinstance(output_backend, FileSystemOutputBackend)
+            )
+            stage_scheduler.run()
+            with build_metrics.stage('close_release_output'):
+                output_backend.close()
+            build_succeeded = True
+            # Only bundles written out are recorded, a dry run leaves no trace
+            if self.release_ledger and not isinstance(output_backend, MemoryOutputBackend):
+                with build_metrics.stage('record_release_ledger'):
+                    self.record_release_ledger(release_handler=release_handler)
+            logger.info("Release process completed successfully.")
+            return build_metrics
+
+        except ReleaseBuildError as e:
+            logger.error("Release build failed: %s", e, exc_info=True)
+            raise
+        except Exception as e:
+            logger.error("Release build failed: %s", e, exc_info=True)
+            raise ReleaseBuildError(f"Release build failed: {e}") from e
+        finally:
+            if not build_succeeded:
+                output_backend.close(succeeded=False)
+            if source_reader:
+                source_reader.close()
+            with build_metrics.stage('save_encoding_cache'):
+                self.encoding_cache.save()
+            write_build_metrics(build_metrics=build_metrics, build_succeeded=build_succeeded)
@@ -0,0 +1,50 @@
+import os
+import sys
+
+import pytest
+
+# The release builder runs from src/, its modules import each other as top level modules
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+from bgt_db_release_utils import FilesManager
+
+@pytest.fixture
+def files_manager():
+    return FilesManager()
+
+@pytest.fixture
+def write_sql(tmp_path):
+    """
+    Write a changed SQL file under tmp_path and return its path.
+    """
+    def write(file_name, sql_text, encoding='utf-8'):
+        file_path = tmp_path / file_name
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_bytes(sql_text.encode(encoding))
+        return str(file_path)
+    return write
+
+@pytest.fixture
+def release_workspace(tmp_path, monkeypatch):
+    """
+    Change to a working directory holding the version file of every database, with the templates of the repository
+    and the caches under tmp_path. Returns the working directory.
+    """
+    import config
+
+    template_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'file_templates')
+    cache_dir = tmp_path / 'cache'
+    monkeypatch.setattr(config, 'BASE_TEMPLATE_PATH', template_path)
+    monkeypatch.setattr(config, 'TEMPLATE_PACK_PATH', os.path.join(template_path, 'templates.pack.json'))
+    monkeypatch.setattr(config, 'ENCODING_CACHE_PATH', str(cache_dir / 'encoding_cache.json'))
+    monkeypatch.setattr(config, 'RELEASE_LEDGER_PATH', str(cache_dir / 'release_ledger.sqlite3'))
+    monkeypatch.setattr(config, 'ARTIFACT_CACHE_DIR', str(cache_dir / 'artifacts'))
+    monkeypatch.setattr(config, 'ENCODING_PREPASS', False)
+
+    working_dir = tmp_path / 'work'
+    for release_database in config.RELEASE_DATABASES:
+        version_file = working_dir / release_database['version_path']
+        version_file.parent.mkdir(parents=True, exist_ok=True)
+        version_file.write_text('old_version=1.0.0-b1\nnew_version=1.0.0-b2\n')
+    monkeypatch.chdir(working_dir)
+    return working_dir
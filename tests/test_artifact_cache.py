@@ -0,0 +1,118 @@
+import os
+import shutil
+
+import config
+from bgt_db_release_utils import ArtifactCache, FileSystemOutputBackend
+from release_builder import ReleaseBuilder
+
+def make_cache(tmp_path, max_bytes=1024 * 1024, builder_version='1'):
+    return ArtifactCache(cache_dir=str(tmp_path / 'artifacts'), max_bytes=max_bytes, builder_version=builder_version)
+
+def test_stored_artifact_is_restored_with_its_metadata(tmp_path):
+    artifact_cache = make_cache(tmp_path=tmp_path)
+    artifact_path = tmp_path / 'views.sql'
+    artifact_path.write_bytes(b'CREATE VIEW dbo.v AS SELECT 1\n\n')
+    assert artifact_cache.store(fingerprint='views inputs', artifact_path=str(artifact_path), artifact_metadata={'scripts': 1})
+
+    target_path = tmp_path / 'release' / 'views.sql'
+    target_path.parent.mkdir()
+    target_path.write_bytes(b'stale')
+    assert artifact_cache.restore(fingerprint='views inputs', target_path=str(target_path)) == {'scripts': 1}
+    assert target_path.read_bytes() == b'CREATE VIEW dbo.v AS SELECT 1\n\n'
+
+    assert artifact_cache.restore(fingerprint='other inputs', target_path=str(tmp_path / 'other.sql')) is None
+    assert not (tmp_path / 'other.sql').exists()
+    # Another builder version does not reuse the artifact
+    assert make_cache(tmp_path=tmp_path, builder_version='2').restore(fingerprint='views inputs',
+                                                                       target_path=str(tmp_path / 'v2.sql')) is None
+
+def test_rewriting_a_restored_file_leaves_the_cache_entry_intact(tmp_path):
+    artifact_cache = make_cache(tmp_path=tmp_path)
+    artifact_path = tmp_path / 'views.sql'
+    artifact_path.write_bytes(b'cached')
+    artifact_cache.store(fingerprint='views inputs', artifact_path=str(artifact_path))
+    target_path = tmp_path / 'restored.sql'
+    artifact_cache.restore(fingerprint='views inputs', target_path=str(target_path))
+
+    FileSystemOutputBackend().write_bytes(file_path=str(target_path), file_content=b'rebuilt')
+    assert target_path.read_bytes() == b'rebuilt'
+    assert artifact_cache.restore(fingerprint='views inputs', target_path=str(tmp_path / 'again.sql')) == {}
+    assert (tmp_path / 'again.sql').read_bytes() == b'cached'
+
+def test_writing_into_a_restored_file_leaves_the_cache_entry_intact(tmp_path):
+    artifact_cache = make_cache(tmp_path=tmp_path)
+    artifact_path = tmp_path / 'views.sql'
+    artifact_path.write_bytes(b'cached')
+    artifact_cache.store(fingerprint='views inputs', artifact_path=str(artifact_path))
+    target_path = tmp_path / 'restored.sql'
+    artifact_cache.restore(fingerprint='views inputs', target_path=str(target_path))
+
+    # Edited in place, as a deployment tool or an editor would
+    with open(target_path, 'ab') as af:
+        af.write(b' and edited')
+    assert artifact_cache.restore(fingerprint='views inputs', target_path=str(tmp_path / 'again.sql')) == {}
+    assert (tmp_path / 'again.sql').read_bytes() == b'cached'
+
+def test_default_build_does_not_use_the_cache(release_workspace, write_sql):
+    view = os.path.relpath(write_sql('work/datatrak_bgt_agt/views/v_orders.sql', 'CREATE OR ALTER VIEW dbo.v_orders AS SELECT 1\nGO\n'))
+    build_metrics = ReleaseBuilder().build(release_number='42', files_changed_with_tags=[view])
+    assert build_metrics.report()['counters'].get('artifact_cache_misses', 0) == 0
+    assert not os.path.exists(config.ARTIFACT_CACHE_DIR)
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    artifact_cache = make_cache(tmp_path=tmp_path, max_bytes=2500)
+    for entry_index in range(3):
+        artifact_path = tmp_path / f"artifact_{entry_index}.sql"
+        artifact_path.write_bytes(b'x' * 1000)
+        artifact_cache.store(fingerprint=f"inputs {entry_index}", artifact_path=str(artifact_path))
+        entry_path = artifact_cache.entry_path(artifact_key=artifact_cache.artifact_key(fingerprint=f"inputs {entry_index}"))
+        os.utime(entry_path, ns=(entry_index * 10 ** 9, entry_index * 10 ** 9))
+    # Using the oldest entry makes the second one the least recently used
+    assert artifact_cache.restore(fingerprint='inputs 0', target_path=str(tmp_path / 'restored.sql')) is not None
+
+    assert artifact_cache.evict() == 1
+    assert [artifact_cache.restore(fingerprint=f"inputs {entry_index}", target_path=str(tmp_path / f"r{entry_index}.sql")) is not None
+            for entry_index in range(3)] == [True, False, True]
+
+def test_file_hash_is_reused_until_the_file_changes(tmp_path):
+    artifact_cache = make_cache(tmp_path=tmp_path)
+    input_path = tmp_path / 'input.sql'
+    input_path.write_bytes(b'SELECT 1')
+    first_hash = artifact_cache.hash_file(file_path=str(input_path))
+    assert artifact_cache.hash_file(file_path=str(input_path)) == first_hash
+    input_path.write_bytes(b'SELECT 22')
+    assert artifact_cache.hash_file(file_path=str(input_path)) != first_hash
+
+def release_files(release_root):
+    return {
+        str(release_path.relative_to(release_root)): release_path.read_bytes()
+        for release_path in release_root.rglob('*') if release_path.is_file() and not release_path.name.endswith('.manifest.json')
+    }
+
+def test_another_working_directory_reuses_the_cached_release_files(release_workspace, write_sql, monkeypatch):
+    monkeypatch.setattr(config, 'TEMPLATE_DATETIME_FORMAT', 'build time')
+    monkeypatch.setattr(config, 'INCREMENTAL_BUILD', False)
+    monkeypatch.setattr(config, 'ARTIFACT_CACHE', True)
+    monkeypatch.setattr(config, 'CHECKSUM_MANIFEST', True)
+    view = os.path.relpath(write_sql('work/datatrak_bgt_agt/views/v_orders.sql', 'CREATE OR ALTER VIEW dbo.v_orders AS SELECT 1\nGO\n'))
+    first_metrics = ReleaseBuilder().build(release_number='42', files_changed_with_tags=[view])
+    first_release = release_files(release_root=release_workspace / 'release')
+    assert first_metrics.report()['counters']['artifact_cache_hits'] == 0
+
+    # A second checkout of the same inputs
+    other_workspace = release_workspace.parent / 'other'
+    shutil.copytree(release_workspace, other_workspace, ignore=shutil.ignore_patterns('release'))
+    monkeypatch.chdir(other_workspace)
+    second_metrics = ReleaseBuilder().build(release_number='42', files_changed_with_tags=[view])
+    assert release_files(release_root=other_workspace / 'release') == first_release
+    assert second_metrics.report()['counters']['artifact_cache_hits'] > 0
+    assert second_metrics.report()['counters']['artifact_cache_misses'] == 0
+
+    # A changed input misses the cache for its release file only, and changes the checksum manifest covering it
+    (other_workspace / view).write_text('CREATE OR ALTER VIEW dbo.v_orders AS SELECT 2\nGO\n')
+    shutil.rmtree(other_workspace / 'release')
+    third_metrics = ReleaseBuilder().build(release_number='42', files_changed_with_tags=[view])
+    third_release = release_files(release_root=other_workspace / 'release')
+    changed_files = {release_path for release_path in third_release if third_release[release_path] != first_release[release_path]}
+    assert {os.path.basename(release_path) for release_path in changed_files} == {'5_datatrak_views_scripts.sql', 'MANIFEST.json'}
+    assert third_metrics.report()['counters']['artifact_cache_misses'] > 0
@@ -0,0 +1,65 @@
+import os
+import sys
+import codecs
+import argparse
+
+BENCHMARKS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks')
+sys.path.insert(0, BENCHMARKS_DIR)
+
+from synthetic_sql_repository import SyntheticSqlRepository
+import run_benchmarks
+
+def generate(root_dir, seed=0, encoding_weights=None):
+    synthetic_repository = SyntheticSqlRepository(
+        root_dir=str(root_dir),
+        database_names=['datatrak_bgt_agt', 'datatrak_bgt_awb'],
+        category_counts={'views': 3, 'insert_statements': 2},
+        file_size=4096,
+        encoding_weights=encoding_weights or {'utf-8': 1, 'utf-8-bom': 1, 'utf-16le': 1, 'cp1252': 1},
+        large_insert_files=1,
+        large_insert_size=64 * 1024,
+        seed=seed
+    )
+    return synthetic_repository, synthetic_repository.generate()
+
+def test_generator_writes_the_requested_tree(tmp_path):
+    synthetic_repository, changed_files = generate(root_dir=tmp_path)
+    assert len(changed_files) == 2 * (3 + 2 + 1)
+    assert os.path.join('datatrak_bgt_agt', 'insert_statements', 'insert_statements_large_0.sql') in changed_files
+    assert (tmp_path / 'datatrak_bgt_awb' / 'version.txt').is_file()
+    assert synthetic_repository.generated_bytes == sum((tmp_path / changed_file).stat().st_size for changed_file in changed_files)
+    for changed_file in changed_files:
+        file_size = (tmp_path / changed_file).stat().st_size
+        target_size = 64 * 1024 if 'large' in changed_file else 4096
+        assert target_size <= file_size < target_size * 2
+
+def test_generator_writes_each_encoding(tmp_path):
+    _, changed_files = generate(root_dir=tmp_path / 'bom', encoding_weights={'utf-16le': 1})
+    view_files = [changed_file for changed_file in changed_files if changed_file.split(os.sep)[1] == 'views']
+    for view_file in view_files:
+        file_content = (tmp_path / 'bom' / view_file).read_bytes()
+        assert file_content.startswith(codecs.BOM_UTF16_LE)
+        assert 'déjà vu' in file_content.decode('utf-16')
+
+def test_generator_is_deterministic(tmp_path):
+    _, first_files = generate(root_dir=tmp_path / 'first', seed=7)
+    _, second_files = generate(root_dir=tmp_path / 'second', seed=7)
+    assert first_files == second_files
+    for changed_file in first_files:
+        assert (tmp_path / 'first' / changed_file).read_bytes() == (tmp_path / 'second' / changed_file).read_bytes()
+
+def test_regressions_are_reported_past_the_tolerance():
+    report = {'results': {'main': {'wall_s': 1.25}, 'copy_sql_files': {'wall_s': 0.5}}}
+    baseline = {'results': {'main': {'wall_s': 1.0}, 'copy_sql_files': {'wall_s': 0.5}, 'removed': {'wall_s': 1.0}}}
+    regressions = run_benchmarks.compare_with_baseline(report=report, baseline=baseline, tolerance=0.1)
+    assert len(regressions) == 1 and regressions[0].startswith('main:')
+    assert report['results']['copy_sql_files']['baseline_ratio'] == 1.0
+
+def test_small_benchmark_runs_every_measurement(tmp_path):
+    args = argparse.Namespace(preset='small', files_per_category=2, file_size=1024, large_insert_files=0, large_insert_size=None,
+                              category_count=[], encodings='utf-8=1,cp1252=1', seed=0, repeat=1,
+                              templates=os.path.join(os.path.dirname(BENCHMARKS_DIR), 'src', 'file_templates'),
+                              work_dir=str(tmp_path), keep=False)
+    report = run_benchmarks.run_benchmarks(args=args)
+    assert report['results']['main']['files'] == 2 * 2 * 8
+    assert report['results']['copy_sql_files']['wall_s'] > 0
@@ -0,0 +1,47 @@
+import io
+import json
+import signal
+import socket
+from types import SimpleNamespace
+
+from build_daemon import BuildDaemon, BuildRequestHandler
+
+def answer(build_request_line, server):
+    request_handler = BuildRequestHandler.__new__(BuildRequestHandler)
+    request_handler.rfile = io.BytesIO(build_request_line)
+    request_handler.wfile = io.BytesIO()
+    request_handler.server = server
+    request_handler.handle()
+    return json.loads(request_handler.wfile.getvalue())
+
+def test_invalid_request_is_answered():
+    build_response = answer(build_request_line=b'not json\n', server=None)
+    assert build_response['status'] == 'failed'
+    assert build_response['error_type'] == 'InvalidRequest'
+
+def test_missing_working_dir_is_answered(tmp_path):
+    server = SimpleNamespace(release_builder=None)
+    server.run_build = lambda **build_request: BuildDaemon.run_build(server, **build_request)
+    build_request = {'working_dir': str(tmp_path / 'missing'), 'arguments': ['42']}
+    build_response = answer(build_request_line=json.dumps(build_request).encode('utf-8') + b'\n', server=server)
+    assert build_response['status'] == 'failed'
+    assert build_response['error_type'] == 'FileNotFoundError'
+    assert build_response['stage'] is None
+
+def test_build_process_does_not_inherit_the_server_sigterm_handler(tmp_path):
+    build_daemon = BuildDaemon(socket_path=str(tmp_path / 'daemon.sock'), release_builder=None, max_children=1)
+    server_handler = signal.getsignal(signal.SIGTERM)
+    server_socket, client_socket = socket.socketpair()
+    try:
+        signal.signal(signal.SIGTERM, lambda signal_number, frame: None)
+        client_socket.sendall(b'not json\n')
+        # ForkingMixIn serves the request through finish_request in the forked process
+        build_daemon.finish_request(request=server_socket, client_address=None)
+        assert signal.getsignal(signal.SIGTERM) == signal.SIG_DFL
+        with client_socket.makefile('rb') as response_stream:
+            assert json.loads(response_stream.readline())['error_type'] == 'InvalidRequest'
+    finally:
+        signal.signal(signal.SIGTERM, server_handler)
+        server_socket.close()
+        client_socket.close()
+        build_daemon.server_close()
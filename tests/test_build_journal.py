@@ -0,0 +1,187 @@
+import os
+import json
+import shutil
+
+import pytest
+
+import config
+from bgt_db_release_utils import BuildJournal, FilesManager, ReleaseStageError
+from bgt_db_release_utils.output_backend import STAGING_SUFFIX
+from release_builder import ReleaseBuilder
+
+VIEW_NAMES = ['v_orders', 'v_lines', 'v_customers', 'v_invoices']
+VIEWS_RELEASE_FILE = 'datatrak_bgt_agt/5_datatrak_views_scripts.sql'
+
+def journal_lines(journal_path):
+    with open(journal_path, 'r', encoding='utf-8') as rf:
+        return rf.readlines()
+
+def test_journal_is_replayed_on_load(tmp_path):
+    journal_path = str(tmp_path / 'bundle.journal')
+    build_journal = BuildJournal(journal_path=journal_path)
+    build_journal.record_file_started(release_file_path='views.sql', fingerprint='views inputs', header_size=10)
+    build_journal.record_script(release_file_path='views.sql', source_path='a.sql', offset=10, length=5, end=17)
+    build_journal.record_file_started(release_file_path='tables.sql', fingerprint='tables inputs', header_size=20)
+    build_journal.record_file_completed(release_file_path='tables.sql', fingerprint='tables inputs', plan_entry={'scripts': 0})
+    build_journal.record_script(release_file_path='views.sql', source_path='b.sql', offset=17, length=5, end=24)
+
+    loaded_journal = BuildJournal(journal_path=journal_path)
+    loaded_journal.load()
+    assert loaded_journal.started_file(release_file_path='views.sql', fingerprint='views inputs') == {
+        'fingerprint': 'views inputs',
+        'header_size': 10,
+        'scripts': [{'source': 'a.sql', 'offset': 10, 'length': 5, 'end': 17},
+                    {'source': 'b.sql', 'offset': 17, 'length': 5, 'end': 24}]
+    }
+    assert loaded_journal.completed_file(release_file_path='tables.sql', fingerprint='tables inputs')['plan_entry'] == {'scripts': 0}
+    assert loaded_journal.started_file(release_file_path='tables.sql', fingerprint='tables inputs') is None
+    # Work done from other inputs is not reused
+    assert loaded_journal.started_file(release_file_path='views.sql', fingerprint='changed inputs') is None
+    assert loaded_journal.completed_file(release_file_path='tables.sql', fingerprint='changed inputs') is None
+
+def test_line_cut_short_and_other_versions_are_ignored(tmp_path):
+    journal_path = tmp_path / 'bundle.journal'
+    build_journal = BuildJournal(journal_path=str(journal_path))
+    build_journal.record_file_started(release_file_path='views.sql', fingerprint='views inputs', header_size=10)
+    build_journal.record_script(release_file_path='views.sql', source_path='a.sql', offset=10, length=5, end=17)
+    build_journal.record_script(release_file_path='views.sql', source_path='b.sql', offset=17, length=5, end=24)
+    build_journal.journal_file.close()
+    written_lines = journal_lines(journal_path=str(journal_path))
+    future_entry = json.dumps({'type': 'completed', 'release_file': 'views.sql', 'fingerprint': 'views inputs', 'version': 99})
+    journal_path.write_text(''.join(written_lines[:2]) + future_entry + '\n' + written_lines[2][:20], encoding='utf-8')
+
+    loaded_journal = BuildJournal(journal_path=str(journal_path))
+    loaded_journal.load()
+    started_file = loaded_journal.started_file(release_file_path='views.sql', fingerprint='views inputs')
+    assert [script['source'] for script in started_file['scripts']] == ['a.sql']
+    assert loaded_journal.completed_files == {}
+
+def test_starting_a_file_again_discards_its_earlier_entries(tmp_path):
+    build_journal = BuildJournal(journal_path=str(tmp_path / 'bundle.journal'))
+    build_journal.apply_entry(journal_entry={'type': 'started', 'release_file': 'views.sql', 'fingerprint': 'old', 'header_size': 10})
+    build_journal.apply_entry(journal_entry={'type': 'script', 'release_file': 'views.sql', 'source': 'a.sql',
+                                             'offset': 10, 'length': 5, 'end': 17})
+    build_journal.apply_entry(journal_entry={'type': 'completed', 'release_file': 'views.sql', 'fingerprint': 'old'})
+    build_journal.apply_entry(journal_entry={'type': 'started', 'release_file': 'views.sql', 'fingerprint': 'new', 'header_size': 12})
+    assert build_journal.completed_file(release_file_path='views.sql', fingerprint='old') is None
+    assert build_journal.started_file(release_file_path='views.sql', fingerprint='new') == {
+        'fingerprint': 'new', 'header_size': 12, 'scripts': []
+    }
+    # A script of a file that was not started is dropped
+    build_journal.apply_entry(journal_entry={'type': 'script', 'release_file': 'other.sql', 'source': 'b.sql',
+                                             'offset': 0, 'length': 1, 'end': 2})
+    assert 'other.sql' not in build_journal.started_files
+
+def test_remove_closes_and_deletes_the_journal(tmp_path):
+    journal_path = tmp_path / 'bundle.journal'
+    build_journal = BuildJournal(journal_path=str(journal_path))
+    build_journal.remove()
+    build_journal.record_file_started(release_file_path='views.sql', fingerprint='views inputs', header_size=10)
+    assert journal_path.exists()
+    build_journal.remove()
+    assert not journal_path.exists()
+    assert build_journal.journal_file is None
+
+def write_views(write_sql):
+    return [
+        os.path.relpath(write_sql(f"work/datatrak_bgt_agt/views/{view_name}.sql",
+                                  f"CREATE OR ALTER VIEW dbo.{view_name} AS SELECT '{view_name}' AS name\r\nGO\r\n"))
+        for view_name in VIEW_NAMES
+    ]
+
+def bundle_files(bundle_dir):
+    return {
+        str(bundle_path.relative_to(bundle_dir)).replace(os.sep, '/'): bundle_path.read_bytes()
+        for bundle_path in bundle_dir.rglob('*') if bundle_path.is_file()
+    }
+
+@pytest.fixture
+def journaled_build(release_workspace, monkeypatch):
+    """
+    Build on one copy worker without the artifact cache, so only the journal carries work over between builds.
+    Returns the bundle directory.
+    """
+    monkeypatch.setattr(config, 'TEMPLATE_DATETIME_FORMAT', 'build time')
+    monkeypatch.setattr(config, 'ARTIFACT_CACHE', False)
+    monkeypatch.setattr(config, 'INCREMENTAL_BUILD', True)
+    monkeypatch.setattr(config, 'BUILD_JOURNAL', True)
+    monkeypatch.setattr(config, 'SQL_BATCH_INDEX', True)
+    monkeypatch.setattr(config, 'COPY_MAX_WORKERS', 1)
+    return release_workspace / config.BASE_RELEASE_DIR / 'AWB_1.0.0-B2_AGT_1.0.0-B2'
+
+def interrupt_the_copy(monkeypatch, failing_view):
+    """
+    Make the copy of failing_view fail as if the build was killed there. Returns the copied source paths.
+    """
+    copied_files = []
+    copy_file = FilesManager.copy_file
+
+    def failing_copy_file(self, target_file_path, *args, **kwargs):
+        if os.path.basename(target_file_path) == f"{failing_view}.sql":
+            raise RuntimeError('build killed')
+        copied_files.append(target_file_path)
+        return copy_file(self, target_file_path, *args, **kwargs)
+    monkeypatch.setattr(FilesManager, 'copy_file', failing_copy_file)
+    return copied_files
+
+def test_interrupted_build_resumes_after_the_journaled_scripts(journaled_build, write_sql, monkeypatch):
+    changed_files = write_views(write_sql=write_sql)
+    ReleaseBuilder().build(release_number='42', files_changed_with_tags=changed_files)
+    baseline_files = bundle_files(bundle_dir=journaled_build)
+    shutil.rmtree(journaled_build.parent)
+
+    with monkeypatch.context() as interrupted:
+        interrupt_the_copy(monkeypatch=interrupted, failing_view='v_customers')
+        with pytest.raises(ReleaseStageError):
+            ReleaseBuilder().build(release_number='42', files_changed_with_tags=changed_files)
+    journal_path = f"{journaled_build}.journal"
+    staged_path = journaled_build / (VIEWS_RELEASE_FILE + STAGING_SUFFIX)
+    assert os.path.exists(journal_path)
+    assert staged_path.exists()
+    assert not (journaled_build / VIEWS_RELEASE_FILE).exists()
+    # Bytes written after the last journaled script are cut off by the resumed build
+    with open(staged_path, 'ab') as af:
+        af.write(b'CREATE OR ALTER VIEW dbo.v_cust')
+
+    with monkeypatch.context() as resumed:
+        copied_files = interrupt_the_copy(monkeypatch=resumed, failing_view='no_such_view')
+        build_metrics = ReleaseBuilder().build(release_number='42', files_changed_with_tags=changed_files)
+    assert [os.path.basename(copied_file) for copied_file in copied_files] == ['v_customers.sql', 'v_invoices.sql']
+    assert build_metrics.report()['counters']['journal_resumed_scripts'] == 2
+    assert bundle_files(bundle_dir=journaled_build) == baseline_files
+    assert not os.path.exists(journal_path)
+    assert not staged_path.exists()
+
+def test_changed_inputs_are_not_resumed(journaled_build, write_sql, monkeypatch):
+    changed_files = write_views(write_sql=write_sql)
+    with monkeypatch.context() as interrupted:
+        interrupt_the_copy(monkeypatch=interrupted, failing_view='v_invoices')
+        with pytest.raises(ReleaseStageError):
+            ReleaseBuilder().build(release_number='42', files_changed_with_tags=changed_files)
+
+    write_sql('work/datatrak_bgt_agt/views/v_orders.sql', 'CREATE OR ALTER VIEW dbo.v_orders AS SELECT 2 AS name\r\nGO\r\n')
+    with monkeypatch.context() as resumed:
+        copied_files = interrupt_the_copy(monkeypatch=resumed, failing_view='no_such_view')
+        build_metrics = ReleaseBuilder().build(release_number='42', files_changed_with_tags=changed_files)
+    assert len(copied_files) == len(VIEW_NAMES)
+    assert build_metrics.report()['counters'].get('journal_resumed_scripts', 0) == 0
+    views_text = (journaled_build / VIEWS_RELEASE_FILE).read_text(encoding='utf-8')
+    assert 'SELECT 2 AS name' in views_text
+    assert "SELECT 'v_orders'" not in views_text
+
+def test_disabled_journal_discards_the_interrupted_build(journaled_build, write_sql, monkeypatch):
+    changed_files = write_views(write_sql=write_sql)
+    with monkeypatch.context() as interrupted:
+        interrupt_the_copy(monkeypatch=interrupted, failing_view='v_invoices')
+        with pytest.raises(ReleaseStageError):
+            ReleaseBuilder().build(release_number='42', files_changed_with_tags=changed_files)
+    assert os.path.exists(f"{journaled_build}.journal")
+
+    monkeypatch.setattr(config, 'BUILD_JOURNAL', False)
+    with monkeypatch.context() as resumed:
+        copied_files = interrupt_the_copy(monkeypatch=resumed, failing_view='no_such_view')
+        ReleaseBuilder().build(release_number='42', files_changed_with_tags=changed_files)
+    assert len(copied_files) == len(VIEW_NAMES)
+    assert not os.path.exists(f"{journaled_build}.journal")
+    assert not (journaled_build / (VIEWS_RELEASE_FILE + STAGING_SUFFIX)).exists()
+    assert "SELECT 'v_invoices'" in (journaled_build / VIEWS_RELEASE_FILE).read_text(encoding='utf-8')
@@ -0,0 +1,53 @@
+import os
+import json
+
+import pytest
+
+import config
+from bgt_db_release_utils import BuildMetrics
+from release_builder import ReleaseBuilder
+
+def test_stages_are_timed_and_failures_recorded():
+    build_metrics = BuildMetrics(release_number='42')
+    with build_metrics.stage('copy_sql_files'):
+        pass
+    with pytest.raises(ValueError):
+        with build_metrics.stage('write_deployment_plan'):
+            raise ValueError('broken')
+    build_metrics.increment(counter_name='files_processed', amount=3)
+    build_metrics.finish(succeeded=False)
+
+    build_report = build_metrics.report()
+    assert build_report['status'] == 'failed'
+    assert [(stage_name, stage['status']) for stage_name, stage in build_report['stages'].items()] \
+        == [('copy_sql_files', 'succeeded'), ('write_deployment_plan', 'failed')]
+    assert build_report['counters']['files_processed'] == 3
+    # Every build counter is reported, even at zero
+    assert build_report['counters']['encoding_cache_hits'] == 0
+
+def test_prometheus_textfile_has_a_sample_per_stage_and_counter():
+    build_metrics = BuildMetrics(release_number='42')
+    with build_metrics.stage('copy_sql_files:agt'):
+        pass
+    build_metrics.finish(succeeded=True)
+    samples = [line for line in build_metrics.prometheus_text().splitlines() if not line.startswith('#')]
+    assert 'bgt_release_build_success{release="42"} 1' in samples
+    assert any(sample.startswith('bgt_release_stage_wall_seconds{release="42",stage="copy_sql_files:agt"} ') for sample in samples)
+    assert 'bgt_release_build_files_written{release="42"} 0' in samples
+
+def test_reports_are_only_written_when_configured(release_workspace, write_sql, monkeypatch, tmp_path):
+    view = write_sql('work/datatrak_bgt_agt/views/v_orders.sql', 'CREATE OR ALTER VIEW dbo.v_orders AS SELECT 1\nGO\n')
+    ReleaseBuilder().build(release_number='42', files_changed_with_tags=[os.path.relpath(view)])
+    assert not list(release_workspace.glob('*metrics*'))
+
+    metrics_json_path = tmp_path / 'metrics' / 'build_metrics.json'
+    monkeypatch.setattr(config, 'METRICS_JSON_PATH', str(metrics_json_path))
+    monkeypatch.setattr(config, 'METRICS_PROMETHEUS_PATH', str(tmp_path / 'metrics' / 'build.prom'))
+    monkeypatch.setattr(config, 'INCREMENTAL_BUILD', False)
+    monkeypatch.setattr(config, 'ARTIFACT_CACHE', False)
+    ReleaseBuilder().build(release_number='42', files_changed_with_tags=[os.path.relpath(view)])
+    build_report = json.loads(metrics_json_path.read_text())
+    assert build_report['status'] == 'succeeded'
+    assert build_report['counters']['files_processed'] == 1
+    assert 'copy_sql_files:agt' in build_report['stages']
+    assert (tmp_path / 'metrics' / 'build.prom').is_file()
@@ -0,0 +1,126 @@
+import os
+import json
+import shutil
+import hashlib
+
+import pytest
+
+import config
+from bgt_db_release_utils import ChecksumManifest, ReleaseInputError
+from release_builder import ReleaseBuilder
+
+@pytest.fixture
+def checksum_manifest_build(release_workspace, monkeypatch):
+    monkeypatch.setattr(config, 'CHECKSUM_MANIFEST', True)
+    return release_workspace
+
+def assert_manifest_matches_the_bundle(bundle_dir, algorithms=('sha256',)):
+    """
+    Check that MANIFEST.json lists every other file of the bundle with its actual size and digests.
+    Returns the manifest.
+    """
+    manifest = json.loads((bundle_dir / config.CHECKSUM_MANIFEST_FILE).read_text(encoding='utf-8'))
+    bundle_files = {
+        str(bundle_path.relative_to(bundle_dir)).replace(os.sep, '/'): bundle_path.read_bytes()
+        for bundle_path in bundle_dir.rglob('*') if bundle_path.is_file() and bundle_path.name != config.CHECKSUM_MANIFEST_FILE
+    }
+    assert sorted(manifest['files']) == sorted(bundle_files)
+    for relative_path, file_content in bundle_files.items():
+        file_entry = manifest['files'][relative_path]
+        assert file_entry['size'] == len(file_content), relative_path
+        for algorithm in algorithms:
+            assert file_entry[algorithm] == hashlib.new(algorithm, file_content).hexdigest(), relative_path
+    assert manifest['total_size'] == sum(len(file_content) for file_content in bundle_files.values())
+    return manifest
+
+def write_views(write_sql, select_value=1):
+    return [
+        os.path.relpath(write_sql(f"work/datatrak_bgt_agt/views/{view_name}.sql",
+                                  f"CREATE OR ALTER VIEW dbo.{view_name} AS SELECT {select_value} AS value\r\nGO\r\n", encoding=encoding))
+        for view_name, encoding in (('v_orders', 'utf-8'), ('v_lines', 'utf-16'))
+    ]
+
+def test_manifest_covers_every_file_of_the_bundle(checksum_manifest_build, release_workspace, write_sql, monkeypatch):
+    monkeypatch.setattr(config, 'CHECKSUM_MANIFEST_ALGORITHMS', ['sha256', 'blake2b'])
+    changed_files = write_views(write_sql=write_sql)
+    ReleaseBuilder().build(release_number='42', files_changed_with_tags=changed_files)
+    (bundle_dir,) = [path for path in release_workspace.glob('release/*') if path.is_dir()]
+    manifest = assert_manifest_matches_the_bundle(bundle_dir=bundle_dir, algorithms=('sha256', 'blake2b'))
+
+    # The sources point at the bytes copied from each changed file
+    views_path = 'datatrak_bgt_agt/5_datatrak_views_scripts.sql'
+    views_bytes = (bundle_dir / views_path).read_bytes()
+    copied_sources = [source for source in manifest['files'][views_path]['sources'] if 'offset' in source]
+    assert [source['path'] for source in copied_sources] == changed_files
+    for source in copied_sources:
+        view_name = os.path.splitext(os.path.basename(source['path']))[0]
+        assert views_bytes[source['offset']:source['offset'] + source['length']] \
+            == f"CREATE OR ALTER VIEW dbo.{view_name} AS SELECT 1 AS value\nGO\n".encode('utf-8')
+
+def test_incremental_build_keeps_the_manifest_in_step(checksum_manifest_build, release_workspace, write_sql, monkeypatch):
+    monkeypatch.setattr(config, 'INCREMENTAL_BUILD', True)
+    monkeypatch.setattr(config, 'ARTIFACT_CACHE', False)
+    changed_files = write_views(write_sql=write_sql)
+    ReleaseBuilder().build(release_number='42', files_changed_with_tags=changed_files)
+    (bundle_dir,) = [path for path in release_workspace.glob('release/*') if path.is_dir()]
+    first_manifest = (bundle_dir / config.CHECKSUM_MANIFEST_FILE).read_bytes()
+
+    ReleaseBuilder().build(release_number='42', files_changed_with_tags=changed_files)
+    assert (bundle_dir / config.CHECKSUM_MANIFEST_FILE).read_bytes() == first_manifest
+
+    write_views(write_sql=write_sql, select_value=2)
+    ReleaseBuilder().build(release_number='42', files_changed_with_tags=changed_files)
+    assert (bundle_dir / config.CHECKSUM_MANIFEST_FILE).read_bytes() != first_manifest
+    assert_manifest_matches_the_bundle(bundle_dir=bundle_dir)
+
+def test_files_restored_from_the_artifact_cache_are_covered(checksum_manifest_build, release_workspace, write_sql, monkeypatch):
+    monkeypatch.setattr(config, 'INCREMENTAL_BUILD', False)
+    monkeypatch.setattr(config, 'ARTIFACT_CACHE', True)
+    changed_files = write_views(write_sql=write_sql)
+    ReleaseBuilder().build(release_number='42', files_changed_with_tags=changed_files)
+    shutil.rmtree(release_workspace / 'release')
+    ReleaseBuilder().build(release_number='42', files_changed_with_tags=changed_files)
+    (bundle_dir,) = [path for path in release_workspace.glob('release/*') if path.is_dir()]
+    assert_manifest_matches_the_bundle(bundle_dir=bundle_dir)
+
+def test_default_build_writes_no_manifest(release_workspace, write_sql):
+    ReleaseBuilder().build(release_number='42', files_changed_with_tags=write_views(write_sql=write_sql))
+    (bundle_dir,) = [path for path in release_workspace.glob('release/*') if path.is_dir()]
+    assert (bundle_dir / 'datatrak_bgt_agt' / '5_datatrak_views_scripts.sql').exists()
+    assert not (bundle_dir / config.CHECKSUM_MANIFEST_FILE).exists()
+
+def test_manifest_is_canonical(tmp_path):
+    bundle_dir = tmp_path / 'bundle'
+    manifests = []
+    for file_names in (['b.sql', 'a.sql'], ['a.sql', 'b.sql']):
+        checksum_manifest = ChecksumManifest(bundle_path=str(bundle_dir))
+        for file_name in file_names:
+            checksum_manifest.record_write(file_path=str(bundle_dir / file_name), file_content=b'SELECT 1\n')
+            checksum_manifest.record_append(file_path=str(bundle_dir / file_name), data=b'SELECT 2\n', source_path='v.sql')
+            checksum_manifest.record_append(file_path=str(bundle_dir / file_name), data=b'SELECT 3\n', source_path='v.sql')
+        manifests.append(checksum_manifest.to_json())
+    assert manifests[0] == manifests[1]
+    manifest = json.loads(manifests[0])
+    assert list(manifest['files']) == ['a.sql', 'b.sql']
+    assert manifest['files']['a.sql']['sources'] == [{'path': 'v.sql', 'offset': 9, 'length': 18}]
+    assert manifest['files']['a.sql']['sha256'] == hashlib.sha256(b'SELECT 1\nSELECT 2\nSELECT 3\n').hexdigest()
+
+def test_files_appended_without_a_write_are_hashed_from_disk(tmp_path):
+    bundle_dir = tmp_path / 'bundle'
+    bundle_dir.mkdir()
+    (bundle_dir / 'kept.sql').write_bytes(b'SELECT 1\nSELECT 2\n')
+    checksum_manifest = ChecksumManifest(bundle_path=str(bundle_dir))
+    checksum_manifest.record_append(file_path=str(bundle_dir / 'kept.sql'), data=b'SELECT 2\n')
+    # Outside the bundle and the manifest itself are not listed
+    checksum_manifest.record_write(file_path=str(tmp_path / 'guide.docx'), file_content=b'docx')
+    checksum_manifest.record_write(file_path=str(bundle_dir / 'MANIFEST.json'), file_content=b'{}')
+    assert checksum_manifest.file_entry(file_path=str(bundle_dir / 'kept.sql')) is None
+    assert checksum_manifest.manifest()['files'] == {}
+
+    checksum_manifest.add_existing_files()
+    assert checksum_manifest.manifest()['files']['kept.sql']['sha256'] == hashlib.sha256(b'SELECT 1\nSELECT 2\n').hexdigest()
+    assert checksum_manifest.hashed_count == 1
+
+def test_unknown_algorithm_is_refused(tmp_path):
+    with pytest.raises(ReleaseInputError):
+        ChecksumManifest(bundle_path=str(tmp_path), algorithms=('sha256', 'crc1024'))
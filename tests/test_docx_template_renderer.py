@@ -0,0 +1,76 @@
+import io
+import os
+import zipfile
+
+import pytest
+
+from bgt_db_release_utils import DocxTemplateRenderer, FilesManager
+
+docx = pytest.importorskip('docx')
+
+DEPLOY_GUIDE_TEMPLATE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'file_templates',
+                                     'BGT MsSQL DBs Release Deployment Guide.docx')
+
+def make_template(template_path):
+    """
+    Write a document with a placeholder split across runs, one in a table and one in the page header.
+    """
+    document = docx.Document()
+    paragraph = document.add_paragraph('Release ')
+    paragraph.add_run('file_').bold = True
+    paragraph.add_run('name, version version')
+    document.add_table(rows=1, cols=1).cell(0, 0).text = 'Bundle: file_name'
+    document.sections[0].header.paragraphs[0].text = 'Guide for version'
+    document.add_paragraph('No placeholder here')
+    document.save(template_path)
+
+def test_placeholders_are_replaced_across_runs(tmp_path):
+    template_path = str(tmp_path / 'template.docx')
+    make_template(template_path=template_path)
+    output_path = str(tmp_path / 'guide.docx')
+    rewritten_parts = DocxTemplateRenderer(replacements={'file_name': 'AWB_1 & AGT_2', 'version': '42'}).render(
+        template_path=template_path, output_path=output_path)
+    assert rewritten_parts == 2
+
+    document = docx.Document(output_path)
+    assert [paragraph.text for paragraph in document.paragraphs] == ['Release AWB_1 & AGT_2, 42 42', 'No placeholder here']
+    # The replacement takes the formatting of the run the placeholder starts in
+    assert document.paragraphs[0].runs[1].bold
+    assert document.tables[0].cell(0, 0).text == 'Bundle: AWB_1 & AGT_2'
+    assert document.sections[0].header.paragraphs[0].text == 'Guide for 42'
+
+def test_parts_without_placeholders_are_copied_unchanged(tmp_path):
+    template_path = str(tmp_path / 'template.docx')
+    make_template(template_path=template_path)
+    rendered_document = io.BytesIO()
+    DocxTemplateRenderer(replacements={'file_name': 'bundle'}).render_to_stream(template_path=template_path,
+                                                                                output_stream=rendered_document)
+    with zipfile.ZipFile(template_path) as template_zip, zipfile.ZipFile(rendered_document) as rendered_zip:
+        assert rendered_zip.namelist() == template_zip.namelist()
+        for member_name in template_zip.namelist():
+            if member_name != 'word/document.xml':
+                assert rendered_zip.read(member_name) == template_zip.read(member_name)
+
+def test_deploy_guide_text_matches_the_python_docx_renderer(tmp_path):
+    replacements = {'file_name': 'release/AWB_1.0.0-B2_AGT_1.0.0-B2', 'version': '42'}
+    xml_output = tmp_path / 'xml'
+    xml_output.mkdir()
+    python_docx_output = tmp_path / 'python_docx'
+    python_docx_output.mkdir()
+    files_manager = FilesManager()
+    files_manager.write_deploy_guide(deploy_guide_word_path=DEPLOY_GUIDE_TEMPLATE, word_doc_name=str(xml_output / 'guide.docx'),
+                                     document_content=render_with_xml(replacements=replacements))
+    files_manager.write_to_deploy_guide_word_with_python_docx(deploy_guide_word_path=DEPLOY_GUIDE_TEMPLATE,
+                                                              replace_dict=replacements,
+                                                              word_doc_name=str(python_docx_output / 'guide.docx'))
+    xml_paragraphs = [paragraph.text for paragraph in docx.Document(str(xml_output / 'guide.docx')).paragraphs]
+    python_docx_paragraphs = [paragraph.text for paragraph in docx.Document(str(python_docx_output / 'guide.docx')).paragraphs]
+    assert xml_paragraphs == python_docx_paragraphs
+    assert any(text.startswith('Unzip Update_AWB_AGT_42.zip file') for text in xml_paragraphs)
+    assert not any('file_name' in text for text in xml_paragraphs)
+
+def render_with_xml(replacements):
+    rendered_document = io.BytesIO()
+    DocxTemplateRenderer(replacements=replacements).render_to_stream(template_path=DEPLOY_GUIDE_TEMPLATE,
+                                                                     output_stream=rendered_document)
+    return rendered_document.getvalue()
@@ -0,0 +1,94 @@
+import os
+import json
+import hashlib
+
+import pytest
+
+import config
+import main
+from bgt_db_release_utils import ArchiveOutputBackend, FileSystemOutputBackend, MemoryOutputBackend, OutputBackend
+from release_builder import ReleaseBuilder
+
+def write_changed_files(write_sql):
+    return [
+        os.path.relpath(write_sql('work/datatrak_bgt_agt/views/v_orders.sql', 'CREATE OR ALTER VIEW dbo.v_orders AS SELECT 1\nGO\n')),
+        os.path.relpath(write_sql('work/datatrak_bgt_agt/views/v_lines.sql', "SELECT 'café' AS note\r\nGO\r\n", encoding='utf-16')),
+        os.path.relpath(write_sql('work/datatrak_bgt_awb/stored_procedures/p_sync.sql', 'CREATE OR ALTER PROCEDURE dbo.p_sync AS '
+                                                                                        'SELECT 1\nGO\n')),
+    ]
+
+def test_dry_run_writes_nothing_to_the_release_directory(release_workspace, write_sql, monkeypatch):
+    monkeypatch.setattr(config, 'TEMPLATE_DATETIME_FORMAT', 'build time')
+    monkeypatch.setattr(config, 'INCREMENTAL_BUILD', False)
+    changed_files = write_changed_files(write_sql=write_sql)
+    working_files = sorted(str(path) for path in release_workspace.rglob('*'))
+    output_backend = MemoryOutputBackend()
+    ReleaseBuilder().build(release_number='42', files_changed_with_tags=changed_files, output_backend=output_backend)
+    assert not (release_workspace / config.BASE_RELEASE_DIR).exists()
+    assert sorted(str(path) for path in release_workspace.rglob('*')) == working_files
+
+    # The bundle held in memory is the one a real build writes
+    ReleaseBuilder().build(release_number='42', files_changed_with_tags=changed_files)
+    release_files = {
+        str(release_path.relative_to(release_workspace)).replace(os.sep, '/'): release_path.read_bytes()
+        for release_path in (release_workspace / config.BASE_RELEASE_DIR).rglob('*') if release_path.is_file()
+    }
+    bundle_manifest = output_backend.manifest()
+    assert sorted(bundle_manifest['files']) == sorted(list(release_files) + [config.RELEASE_DOCX])
+    for bundle_path, file_content in release_files.items():
+        assert output_backend.read_bytes(file_path=bundle_path) == file_content
+        assert bundle_manifest['files'][bundle_path]['size'] == len(file_content)
+        assert bundle_manifest['files'][bundle_path]['sha256'] == hashlib.sha256(file_content).hexdigest()
+    assert bundle_manifest['total_size'] == sum(file_entry['size'] for file_entry in bundle_manifest['files'].values())
+    assert {os.path.dirname(bundle_path) for bundle_path in release_files if bundle_path.endswith('.sql')} \
+        <= set(bundle_manifest['directories'])
+
+def test_dry_run_manifest_lists_the_sources_of_each_file(release_workspace, write_sql, tmp_path):
+    changed_files = write_changed_files(write_sql=write_sql)
+    output_backend = MemoryOutputBackend()
+    assert main.main(files_changed_with_tags=changed_files, release_number='42', output_backend=output_backend)
+    manifest_path = tmp_path / 'manifest.json'
+    main.write_dry_run_manifest(output_backend=output_backend, manifest_path=str(manifest_path))
+    bundle_manifest = json.loads(manifest_path.read_text(encoding='utf-8'))
+
+    # Each release file lists its template, then the changed files in the order they were appended
+    sources = {bundle_path.split('/', 2)[-1]: file_entry['sources'][1:]
+               for bundle_path, file_entry in bundle_manifest['files'].items() if len(file_entry['sources']) > 1}
+    assert sources == {
+        'datatrak_bgt_agt/5_datatrak_views_scripts.sql': changed_files[:2],
+        'datatrak_bgt_awb/6_datatrak_sp_scripts.sql': changed_files[2:],
+    }
+    views_sources = [file_entry['sources'] for bundle_path, file_entry in bundle_manifest['files'].items()
+                     if bundle_path.endswith('datatrak_bgt_agt/5_datatrak_views_scripts.sql')]
+    assert views_sources[0][0] == os.path.join(config.BASE_TEMPLATE_PATH, 'default_header.txt')
+    assert bundle_manifest['dropped_duplicates'] == []
+
+def test_read_bytes_normalises_the_path(tmp_path):
+    output_backend = MemoryOutputBackend()
+    output_backend.write_bytes(file_path=str(tmp_path / 'a' / '..' / 'b.sql'), file_content=b'SELECT 1')
+    assert output_backend.read_bytes(file_path=str(tmp_path / 'b.sql')) == b'SELECT 1'
+    with pytest.raises(FileNotFoundError):
+        output_backend.read_bytes(file_path=str(tmp_path / 'c.sql'))
+
+def test_open_read_reads_back_what_was_written_and_appended(tmp_path):
+    output_backend = MemoryOutputBackend()
+    file_path = str(tmp_path / 'views.sql')
+    output_backend.write_bytes(file_path=file_path, file_content=b'/* header */\n')
+    with output_backend.open_append(file_path=file_path) as append_handle:
+        append_handle.write(b'SELECT 1\n')
+    with output_backend.open_read(file_path=file_path) as rf:
+        rf.seek(13)
+        assert rf.read() == b'SELECT 1\n'
+    with pytest.raises(FileNotFoundError):
+        output_backend.open_read(file_path=str(tmp_path / 'missing.sql'))
+
+def test_every_backend_implements_the_file_operations():
+    for output_backend_class in (FileSystemOutputBackend, ArchiveOutputBackend, MemoryOutputBackend):
+        assert not output_backend_class.__abstractmethods__
+    assert OutputBackend.__abstractmethods__ == {'make_directory', 'write_bytes', 'open_append', 'open_read'}
+
+    class PartialOutputBackend(OutputBackend):
+        def make_directory(self, directory_path):
+            pass
+    with pytest.raises(TypeError):
+        PartialOutputBackend()
@@ -0,0 +1,96 @@
+import json
+
+from bgt_db_release_utils import EncodingCache, FilesManager
+
+CP1252_SQL = "SELECT 'café crème brûlée' AS dessert\r\n" * 20
+
+def test_cache_persists_across_runs(tmp_path):
+    cache_path = str(tmp_path / 'encoding_cache.json')
+    encoding_cache = EncodingCache(cache_path=cache_path, max_entries=10)
+    encoding_cache.put(b'sample', 'windows-1252')
+    encoding_cache.save()
+
+    next_run_cache = EncodingCache(cache_path=cache_path, max_entries=10)
+    next_run_cache.load()
+    assert next_run_cache.get(b'sample') == 'windows-1252'
+    assert next_run_cache.get(b'other sample') is None
+    assert (next_run_cache.hits, next_run_cache.misses) == (1, 1)
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    encoding_cache = EncodingCache(cache_path=str(tmp_path / 'encoding_cache.json'), max_entries=2)
+    encoding_cache.put(b'first', 'ascii')
+    encoding_cache.put(b'second', 'ascii')
+    encoding_cache.get(b'first')
+    encoding_cache.put(b'third', 'ascii')
+    assert encoding_cache.get(b'second') is None
+    assert encoding_cache.get(b'first') == encoding_cache.get(b'third') == 'ascii'
+
+def test_unreadable_or_old_cache_starts_empty(tmp_path):
+    cache_file = tmp_path / 'encoding_cache.json'
+    cache_file.write_text('{not json')
+    encoding_cache = EncodingCache(cache_path=str(cache_file), max_entries=10)
+    encoding_cache.load()
+    assert not encoding_cache.entries
+
+    cache_file.write_text(json.dumps({'version': 0, 'entries': [['key', 'ascii']]}))
+    encoding_cache.load()
+    assert not encoding_cache.entries
+
+def test_reload_merges_entries_saved_by_another_run(tmp_path):
+    cache_path = str(tmp_path / 'encoding_cache.json')
+    daemon_cache = EncodingCache(cache_path=cache_path, max_entries=10)
+    daemon_cache.load()
+    build_cache = EncodingCache(cache_path=cache_path, max_entries=10)
+    build_cache.put(b'sample', 'utf-16')
+    build_cache.save()
+
+    daemon_cache.reload_if_changed()
+    assert daemon_cache.get(b'sample') == 'utf-16'
+
+def test_chardet_result_is_reused(tmp_path, write_sql):
+    sql_file_path = write_sql('cp1252.sql', CP1252_SQL, encoding='cp1252')
+    encoding_cache = EncodingCache(cache_path=str(tmp_path / 'encoding_cache.json'), max_entries=10)
+    first_run_encoding = FilesManager(encoding_cache=encoding_cache).detect_encoding(file_path=sql_file_path)
+    assert encoding_cache.misses == 1
+
+    files_manager = FilesManager(encoding_cache=encoding_cache)
+    assert files_manager.detect_encoding(file_path=sql_file_path) == first_run_encoding
+    assert encoding_cache.hits == 1
+
+def test_bom_and_utf8_samples_skip_the_cache(tmp_path, write_sql):
+    encoding_cache = EncodingCache(cache_path=str(tmp_path / 'encoding_cache.json'), max_entries=10)
+    files_manager = FilesManager(encoding_cache=encoding_cache)
+    assert files_manager.detect_encoding(file_path=write_sql('utf16.sql', 'SELECT 1', encoding='utf-16')) == 'UTF-16'
+    assert files_manager.detect_encoding(file_path=write_sql('utf8.sql', 'SELECT \'é\'')) == 'utf-8'
+    assert (encoding_cache.hits, encoding_cache.misses) == (0, 0)
+
+def test_concurrent_runs_keep_each_others_entries(tmp_path):
+    cache_path = str(tmp_path / 'encoding_cache.json')
+    first_run_cache = EncodingCache(cache_path=cache_path, max_entries=10)
+    first_run_cache.load()
+    second_run_cache = EncodingCache(cache_path=cache_path, max_entries=10)
+    second_run_cache.load()
+    first_run_cache.put(b'first sample', 'utf-16')
+    second_run_cache.put(b'second sample', 'windows-1252')
+    first_run_cache.save()
+    second_run_cache.save()
+
+    next_run_cache = EncodingCache(cache_path=cache_path, max_entries=10)
+    next_run_cache.load()
+    assert next_run_cache.get(b'first sample') == 'utf-16'
+    assert next_run_cache.get(b'second sample') == 'windows-1252'
+
+def test_merged_entries_are_trimmed_to_the_most_recent(tmp_path):
+    cache_path = str(tmp_path / 'encoding_cache.json')
+    other_run_cache = EncodingCache(cache_path=cache_path, max_entries=2)
+    other_run_cache.put(b'old', 'ascii')
+    other_run_cache.put(b'older', 'ascii')
+    other_run_cache.save()
+    this_run_cache = EncodingCache(cache_path=cache_path, max_entries=2)
+    this_run_cache.put(b'new', 'utf-16')
+    this_run_cache.save()
+
+    with open(cache_path, 'r', encoding='utf-8') as rf:
+        saved_entries = json.load(rf)['entries']
+    assert [encoding for _, encoding in saved_entries] == ['ascii', 'utf-16']
+    assert saved_entries[-1][0] == this_run_cache.sample_key(b'new')
@@ -0,0 +1,110 @@
+import os
+
+import pytest
+
+import config
+from bgt_db_release_utils import EncodingPrepass, FilesManager
+from bgt_db_release_utils import encoding_prepass as encoding_prepass_module
+from release_builder import ReleaseBuilder
+
+SQL_TEXT = "-- Résumé of the orders, café\r\nSELECT OrderId, Customer FROM dbo.Orders WHERE Note = 'café'\r\nGO\r\n" * 20
+
+SOURCE_TEXTS = {
+    'utf8.sql': (SQL_TEXT, 'utf-8'),
+    'bom.sql': (SQL_TEXT, 'utf-8-sig'),
+    'utf16.sql': (SQL_TEXT, 'utf-16'),
+    'cp1252.sql': (SQL_TEXT, 'cp1252'),
+    'ascii.sql': ('SELECT 1 AS note\r\nGO\r\n', 'ascii'),
+}
+
+def write_sources(write_sql):
+    return [write_sql(file_name, sql_text, encoding=encoding) for file_name, (sql_text, encoding) in SOURCE_TEXTS.items()]
+
+def make_prepass(file_manager, max_workers=2, decode=False):
+    return EncodingPrepass(file_manager=file_manager, max_workers=max_workers, min_pool_files=1, batch_size=2,
+                           start_method=config.ENCODING_PREPASS_START_METHOD, decode=decode,
+                           decode_max_file_bytes=1024 * 1024, decode_max_bytes=1024 * 1024)
+
+def test_pool_detects_the_encodings_detected_in_process(write_sql):
+    file_paths = write_sources(write_sql=write_sql)
+    in_process_files_manager = FilesManager()
+    make_prepass(file_manager=in_process_files_manager, max_workers=1).run(file_paths=file_paths)
+    pool_files_manager = FilesManager()
+    make_prepass(file_manager=pool_files_manager).run(file_paths=file_paths)
+
+    assert pool_files_manager.detected_encodings == in_process_files_manager.detected_encodings
+    assert sorted(pool_files_manager.detected_encodings) == sorted(file_paths)
+    # Every file is copied as the copy would have detected it without the prepass
+    assert pool_files_manager.detected_encodings == {
+        file_path: FilesManager().detect_encoding(file_path=file_path) for file_path in file_paths
+    }
+
+def test_pool_decodes_the_copy_output(write_sql):
+    file_paths = write_sources(write_sql=write_sql)
+    files_manager = FilesManager()
+    make_prepass(file_manager=files_manager, decode=True).run(file_paths=file_paths)
+
+    assert sorted(files_manager.decoded_sources) == sorted(file_paths)
+    for file_path in file_paths:
+        assert files_manager.decoded_sources[file_path] == b''.join(FilesManager().iter_source_utf8_chunks(file_path=file_path))
+        # The copy is handed the decoded bytes once, with the newlines translated as the baseline copy does
+        sql_text = SOURCE_TEXTS[file_path.rsplit('/', 1)[-1]][0]
+        assert b''.join(files_manager.iter_copy_chunks(file_path=file_path)) == sql_text.replace('\r\n', '\n').encode('utf-8')
+        assert file_path not in files_manager.decoded_sources
+
+def test_decode_keeps_to_the_memory_budget(write_sql, files_manager):
+    file_paths = write_sources(write_sql=write_sql)
+    encoding_prepass = make_prepass(file_manager=files_manager, decode=True)
+    for file_path in file_paths:
+        files_manager.detected_encodings[file_path] = FilesManager().detect_encoding(file_path=file_path)
+    source_sizes = [files_manager.source_size(file_path=file_path) for file_path in file_paths]
+
+    encoding_prepass.decode_max_file_bytes = max(source_sizes) - 1
+    encoding_prepass.decode_max_bytes = sum(source_sizes)
+    assert [file_path for file_path, _ in encoding_prepass.plan_decode_jobs(file_paths=file_paths)] == [
+        file_path for file_path, source_size in zip(file_paths, source_sizes) if source_size < max(source_sizes)
+    ]
+
+    encoding_prepass.decode_max_file_bytes = max(source_sizes)
+    encoding_prepass.decode_max_bytes = source_sizes[0]
+    assert encoding_prepass.plan_decode_jobs(file_paths=file_paths) == [(file_paths[0], files_manager.detected_encodings[file_paths[0]])]
+
+def test_missing_files_are_left_to_the_copy(write_sql, files_manager, tmp_path):
+    file_paths = write_sources(write_sql=write_sql)
+    missing_path = str(tmp_path / 'missing.sql')
+    make_prepass(file_manager=files_manager, max_workers=1).run(file_paths=[missing_path] + file_paths)
+    assert missing_path not in files_manager.detected_encodings
+    assert sorted(files_manager.detected_encodings) == sorted(file_paths)
+
+@pytest.fixture
+def no_process_pool(monkeypatch):
+    """
+    Fail any attempt to start the worker pool.
+    """
+    def refuse_pool(*args, **kwargs):
+        raise AssertionError('the encoding prepass started a process pool')
+    monkeypatch.setattr(encoding_prepass_module, 'ProcessPoolExecutor', refuse_pool)
+
+@pytest.mark.parametrize('decode', [False, True])
+def test_small_change_sets_never_start_the_pool(write_sql, files_manager, no_process_pool, decode):
+    file_paths = write_sources(write_sql=write_sql)
+    EncodingPrepass(file_manager=files_manager, max_workers=8, min_pool_files=config.ENCODING_PREPASS_MIN_FILES,
+                    batch_size=config.ENCODING_PREPASS_BATCH_SIZE, decode=decode, decode_max_file_bytes=1024 * 1024,
+                    decode_max_bytes=1024 * 1024).run(file_paths=file_paths)
+    assert sorted(files_manager.detected_encodings) == sorted(file_paths)
+    assert files_manager.decoded_sources == {}
+
+def test_files_settled_without_chardet_do_not_count_towards_the_pool(write_sql, files_manager, no_process_pool):
+    file_paths = [write_sql(f"utf8_{index}.sql", SQL_TEXT) for index in range(config.ENCODING_PREPASS_MIN_FILES + 10)]
+    EncodingPrepass(file_manager=files_manager, max_workers=8, min_pool_files=config.ENCODING_PREPASS_MIN_FILES,
+                    batch_size=config.ENCODING_PREPASS_BATCH_SIZE).run(file_paths=file_paths)
+    assert set(files_manager.detected_encodings.values()) == {'utf-8'}
+
+def test_default_build_of_a_small_change_set_stays_in_process(release_workspace, write_sql, monkeypatch, no_process_pool):
+    monkeypatch.setattr(config, 'ENCODING_PREPASS', True)
+    monkeypatch.setattr(config, 'ENCODING_PREPASS_MAX_WORKERS', 8)
+    changed_files = [os.path.relpath(write_sql(f"work/datatrak_bgt_agt/views/{file_name}", sql_text, encoding=encoding))
+                     for file_name, (sql_text, encoding) in SOURCE_TEXTS.items()]
+    ReleaseBuilder().build(release_number='42', files_changed_with_tags=changed_files)
+    (release_file,) = release_workspace.glob('release/*/datatrak_bgt_agt/5_datatrak_views_scripts.sql')
+    assert 'Résumé of the orders' in release_file.read_text(encoding='utf-8')
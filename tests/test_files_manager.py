@@ -0,0 +1,77 @@
+import codecs
+
+import chardet
+import pytest
+
+from bgt_db_release_utils import FilesManager, ReleaseBuildError
+
+# Sources in every encoding the builder meets, with the newline styles editors leave in them
+SOURCE_FILES = {
+    'ascii_lf.sql': ("SELECT 1\nGO\n", 'utf-8'),
+    'utf8_crlf.sql': ("SELECT 'déjà vu'\r\nGO\r\n" * 300, 'utf-8'),
+    'utf8_mixed_newlines.sql': ("SELECT 'é'\r\nSELECT 2\rSELECT 3\nGO", 'utf-8'),
+    'utf8_bom.sql': ("SELECT 'naïve'\nGO\n" * 400, 'utf-8-sig'),
+    'utf16_le.sql': ("SELECT N'日本語'\r\nGO\r\n" * 500, 'utf-16'),
+    'utf16_be.sql': ("SELECT N'café'\r\nGO\r\n", 'utf-16-be'),
+    'utf32.sql': ("SELECT 'Ω'\nGO\n", 'utf-32'),
+    'cp1252.sql': ("SELECT 'café crème'\r\nGO\r\n" * 300, 'cp1252'),
+}
+
+def write_source(write_sql, file_name, sql_text, encoding):
+    if encoding == 'utf-16-be':
+        return write_sql(file_name, codecs.BOM_UTF16_BE.decode('utf-16-be') + sql_text, encoding=encoding)
+    return write_sql(file_name, sql_text, encoding=encoding)
+
+def copy_as_the_baseline(source_file_path, release_file_path):
+    """
+    Copy a source the way the builder did before the fast path: detect with chardet, decode in text mode and
+    append line by line as UTF-8.
+    """
+    with open(source_file_path, 'rb') as rf:
+        encoding = chardet.detect(rf.read(4096))['encoding']
+    with open(source_file_path, 'r', encoding=encoding.lower()) as rf, \
+            open(release_file_path, 'a', encoding='utf-8') as wf:
+        for line in rf:
+            wf.write(line)
+        wf.write('\n\n')
+
+@pytest.mark.parametrize('chunk_size', [1, 3, 4096, 1024 * 1024])
+@pytest.mark.parametrize('file_name', sorted(SOURCE_FILES))
+def test_copy_matches_the_baseline_output(tmp_path, write_sql, files_manager, file_name, chunk_size):
+    sql_text, encoding = SOURCE_FILES[file_name]
+    source_file_path = write_source(write_sql=write_sql, file_name=file_name, sql_text=sql_text, encoding=encoding)
+    copy_as_the_baseline(source_file_path=source_file_path, release_file_path=str(tmp_path / 'baseline.sql'))
+    files_manager.copy_file(target_file_path=source_file_path, final_release_path=str(tmp_path / 'release.sql'),
+                            chunk_size=chunk_size)
+    assert (tmp_path / 'release.sql').read_bytes() == (tmp_path / 'baseline.sql').read_bytes()
+
+class CountingFilesManager(FilesManager):
+    """
+    Keeps the build counters without build metrics.
+    """
+    def __init__(self):
+        super().__init__()
+        self.counters = {}
+
+    def count(self, counter_name, amount=1):
+        self.counters[counter_name] = self.counters.get(counter_name, 0) + amount
+
+def test_utf8_sources_are_recognised_without_chardet(write_sql):
+    files_manager = CountingFilesManager()
+    source_file_path = write_sql('utf8.sql', "SELECT 'é'\nGO\n")
+    assert b''.join(files_manager.iter_copy_chunks(file_path=source_file_path)) == "SELECT 'é'\nGO\n".encode('utf-8')
+    assert files_manager.counters == {'encoding_fast_path_hits': 1}
+
+def test_invalid_utf8_after_the_sample_fails_the_copy(tmp_path, write_sql, files_manager):
+    source_file_path = write_sql('broken.sql', 'SELECT 1\n' * 1000)
+    with open(source_file_path, 'ab') as wf:
+        wf.write(b'SELECT \xff\n')
+    with pytest.raises(ReleaseBuildError, match='broken.sql'):
+        files_manager.copy_file(target_file_path=source_file_path, final_release_path=str(tmp_path / 'release.sql'))
+
+def test_read_source_bytes_matches_the_streamed_copy(tmp_path, write_sql, files_manager):
+    sql_text, encoding = SOURCE_FILES['utf16_le.sql']
+    source_file_path = write_source(write_sql=write_sql, file_name='utf16_le.sql', sql_text=sql_text, encoding=encoding)
+    files_manager.copy_file(target_file_path=source_file_path, final_release_path=str(tmp_path / 'release.sql'))
+    assert files_manager.read_source_bytes(source_file_path=source_file_path) + b'\n\n' \
+        == (tmp_path / 'release.sql').read_bytes()
@@ -0,0 +1,102 @@
+import os
+import shutil
+import subprocess
+
+import pytest
+
+import config
+from bgt_db_release_utils import GitSourceReader, ReleaseInputError
+from release_builder import ReleaseBuilder
+
+def git(repo_path, *git_args):
+    return subprocess.run(['git', '-C', str(repo_path), *git_args], check=True, stdout=subprocess.PIPE).stdout.decode()
+
+def commit_all(repo_path, message):
+    git(repo_path, 'add', '-A')
+    git(repo_path, '-c', 'user.name=builder', '-c', 'user.email=builder@localhost', 'commit', '-q', '-m', message)
+
+@pytest.fixture
+def git_repo(tmp_path):
+    """
+    A repository with a base commit and a head commit adding, changing, renaming and deleting SQL files.
+    """
+    repo_path = tmp_path / 'repo'
+    views_dir = repo_path / 'datatrak_bgt_agt' / 'views'
+    views_dir.mkdir(parents=True)
+    git(repo_path, 'init', '-q')
+    (views_dir / 'v_changed.sql').write_text('CREATE VIEW dbo.v_changed AS SELECT 1\n')
+    (views_dir / 'v_deleted.sql').write_text('CREATE VIEW dbo.v_deleted AS SELECT 1\n')
+    (views_dir / 'v_renamed.sql').write_text('CREATE VIEW dbo.v_renamed AS SELECT 1 -- long enough to be seen as a rename\n')
+    commit_all(repo_path=repo_path, message='base')
+    git(repo_path, 'tag', 'AGT_1.0.0-b1_and_AWB_2.0.0-b1')
+
+    (views_dir / 'v_changed.sql').write_text('CREATE VIEW dbo.v_changed AS SELECT 2\n')
+    (views_dir / 'v_deleted.sql').unlink()
+    (views_dir / 'v_renamed.sql').rename(views_dir / 'v_moved.sql')
+    (views_dir / 'v_added.sql').write_bytes("CREATE VIEW dbo.v_added AS SELECT 'é'\r\n".encode('utf-16'))
+    (views_dir / 'notes.txt').write_text('not SQL\n')
+    commit_all(repo_path=repo_path, message='head')
+    git(repo_path, 'tag', 'AGT_1.0.0-b2_and_AWB_2.0.0-b2')
+    return repo_path
+
+def make_reader(git_repo, from_ref='AGT_1.0.0-b1_and_AWB_2.0.0-b1', to_ref='AGT_1.0.0-b2_and_AWB_2.0.0-b2'):
+    return GitSourceReader(repo_path=str(git_repo), from_ref=from_ref, to_ref=to_ref)
+
+def test_changed_files_leave_out_deleted_and_other_files(git_repo):
+    source_reader = make_reader(git_repo=git_repo)
+    assert source_reader.list_changed_files() == [
+        'datatrak_bgt_agt/views/v_added.sql',
+        'datatrak_bgt_agt/views/v_changed.sql',
+        'datatrak_bgt_agt/views/v_moved.sql',
+    ]
+    assert source_reader.version_tags() == ['AGT_1.0.0-b1_and_AWB_2.0.0-b1', 'AGT_1.0.0-b2_and_AWB_2.0.0-b2']
+    assert make_reader(git_repo=git_repo, from_ref='HEAD~1', to_ref='HEAD').version_tags() == []
+
+def test_blobs_are_read_from_the_object_store(git_repo):
+    source_reader = make_reader(git_repo=git_repo)
+    source_reader.list_changed_files()
+    shutil.rmtree(git_repo / 'datatrak_bgt_agt')
+    try:
+        # A stream left half read does not disturb the next blob
+        with source_reader.open_blob(file_path='./datatrak_bgt_agt/views/v_added.sql') as blob_stream:
+            assert blob_stream.read(2) == b'\xff\xfe'
+        with source_reader.open_blob(file_path='datatrak_bgt_agt/views/v_changed.sql') as blob_stream:
+            assert blob_stream.read() == b'CREATE VIEW dbo.v_changed AS SELECT 2\n'
+        assert source_reader.blob_size(file_path='datatrak_bgt_agt/views/v_changed.sql') \
+            == len(b'CREATE VIEW dbo.v_changed AS SELECT 2\n')
+        assert source_reader.exists(file_path='datatrak_bgt_agt/views/notes.txt')
+        assert not source_reader.exists(file_path='datatrak_bgt_agt/views/v_deleted.sql')
+        with pytest.raises(FileNotFoundError):
+            source_reader.open_blob(file_path='datatrak_bgt_agt/views/v_deleted.sql')
+    finally:
+        source_reader.close()
+
+def test_unknown_ref_is_an_input_error(git_repo):
+    with pytest.raises(ReleaseInputError):
+        make_reader(git_repo=git_repo, to_ref='no-such-ref').list_changed_files()
+
+def test_git_build_matches_the_working_tree_build(release_workspace, monkeypatch):
+    monkeypatch.setattr(config, 'TEMPLATE_DATETIME_FORMAT', 'build time')
+    monkeypatch.setattr(config, 'INCREMENTAL_BUILD', False)
+    monkeypatch.setattr(config, 'ARTIFACT_CACHE', False)
+    git(release_workspace, 'init', '-q')
+    commit_all(repo_path=release_workspace, message='versions')
+    views_dir = release_workspace / 'datatrak_bgt_agt' / 'views'
+    views_dir.mkdir()
+    (views_dir / 'v_orders.sql').write_bytes("CREATE VIEW dbo.v_orders AS SELECT 'é' AS note\r\nGO\r\n".encode('utf-16'))
+    functions_dir = release_workspace / 'datatrak_bgt_awb' / 'functions'
+    functions_dir.mkdir()
+    (functions_dir / 'fn_total.sql').write_text('CREATE FUNCTION dbo.fn_total() RETURNS INT AS BEGIN RETURN 1 END\n')
+    commit_all(repo_path=release_workspace, message='changes')
+
+    ReleaseBuilder().build(release_number='42', git_from_ref='HEAD~1', git_to_ref='HEAD', git_repo_path=str(release_workspace))
+    git_release = {release_path.relative_to(release_workspace): release_path.read_bytes()
+                   for release_path in (release_workspace / 'release').rglob('*') if release_path.is_file()}
+    shutil.rmtree(release_workspace / 'release')
+
+    ReleaseBuilder().build(release_number='42', files_changed_with_tags=[
+        os.path.join('datatrak_bgt_agt', 'views', 'v_orders.sql'), os.path.join('datatrak_bgt_awb', 'functions', 'fn_total.sql')
+    ])
+    working_tree_release = {release_path.relative_to(release_workspace): release_path.read_bytes()
+                            for release_path in (release_workspace / 'release').rglob('*') if release_path.is_file()}
+    assert git_release == working_tree_release
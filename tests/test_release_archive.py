@@ -0,0 +1,160 @@
+import io
+import os
+import gzip
+import shutil
+import tarfile
+import zipfile
+import tempfile
+
+import pytest
+
+import config
+from bgt_db_release_utils import ArchiveOutputBackend, ReleaseArchiveWriter, ReleaseStageError
+from bgt_db_release_utils import release_archive
+from release_builder import ReleaseBuilder
+
+def make_members():
+    """
+    Return a fresh set of archive members, listed out of order, with a directory and a multi-chunk file.
+    """
+    return {
+        'bundle/datatrak_bgt_agt/5_datatrak_views_scripts.sql': io.BytesIO(b'CREATE VIEW dbo.v AS SELECT 1\n\n'),
+        'bundle': None,
+        'bundle/datatrak_bgt_agt': None,
+        'bundle/datatrak_bgt_agt/0_datatrak_begin.sql': io.BytesIO(bytes(range(256)) * 20000),
+        'bundle/datatrak_bgt_agt/empty.sql': io.BytesIO(),
+    }
+
+def write_archive(archive_path, max_workers):
+    ReleaseArchiveWriter(archive_path=str(archive_path), max_workers=max_workers).write(members=make_members())
+    return archive_path.read_bytes()
+
+@pytest.mark.parametrize('archive_name', ['bundle.zip', 'bundle.tar.gz'])
+def test_archive_bytes_do_not_depend_on_the_workers_or_the_run(tmp_path, monkeypatch, archive_name):
+    # Small gzip blocks, for the tar.gz to be compressed as several blocks
+    monkeypatch.setattr(release_archive, 'GZIP_BLOCK_SIZE', 64 * 1024)
+    archive_bytes = write_archive(archive_path=tmp_path / archive_name, max_workers=1)
+    assert write_archive(archive_path=tmp_path / archive_name, max_workers=4) == archive_bytes
+    assert write_archive(archive_path=tmp_path / archive_name, max_workers=4) == archive_bytes
+
+def test_zip_members_are_sorted_with_fixed_metadata(tmp_path):
+    write_archive(archive_path=tmp_path / 'bundle.zip', max_workers=4)
+    with zipfile.ZipFile(tmp_path / 'bundle.zip') as zip_file:
+        assert zip_file.testzip() is None
+        assert zip_file.namelist() == [
+            'bundle/', 'bundle/datatrak_bgt_agt/', 'bundle/datatrak_bgt_agt/0_datatrak_begin.sql',
+            'bundle/datatrak_bgt_agt/5_datatrak_views_scripts.sql', 'bundle/datatrak_bgt_agt/empty.sql'
+        ]
+        for member_path, member_stream in make_members().items():
+            if member_stream is not None:
+                assert zip_file.read(member_path) == member_stream.getvalue()
+        for zip_info in zip_file.infolist():
+            assert zip_info.date_time == (1980, 1, 1, 0, 0, 0)
+            assert zip_info.external_attr >> 16 == (0o040755 if zip_info.is_dir() else 0o100644)
+    assert oct(os.stat(tmp_path / 'bundle.zip').st_mode & 0o777) == oct(0o644)
+
+def test_tar_gz_members_are_sorted_with_fixed_metadata(tmp_path, monkeypatch):
+    monkeypatch.setattr(release_archive, 'GZIP_BLOCK_SIZE', 64 * 1024)
+    archive_bytes = write_archive(archive_path=tmp_path / 'bundle.tar.gz', max_workers=4)
+    # The gzip members carry no timestamp
+    assert archive_bytes[4:8] == b'\0\0\0\0'
+    with tarfile.open(tmp_path / 'bundle.tar.gz') as tar_file:
+        assert tar_file.getnames() == sorted(make_members())
+        for tar_info in tar_file.getmembers():
+            assert (tar_info.mtime, tar_info.uid, tar_info.gid, tar_info.uname, tar_info.gname) == (0, 0, 0, '', '')
+            assert tar_info.mode == (0o755 if tar_info.isdir() else 0o644)
+        for member_path, member_stream in make_members().items():
+            if member_stream is not None:
+                assert tar_file.extractfile(member_path).read() == member_stream.getvalue()
+    assert gzip.decompress(archive_bytes).startswith(b'bundle/')
+
+@pytest.mark.parametrize('archive_name', ['bundle.zip', 'bundle.tar.gz'])
+def test_members_are_streamed_without_a_second_spool(tmp_path, monkeypatch, archive_name):
+    def refuse_spool(*args, **kwargs):
+        raise AssertionError('a member was spooled again while writing the archive')
+    monkeypatch.setattr(tempfile, 'SpooledTemporaryFile', refuse_spool)
+    write_archive(archive_path=tmp_path / archive_name, max_workers=4)
+
+def test_backend_keeps_a_header_and_the_scripts_appended_to_it(tmp_path):
+    release_root = tmp_path / 'release'
+    archive_output_backend = ArchiveOutputBackend(archive_path=str(tmp_path / 'bundle.zip'), release_root=str(release_root),
+                                                  max_workers=2, spool_max_bytes=16)
+    release_file_path = str(release_root / 'bundle' / 'views.sql')
+    archive_output_backend.make_directory(directory_path=str(release_root / 'bundle'))
+    archive_output_backend.write_bytes(file_path=release_file_path, file_content=b'/* header */\n')
+    with archive_output_backend.open_append(file_path=release_file_path) as append_handle:
+        append_handle.write(b'CREATE VIEW dbo.v AS SELECT 1\n' * 10)
+    archive_output_backend.write_bytes(file_path=str(release_root / 'bundle' / 'scriptlist.txt'), file_content=b'views.sql\n')
+    archive_output_backend.close()
+
+    with zipfile.ZipFile(tmp_path / 'bundle.zip') as zip_file:
+        assert zip_file.namelist() == ['bundle/', 'bundle/scriptlist.txt', 'bundle/views.sql']
+        assert zip_file.read('bundle/views.sql') == b'/* header */\n' + b'CREATE VIEW dbo.v AS SELECT 1\n' * 10
+        assert zip_file.read('bundle/scriptlist.txt') == b'views.sql\n'
+
+def test_backend_reads_back_a_member_while_it_is_appended_to(tmp_path):
+    release_root = tmp_path / 'release'
+    archive_output_backend = ArchiveOutputBackend(archive_path=str(tmp_path / 'bundle.zip'), release_root=str(release_root),
+                                                  max_workers=1, spool_max_bytes=16)
+    release_file_path = str(release_root / 'bundle' / 'views.sql')
+    archive_output_backend.write_bytes(file_path=release_file_path, file_content=b'/* header */\n')
+    append_handle = archive_output_backend.open_append(file_path=release_file_path)
+    append_handle.write(b'SELECT 1\n')
+    with archive_output_backend.open_read(file_path=release_file_path) as rf:
+        assert rf.read(12) == b'/* header */'
+        append_handle.write(b'SELECT 2\n')
+        assert rf.read() == b'\nSELECT 1\nSELECT 2\n'
+        rf.seek(-9, io.SEEK_END)
+        assert rf.read() == b'SELECT 2\n'
+    assert append_handle.tell() == 31
+    with pytest.raises(FileNotFoundError):
+        archive_output_backend.open_read(file_path=str(release_root / 'bundle' / 'missing.sql'))
+    archive_output_backend.close()
+
+    with zipfile.ZipFile(tmp_path / 'bundle.zip') as zip_file:
+        assert zip_file.read('bundle/views.sql') == b'/* header */\nSELECT 1\nSELECT 2\n'
+
+def test_unsupported_archive_suffix_is_refused(tmp_path):
+    with pytest.raises(ValueError):
+        ReleaseArchiveWriter(archive_path=str(tmp_path / 'bundle.rar'), max_workers=1)
+
+def release_directory_files(release_workspace):
+    release_root = release_workspace / config.BASE_RELEASE_DIR
+    return {
+        str(release_path.relative_to(release_root)).replace(os.sep, '/'): release_path.read_bytes()
+        for release_path in release_root.rglob('*') if release_path.is_file()
+    }
+
+@pytest.mark.parametrize('archive_name', ['bundle.zip', 'bundle.tar.gz'])
+def test_archive_build_holds_the_release_directory(release_workspace, write_sql, monkeypatch, archive_name):
+    monkeypatch.setattr(config, 'TEMPLATE_DATETIME_FORMAT', 'build time')
+    monkeypatch.setattr(config, 'INCREMENTAL_BUILD', False)
+    changed_files = [
+        os.path.relpath(write_sql('work/datatrak_bgt_agt/views/v_orders.sql', 'CREATE OR ALTER VIEW dbo.v_orders AS SELECT 1\nGO\n')),
+        os.path.relpath(write_sql('work/datatrak_bgt_awb/functions/f_total.sql', 'CREATE OR ALTER FUNCTION dbo.f_total() '
+                                                                                   'RETURNS INT AS BEGIN RETURN 1 END\nGO\n')),
+    ]
+    ReleaseBuilder().build(release_number='42', files_changed_with_tags=changed_files)
+    directory_files = release_directory_files(release_workspace=release_workspace)
+    shutil.rmtree(release_workspace / config.BASE_RELEASE_DIR)
+
+    archive_path = release_workspace / archive_name
+    ReleaseBuilder().build(release_number='42', files_changed_with_tags=changed_files, archive_path=str(archive_path))
+    # Nothing is written to the release directory
+    assert not (release_workspace / config.BASE_RELEASE_DIR).exists()
+    if archive_name.endswith('.zip'):
+        with zipfile.ZipFile(archive_path) as zip_file:
+            archive_files = {member_path: zip_file.read(member_path) for member_path in zip_file.namelist()
+                             if not member_path.endswith('/')}
+    else:
+        with tarfile.open(archive_path) as tar_file:
+            archive_files = {tar_info.name: tar_file.extractfile(tar_info).read() for tar_info in tar_file if tar_info.isfile()}
+    assert archive_files == directory_files
+
+def test_failed_archive_build_leaves_no_archive(release_workspace):
+    archive_path = release_workspace / 'bundle.zip'
+    with pytest.raises(ReleaseStageError):
+        ReleaseBuilder().build(release_number='42', files_changed_with_tags=['datatrak_bgt_agt/views/v_missing.sql'],
+                               archive_path=str(archive_path))
+    assert not archive_path.exists()
+    assert not list(release_workspace.glob('.release_archive.*'))
@@ -0,0 +1,221 @@
+import os
+import shutil
+import logging
+
+import pytest
+
+import config
+from bgt_db_release_utils import ReleaseResourceManager, ReleaseStageError
+from release_builder import ReleaseBuilder
+
+SOURCE_ENCODINGS = ['utf-8', 'utf-8-sig', 'utf-16', 'cp1252']
+
+def write_changed_files(write_sql):
+    """
+    Write changed files of every category of both databases, in every supported encoding, and return their paths.
+    """
+    changed_files = []
+    for database in ('datatrak_bgt_agt', 'datatrak_bgt_awb'):
+        for category in config.RELEASE_FILE_MAPPING:
+            for index, encoding in enumerate(SOURCE_ENCODINGS):
+                sql_text = f"-- {category} {index}, café\r\nSELECT '{category}_{index}' AS note\r\nGO\r\n" * (index * 40 + 1)
+                changed_files.append(os.path.relpath(write_sql(f"work/{database}/{category}/{category}_{index}.sql", sql_text,
+                                                               encoding=encoding)))
+    return changed_files
+
+def build_release(release_workspace, monkeypatch, changed_files, **config_values):
+    """
+    Build the release from scratch with the given config values and return the content of its files by path.
+    """
+    monkeypatch.setattr(config, 'TEMPLATE_DATETIME_FORMAT', 'build time')
+    for config_name, config_value in config_values.items():
+        monkeypatch.setattr(config, config_name, config_value)
+    shutil.rmtree(release_workspace / 'release', ignore_errors=True)
+    ReleaseBuilder().build(release_number='42', files_changed_with_tags=changed_files)
+    return {
+        str(release_path.relative_to(release_workspace)): release_path.read_bytes()
+        for release_path in sorted((release_workspace / 'release').rglob('*')) if release_path.is_file()
+    }
+
+def test_build_copies_the_changed_files(release_workspace, write_sql):
+    view = write_sql('work/datatrak_bgt_agt/views/v_orders.sql', 'CREATE OR ALTER VIEW dbo.v_orders AS SELECT 1\nGO\n')
+    ReleaseBuilder().build(release_number='42', files_changed_with_tags=[os.path.relpath(view)])
+
+    (release_file,) = release_workspace.glob('release/*/datatrak_bgt_agt/5_datatrak_views_scripts.sql')
+    assert 'CREATE OR ALTER VIEW dbo.v_orders AS SELECT 1' in release_file.read_text(encoding='utf-8')
+    # Incremental builds are opt-in, a default build records no build manifest
+    assert not list(release_workspace.glob('release/*.manifest.json'))
+
+def test_build_fails_on_an_unreadable_source(release_workspace, write_sql):
+    view = write_sql('work/datatrak_bgt_agt/views/v_orders.sql', 'CREATE OR ALTER VIEW dbo.v_orders AS SELECT 1\nGO\n')
+    with pytest.raises(ReleaseStageError) as stage_error:
+        ReleaseBuilder().build(release_number='42', files_changed_with_tags=[
+            os.path.relpath(view), 'datatrak_bgt_agt/views/v_missing.sql'
+        ])
+
+    assert stage_error.value.stage_name.startswith('copy_sql_files')
+    # Neither the release file nor the build manifest of the broken bundle are written
+    assert not list(release_workspace.glob('release/*/datatrak_bgt_agt/5_datatrak_views_scripts.sql'))
+    assert not list(release_workspace.glob('release/*.manifest.json'))
+
+def test_concurrent_copy_writes_the_sequential_output(release_workspace, write_sql, monkeypatch):
+    changed_files = write_changed_files(write_sql=write_sql)
+    sequential_release = build_release(release_workspace, monkeypatch, changed_files, COPY_MAX_WORKERS=1,
+                                       INCREMENTAL_BUILD=False, ARTIFACT_CACHE=False)
+    concurrent_release = build_release(release_workspace, monkeypatch, changed_files, COPY_MAX_WORKERS=8,
+                                       COPY_INLINE_MAX_BYTES=1024, INCREMENTAL_BUILD=False, ARTIFACT_CACHE=False)
+    assert concurrent_release == sequential_release
+
+    # Scripts are appended in input order, transcoded to UTF-8
+    (sp_release_path,) = [release_path for release_path in concurrent_release
+                          if release_path.endswith('datatrak_bgt_agt/6_datatrak_sp_scripts.sql')]
+    sp_release_file = concurrent_release[sp_release_path].decode('utf-8')
+    script_positions = [sp_release_file.index(f"'stored_procedures_{index}' AS note") for index in range(len(SOURCE_ENCODINGS))]
+    assert script_positions == sorted(script_positions)
+
+def test_encoding_prepass_writes_the_output_of_the_copy(release_workspace, write_sql, monkeypatch, caplog):
+    caplog.set_level(logging.INFO, logger='bgt_db_release_utils.encoding_prepass')
+    changed_files = write_changed_files(write_sql=write_sql)
+    baseline_release = build_release(release_workspace, monkeypatch, changed_files, ENCODING_PREPASS=False,
+                                     INCREMENTAL_BUILD=False, ARTIFACT_CACHE=False)
+    # A fresh encoding cache, for the samples to go to the pool instead of the cache of the first build
+    prepass_release = build_release(release_workspace, monkeypatch, changed_files, ENCODING_PREPASS=True,
+                                    ENCODING_PREPASS_MAX_WORKERS=2, ENCODING_PREPASS_MIN_FILES=1, ENCODING_PREPASS_DECODE=True,
+                                    ENCODING_CACHE_PATH=str(release_workspace.parent / 'cache' / 'prepass_encoding_cache.json'),
+                                    INCREMENTAL_BUILD=False, ARTIFACT_CACHE=False)
+    assert prepass_release == baseline_release
+    assert 'Encoding prepass decoded' in caplog.text
+
+def release_file_inodes(release_workspace):
+    return {
+        release_path.name: (release_path.stat().st_ino, release_path.stat().st_mtime_ns)
+        for release_path in release_workspace.glob('release/*/datatrak_bgt_agt/*.sql')
+    }
+
+def test_incremental_build_keeps_the_unchanged_release_files(release_workspace, write_sql, monkeypatch):
+    monkeypatch.setattr(config, 'INCREMENTAL_BUILD', True)
+    monkeypatch.setattr(config, 'ARTIFACT_CACHE', False)
+    view = write_sql('work/datatrak_bgt_agt/views/v_orders.sql', 'CREATE OR ALTER VIEW dbo.v_orders AS SELECT 1\nGO\n')
+    procedure = write_sql('work/datatrak_bgt_agt/stored_procedures/usp_orders.sql',
+                          'CREATE OR ALTER PROCEDURE dbo.usp_orders AS SELECT 1\n')
+    changed_files = [os.path.relpath(view), os.path.relpath(procedure)]
+    ReleaseBuilder().build(release_number='42', files_changed_with_tags=changed_files)
+    assert list(release_workspace.glob('release/*.manifest.json'))
+    first_build_files = release_file_inodes(release_workspace=release_workspace)
+
+    ReleaseBuilder().build(release_number='42', files_changed_with_tags=changed_files)
+    assert release_file_inodes(release_workspace=release_workspace) == first_build_files
+
+    write_sql('work/datatrak_bgt_agt/views/v_orders.sql', 'CREATE OR ALTER VIEW dbo.v_orders AS SELECT 2\nGO\n')
+    ReleaseBuilder().build(release_number='42', files_changed_with_tags=changed_files)
+    third_build_files = release_file_inodes(release_workspace=release_workspace)
+    assert third_build_files['6_datatrak_sp_scripts.sql'] == first_build_files['6_datatrak_sp_scripts.sql']
+    assert third_build_files['5_datatrak_views_scripts.sql'] != first_build_files['5_datatrak_views_scripts.sql']
+    (views_release_file,) = release_workspace.glob('release/*/datatrak_bgt_agt/5_datatrak_views_scripts.sql')
+    assert 'AS SELECT 2' in views_release_file.read_text(encoding='utf-8')
+
+def test_incremental_build_rebuilds_a_deleted_release_file(release_workspace, write_sql, monkeypatch):
+    monkeypatch.setattr(config, 'INCREMENTAL_BUILD', True)
+    monkeypatch.setattr(config, 'ARTIFACT_CACHE', False)
+    view = write_sql('work/datatrak_bgt_agt/views/v_orders.sql', 'CREATE OR ALTER VIEW dbo.v_orders AS SELECT 1\nGO\n')
+    ReleaseBuilder().build(release_number='42', files_changed_with_tags=[os.path.relpath(view)])
+    (views_release_file,) = release_workspace.glob('release/*/datatrak_bgt_agt/5_datatrak_views_scripts.sql')
+    views_release_file.unlink()
+
+    ReleaseBuilder().build(release_number='42', files_changed_with_tags=[os.path.relpath(view)])
+    assert 'AS SELECT 1' in views_release_file.read_text(encoding='utf-8')
+
+def test_empty_changed_file_is_copied_as_an_empty_script(release_workspace, write_sql):
+    empty_view = write_sql('work/datatrak_bgt_agt/views/v_empty.sql', '')
+    view = write_sql('work/datatrak_bgt_agt/views/v_orders.sql', 'CREATE OR ALTER VIEW dbo.v_orders AS SELECT 1\nGO\n')
+    ReleaseBuilder().build(release_number='42', files_changed_with_tags=[os.path.relpath(empty_view), os.path.relpath(view)])
+
+    (release_file,) = release_workspace.glob('release/*/datatrak_bgt_agt/5_datatrak_views_scripts.sql')
+    assert release_file.read_text(encoding='utf-8').endswith('\n\n\n\nCREATE OR ALTER VIEW dbo.v_orders AS SELECT 1\nGO\n\n\n')
+
+@pytest.mark.parametrize('reorder, expected_scripts', [
+    (False, ['v_customers_report_2', 'v_customers']),
+    (True, ['v_customers', 'v_customers_report_2']),
+])
+def test_dedupe_runs_before_the_dependency_order(release_workspace, write_sql, monkeypatch, reorder, expected_scripts):
+    monkeypatch.setattr(config, 'SQL_DEDUPE_DEFINITIONS', True)
+    monkeypatch.setattr(config, 'SQL_DEPENDENCY_REORDER', reorder)
+    changed_files = [os.path.relpath(write_sql(f"work/datatrak_bgt_agt/views/{file_name}.sql", sql_text)) for file_name, sql_text in (
+        ('v_customers_report_1', 'CREATE OR ALTER VIEW dbo.v_customers_report AS SELECT 1 AS version FROM dbo.v_customers\nGO\n'),
+        ('v_customers_report_2', 'CREATE OR ALTER VIEW dbo.v_customers_report AS SELECT 2 AS version FROM dbo.v_customers\nGO\n'),
+        ('v_customers', 'CREATE VIEW dbo.v_customers AS SELECT 1 AS id\nGO\n'),
+    )]
+    ReleaseBuilder().build(release_number='42', files_changed_with_tags=changed_files)
+
+    (release_file,) = release_workspace.glob('release/*/datatrak_bgt_agt/5_datatrak_views_scripts.sql')
+    release_text = release_file.read_text(encoding='utf-8')
+    # The replaced definition is left out, the rest is ordered with the definition before its reference
+    assert 'SELECT 1 AS version' not in release_text
+    script_positions = {
+        'v_customers_report_2': release_text.index('SELECT 2 AS version'),
+        'v_customers': release_text.index('CREATE VIEW dbo.v_customers'),
+    }
+    assert sorted(script_positions, key=script_positions.get) == expected_scripts
+
+@pytest.mark.parametrize('artifact_cache', [False, True])
+def test_changing_a_build_setting_rebuilds_the_release_files(release_workspace, write_sql, monkeypatch, artifact_cache):
+    monkeypatch.setattr(config, 'INCREMENTAL_BUILD', True)
+    monkeypatch.setattr(config, 'ARTIFACT_CACHE', artifact_cache)
+    changed_files = [os.path.relpath(write_sql(f"work/datatrak_bgt_agt/views/{file_name}.sql", sql_text)) for file_name, sql_text in (
+        ('v_customers_report', 'CREATE OR ALTER VIEW dbo.v_customers_report AS SELECT id FROM dbo.v_customers\nGO\n'),
+        ('v_customers', 'CREATE VIEW dbo.v_customers AS SELECT 1 AS id\nGO\n'),
+    )]
+
+    def views_order():
+        (release_file,) = release_workspace.glob('release/*/datatrak_bgt_agt/5_datatrak_views_scripts.sql')
+        release_text = release_file.read_text(encoding='utf-8')
+        return release_text.index('CREATE VIEW dbo.v_customers ') < release_text.index('dbo.v_customers_report AS')
+
+    monkeypatch.setattr(config, 'SQL_DEPENDENCY_REORDER', False)
+    ReleaseBuilder().build(release_number='42', files_changed_with_tags=changed_files)
+    assert not views_order()
+    monkeypatch.setattr(config, 'SQL_DEPENDENCY_REORDER', True)
+    ReleaseBuilder().build(release_number='42', files_changed_with_tags=changed_files)
+    assert views_order()
+    monkeypatch.setattr(config, 'SQL_DEPENDENCY_REORDER', False)
+    ReleaseBuilder().build(release_number='42', files_changed_with_tags=changed_files)
+    assert not views_order()
+
+@pytest.mark.parametrize('dependency_analysis', [False, True])
+def test_deployment_plan_is_opt_in(release_workspace, write_sql, monkeypatch, dependency_analysis):
+    monkeypatch.setattr(config, 'SQL_DEPENDENCY_ANALYSIS', dependency_analysis)
+    view = write_sql('work/datatrak_bgt_agt/views/v_orders.sql', 'CREATE OR ALTER VIEW dbo.v_orders AS SELECT 1\nGO\n')
+    ReleaseBuilder().build(release_number='42', files_changed_with_tags=[os.path.relpath(view)])
+
+    assert bool(list(release_workspace.glob(f"release/*/{config.DEPLOYMENT_PLAN_FILE}"))) == dependency_analysis
+
+@pytest.mark.parametrize('incremental_build, artifact_cache', [(False, False), (True, False), (False, True)])
+def test_every_release_file_is_checked_for_reuse_once(release_workspace, write_sql, monkeypatch, incremental_build, artifact_cache):
+    monkeypatch.setattr(config, 'INCREMENTAL_BUILD', incremental_build)
+    monkeypatch.setattr(config, 'ARTIFACT_CACHE', artifact_cache)
+    reuse_decisions = []
+    reuse_release_file = ReleaseResourceManager.reuse_release_file
+
+    def recording_reuse_release_file(self, release_file_path, *args, **kwargs):
+        fingerprint, reused = reuse_release_file(self, release_file_path, *args, **kwargs)
+        reuse_decisions.append((os.path.abspath(release_file_path), fingerprint, reused))
+        return fingerprint, reused
+    monkeypatch.setattr(ReleaseResourceManager, 'reuse_release_file', recording_reuse_release_file)
+    view = write_sql('work/datatrak_bgt_agt/views/v_orders.sql', 'CREATE OR ALTER VIEW dbo.v_orders AS SELECT 1\nGO\n')
+
+    # The second build reuses every release file of the first one, kept in place or restored from the cache
+    for build_number in range(2):
+        if not incremental_build:
+            shutil.rmtree(release_workspace / 'release', ignore_errors=True)
+        reuse_decisions.clear()
+        ReleaseBuilder().build(release_number='42', files_changed_with_tags=[os.path.relpath(view)])
+        decided_paths = [release_file_path for release_file_path, _, _ in reuse_decisions]
+        assert len(decided_paths) == len(set(decided_paths))
+        # The deploy guide is written to the working directory, the other files to the release directory
+        (deploy_guide_path,) = [release_file_path for release_file_path in decided_paths if release_file_path.endswith('.docx')]
+        assert os.path.isfile(deploy_guide_path)
+        assert {str(release_path) for release_path in (release_workspace / 'release').rglob('*')
+                if release_path.is_file() and not release_path.name.endswith('.json')} == set(decided_paths) - {deploy_guide_path}
+        for _, fingerprint, reused in reuse_decisions:
+            assert (fingerprint is not None) == (incremental_build or artifact_cache)
+            assert reused == (fingerprint is not None and build_number == 1)
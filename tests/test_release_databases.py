@@ -0,0 +1,73 @@
+import os
+
+import pytest
+
+import config
+from bgt_db_release_utils import ReleaseInputError, VersionManager
+from release_builder import ReleaseBuilder
+
+MIS_DATABASE = {
+    'key': 'mis',
+    'tag_prefix': 'MIS',
+    'source_dir': 'datatrak_bgt_mis',
+    'version_path': './datatrak_bgt_mis/version.txt',
+    'release_dir': 'datatrak_bgt_mis'
+}
+
+@pytest.fixture
+def three_databases(release_workspace, monkeypatch):
+    """
+    Add a third database to the release, with its version file. Returns the working directory.
+    """
+    release_databases = config.RELEASE_DATABASES + [MIS_DATABASE]
+    monkeypatch.setattr(config, 'RELEASE_DATABASES', release_databases)
+    monkeypatch.setattr(config, 'RELEASE_BUNDLE_NAME', 'MIS_{mis}_AWB_{awb}_AGT_{agt}')
+    monkeypatch.setattr(config, 'BASE_RELEASE_DB', [release_database['release_dir'] for release_database in release_databases])
+    monkeypatch.setattr(config, 'VERSION_PATHS', {
+        release_database['key']: release_database['version_path'] for release_database in release_databases
+    })
+    version_file = release_workspace / MIS_DATABASE['version_path']
+    version_file.parent.mkdir(parents=True, exist_ok=True)
+    version_file.write_text('old_version=2.0.0-b1\nnew_version=2.0.0-b2\n')
+    return release_workspace
+
+def test_versions_of_every_database_are_read_from_the_tags():
+    version_manager = VersionManager(
+        files_changed_with_tags=['datatrak_bgt_mis/views/v.sql', 'AGT_1.0.1-b1_and_AWB_1.0.2-b1_and_MIS_2.0.0-b1',
+                                 'MIS_2.0.1-b1_and_AGT_1.0.1-b2_and_AWB_1.0.2-b2'],
+        version_files_data={},
+        release_databases=config.RELEASE_DATABASES + [MIS_DATABASE]
+    )
+    assert version_manager.fetch_db_versions() == {
+        'agt': ('1.0.1-b1', '1.0.1-B2'),
+        'awb': ('1.0.2-b1', '1.0.2-B2'),
+        'mis': ('2.0.0-b1', '2.0.1-B1'),
+    }
+
+def test_tag_without_a_database_is_refused():
+    version_manager = VersionManager(
+        files_changed_with_tags=['AGT_1.0.1-b1_and_AWB_1.0.2-b1', 'AGT_1.0.1-b2_and_AWB_1.0.2-b2'],
+        version_files_data={},
+        release_databases=config.RELEASE_DATABASES + [MIS_DATABASE]
+    )
+    with pytest.raises(ReleaseInputError):
+        version_manager.fetch_db_versions()
+
+def test_every_database_is_built_in_its_own_stages(three_databases, write_sql):
+    changed_files = [
+        os.path.relpath(write_sql(f"work/{source_dir}/views/v_orders.sql", f"CREATE OR ALTER VIEW dbo.v_orders AS SELECT '{source_dir}'\nGO\n"))
+        for source_dir in ('datatrak_bgt_agt', 'datatrak_bgt_mis')
+    ]
+    build_metrics = ReleaseBuilder().build(release_number='42', files_changed_with_tags=changed_files)
+
+    bundle_dir = three_databases / config.BASE_RELEASE_DIR / 'MIS_2.0.0-B2_AWB_1.0.0-B2_AGT_1.0.0-B2'
+    assert sorted(database_dir.name for database_dir in bundle_dir.iterdir() if database_dir.is_dir()) == [
+        'datatrak_bgt_agt', 'datatrak_bgt_awb', 'datatrak_bgt_mis'
+    ]
+    for source_dir in ('datatrak_bgt_agt', 'datatrak_bgt_mis'):
+        views_text = (bundle_dir / source_dir / '5_datatrak_views_scripts.sql').read_text(encoding='utf-8')
+        assert [database for database in ('datatrak_bgt_agt', 'datatrak_bgt_mis') if f"SELECT '{database}'" in views_text] == [source_dir]
+    # The header of each database carries its own versions
+    mis_views_text = (bundle_dir / 'datatrak_bgt_mis' / '5_datatrak_views_scripts.sql').read_text(encoding='utf-8')
+    assert "set @oldversion = '2.0.0-B1'" in mis_views_text
+    assert 'copy_sql_files:mis' in build_metrics.report()['stages']
@@ -0,0 +1,81 @@
+import pytest
+
+import config
+from bgt_db_release_utils import ReleaseFileRouter
+
+RELEASE_DATABASES = [
+    {'key': 'agt', 'source_dir': 'datatrak_bgt_agt'},
+    {'key': 'awb', 'source_dir': './datatrak_bgt_awb/'},
+]
+
+RELEASE_FILE_MAPPING = {
+    'views': '5_datatrak_views_scripts.sql',
+    'views/reporting': 'reporting_views.sql',
+    'views/*_report.sql': 'report_views.sql',
+    'insert_statements': '7_new_datatrak_data_insertion_scripts.sql',
+    'insert_statements/*_seed.sql': 'seed_data.sql',
+    'insert_statements/base_seed.sql': 'base_seed_data.sql',
+    '*/legacy': 'legacy_scripts.sql',
+}
+
+def route(file_path):
+    return [(release_database['key'], release_file_name) for release_database, release_file_name in
+            ReleaseFileRouter(release_databases=RELEASE_DATABASES, release_file_mapping=RELEASE_FILE_MAPPING).route(file_path=file_path)]
+
+@pytest.mark.parametrize('file_path, expected_routes', [
+    ('datatrak_bgt_agt/views/v_orders.sql', [('agt', '5_datatrak_views_scripts.sql')]),
+    # A rule applies to the nested folders below it
+    ('datatrak_bgt_agt/views/sales/2024/v_orders.sql', [('agt', '5_datatrak_views_scripts.sql')]),
+    # The deepest rule wins
+    ('datatrak_bgt_agt/views/reporting/v_sales.sql', [('agt', 'reporting_views.sql')]),
+    ('datatrak_bgt_agt/views/reporting/monthly/v_sales.sql', [('agt', 'reporting_views.sql')]),
+    # A deeper glob wins over a shallower exact folder
+    ('datatrak_bgt_agt/views/v_sales_report.sql', [('agt', 'report_views.sql')]),
+    ('datatrak_bgt_agt/views/legacy/v_old.sql', [('agt', 'legacy_scripts.sql')]),
+    # At the same depth an exact name wins over a glob
+    ('datatrak_bgt_awb/insert_statements/base_seed.sql', [('awb', 'base_seed_data.sql')]),
+    ('datatrak_bgt_awb/insert_statements/customers_seed.sql', [('awb', 'seed_data.sql')]),
+    # A glob only matches one segment, deeper files fall back to the folder rule
+    ('datatrak_bgt_awb/insert_statements/2024/customers_seed.sql', [('awb', '7_new_datatrak_data_insertion_scripts.sql')]),
+    ('datatrak_bgt_awb/insert_statements/Customers_Seed.SQL', [('awb', '7_new_datatrak_data_insertion_scripts.sql')]),
+])
+def test_most_specific_rule_wins(file_path, expected_routes):
+    assert route(file_path=file_path) == expected_routes
+
+@pytest.mark.parametrize('file_path', [
+    './datatrak_bgt_agt/views/v_orders.sql',
+    'datatrak_bgt_agt//views/./v_orders.sql',
+    'datatrak_bgt_agt\\views\\v_orders.sql',
+])
+def test_paths_are_normalised(file_path):
+    assert route(file_path=file_path) == [('agt', '5_datatrak_views_scripts.sql')]
+
+@pytest.mark.parametrize('file_path', [
+    'datatrak_bgt_agt/readme.sql',
+    'datatrak_bgt_agt/tables/t_orders.sql',
+    'other_db/views/v_orders.sql',
+    'views/v_orders.sql',
+])
+def test_files_outside_the_rules_are_not_routed(file_path):
+    assert route(file_path=file_path) == []
+
+def test_classify_keeps_the_input_order_and_lists_the_unrouted_files():
+    release_file_router = ReleaseFileRouter(release_databases=RELEASE_DATABASES, release_file_mapping=RELEASE_FILE_MAPPING)
+    routed_files, unrouted_files = release_file_router.classify(file_paths=[
+        'datatrak_bgt_awb/views/v_b.sql', '', 'datatrak_bgt_agt/tables/t.sql', '  ', 'datatrak_bgt_agt/views/reporting/v_a.sql'
+    ])
+    assert [(file_path, release_database['key'], release_file_name) for file_path, release_database, release_file_name in routed_files] == [
+        ('datatrak_bgt_awb/views/v_b.sql', 'awb', '5_datatrak_views_scripts.sql'),
+        ('datatrak_bgt_agt/views/reporting/v_a.sql', 'agt', 'reporting_views.sql'),
+    ]
+    assert unrouted_files == ['datatrak_bgt_agt/tables/t.sql']
+
+def test_default_mapping_routes_every_folder_of_every_database():
+    release_file_router = ReleaseFileRouter(release_databases=config.RELEASE_DATABASES,
+                                            release_file_mapping=config.RELEASE_FILE_MAPPING)
+    for release_database in config.RELEASE_DATABASES:
+        for rule, release_file_name in config.RELEASE_FILE_MAPPING.items():
+            file_path = f"{release_database['source_dir']}/{rule}/script.sql"
+            assert release_file_router.route(file_path=file_path) == [(release_database, release_file_name)]
+    assert release_file_router.route(file_path='datatrak_bgt_agt/index/ix_orders.sql') \
+        == release_file_router.route(file_path='datatrak_bgt_agt/alter_table/add_column.sql')
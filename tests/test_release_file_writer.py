@@ -0,0 +1,72 @@
+import io
+
+import pytest
+
+from bgt_db_release_utils import ReleaseBuildError
+from bgt_db_release_utils.release_file_writer import ReleaseFileWriter
+from bgt_db_release_utils.output_backend import FileSystemOutputBackend
+
+class CountingOutputBackend(FileSystemOutputBackend):
+    """
+    Counts the append handles opened on every file.
+    """
+    def __init__(self):
+        super().__init__()
+        self.opened_paths = []
+
+    def open_append(self, file_path, buffer_size=-1):
+        self.opened_paths.append(file_path)
+        return super().open_append(file_path=file_path, buffer_size=buffer_size)
+
+class FailingCloseHandle(io.BytesIO):
+    def close(self):
+        raise OSError('No space left on device')
+
+def test_group_copy_jobs_keeps_the_input_order_of_each_release_file():
+    grouped_jobs = ReleaseFileWriter.group_copy_jobs(copy_jobs=[
+        ('a.sql', 'views.sql'), ('b.sql', 'sp.sql'), ('c.sql', 'views.sql'), ('d.sql', 'sp.sql')
+    ])
+    assert list(grouped_jobs.items()) == [('views.sql', ['a.sql', 'c.sql']), ('sp.sql', ['b.sql', 'd.sql'])]
+
+def test_each_release_file_is_opened_once(tmp_path):
+    views_release_file = tmp_path / '5_datatrak_views_scripts.sql'
+    views_release_file.write_bytes(b'header\n')
+    sp_release_file = tmp_path / '6_datatrak_sp_scripts.sql'
+    output_backend = CountingOutputBackend()
+    with ReleaseFileWriter(buffer_size=1024, output_backend=output_backend) as release_file_writer:
+        for index in range(3):
+            release_file_writer.append_content(release_file_path=str(views_release_file), file_content=f'view {index}'.encode(),
+                                               source_path=f'v{index}.sql')
+            release_file_writer.append_content(release_file_path=str(sp_release_file), file_content=f'sp {index}'.encode(),
+                                               source_path=f'p{index}.sql')
+
+    assert sorted(output_backend.opened_paths) == sorted([str(views_release_file), str(sp_release_file)])
+    assert views_release_file.read_bytes() == b'header\nview 0\n\nview 1\n\nview 2\n\n'
+    assert sp_release_file.read_bytes() == b'sp 0\n\nsp 1\n\nsp 2\n\n'
+    # Script ranges exclude the separators
+    assert release_file_writer.script_ranges[str(views_release_file)] == [('v0.sql', 7, 6), ('v1.sql', 15, 6), ('v2.sql', 23, 6)]
+
+def test_writer_copy_matches_the_copy_without_writer(tmp_path, files_manager, write_sql):
+    sql_file_paths = [
+        write_sql('a.sql', "SELECT 'é'\r\nGO\r\n", encoding='utf-16'),
+        write_sql('b.sql', 'SELECT 2\nGO'),
+    ]
+    reopened_release_file = tmp_path / 'reopened.sql'
+    for sql_file_path in sql_file_paths:
+        files_manager.copy_file(target_file_path=sql_file_path, final_release_path=str(reopened_release_file))
+
+    written_release_file = tmp_path / 'written.sql'
+    with ReleaseFileWriter(buffer_size=1024) as release_file_writer:
+        for sql_file_path in sql_file_paths:
+            files_manager.copy_file(target_file_path=sql_file_path, final_release_path=str(written_release_file),
+                                    release_file_writer=release_file_writer, chunk_size=4)
+    assert written_release_file.read_bytes() == reopened_release_file.read_bytes()
+
+def test_close_failure_is_raised_after_closing_every_file(tmp_path):
+    release_file_writer = ReleaseFileWriter(buffer_size=1024)
+    release_file_writer.release_file_handles['broken.sql'] = FailingCloseHandle()
+    release_file_writer.append_content(release_file_path=str(tmp_path / 'other.sql'), file_content=b'SELECT 1')
+    with pytest.raises(ReleaseBuildError, match='broken.sql'):
+        release_file_writer.close()
+    assert not release_file_writer.release_file_handles
+    assert (tmp_path / 'other.sql').read_bytes() == b'SELECT 1\n\n'
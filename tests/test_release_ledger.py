@@ -0,0 +1,97 @@
+import os
+import sqlite3
+
+import pytest
+
+import config
+from bgt_db_release_utils import ReleaseBuildError, ReleaseLedger
+from release_builder import ReleaseBuilder
+
+def build_input(source, sha256, objects, release_file='datatrak_bgt_agt/6_datatrak_sp_scripts.sql'):
+    return {'source': source, 'release_file': release_file, 'sha256': sha256, 'objects': objects}
+
+@pytest.fixture
+def release_ledger(tmp_path):
+    """
+    A ledger holding three builds: 1.0.1, 1.0.2 and a rebuild of 1.0.1 of the agt database.
+    """
+    release_ledger = ReleaseLedger(ledger_path=str(tmp_path / 'ledger' / 'release_ledger.sqlite3'))
+    release_ledger.record_build(release_number='40', release_path='release/AGT_1.0.1', db_versions={'agt': ('1.0.0', '1.0.1')},
+                                build_inputs=[build_input('./datatrak_bgt_agt/stored_procedures/p_sync.sql', 'a1', ['dbo.p_sync'])])
+    release_ledger.record_build(release_number='41', release_path='release/AGT_1.0.2', db_versions={'agt': ('1.0.1', '1.0.2')},
+                                build_inputs=[build_input('datatrak_bgt_agt/stored_procedures/p_sync.sql', 'a2', ['dbo.p_sync']),
+                                              build_input('datatrak_bgt_agt/views/v_orders.sql', 'b1', ['dbo.v_orders'],
+                                                          release_file='datatrak_bgt_agt/5_datatrak_views_scripts.sql')])
+    # Not scanned this time, the objects recorded for the same content are taken
+    release_ledger.record_build(release_number='42', release_path='release/AGT_1.0.1', db_versions={'agt': ('1.0.0', '1.0.1')},
+                                build_inputs=[build_input('datatrak_bgt_agt/stored_procedures/p_sync.sql', 'a1', None)])
+    return release_ledger
+
+def test_versions_follow_the_builds(release_ledger):
+    assert release_ledger.latest_version(database='agt') == '1.0.1'
+    assert release_ledger.latest_version(database='awb') is None
+    # A rebuilt version keeps the version released before its first build
+    assert release_ledger.previous_version(database='agt', version='1.0.1') is None
+    assert release_ledger.previous_version(database='agt', version='1.0.2') == '1.0.1'
+    assert release_ledger.previous_version(database='agt', version='1.0.3') == '1.0.1'
+
+def test_unchanged_inputs_are_compared_with_the_last_build_of_a_version(release_ledger):
+    assert release_ledger.input_hashes(database='agt', version='1.0.2') == {
+        'datatrak_bgt_agt/stored_procedures/p_sync.sql': 'a2',
+        'datatrak_bgt_agt/views/v_orders.sql': 'b1',
+    }
+    assert release_ledger.unchanged_inputs_since(database='agt', version='1.0.2', current_hashes={
+        './datatrak_bgt_agt/stored_procedures/p_sync.sql': 'a3',
+        './datatrak_bgt_agt/views/v_orders.sql': 'b1',
+        './datatrak_bgt_agt/views/v_lines.sql': 'c1',
+    }) == ['./datatrak_bgt_agt/views/v_orders.sql']
+
+def test_releases_touching_an_object_or_a_file(release_ledger):
+    touching_builds = release_ledger.releases_touching_object(object_name='[DBO].[P_Sync]')
+    assert [(build['release_number'], build['versions']) for build in touching_builds] == [
+        ('40', {'agt': '1.0.1'}), ('41', {'agt': '1.0.2'}), ('42', {'agt': '1.0.1'})
+    ]
+    assert {build['source'] for build in touching_builds} == {'datatrak_bgt_agt/stored_procedures/p_sync.sql'}
+    assert [build['release_number'] for build in release_ledger.releases_touching_object(object_name='v_orders')] == ['41']
+    assert [build['release_file'] for build in release_ledger.releases_touching_file(source_path='./datatrak_bgt_agt/views/v_orders.sql')] \
+        == ['datatrak_bgt_agt/5_datatrak_views_scripts.sql']
+    assert release_ledger.releases_touching_object(object_name='dbo.p_missing') == []
+
+def test_ledger_of_an_unknown_format_is_refused(tmp_path):
+    ledger_path = str(tmp_path / 'release_ledger.sqlite3')
+    connection = sqlite3.connect(ledger_path)
+    connection.execute('PRAGMA user_version = 99')
+    connection.close()
+    with pytest.raises(sqlite3.DatabaseError):
+        ReleaseLedger(ledger_path=ledger_path).latest_version(database='agt')
+
+def test_build_is_recorded_and_gives_the_next_old_version(release_workspace, write_sql, monkeypatch):
+    monkeypatch.setattr(config, 'RELEASE_LEDGER', True)
+    monkeypatch.setattr(config, 'SQL_DEPENDENCY_ANALYSIS', True)
+    procedure = os.path.relpath(write_sql('work/datatrak_bgt_agt/stored_procedures/p_sync.sql',
+                                          'CREATE OR ALTER PROCEDURE dbo.p_sync AS SELECT 1\nGO\n'))
+    ReleaseBuilder().build(release_number='42', files_changed_with_tags=[procedure])
+    release_ledger = ReleaseLedger(ledger_path=config.RELEASE_LEDGER_PATH)
+    (touching_build,) = release_ledger.releases_touching_object(object_name='dbo.p_sync')
+    assert touching_build['release_number'] == '42'
+    assert touching_build['release_file'] == 'datatrak_bgt_agt/6_datatrak_sp_scripts.sql'
+    assert set(touching_build['versions'].values()) == {'1.0.0-B2'}
+
+    # A version file without old_version takes the version built last
+    for release_database in config.RELEASE_DATABASES:
+        (release_workspace / release_database['version_path']).write_text('new_version=1.0.0-b3\n')
+    ReleaseBuilder().build(release_number='43', files_changed_with_tags=[procedure])
+    (sp_release_file,) = release_workspace.glob('release/AWB_1.0.0-B3_AGT_1.0.0-B3/datatrak_bgt_agt/6_datatrak_sp_scripts.sql')
+    assert "set @oldversion = '1.0.0-B2'" in sp_release_file.read_text(encoding='utf-8')
+
+def test_default_build_is_not_recorded(release_workspace, write_sql):
+    procedure = os.path.relpath(write_sql('work/datatrak_bgt_agt/stored_procedures/p_sync.sql',
+                                          'CREATE OR ALTER PROCEDURE dbo.p_sync AS SELECT 1\nGO\n'))
+    ReleaseBuilder().build(release_number='42', files_changed_with_tags=[procedure])
+    assert not os.path.exists(config.RELEASE_LEDGER_PATH)
+
+    # Without the ledger a version file needs its old_version
+    for release_database in config.RELEASE_DATABASES:
+        (release_workspace / release_database['version_path']).write_text('new_version=1.0.0-b3\n')
+    with pytest.raises(ReleaseBuildError, match='No old_version'):
+        ReleaseBuilder().build(release_number='43', files_changed_with_tags=[procedure])
@@ -0,0 +1,161 @@
+import os
+import re
+import json
+import random
+
+import pytest
+
+import config
+from bgt_db_release_utils import SqlBatchIndexer
+from bgt_db_release_utils.sql_batch_indexer import MAX_PENDING_LINE_BYTES, SqlBatchTokenizer
+from release_builder import ReleaseBuilder
+
+# Every case of a GO that separates batches and of one that does not
+RELEASE_TEXT = (
+    b"/* header */\r\nSET NOCOUNT ON\r\nGO\r\n"
+    b"CREATE OR ALTER PROCEDURE [dbo].[p_orders] AS\n"
+    b"-- a line comment\n"
+    b"-- GO in a line comment\n"
+    b"SELECT 'it''s\nGO\nin a string' AS note, \"quoted\nGO\nname\" AS [bracketed\nGO\nname]\n"
+    b"/* block /* nested\nGO\n*/ still\nGO\n in the comment */ SELECT 1 -- trailing\n"
+    b"  go 3  -- repeated three times\n"
+    b"GOTO done\n"
+    b"SELECT 1 AS GO\n"
+    b"\tGo\t\n"
+    b"\n  \n"
+    b"GO\n"
+    b"CREATE VIEW reporting.v_orders AS SELECT 1 AS id--\n"
+    b"GO -- trailing comment\n"
+    b"ALTER TABLE dbo.t_orders ADD note INT\n"
+    b"go"
+)
+
+GO_LINE_PATTERN = re.compile(rb'[ \t]*GO(?:[ \t]+(\d+))?[ \t]*(?:--[^\n]*)?\r?(?=\n|\Z)', re.IGNORECASE)
+QUOTE_ENDS = {b"'": b"'", b'"': b'"', b'[': b']'}
+
+def reference_batches(data):
+    """
+    Split data into (offset, length, repeat) batches one byte at a time, as sqlcmd reads the whole file.
+    """
+    batches = []
+    state = None
+    comment_depth = 0
+    batch_start = position = 0
+    at_line_start = True
+    while position < len(data):
+        if state is None and at_line_start:
+            go_match = GO_LINE_PATTERN.match(data, position)
+            if go_match:
+                batches.append((batch_start, position - batch_start, int(go_match.group(1) or 1)))
+                position = go_match.end() + 1
+                batch_start = min(position, len(data))
+                continue
+        character, two_characters = data[position:position + 1], data[position:position + 2]
+        at_line_start = character == b'\n'
+        if state is None and two_characters in (b'--', b'/*'):
+            state = two_characters
+            comment_depth = 1
+            position += 2
+            continue
+        if state is None and character in QUOTE_ENDS:
+            state = character
+        elif state == b'--' and character == b'\n':
+            state = None
+        elif state == b'/*' and two_characters in (b'/*', b'*/'):
+            comment_depth += 1 if two_characters == b'/*' else -1
+            state = state if comment_depth else None
+            position += 2
+            continue
+        elif state in QUOTE_ENDS and character == QUOTE_ENDS[state]:
+            state = None
+        position += 1
+    batches.append((batch_start, len(data) - batch_start, 1))
+    return [batch for batch in batches if data[batch[0]:batch[0] + batch[1]].strip()]
+
+def tokenize(chunks, **tokenizer_options):
+    sql_batch_tokenizer = SqlBatchTokenizer(**tokenizer_options)
+    for chunk in chunks:
+        sql_batch_tokenizer.feed(data=chunk)
+    return sql_batch_tokenizer.finish()
+
+def batch_ranges(batches):
+    return [(batch['offset'], batch['length'], batch['repeat']) for batch in batches]
+
+def test_reference_split_of_the_release_text():
+    batches = reference_batches(data=RELEASE_TEXT)
+    assert [RELEASE_TEXT[offset:offset + length].split(b'\n', 1)[0] for offset, length, _ in batches] == [
+        b'/* header */\r', b'CREATE OR ALTER PROCEDURE [dbo].[p_orders] AS', b'GOTO done',
+        b'CREATE VIEW reporting.v_orders AS SELECT 1 AS id--', b'ALTER TABLE dbo.t_orders ADD note INT'
+    ]
+    assert [repeat for _, _, repeat in batches] == [1, 3, 1, 1, 1]
+
+def test_whole_text_is_split_like_the_reference():
+    batches = tokenize(chunks=[RELEASE_TEXT])
+    assert batch_ranges(batches) == reference_batches(data=RELEASE_TEXT)
+    assert [batch['objects'] for batch in batches] == [[], ['dbo.p_orders'], [], ['reporting.v_orders'], []]
+
+def test_every_two_chunk_split_gives_the_same_batches():
+    expected_batches = tokenize(chunks=[RELEASE_TEXT])
+    for split_offset in range(1, len(RELEASE_TEXT)):
+        assert tokenize(chunks=[RELEASE_TEXT[:split_offset], RELEASE_TEXT[split_offset:]]) == expected_batches, split_offset
+
+def test_single_byte_and_random_chunks_give_the_same_batches():
+    expected_batches = tokenize(chunks=[RELEASE_TEXT])
+    assert tokenize(chunks=[RELEASE_TEXT[offset:offset + 1] for offset in range(len(RELEASE_TEXT))]) == expected_batches
+    chunk_random = random.Random(42)
+    for _ in range(200):
+        split_offsets = sorted(chunk_random.sample(range(1, len(RELEASE_TEXT)), k=chunk_random.randint(2, 40)))
+        chunks = [RELEASE_TEXT[start:end] for start, end in zip([0] + split_offsets, split_offsets + [len(RELEASE_TEXT)])]
+        assert tokenize(chunks=chunks) == expected_batches, split_offsets
+
+@pytest.mark.parametrize('sql_text', [
+    b"SELECT '" + b'x' * (MAX_PENDING_LINE_BYTES + 10) + b"\nGO\n' AS note\nGO\nSELECT 2\n",
+    b"SELECT 1 /*" + b'x' * (MAX_PENDING_LINE_BYTES + 10) + b"\nGO\n*/\nGO\nSELECT 2\n",
+    b"SELECT 1 -- " + b'-' * (MAX_PENDING_LINE_BYTES + 10) + b"\nGO\nSELECT 2\n",
+])
+def test_lines_longer_than_the_pending_limit(sql_text):
+    chunks = [sql_text[offset:offset + 4096] for offset in range(0, len(sql_text), 4096)]
+    assert batch_ranges(tokenize(chunks=chunks)) == reference_batches(data=sql_text)
+    assert len(reference_batches(data=sql_text)) == 2
+
+def test_batches_list_the_sources_of_their_bytes():
+    sql_batch_tokenizer = SqlBatchTokenizer(start_offset=100)
+    sql_batch_tokenizer.feed(data=b'/* header */\nGO\n')
+    sql_batch_tokenizer.feed(data=b'CREATE PROCEDURE dbo.p_a AS SELECT 1\n', source_path='a.sql')
+    sql_batch_tokenizer.feed(data=b'\n\n')
+    sql_batch_tokenizer.feed(data=b'EXEC dbo.p_a\nGO\nCREATE FUNCTION f_b() RETURNS INT AS BEGIN RETURN 1 END', source_path='b.sql')
+    sql_batch_tokenizer.feed(data=b'\n\n')
+    batches = sql_batch_tokenizer.finish()
+    assert [(batch['offset'], batch['sources'], batch['objects']) for batch in batches] == [
+        (100, [], []),
+        (116, ['a.sql', 'b.sql'], ['dbo.p_a']),
+        (171, ['b.sql'], ['dbo.f_b']),
+    ]
+
+def test_tokenizer_starts_after_the_header_it_is_given():
+    sql_batch_indexer = SqlBatchIndexer()
+    header = b'/* header */\nGO\n'
+    assert sql_batch_indexer.create_tokenizer(release_file_header=header, start_offset=len(header)).finish() == [
+        {'offset': 0, 'length': 13, 'repeat': 1, 'sources': [], 'objects': []}
+    ]
+    # An unknown header is not tokenised, the index starts where the appended content does
+    sql_batch_tokenizer = sql_batch_indexer.create_tokenizer(release_file_header=b'other', start_offset=len(header))
+    sql_batch_tokenizer.feed(data=b'SELECT 1\n')
+    assert batch_ranges(sql_batch_tokenizer.finish()) == [(len(header), 9, 1)]
+
+def test_release_file_index_matches_the_release_file(release_workspace, write_sql, monkeypatch):
+    monkeypatch.setattr(config, 'SQL_BATCH_INDEX', True)
+    procedures = [os.path.relpath(write_sql(f"work/datatrak_bgt_agt/stored_procedures/p_{index}.sql", RELEASE_TEXT.decode('utf-8')))
+                  for index in range(3)]
+    ReleaseBuilder().build(release_number='42', files_changed_with_tags=procedures)
+    (release_file,) = release_workspace.glob('release/*/datatrak_bgt_agt/6_datatrak_sp_scripts.sql')
+    release_bytes = release_file.read_bytes()
+    batch_index = json.loads((release_file.parent / (release_file.name + '.batches.json')).read_text(encoding='utf-8'))
+    assert batch_index['size'] == len(release_bytes)
+    assert batch_ranges(batch_index['batches']) == reference_batches(data=release_bytes)
+
+def test_default_build_writes_no_batch_index(release_workspace, write_sql):
+    procedure = write_sql('work/datatrak_bgt_agt/stored_procedures/p_0.sql', RELEASE_TEXT.decode('utf-8'))
+    ReleaseBuilder().build(release_number='42', files_changed_with_tags=[os.path.relpath(procedure)])
+    assert list(release_workspace.glob('release/*/datatrak_bgt_agt/6_datatrak_sp_scripts.sql'))
+    assert not list(release_workspace.glob('release/**/*.batches.json'))
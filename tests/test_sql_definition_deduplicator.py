@@ -0,0 +1,90 @@
+from bgt_db_release_utils import SqlDefinitionDeduplicator
+
+RELEASE_FILE = '/release/datatrak_bgt_agt/6_datatrak_sp_scripts.sql'
+
+def make_deduplicator(files_manager):
+    return SqlDefinitionDeduplicator(file_manager=files_manager, max_script_bytes=1024 * 1024)
+
+def dedupe(deduplicator, sql_file_paths):
+    deduped_copy_jobs, dropped_duplicates = deduplicator.dedupe(grouped_copy_jobs={RELEASE_FILE: sql_file_paths})
+    return deduped_copy_jobs[RELEASE_FILE], [(dropped['source'], dropped['kept']) for dropped in dropped_duplicates]
+
+def test_scan_script_reads_how_the_object_is_defined(files_manager):
+    deduplicator = make_deduplicator(files_manager=files_manager)
+    assert deduplicator.scan_script(sql_text='CREATE OR ALTER PROCEDURE dbo.p AS SELECT 1') == ('dbo.p', 'replace', set())
+    assert deduplicator.scan_script(sql_text="""
+        DROP PROCEDURE IF EXISTS dbo.p
+        GO
+        CREATE PROCEDURE dbo.p AS SELECT 1
+    """) == ('dbo.p', 'replace', {'dbo.p'})
+    assert deduplicator.scan_script(sql_text='CREATE PROC p AS SELECT 1') == ('dbo.p', 'create', set())
+    assert deduplicator.scan_script(sql_text='ALTER VIEW dbo.v AS SELECT 1') == ('dbo.v', 'alter', set())
+    # A DROP after the definition does not make it a replacement
+    assert deduplicator.scan_script(sql_text="""
+        CREATE PROCEDURE dbo.p AS SELECT 1
+        GO
+        DROP PROCEDURE dbo.p
+    """) == ('dbo.p', 'create', {'dbo.p'})
+
+def test_scan_script_ignores_tables_and_several_objects(files_manager):
+    deduplicator = make_deduplicator(files_manager=files_manager)
+    assert deduplicator.scan_script(sql_text='CREATE TABLE dbo.t (Id INT)')[0] is None
+    assert deduplicator.scan_script(sql_text="""
+        CREATE OR ALTER VIEW dbo.v AS SELECT 1
+        GO
+        CREATE OR ALTER VIEW dbo.w AS SELECT 1
+    """)[0] is None
+    # Definitions inside comments and strings are not definitions
+    assert deduplicator.scan_script(sql_text="""
+        -- CREATE OR ALTER VIEW dbo.w AS SELECT 1
+        CREATE OR ALTER VIEW dbo.v AS SELECT 'ALTER VIEW dbo.x'
+    """) == ('dbo.v', 'replace', set())
+
+def test_create_then_alter_keeps_both(files_manager, write_sql):
+    create = write_sql('a.sql', 'CREATE PROCEDURE dbo.p AS SELECT 1')
+    alter = write_sql('b.sql', 'ALTER PROCEDURE dbo.p AS SELECT 2')
+    assert dedupe(make_deduplicator(files_manager=files_manager), [create, alter]) == ([create, alter], [])
+
+def test_final_alter_keeps_the_earliest_create(files_manager, write_sql):
+    create = write_sql('a.sql', 'CREATE PROCEDURE dbo.p AS SELECT 1')
+    first_alter = write_sql('b.sql', 'ALTER PROCEDURE dbo.p AS SELECT 2')
+    last_alter = write_sql('c.sql', 'ALTER PROCEDURE dbo.p AS SELECT 3')
+    assert dedupe(make_deduplicator(files_manager=files_manager), [create, first_alter, last_alter]) == (
+        [create, last_alter], [(first_alter, last_alter)]
+    )
+
+def test_create_or_alter_replaces_earlier_definitions(files_manager, write_sql):
+    create = write_sql('a.sql', 'CREATE PROCEDURE dbo.p AS SELECT 1')
+    alter = write_sql('b.sql', 'ALTER PROCEDURE dbo.p AS SELECT 2')
+    replace = write_sql('c.sql', 'CREATE OR ALTER PROCEDURE dbo.p AS SELECT 3')
+    assert dedupe(make_deduplicator(files_manager=files_manager), [create, alter, replace]) == (
+        [replace], [(create, replace), (alter, replace)]
+    )
+
+def test_drop_and_create_replaces_earlier_definitions(files_manager, write_sql):
+    create = write_sql('a.sql', 'CREATE VIEW dbo.v AS SELECT 1')
+    replace = write_sql('b.sql', 'DROP VIEW IF EXISTS dbo.v\nGO\nCREATE VIEW dbo.v AS SELECT 2')
+    assert dedupe(make_deduplicator(files_manager=files_manager), [create, replace]) == ([replace], [(create, replace)])
+
+def test_final_plain_create_drops_nothing(files_manager, write_sql):
+    replace = write_sql('a.sql', 'CREATE OR ALTER VIEW dbo.v AS SELECT 1')
+    create = write_sql('b.sql', 'CREATE VIEW dbo.v AS SELECT 2')
+    assert dedupe(make_deduplicator(files_manager=files_manager), [replace, create]) == ([replace, create], [])
+
+def test_object_dropped_by_another_script_is_kept(files_manager, write_sql):
+    first = write_sql('a.sql', 'CREATE OR ALTER FUNCTION dbo.f() RETURNS INT AS BEGIN RETURN 1 END')
+    drop = write_sql('b.sql', 'DROP FUNCTION dbo.f')
+    last = write_sql('c.sql', 'CREATE OR ALTER FUNCTION dbo.f() RETURNS INT AS BEGIN RETURN 2 END')
+    assert dedupe(make_deduplicator(files_manager=files_manager), [first, drop, last]) == ([first, drop, last], [])
+
+def test_file_listed_again_is_copied_at_its_last_position(files_manager, write_sql):
+    table = write_sql('a.sql', 'CREATE TABLE dbo.t (Id INT)')
+    view = write_sql('b.sql', 'CREATE VIEW dbo.v AS SELECT Id FROM dbo.t')
+    deduped_paths, dropped_duplicates = dedupe(make_deduplicator(files_manager=files_manager), [view, table, view])
+    assert deduped_paths == [table, view]
+    assert dropped_duplicates == [(view, view)]
+
+def test_multi_object_scripts_are_kept(files_manager, write_sql):
+    both = write_sql('a.sql', 'CREATE OR ALTER VIEW dbo.v AS SELECT 1\nGO\nCREATE OR ALTER VIEW dbo.w AS SELECT 1')
+    replace = write_sql('b.sql', 'CREATE OR ALTER VIEW dbo.v AS SELECT 2')
+    assert dedupe(make_deduplicator(files_manager=files_manager), [both, replace]) == ([both, replace], [])
@@ -0,0 +1,95 @@
+from bgt_db_release_utils import SqlDependencyAnalyzer
+
+RELEASE_FILE = '/release/datatrak_bgt_agt/6_datatrak_sp_scripts.sql'
+
+def make_analyzer(files_manager, reorder=False):
+    return SqlDependencyAnalyzer(file_manager=files_manager, release_file_order=['6_datatrak_sp_scripts.sql'],
+                                 max_script_bytes=1024 * 1024, reorder=reorder)
+
+def analyze(analyzer, sql_file_paths):
+    ordered_copy_jobs, deployment_batches = analyzer.analyze(grouped_copy_jobs={RELEASE_FILE: sql_file_paths})
+    batches = [[script['source'] for script in batch] for batch in deployment_batches[RELEASE_FILE]]
+    return ordered_copy_jobs[RELEASE_FILE], batches
+
+def test_scan_script_takes_references_from_object_positions_only(files_manager):
+    analyzer = make_analyzer(files_manager=files_manager)
+    defined, referenced, dropped = analyzer.scan_script(sql_text="""
+        CREATE PROCEDURE dbo.usp_orders AS
+        SELECT o.Status, Status, dbo.fn_total(o.Id) FROM dbo.Orders o
+        JOIN [sales].[Customers] c ON c.Id = o.CustomerId
+        EXEC @rc = dbo.usp_log
+        INSERT INTO dbo.Audit (Status) VALUES ('FROM dbo.NotATable')
+    """)
+    assert defined == {'dbo.usp_orders'}
+    assert referenced == {'dbo.orders', 'sales.customers', 'dbo.fn_total', 'dbo.usp_log', 'dbo.audit'}
+    assert dropped == set()
+
+def test_scan_script_reads_ddl_targets(files_manager):
+    analyzer = make_analyzer(files_manager=files_manager)
+    defined, referenced, dropped = analyzer.scan_script(sql_text="""
+        DROP TABLE IF EXISTS dbo.Old, dbo.Older
+        CREATE TRIGGER dbo.trg_orders ON dbo.Orders AFTER INSERT AS SELECT 1
+        ALTER TABLE dbo.Lines ADD CONSTRAINT fk FOREIGN KEY (OrderId) REFERENCES dbo.Headers (Id)
+        GRANT EXECUTE ON OBJECT::dbo.usp_orders TO app_role
+    """)
+    assert defined == {'dbo.trg_orders'}
+    assert referenced == {'dbo.orders', 'dbo.lines', 'dbo.headers', 'dbo.usp_orders'}
+    assert dropped == {'dbo.old', 'dbo.older'}
+
+def test_column_named_like_a_table_is_not_a_dependency(files_manager, write_sql):
+    status_view = write_sql('a.sql', 'CREATE VIEW dbo.v_orders AS SELECT Status FROM dbo.Orders')
+    status_table = write_sql('b.sql', 'CREATE TABLE dbo.Status (Id INT)')
+    ordered, batches = analyze(make_analyzer(files_manager=files_manager, reorder=True), [status_view, status_table])
+    assert ordered == [status_view, status_table]
+    assert batches == [[status_view, status_table]]
+
+def test_drop_runs_before_the_definition_when_reordering(files_manager, write_sql):
+    drop_script = write_sql('d.sql', 'DROP TABLE dbo.Orders')
+    create_script = write_sql('c.sql', 'CREATE TABLE dbo.Orders (Id INT)')
+    ordered, batches = analyze(make_analyzer(files_manager=files_manager, reorder=True), [create_script, drop_script])
+    assert ordered == [drop_script, create_script]
+    assert batches == [[drop_script], [create_script]]
+
+def test_drop_then_create_keeps_its_order(files_manager, write_sql):
+    drop_script = write_sql('d.sql', 'DROP TABLE dbo.Orders')
+    create_script = write_sql('c.sql', 'CREATE TABLE dbo.Orders (Id INT)')
+    for reorder in (False, True):
+        ordered, batches = analyze(make_analyzer(files_manager=files_manager, reorder=reorder), [drop_script, create_script])
+        assert ordered == [drop_script, create_script]
+        assert batches == [[drop_script], [create_script]]
+
+def test_reorder_moves_definitions_before_their_references(files_manager, write_sql):
+    view_script = write_sql('v.sql', 'CREATE VIEW dbo.v_orders AS SELECT Id FROM dbo.Orders')
+    table_script = write_sql('t.sql', 'CREATE TABLE dbo.Orders (Id INT)')
+    other_script = write_sql('o.sql', 'CREATE TABLE dbo.Other (Id INT)')
+    ordered, batches = analyze(make_analyzer(files_manager=files_manager, reorder=True),
+                               [view_script, table_script, other_script])
+    assert ordered == [table_script, view_script, other_script]
+    assert batches == [[table_script, other_script], [view_script]]
+
+def test_input_order_is_kept_by_default(files_manager, write_sql):
+    view_script = write_sql('v.sql', 'CREATE VIEW dbo.v_orders AS SELECT Id FROM dbo.Orders')
+    table_script = write_sql('t.sql', 'CREATE TABLE dbo.Orders (Id INT)')
+    report_script = write_sql('r.sql', 'CREATE VIEW dbo.v_report AS SELECT Id FROM dbo.Orders')
+    analyzer = make_analyzer(files_manager=files_manager)
+    ordered, batches = analyze(analyzer, [view_script, table_script, report_script])
+    assert ordered == [view_script, table_script, report_script]
+    assert batches == [[view_script, table_script], [report_script]]
+    assert any('only defined after it' in warning for warning in analyzer.warnings[RELEASE_FILE])
+
+def test_drop_after_definition_is_reported(files_manager, write_sql):
+    create_script = write_sql('c.sql', 'CREATE TABLE dbo.Orders (Id INT)')
+    drop_script = write_sql('d.sql', 'DROP TABLE dbo.Orders')
+    analyzer = make_analyzer(files_manager=files_manager)
+    ordered, _ = analyze(analyzer, [create_script, drop_script])
+    assert ordered == [create_script, drop_script]
+    assert any('drops dbo.orders' in warning for warning in analyzer.warnings[RELEASE_FILE])
+
+def test_unscanned_scripts_deploy_alone_in_place(files_manager, write_sql):
+    first_script = write_sql('1.sql', 'CREATE TABLE dbo.A (Id INT)')
+    large_script = write_sql('2.sql', 'INSERT INTO dbo.A VALUES (1)\n' * 100)
+    last_script = write_sql('3.sql', 'CREATE TABLE dbo.B (Id INT)')
+    analyzer = SqlDependencyAnalyzer(file_manager=files_manager, release_file_order=[], max_script_bytes=100, reorder=True)
+    ordered, batches = analyze(analyzer, [first_script, large_script, last_script])
+    assert ordered == [first_script, large_script, last_script]
+    assert batches == [[first_script], [large_script], [last_script]]
@@ -0,0 +1,90 @@
+import threading
+
+import pytest
+
+from bgt_db_release_utils import BuildMetrics, ReleaseBuildError, ReleaseInputError, ReleaseStageError, StageScheduler
+
+def recording_stage(ran_stages, stage_name):
+    return lambda: ran_stages.append(stage_name)
+
+def test_stages_run_after_their_dependencies():
+    ran_stages = []
+    stage_scheduler = StageScheduler(max_workers=4)
+    stage_scheduler.add_stage('resolve_versions', recording_stage(ran_stages, 'resolve_versions'))
+    stage_scheduler.add_stage('create_release_directories', recording_stage(ran_stages, 'create_release_directories'),
+                              depends_on=('resolve_versions',))
+    stage_scheduler.add_stage('copy_sql_files:agt', recording_stage(ran_stages, 'copy_sql_files:agt'),
+                              depends_on=('create_release_directories',))
+    stage_scheduler.add_stage('copy_sql_files:awb', recording_stage(ran_stages, 'copy_sql_files:awb'),
+                              depends_on=('create_release_directories',))
+    stage_scheduler.add_stage('save_build_manifest', recording_stage(ran_stages, 'save_build_manifest'),
+                              depends_on=('copy_sql_files:agt', 'copy_sql_files:awb'))
+    stage_scheduler.run()
+
+    assert sorted(ran_stages) == sorted(stage_scheduler.stages)
+    assert ran_stages[:2] == ['resolve_versions', 'create_release_directories']
+    assert ran_stages[-1] == 'save_build_manifest'
+
+def test_independent_stages_run_concurrently():
+    # Each stage waits for the other, which only finishes when both run at the same time
+    both_started = threading.Barrier(2, timeout=5)
+    stage_scheduler = StageScheduler(max_workers=2)
+    stage_scheduler.add_stage('copy_sql_files:agt', both_started.wait)
+    stage_scheduler.add_stage('copy_sql_files:awb', both_started.wait)
+    stage_scheduler.run()
+
+def test_declaration_order_is_a_valid_sequential_order():
+    stage_scheduler = StageScheduler(max_workers=0)
+    assert stage_scheduler.max_workers == 1
+    stage_scheduler.add_stage('a', lambda: None)
+    stage_scheduler.add_stage('b', lambda: None, depends_on=('a',))
+    assert [stage_name for stage_name, _ in stage_scheduler.ordered_stages()] == ['a', 'b']
+
+def test_undeclared_and_duplicate_stages_are_refused():
+    stage_scheduler = StageScheduler(max_workers=1)
+    stage_scheduler.add_stage('a', lambda: None)
+    with pytest.raises(ValueError):
+        stage_scheduler.add_stage('a', lambda: None)
+    with pytest.raises(ValueError):
+        stage_scheduler.add_stage('b', lambda: None, depends_on=('c',))
+
+def test_failure_stops_the_dependent_stages():
+    ran_stages = []
+    build_metrics = BuildMetrics(release_number='42')
+    stage_scheduler = StageScheduler(max_workers=2, build_metrics=build_metrics)
+
+    def fail():
+        raise OSError('disk full')
+
+    stage_scheduler.add_stage('create_release_directories', fail)
+    stage_scheduler.add_stage('copy_sql_files', recording_stage(ran_stages, 'copy_sql_files'),
+                              depends_on=('create_release_directories',))
+    with pytest.raises(ReleaseStageError) as raised:
+        stage_scheduler.run()
+
+    assert raised.value.stage_name == 'create_release_directories'
+    assert isinstance(raised.value.stage_error, OSError)
+    assert raised.value.__cause__ is raised.value.stage_error
+    assert ran_stages == []
+    assert build_metrics.report()['stages']['create_release_directories']['status'] == 'failed'
+    assert 'copy_sql_files' not in build_metrics.report()['stages']
+
+@pytest.mark.parametrize('stage_error, raised_type', [
+    (ReleaseInputError('bad tag'), ReleaseInputError),
+    (ReleaseStageError(stage_name='inner', stage_error=ValueError('broken')), ReleaseStageError),
+    (ReleaseBuildError('cannot write'), ReleaseStageError),
+    (KeyError('file_name'), ReleaseStageError),
+])
+def test_only_input_and_stage_errors_are_raised_as_they_are(stage_error, raised_type):
+    def fail():
+        raise stage_error
+
+    stage_scheduler = StageScheduler(max_workers=1)
+    stage_scheduler.add_stage('plan_sql_copies', fail)
+    with pytest.raises(raised_type) as raised:
+        stage_scheduler.run()
+    if raised_type is ReleaseStageError and not isinstance(stage_error, ReleaseStageError):
+        assert raised.value.stage_name == 'plan_sql_copies'
+        assert raised.value.stage_error is stage_error
+    else:
+        assert raised.value is stage_error
@@ -0,0 +1,63 @@
+import os
+
+import pytest
+
+from bgt_db_release_utils import TemplateEngine
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'file_templates')
+
+def replace_one_by_one(file_content, release_db_name, old_version, new_version, sql_release_file_name=None):
+    """
+    Render a template the way the builder did before the template engine, one str.replace per placeholder.
+    """
+    if sql_release_file_name:
+        file_content = file_content.replace('title_based_on_script', sql_release_file_name)
+        file_content = file_content.replace('strdatetime', 'build time')
+    file_content = file_content.replace('deployment_db_name', release_db_name)
+    file_content = file_content.replace('old_version', f"'{old_version}'")
+    return file_content.replace('new_version', f"'{new_version}'")
+
+@pytest.mark.parametrize('template_name, sql_release_file_name', [
+    ('default_header.txt', '5_datatrak_views_scripts.sql'),
+    ('defalt_header_with_create.txt', '1_datatrak_create_new_table_scripts.sql'),
+    ('__DO_IT.bat_txt', None),
+    ('scriptlist.txt', None),
+    ('8_permission_datatrak_scripts.sql', None),
+    ('9_new_datatrak_mis_version_update_scripts.sql', None),
+])
+def test_templates_render_as_with_one_replace_per_placeholder(template_name, sql_release_file_name):
+    with open(os.path.join(TEMPLATE_DIR, template_name), 'r', encoding='utf-8', newline='') as rf:
+        template_content = rf.read()
+    template_engine = TemplateEngine(datetime_format='build time')
+    render_context = template_engine.build_context(release_db_name='datatrak_bgt_agt', db_version_tuple=('1.0.0-b1', '1.0.0-b2'),
+                                                   sql_release_file_name=sql_release_file_name)
+    assert template_engine.render(file_content=template_content, render_context=render_context) == replace_one_by_one(
+        file_content=template_content, release_db_name='datatrak_bgt_agt', old_version='1.0.0-b1', new_version='1.0.0-b2',
+        sql_release_file_name=sql_release_file_name
+    )
+
+def test_replacements_are_not_substituted_again():
+    template_engine = TemplateEngine()
+    render_context = template_engine.build_context(release_db_name='old_version_db', db_version_tuple=('1', '2'))
+    assert template_engine.render(file_content='use deployment_db_name -- old_version', render_context=render_context) \
+        == "use old_version_db -- '1'"
+
+def test_longest_placeholder_wins():
+    template_engine = TemplateEngine(extra_values={'version': 'v', 'new_version_note': 'note'})
+    render_context = template_engine.build_context(db_version_tuple=('1', '2'))
+    assert template_engine.render(file_content='version new_version new_version_note', render_context=render_context) \
+        == "v '2' note"
+
+def test_only_sql_release_file_headers_are_timestamped():
+    template_engine = TemplateEngine(datetime_format='build time')
+    header_context = template_engine.build_context(release_db_name='db', sql_release_file_name='6_datatrak_sp_scripts.sql')
+    assert template_engine.render(file_content='strdatetime', render_context=header_context) == 'build time'
+    batch_context = template_engine.build_context(release_db_name='db')
+    assert template_engine.render(file_content='strdatetime', render_context=batch_context) == 'strdatetime'
+
+def test_signature_ignores_the_build_time():
+    assert TemplateEngine(datetime_format='first').signature() == TemplateEngine(datetime_format='second').signature()
+    assert TemplateEngine(release_number='41').signature() == TemplateEngine(release_number='42').signature()
+    release_placeholders = {'release_number_here': 'release_number'}
+    assert TemplateEngine(placeholders=release_placeholders, release_number='41').signature() \
+        != TemplateEngine(placeholders=release_placeholders, release_number='42').signature()
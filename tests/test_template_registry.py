@@ -0,0 +1,78 @@
+import os
+
+from bgt_db_release_utils import FilesManager, TemplateEngine, TemplateRegistry
+
+HEADER_TEMPLATE = '/* title_based_on_script on deployment_db_name */\nset @oldversion = old_version\nstrdatetime\n'
+
+class CountingFilesManager(FilesManager):
+    """
+    Counts the template files read from disk.
+    """
+    def __init__(self, template_engine):
+        super().__init__(template_engine=template_engine)
+        self.read_paths = []
+
+    def read_file_content(self, file_path):
+        self.read_paths.append(file_path)
+        return super().read_file_content(file_path=file_path)
+
+def make_registry(template_engine=None):
+    return TemplateRegistry(file_manager=CountingFilesManager(template_engine=template_engine or TemplateEngine()))
+
+def write_template(tmp_path, template_content=HEADER_TEMPLATE):
+    template_path = tmp_path / 'default_header.txt'
+    template_path.write_text(template_content, encoding='utf-8')
+    return str(template_path)
+
+def test_compiled_template_renders_like_the_engine():
+    template_registry = make_registry(template_engine=TemplateEngine(datetime_format='build time'))
+    template_engine = template_registry.template_engine
+    render_context = template_engine.build_context(release_db_name='datatrak_bgt_agt', db_version_tuple=('1', '2'),
+                                                   sql_release_file_name='6_datatrak_sp_scripts.sql')
+    compiled_template = template_registry.compile_template(file_content=HEADER_TEMPLATE)
+    assert len(compiled_template.slots) == 4
+    assert compiled_template.render(render_context=render_context) \
+        == template_engine.render(file_content=HEADER_TEMPLATE, render_context=render_context)
+    # Placeholders without a value are kept
+    assert compiled_template.render(render_context={}) == HEADER_TEMPLATE
+
+def test_template_is_compiled_once_until_it_changes(tmp_path):
+    template_path = write_template(tmp_path=tmp_path)
+    template_registry = make_registry()
+    first_template = template_registry.get_template(template_path=template_path)
+    assert template_registry.get_template(template_path=template_path) is first_template
+    assert template_registry.file_manager.read_paths == [template_path]
+
+    write_template(tmp_path=tmp_path, template_content='new_version\n')
+    os.utime(template_path, ns=(1, 1))
+    assert template_registry.get_template(template_path=template_path).slots == ['new_version']
+    assert len(template_registry.file_manager.read_paths) == 2
+
+def test_template_pack_skips_reading_the_templates(tmp_path):
+    template_path = write_template(tmp_path=tmp_path)
+    pack_path = str(tmp_path / 'templates.pack.json')
+    make_registry().save_pack(pack_path=pack_path, template_paths=[template_path])
+
+    template_registry = make_registry()
+    template_registry.load_pack(pack_path=pack_path)
+    compiled_template = template_registry.get_template(template_path=template_path)
+    assert template_registry.file_manager.read_paths == []
+    assert compiled_template.render(render_context={}) == HEADER_TEMPLATE
+
+def test_outdated_template_pack_is_ignored(tmp_path):
+    template_path = write_template(tmp_path=tmp_path)
+    pack_path = str(tmp_path / 'templates.pack.json')
+    make_registry().save_pack(pack_path=pack_path, template_paths=[template_path])
+
+    # Built with other placeholders
+    template_registry = make_registry(template_engine=TemplateEngine(extra_values={'deployment_db_name': 'db'}))
+    template_registry.load_pack(pack_path=pack_path)
+    assert not template_registry.packed_templates
+
+    # Template changed since the pack was built
+    write_template(tmp_path=tmp_path, template_content='old_version\n')
+    os.utime(template_path, ns=(1, 1))
+    template_registry = make_registry()
+    template_registry.load_pack(pack_path=pack_path)
+    assert template_registry.get_template(template_path=template_path).slots == ['old_version']
+    assert template_registry.file_manager.read_paths == [template_path]